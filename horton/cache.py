@@ -23,10 +23,18 @@
    In principle, the ``JustOnceClass`` and the ``Cache`` can be used
    independently, but in some cases it makes a lot of sense to combine them.
    See for example the density partitioning code in ``horton.part``.
+
+   The memory used by the arrays in a ``Cache`` can be limited with
+   ``Cache.set_memory_policy``. Items with the tag ``'r'`` are then considered
+   to be recomputable: the least recently used ones are removed from memory
+   when the budget is exceeded, or they are moved to a scratch file.
 '''
 
 
-import numpy as np, types
+import os, sys, tempfile, threading, types
+import numpy as np, h5py as h5
+from collections import OrderedDict
+
 from horton.log import log
 
 
@@ -205,14 +213,197 @@ def _normalize_key(key):
     return key
 
 
+def _get_nbytes(value):
+    '''Return the amount of memory used by a cached value
+
+       Only numpy arrays in memory are taken into account. Memory-mapped arrays
+       and other objects are ignored.
+    '''
+    if isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+        return value.nbytes
+    return 0
+
+
 class Cache(object):
     '''Object that stores previously computed results.
 
        The cache behaves like a dictionary with some extra features that can be
        used to avoid recomputation or reallocation.
     '''
-    def __init__(self):
+    def __init__(self, max_memory=None, spill_dir=None):
+        '''
+           **Optional arguments:**
+
+           max_memory, spill_dir
+                See ``set_memory_policy``. By default, the memory usage is not
+                limited.
+        '''
         self._store = {}
+        # Bookkeeping for the memory policy.
+        self._lock = threading.RLock()
+        self._nbytes = 0
+        self._max_memory = None
+        self._lru = OrderedDict()
+        self._spilled = {}
+        self._spill_fn = None
+        self._spill_file = None
+        self._spill_counter = 0
+        if max_memory is not None or spill_dir is not None:
+            self.set_memory_policy(max_memory, spill_dir)
+
+    def __del__(self):
+        self._close_spill_file()
+
+    def _get_nbytes(self):
+        '''The amount of memory used by arrays in the cache (in bytes)'''
+        return self._nbytes
+
+    nbytes = property(_get_nbytes)
+
+    def _get_max_memory(self):
+        '''The memory budget for the cached arrays (in bytes) or None'''
+        return self._max_memory
+
+    max_memory = property(_get_max_memory)
+
+    def set_memory_policy(self, max_memory=None, spill_dir=None):
+        '''Limit the amount of memory used by the cached arrays
+
+           **Optional arguments:**
+
+           max_memory
+                The maximum amount of memory (in bytes) used by the arrays in
+                the cache. When this budget is exceeded, the least recently
+                used arrays with the tag ``'r'`` are evicted. Such items must
+                be recomputable: the caller should always load them with the
+                ``alloc`` argument and recompute them when they are new.
+                Arrays that are still referenced outside the cache are never
+                evicted. The budget may therefore be exceeded temporarily.
+                When None (the default), the memory usage is not limited.
+
+           spill_dir
+                A directory for a scratch HDF5 file. When given, evicted arrays
+                are written to this file and they are read again when they are
+                loaded later. Without this argument, evicted arrays are
+                discarded. The scratch file is removed when the memory policy
+                changes or when the cache is deleted.
+        '''
+        if max_memory is not None and max_memory < 0:
+            raise ValueError('The max_memory argument can not be negative.')
+        if spill_dir is not None:
+            if max_memory is None:
+                raise ValueError('The spill_dir argument requires a max_memory argument.')
+            if not os.path.isdir(spill_dir):
+                raise ValueError('The spill_dir argument must be an existing directory.')
+        with self._lock:
+            # Bring all spilled items back in memory before the old scratch
+            # file is closed.
+            self._max_memory = None
+            for key in self._spilled.keys():
+                self._restore(key)
+            self._close_spill_file()
+            # Set up the new policy
+            self._max_memory = max_memory
+            if spill_dir is not None:
+                fd, self._spill_fn = tempfile.mkstemp(prefix='horton_cache_', suffix='.h5', dir=spill_dir)
+                os.close(fd)
+                self._spill_file = h5.File(self._spill_fn, 'w')
+            self._lru = OrderedDict()
+            if max_memory is not None:
+                for key, item in self._store.iteritems():
+                    self._touch(key, item)
+                self._enforce_budget()
+
+    def _close_spill_file(self):
+        '''Close and remove the scratch file, if any'''
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_fn)
+            self._spill_file = None
+            self._spill_fn = None
+        self._spilled = {}
+
+    def _set_item(self, key, item):
+        '''Store an item in the cache and update the memory bookkeeping'''
+        with self._lock:
+            self._del_item(key)
+            self._store[key] = item
+            self._nbytes += _get_nbytes(item._value)
+            self._touch(key, item)
+            self._enforce_budget(key)
+
+    def _del_item(self, key):
+        '''Remove an item from the cache (also from the scratch file)'''
+        with self._lock:
+            item = self._store.pop(key, None)
+            if item is not None:
+                self._nbytes -= _get_nbytes(item._value)
+                self._lru.pop(key, None)
+            spilled = self._spilled.pop(key, None)
+            if spilled is not None:
+                del self._spill_file[spilled[0]]
+
+    def _touch(self, key, item):
+        '''Mark an item as most recently used, if it can be evicted'''
+        if self._max_memory is not None and 'r' in item.tags and \
+           _get_nbytes(item._value) > 0:
+            with self._lock:
+                self._lru.pop(key, None)
+                self._lru[key] = None
+
+    def _enforce_budget(self, keep=None):
+        '''Evict least recently used items until the budget is respected
+
+           **Optional arguments:**
+
+           keep
+                A key of an item that may not be evicted.
+        '''
+        if self._max_memory is None:
+            return
+        with self._lock:
+            for key in self._lru.keys():
+                if self._nbytes <= self._max_memory:
+                    break
+                if key == keep:
+                    continue
+                item = self._store[key]
+                # Only arrays that are referenced by the cache item alone are
+                # evicted. (One extra reference is the argument of getrefcount.)
+                if sys.getrefcount(item._value) > 2:
+                    continue
+                if item.valid and self._spill_file is not None:
+                    name = 'item%i' % self._spill_counter
+                    self._spill_counter += 1
+                    self._spill_file[name] = item._value
+                    self._del_item(key)
+                    self._spilled[key] = (name, item.tags)
+                else:
+                    self._del_item(key)
+
+    def _restore(self, key):
+        '''Load a spilled item from the scratch file into memory'''
+        with self._lock:
+            name, tags = self._spilled.pop(key)
+            array = self._spill_file[name][:]
+            del self._spill_file[name]
+            log.mem.announce(array.nbytes)
+            item = CacheItem(array, own=True, tags=tags)
+            self._set_item(key, item)
+            return item
+
+    def _get_item(self, key):
+        '''Return an item, also when it has been spilled, or None'''
+        item = self._store.get(key)
+        if item is None:
+            with self._lock:
+                if key in self._spilled:
+                    item = self._restore(key)
+                else:
+                    item = self._store.get(key)
+        else:
+            self._touch(key, item)
+        return item
 
     def clear(self, **kwargs):
         '''Clear all items in the cache
@@ -239,6 +430,9 @@ class Cache(object):
         for key, item in self._store.items():
             if len(tags) == 0 or len(item.tags & tags) > 0:
                 self.clear_item(key, dealloc=dealloc)
+        for key, (name, item_tags) in self._spilled.items():
+            if len(tags) == 0 or len(item_tags & tags) > 0:
+                self.clear_item(key)
 
     def clear_item(self, *key, **kwargs):
         '''Clear a selected item from the cache
@@ -252,6 +446,10 @@ class Cache(object):
         dealloc = kwargs.pop('dealloc', False)
         if len(kwargs) > 0:
             raise TypeError('Unexpected arguments: %s' % kwargs.keys())
+        if key in self._spilled:
+            # Spilled items are simply forgotten.
+            self._del_item(key)
+            return
         item = self._store.get(key)
         if item is None:
             return
@@ -259,7 +457,7 @@ class Cache(object):
         if not dealloc:
             cleared = item.clear()
         if not cleared:
-            del self._store[key]
+            self._del_item(key)
 
     def load(self, *key, **kwargs):
         '''Get a value from the cache
@@ -308,15 +506,16 @@ class Cache(object):
             raise TypeError('Unknown optional arguments: %s' % kwargs.keys())
 
         # get the item from the store and decide what to do
-        item = self._store.get(key)
+        item = self._get_item(key)
         # there are three behaviors, depending on the keyword argumentsL
         if alloc is not None:
             # alloc is given. hence two return values: value, new
             if item is None:
                 # allocate a new item and store it
                 item = CacheItem.from_alloc(alloc, tags)
-                self._store[key] = item
-                return item.value, True
+                value = item.value
+                self._set_item(key, item)
+                return value, True
             elif not item.valid:
                 try:
                     # try to reuse the same memroy
@@ -326,7 +525,9 @@ class Cache(object):
                 except TypeError:
                     # if reuse fails, reallocate
                     item = CacheItem.from_alloc(alloc, tags)
-                    self._store[key] = item
+                    value = item.value
+                    self._set_item(key, item)
+                    return value, True
                 return item.value, True
             else:
                 item.check_alloc(alloc)
@@ -347,6 +548,8 @@ class Cache(object):
 
     def __contains__(self, key):
         key = _normalize_key(key)
+        if key in self._spilled:
+            return True
         item = self._store.get(key)
         if item is None:
             return False
@@ -383,10 +586,10 @@ class Cache(object):
         key = _normalize_key(args[:-1])
         value = args[-1]
         item = CacheItem(value, own, tags)
-        self._store[key] = item
+        self._set_item(key, item)
 
     def __len__(self):
-        return sum(item.valid for item in self._store.itervalues())
+        return sum(item.valid for item in self._store.itervalues()) + len(self._spilled)
 
     def __getitem__(self, key):
         return self.load(key)
@@ -400,20 +603,24 @@ class Cache(object):
     def iterkeys(self, tags=None):
         '''Iterate over the keys of all valid items in the cache.'''
         tags = _normalize_tags(tags)
-        for key, item in self._store.iteritems():
+        for key, item in self._store.items():
             if item.valid and (len(tags) == 0 or len(item.tags & tags) > 0):
                 yield key
+        for key, (name, item_tags) in self._spilled.items():
+            if len(tags) == 0 or len(item_tags & tags) > 0:
+                yield key
 
     def itervalues(self, tags=None):
         '''Iterate over the values of all valid items in the cache.'''
-        tags = _normalize_tags(tags)
-        for item in self._store.itervalues():
-            if item.valid and (len(tags) == 0 or len(item.tags & tags) > 0):
-                yield item.value
+        for key, value in self.iteritems(tags):
+            yield value
 
     def iteritems(self, tags=None):
-        '''Iterate over all valid items in the cache.'''
-        tags = _normalize_tags(tags)
-        for key, item in self._store.iteritems():
-            if item.valid and (len(tags) == 0 or len(item.tags & tags) > 0):
+        '''Iterate over all valid items in the cache.
+
+           Spilled items are loaded again in memory.
+        '''
+        for key in list(self.iterkeys(tags)):
+            item = self._get_item(key)
+            if item is not None and item.valid:
                 yield key, item.value
@@ -22,10 +22,14 @@
 '''C++ extensions'''
 
 
+import os
+
 import numpy as np
 cimport numpy as np
 np.import_array()
 
+cimport openmp
+
 cimport cell
 cimport moments
 cimport nucpot
@@ -37,6 +41,8 @@ __all__ = [
     'fill_cartesian_polynomials', 'fill_pure_polynomials', 'fill_radial_polynomials',
     # nucpot.cpp
     'compute_grid_nucpot',
+    # OpenMP
+    'set_num_threads', 'get_num_threads',
 ]
 
 
@@ -472,3 +478,34 @@ def compute_grid_nucpot(np.ndarray[long, ndim=1] numbers not None,
         nucpot.compute_grid_nucpot(
             &numbers[0], &coordinates[0,0], natom,
             &points[0,0], &output[0], npoint)
+
+
+#
+# OpenMP
+#
+
+
+def set_num_threads(long nthread):
+    '''Set the number of threads used by the parallel loops in Horton.
+
+       **Arguments:**
+
+       nthread
+            The number of threads, must be at least one.
+
+       The default number of threads can also be set with the environment
+       variable ``HORTON_NUM_THREADS``. When that is not present, the OpenMP
+       defaults are used, e.g. ``OMP_NUM_THREADS``.
+    '''
+    if nthread < 1:
+        raise ValueError('The number of threads must be at least one.')
+    openmp.omp_set_num_threads(nthread)
+
+
+def get_num_threads():
+    '''Return the number of threads used by the parallel loops in Horton.'''
+    return openmp.omp_get_max_threads()
+
+
+if 'HORTON_NUM_THREADS' in os.environ:
+    set_num_threads(int(os.environ['HORTON_NUM_THREADS']))
@@ -23,3 +23,4 @@
 
 from horton.espfit.cext import *
 from horton.espfit.cost import *
+from horton.espfit.ewald import *
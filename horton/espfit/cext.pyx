@@ -39,7 +39,7 @@ __all__ = [
     # electrostatics
     'pair_ewald',
     'setup_esp_cost_cube',
-    'compute_esp_grid_cube',
+    'compute_ewald_real_cube', 'compute_esp_grid_cube',
     # mask
     'multiply_dens_mask', 'multiply_near_mask', 'multiply_far_mask',
 ]
@@ -57,17 +57,26 @@ def setup_esp_cost_cube(horton.grid.cext.UniformGrid ugrid not None,
                         np.ndarray[double, ndim=2] A not None,
                         np.ndarray[double, ndim=1] B not None,
                         np.ndarray[double, ndim=0] C not None,
-                        double rcut, double alpha, double gcut):
+                        double rcut, double alpha, double gcut,
+                        long begin0=0, long end0=-1):
+    # When begin0 and end0 are given, only the slab begin0:end0 (along the
+    # first axis) of the grid is considered and vref and weights only contain
+    # the data of this slab. Contributions are added to A, B and C.
 
     is0d = (ugrid.pbc == [0, 0, 0]).all()
     is3d = (ugrid.pbc == [1, 1, 1]).all()
 
+    if end0 < 0:
+        end0 = ugrid.shape[0]
+    assert begin0 >= 0
+    assert end0 > begin0
+    assert end0 <= ugrid.shape[0]
     assert vref.flags['C_CONTIGUOUS']
-    assert vref.shape[0] == ugrid.shape[0]
+    assert vref.shape[0] == end0 - begin0
     assert vref.shape[1] == ugrid.shape[1]
     assert vref.shape[2] == ugrid.shape[2]
     assert weights.flags['C_CONTIGUOUS']
-    assert weights.shape[0] == ugrid.shape[0]
+    assert weights.shape[0] == end0 - begin0
     assert weights.shape[1] == ugrid.shape[1]
     assert weights.shape[2] == ugrid.shape[2]
     assert centers.flags['C_CONTIGUOUS']
@@ -93,14 +102,94 @@ def setup_esp_cost_cube(horton.grid.cext.UniformGrid ugrid not None,
 
     electrostatics.setup_esp_cost_cube(ugrid._this, &vref[0, 0, 0],
         &weights[0, 0, 0], &centers[0, 0], &A[0, 0],
-        &B[0], <double*>np.PyArray_DATA(C), ncenter, rcut, alpha, gcut)
+        &B[0], <double*>np.PyArray_DATA(C), ncenter, rcut, alpha, gcut,
+        begin0, end0)
+
+
+def compute_ewald_real_cube(horton.grid.cext.UniformGrid ugrid not None,
+                            np.ndarray[double, ndim=1] center not None,
+                            np.ndarray[double, ndim=3] output not None,
+                            double rcut, double alpha, double coeff=1.0):
+    '''Add the real-space Ewald potential of a point charge to a cube
+
+       **Arguments:**
+
+       ugrid
+            A UniformGrid object with 3D periodic boundary conditions.
+
+       center
+            The position of the charge.
+
+       output
+            The output array to which the potential is added.
+
+       rcut
+            The real-space cutoff. All periodic images of the center within this
+            distance of a grid point are included.
+
+       alpha
+            The Ewald screening parameter.
+
+       **Optional arguments:**
+
+       coeff
+            The charge at the center.
+    '''
+    assert center.flags['C_CONTIGUOUS']
+    assert center.shape[0] == 3
+    assert output.flags['C_CONTIGUOUS']
+    assert output.shape[0] == ugrid.shape[0]
+    assert output.shape[1] == ugrid.shape[1]
+    assert output.shape[2] == ugrid.shape[2]
+    assert rcut > 0
+    assert alpha > 0
+    if not (ugrid.pbc == [1, 1, 1]).all():
+        raise NotImplementedError
+
+    electrostatics.compute_ewald_real_cube(ugrid._this, &center[0], coeff,
+        &output[0, 0, 0], rcut, alpha)
 
 
 def compute_esp_grid_cube(horton.grid.cext.UniformGrid ugrid not None,
                           np.ndarray[double, ndim=3] esp not None,
                           np.ndarray[double, ndim=2] centers not None,
                           np.ndarray[double, ndim=1] charges not None,
-                          double rcut, double alpha, double gcut):
+                          double rcut, double alpha, double gcut,
+                          method='direct'):
+    '''Compute the electrostatic potential of point charges on a cube
+
+       **Arguments:**
+
+       ugrid
+            A UniformGrid object.
+
+       esp
+            The output array.
+
+       centers
+            The positions of the point charges, shape=(n,3).
+
+       charges
+            The point charges, shape=(n,).
+
+       rcut, alpha, gcut
+            The Ewald parameters, see ``pair_ewald``.
+
+       **Optional arguments:**
+
+       method
+            'direct' (default) evaluates the Ewald sum for every pair of a grid
+            point and a center. 'spme' is only supported for 3D periodic grids
+            and uses the smooth particle-mesh Ewald method, see
+            ``compute_esp_spme_cube``.
+    '''
+    if method == 'spme':
+        from horton.espfit.ewald import compute_esp_spme_cube
+        esp[:] = 0.0
+        compute_esp_spme_cube(ugrid, esp, centers, charges, rcut, alpha, gcut)
+        return
+    elif method != 'direct':
+        raise ValueError('The method argument must be \'direct\' or \'spme\'.')
     assert centers.flags['C_CONTIGUOUS']
     ncenter = centers.shape[0]
     assert ncenter > 0
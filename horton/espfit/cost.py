@@ -28,9 +28,10 @@ from horton.units import angstrom
 from horton.grid.cext import UniformGrid
 from horton.espfit.cext import setup_esp_cost_cube, multiply_dens_mask, \
     multiply_near_mask, multiply_far_mask
+from horton.espfit.ewald import iter_ewald_unit_cubes
 
 
-__all__ = ['ESPCost', 'setup_weights']
+__all__ = ['ESPCost', 'ESPCostAccumulator', 'setup_weights']
 
 
 class ESPCost(object):
@@ -59,27 +60,76 @@ class ESPCost(object):
         grp['natom'] = self.natom
 
     @classmethod
-    def from_grid_data(cls, system, ugrid, vref, weights, rcut=20.0, alpha=None, gcut=None):
-        if alpha is None:
-            alpha = 3.0 / rcut
-        if gcut is None:
-            gcut = 1.1 * alpha
+    def from_grid_data(cls, system, ugrid, vref, weights, rcut=20.0, alpha=None, gcut=None, method='direct'):
+        '''Construct the cost function from ESP data on a uniform grid
+
+           **Arguments:**
+
+           system
+                The System object with the positions of the charges.
+
+           ugrid
+                A UniformGrid object.
+
+           vref
+                The reference ESP on the grid.
+
+           weights
+                The weights of the grid points in the cost function.
+
+           **Optional arguments:**
+
+           rcut, alpha, gcut
+                The Ewald parameters, only used for 3D periodic grids. When
+                not given, alpha = 3/rcut and gcut = 1.1*alpha.
+
+           method
+                'direct' (default) evaluates the Ewald sum for every pair of
+                a grid point and an atom. 'fft' is only supported for 3D
+                periodic grids and is much faster for large systems: it
+                computes the potential of each unit charge on the whole grid
+                at once (see ``iter_ewald_unit_cubes``) and assembles the cost
+                function with matrix products. It keeps the potentials of all
+                atoms at all grid points with a non-zero weight in memory.
+
+           For grids that do not fit in memory, use the ``ESPCostAccumulator``
+           instead.
+        '''
+        if method not in ['direct', 'fft']:
+            raise ValueError('The method argument must be \'direct\' or \'fft\'.')
         if isinstance(ugrid, UniformGrid):
             if (ugrid.pbc == [1, 1, 1]).all():
-                A = np.zeros((system.natom+1, system.natom+1), float)
-                B = np.zeros(system.natom+1, float)
-                C = np.zeros((), float)
-                setup_esp_cost_cube(ugrid, vref, weights, system.coordinates, A, B, C, rcut, alpha, gcut)
-                return cls(A, B, C, system.natom)
-            else:
-                A = np.zeros((system.natom, system.natom), float)
-                B = np.zeros(system.natom, float)
-                C = np.zeros((), float)
-                setup_esp_cost_cube(ugrid, vref, weights, system.coordinates, A, B, C, 0.0, 0.0, 0.0)
-                return cls(A, B, C, system.natom)
+                if method == 'fft':
+                    if alpha is None:
+                        alpha = 3.0 / rcut
+                    if gcut is None:
+                        gcut = 1.1 * alpha
+                    return cls._from_grid_data_fft(system, ugrid, vref, weights, rcut, alpha, gcut)
+            elif method == 'fft':
+                raise NotImplementedError('The fft method requires a 3D periodic grid.')
+            accumulator = ESPCostAccumulator(system.coordinates, ugrid, rcut, alpha, gcut)
+            accumulator.add_slab(0, vref, weights)
+            return accumulator.get_cost()
         else:
             raise NotImplementedError
 
+    @classmethod
+    def _from_grid_data_fft(cls, system, ugrid, vref, weights, rcut, alpha, gcut):
+        mask = weights.ravel() > 0
+        sqrtw = np.sqrt(weights.ravel()[mask]*ugrid.get_grid_cell().volume)
+        # Design matrix: one row per unknown, one column per used grid point.
+        # The last row corresponds to the constant shift of the potential.
+        design = np.zeros((system.natom+1, mask.sum()), float)
+        for iatom, pot in enumerate(iter_ewald_unit_cubes(ugrid, system.coordinates, rcut, alpha, gcut)):
+            design[iatom] = pot.ravel()[mask]
+            design[iatom] *= sqrtw
+        design[system.natom] = sqrtw
+        vrefw = vref.ravel()[mask]*sqrtw
+        A = np.dot(design, design.T)
+        B = np.dot(design, vrefw)
+        C = np.array(np.dot(vrefw, vrefw))
+        return cls(A, B, C, system.natom)
+
     def value(self, x):
         return np.dot(x, np.dot(self._A, x) - 2*self._B) + self._C
 
@@ -137,6 +187,237 @@ class ESPCost(object):
         return x
 
 
+class ESPCostAccumulator(object):
+    '''Construct an ESPCost from ESP data on a uniform grid, slab by slab
+
+       A slab is a range of consecutive layers along the first axis of the
+       grid, i.e. a contiguous part of the (C-ordered) grid data. The slabs can
+       be added in any order, such that the data never have to be loaded in
+       memory all at once. Partial accumulators, e.g. computed in separate
+       processes, can be merged and they can be stored in an HDF5 checkpoint
+       to resume an interrupted computation.
+    '''
+    def __init__(self, coordinates, ugrid, rcut=20.0, alpha=None, gcut=None):
+        '''
+           **Arguments:**
+
+           coordinates
+                The positions of the charges, shape (natom, 3).
+
+           ugrid
+                A UniformGrid object, with 0D or 3D periodic boundary
+                conditions.
+
+           **Optional arguments:**
+
+           rcut, alpha, gcut
+                The Ewald parameters, only used for 3D periodic grids. When
+                not given, alpha = 3/rcut and gcut = 1.1*alpha.
+        '''
+        if not isinstance(ugrid, UniformGrid):
+            raise NotImplementedError
+        self.is3d = (ugrid.pbc == [1, 1, 1]).all()
+        if self.is3d:
+            if alpha is None:
+                alpha = 3.0 / rcut
+            if gcut is None:
+                gcut = 1.1 * alpha
+        else:
+            rcut, alpha, gcut = 0.0, 0.0, 0.0
+        self.coordinates = coordinates
+        self.ugrid = ugrid
+        self.rcut = rcut
+        self.alpha = alpha
+        self.gcut = gcut
+        neq = self.natom + self.is3d
+        self._A = np.zeros((neq, neq), float)
+        self._B = np.zeros(neq, float)
+        self._C = np.zeros((), float)
+        # One flag per layer of the grid, set when the layer has been added.
+        self._done = np.zeros(ugrid.shape[0], bool)
+        # Checksums of the data in each layer that has been added, see
+        # check_data.
+        self._checksums = np.zeros((ugrid.shape[0], 2), float)
+
+    def _get_natom(self):
+        '''The number of atoms'''
+        return len(self.coordinates)
+
+    natom = property(_get_natom)
+
+    def _get_complete(self):
+        '''True when all layers of the grid are added'''
+        return self._done.all()
+
+    complete = property(_get_complete)
+
+    @classmethod
+    def from_hdf5(cls, grp, lf):
+        result = cls(
+            grp['coordinates'][:],
+            UniformGrid.from_hdf5(grp['ugrid'], lf),
+            grp['rcut'][()],
+            grp['alpha'][()],
+            grp['gcut'][()],
+        )
+        result._A[:] = grp['A'][:]
+        result._B[:] = grp['B'][:]
+        result._C[...] = grp['C'][()]
+        result._done[:] = grp['done'][:]
+        result._checksums[:] = grp['checksums'][:]
+        return result
+
+    def to_hdf5(self, grp):
+        grp.attrs['class'] = self.__class__.__name__
+        grp['coordinates'] = self.coordinates
+        self.ugrid.to_hdf5(grp.create_group('ugrid'))
+        grp['rcut'] = self.rcut
+        grp['alpha'] = self.alpha
+        grp['gcut'] = self.gcut
+        grp['A'] = self._A
+        grp['B'] = self._B
+        grp['C'] = self._C
+        grp['done'] = self._done
+        grp['checksums'] = self._checksums
+
+    def add_slab(self, begin, vref, weights):
+        '''Add the contributions of a slab of the grid to the cost function
+
+           **Arguments:**
+
+           begin
+                The index of the first layer of the slab (along the first axis
+                of the grid).
+
+           vref
+                The reference ESP in the slab, shape (nlayer, shape[1],
+                shape[2]). A memory-mapped array or an HDF5 dataset may also
+                be given. It is converted to a Numpy array in memory.
+
+           weights
+                The weights of the grid points in the slab, same shape as vref.
+        '''
+        vref = np.ascontiguousarray(vref, float)
+        weights = np.ascontiguousarray(weights, float)
+        end = begin + len(vref)
+        if begin < 0 or end > self.ugrid.shape[0] or end == begin:
+            raise ValueError('The slab does not fit in the grid.')
+        if self._done[begin:end].any():
+            raise ValueError('Some layers of the slab were already added.')
+        setup_esp_cost_cube(self.ugrid, vref, weights, self.coordinates,
+            self._A, self._B, self._C, self.rcut, self.alpha, self.gcut,
+            begin, end)
+        self._done[begin:end] = True
+        self._checksums[begin:end] = _compute_checksums(vref, weights)
+
+    def iter_slabs(self, nlayer, begin=0, end=None):
+        '''Iterate over the slabs that still have to be added
+
+           **Arguments:**
+
+           nlayer
+                The maximum number of layers in one slab.
+
+           **Optional arguments:**
+
+           begin, end
+                Only consider the layers begin:end of the grid. By default, all
+                layers are considered.
+
+           Yields (begin, end) tuples, such that the slab consists of the
+           layers begin:end.
+        '''
+        if nlayer <= 0:
+            raise ValueError('The number of layers in a slab must be strictly positive.')
+        if end is None:
+            end = len(self._done)
+        if begin < 0 or end > len(self._done) or end <= begin:
+            raise ValueError('The range of layers does not fit in the grid.')
+        while begin < end:
+            if self._done[begin]:
+                begin += 1
+                continue
+            slab_end = begin + 1
+            while slab_end < end and slab_end - begin < nlayer and not self._done[slab_end]:
+                slab_end += 1
+            yield begin, slab_end
+            begin = slab_end
+
+    def merge(self, other):
+        '''Add the contributions of another (partial) accumulator to this one
+
+           **Arguments:**
+
+           other
+                An ESPCostAccumulator for the same grid, the same charges and
+                the same Ewald parameters. It may not contain layers that are
+                already added to this accumulator.
+        '''
+        self.check_compatible(other)
+        if (self._done & other._done).any():
+            raise ValueError('Some layers are present in both accumulators.')
+        self._A += other._A
+        self._B += other._B
+        self._C += other._C
+        self._done |= other._done
+        self._checksums[other._done] = other._checksums[other._done]
+
+    def check_compatible(self, other):
+        '''Raise a ValueError when another accumulator has a different setup
+
+           **Arguments:**
+
+           other
+                An ESPCostAccumulator. It must have the same grid, the same
+                charges and the same Ewald parameters.
+        '''
+        if not ((self.ugrid.shape == other.ugrid.shape).all() and
+                (self.ugrid.pbc == other.ugrid.pbc).all() and
+                (self.ugrid.origin == other.ugrid.origin).all() and
+                (self.ugrid.grid_rvecs == other.ugrid.grid_rvecs).all()):
+            raise ValueError('The accumulators are defined on different grids.')
+        if self.coordinates.shape != other.coordinates.shape or \
+           (self.coordinates != other.coordinates).any():
+            raise ValueError('The accumulators have different coordinates.')
+        if (self.rcut, self.alpha, self.gcut) != (other.rcut, other.alpha, other.gcut):
+            raise ValueError('The accumulators have different Ewald parameters.')
+
+    def check_data(self, vref, weights):
+        '''Raise a ValueError when the added layers used other data
+
+           **Arguments:**
+
+           vref
+                The reference ESP on the whole grid.
+
+           weights
+                The weights on the whole grid.
+
+           The data of the layers that are already added are compared with
+           those given here, through a checksum per layer. This is useful to
+           make sure that a checkpoint belongs to the current computation.
+        '''
+        for index in self._done.nonzero()[0]:
+            checksums = _compute_checksums(
+                np.asarray(vref[index:index+1], float),
+                np.asarray(weights[index:index+1], float))[0]
+            if abs(checksums - self._checksums[index]).max() > 1e-10*abs(checksums).max():
+                raise ValueError('The ESP or the weights of layer %i differ from those used before.' % index)
+
+    def get_cost(self):
+        '''Return the ESPCost object, once all layers of the grid are added'''
+        if not self.complete:
+            raise ValueError('Not all layers of the grid have been added.')
+        return ESPCost(self._A.copy(), self._B.copy(), self._C.copy(), self.natom)
+
+
+def _compute_checksums(vref, weights):
+    '''Return the sum of the weights and of weights*vref for each layer'''
+    wsums = weights.reshape(len(weights), -1).sum(axis=1)
+    wvsums = (weights*vref).reshape(len(weights), -1).sum(axis=1)
+    return np.array([wsums, wvsums]).T
+
+
 def setup_weights(system, grid, dens=None, near=None, far=None):
     '''Define a weight function for the ESPCost
 
@@ -109,7 +109,8 @@ double pair_ewald3d(double* delta, const Cell* cell, double rcut, double alpha,
 
 void setup_esp_cost_cube(UniformGrid* ugrid, double* vref,
     double* weights, double* centers, double* A, double* B, double* C,
-    long ncenter, double rcut, double alpha, double gcut) {
+    long ncenter, double rcut, double alpha, double gcut, long begin0,
+    long end0) {
 
     Cell* cell = ugrid->get_cell();
     Cell* grid_cell = ugrid->get_grid_cell();
@@ -119,7 +120,11 @@ void setup_esp_cost_cube(UniformGrid* ugrid, double* vref,
     double* work = new double[neq];
     double grid_cart[3];
 
-    Cube3Iterator c3i = Cube3Iterator(NULL, ugrid->shape);
+    // Only the slab begin0 <= i[0] < end0 of the grid is considered. The arrays
+    // vref and weights only contain the data for this slab.
+    long begin[3] = {begin0, 0, 0};
+    long end[3] = {end0, ugrid->shape[1], ugrid->shape[2]};
+    Cube3Iterator c3i = Cube3Iterator(begin, end);
     long i[3];
     long npoint = c3i.get_npoint();
 
@@ -166,6 +171,43 @@ void setup_esp_cost_cube(UniformGrid* ugrid, double* vref,
 }
 
 
+void compute_ewald_real_cube(UniformGrid* ugrid, double* center,
+    double coeff, double* output, double rcut, double alpha) {
+
+    // Find the ranges for the triple loop over all periodic images of the
+    // center within the cutoff.
+    long begin[3], end[3];
+    ugrid->set_ranges_rcut(center, rcut, begin, end);
+
+    Block3Iterator b3i = Block3Iterator(begin, end, ugrid->shape);
+
+    // Run triple loop over blocks (serial)
+    for (long iblock=b3i.get_nblock()-1; iblock>=0; iblock--) {
+        long b[3];
+        b3i.set_block(iblock, b);
+
+        long cube_begin[3];
+        long cube_end[3];
+        b3i.set_cube_ranges(b, cube_begin, cube_end);
+
+        // Run triple loop within one block (parallel)
+        Cube3Iterator c3i = Cube3Iterator(cube_begin, cube_end);
+        #pragma omp parallel for
+        for (long ipoint=c3i.get_npoint()-1; ipoint>=0; ipoint--) {
+            long j[3];
+            long jwrap[3];
+            c3i.set_point(ipoint, jwrap);
+            b3i.translate(b, jwrap, j);
+
+            double d = ugrid->dist_grid_point(center, j);
+            if (d < rcut) {
+                *(ugrid->get_pointer(output, jwrap)) += coeff*erfc(alpha*d)/d;
+            }
+        }
+    }
+}
+
+
 void compute_esp_cube(UniformGrid* ugrid, double* esp,
     double* centers, double* charges, long ncenter, double rcut, double alpha,
     double gcut) {
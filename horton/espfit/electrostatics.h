@@ -33,7 +33,11 @@ double pair_ewald3d(double* delta, const Cell* cell, double rcut, double alpha,
 
 void setup_esp_cost_cube(UniformGrid* ugrid, double* vref,
     double* weights, double* centers, double* A, double* B, double* C,
-    long ncenter, double rcut, double alpha, double gcut);
+    long ncenter, double rcut, double alpha, double gcut, long begin0,
+    long end0);
+
+void compute_ewald_real_cube(UniformGrid* ugrid, double* center,
+    double coeff, double* output, double rcut, double alpha);
 
 void compute_esp_cube(UniformGrid* ugrid, double* esp,
     double* centers, double* charges, long ncenter, double rcut, double alpha,
@@ -31,7 +31,11 @@ cdef extern from "electrostatics.h":
 
     void setup_esp_cost_cube(uniform.UniformGrid* ugrid,
         double* vref, double* weights, double* centers, double* A, double* B,
-        double* C, long ncenter, double rcut, double alpha, double gcut) except +
+        double* C, long ncenter, double rcut, double alpha, double gcut,
+        long begin0, long end0) except +
+
+    void compute_ewald_real_cube(uniform.UniformGrid* ugrid, double* center,
+        double coeff, double* output, double rcut, double alpha)
 
     void compute_esp_cube(uniform.UniformGrid* ugrid, double* esp,
         double* centers, double* charges, long ncenter, double rcut,
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Horton is a development platform for electronic structure methods.
+# Copyright (C) 2011-2013 Toon Verstraelen <Toon.Verstraelen@UGent.be>
+#
+# This file is part of Horton.
+#
+# Horton is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# Horton is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+'''Ewald summation of electrostatic potentials on uniform grids'''
+
+
+import numpy as np
+
+from horton.log import log
+from horton.espfit.cext import compute_ewald_real_cube
+
+
+__all__ = [
+    'compute_ewald_reci_cube', 'iter_ewald_unit_cubes', 'compute_esp_spme_cube',
+]
+
+
+def _setup_ewald_reci(ugrid, alpha, gcut):
+    '''Precompute the center-independent part of the reciprocal-space sum
+
+       **Returns:** a four-tuple with the integer coefficients of the
+       k-vectors, shape=(nk,3), their flat indexes in the FFT mesh (folded into
+       the shape of the grid), the Cartesian k-vectors and the corresponding
+       prefactors.
+    '''
+    cell = ugrid.get_cell()
+    kmax = np.ceil(gcut/cell.gspacings).astype(int)
+    ms = np.indices(2*kmax+1).reshape(3, -1).T - kmax
+    # Exclude the origin of reciprocal space
+    ms = ms[abs(ms).sum(axis=1) > 0]
+    kvecs = 2*np.pi*np.dot(ms, cell.gvecs)
+    ksq = (kvecs**2).sum(axis=1)
+    prefacs = 4*np.pi/cell.volume*np.exp(-0.25*ksq/alpha**2)/ksq
+    # Because the grid points are equidistant along each cell vector, the
+    # plane waves of k-vectors outside the mesh alias exactly onto a k-vector
+    # within the mesh.
+    shape = ugrid.shape
+    folded = ms % shape
+    indexes = (folded[:,0]*shape[1] + folded[:,1])*shape[2] + folded[:,2]
+    return ms, indexes, kvecs, prefacs
+
+
+def _add_ewald_reci(ugrid, center, output, alpha, reci):
+    '''Add the reciprocal-space Ewald potential with precomputed terms'''
+    ms, indexes, kvecs, prefacs = reci
+    phases = np.dot(kvecs, center - ugrid.origin)
+    size = ugrid.size
+    coeffs = np.bincount(indexes, prefacs*np.cos(phases), size) + \
+             1j*np.bincount(indexes, prefacs*np.sin(phases), size)
+    output += np.fft.fftn(coeffs.reshape(ugrid.shape)).real
+    # background correction (needed to make result independent of alpha)
+    output -= np.pi/ugrid.get_cell().volume/alpha**2
+
+
+def compute_ewald_reci_cube(ugrid, center, output, alpha, gcut):
+    '''Add the reciprocal-space Ewald potential of a unit charge to a cube
+
+       **Arguments:**
+
+       ugrid
+            A UniformGrid object with 3D periodic boundary conditions.
+
+       center
+            The position of the unit charge.
+
+       output
+            The output array to which the potential is added.
+
+       alpha
+            The Ewald screening parameter.
+
+       gcut
+            The reciprocal-space cutoff.
+
+       The result is identical to the reciprocal-space part of ``pair_ewald``,
+       but the whole grid is done with a single FFT instead of a sum over all
+       k-vectors for every grid point.
+    '''
+    if not (ugrid.pbc == [1, 1, 1]).all():
+        raise NotImplementedError
+    assert output.shape == tuple(ugrid.shape)
+    _add_ewald_reci(ugrid, center, output, alpha, _setup_ewald_reci(ugrid, alpha, gcut))
+
+
+def iter_ewald_unit_cubes(ugrid, centers, rcut, alpha, gcut):
+    '''Iterate over the periodic potentials of unit charges on a cube
+
+       **Arguments:**
+
+       ugrid
+            A UniformGrid object with 3D periodic boundary conditions.
+
+       centers
+            An array with the positions of the unit charges, shape=(n,3).
+
+       rcut, alpha, gcut
+            The Ewald parameters, see ``pair_ewald``.
+
+       **Yields:** for every center, a new array with the potential on the
+       grid. The real-space part is evaluated with a cell list of all periodic
+       images within the cutoff, the reciprocal-space part with an FFT. The
+       k-vector terms are computed only once for all centers.
+    '''
+    if not (ugrid.pbc == [1, 1, 1]).all():
+        raise NotImplementedError
+    reci = _setup_ewald_reci(ugrid, alpha, gcut)
+    for center in centers:
+        center = np.ascontiguousarray(center, float)
+        output = ugrid.zeros()
+        compute_ewald_real_cube(ugrid, center, output, rcut, alpha)
+        _add_ewald_reci(ugrid, center, output, alpha, reci)
+        yield output
+
+
+def _eval_bspline(x, order):
+    '''Evaluate the cardinal B-spline of the given order, M_order(x)'''
+    if order == 2:
+        return np.clip(1 - abs(x - 1), 0, None)
+    return (x*_eval_bspline(x, order-1) + (order-x)*_eval_bspline(x-1, order-1))/(order-1)
+
+
+def _get_bspline_moduli(m, size, order):
+    '''The factors b(m) of the Euler exponential spline interpolation
+
+       These satisfy exp(2*pi*i*m*u/size) ~ b(m) sum_k M_order(u-k)
+       exp(2*pi*i*m*k/size), where the sum runs over all integers k.
+    '''
+    k = np.arange(order-1)
+    denom = np.dot(np.exp(2j*np.pi*np.outer(m, k)/size), _eval_bspline(k+1.0, order))
+    return np.exp(2j*np.pi*(order-1)*m/size)/denom
+
+
+def compute_esp_spme_cube(ugrid, esp, centers, charges, rcut, alpha, gcut, order=6):
+    '''Add the periodic potential of point charges to a cube with SPME
+
+       **Arguments:**
+
+       ugrid
+            A UniformGrid object with 3D periodic boundary conditions.
+
+       esp
+            The output array to which the potential is added.
+
+       centers
+            The positions of the point charges, shape=(n,3).
+
+       charges
+            The point charges, shape=(n,).
+
+       rcut, alpha, gcut
+            The Ewald parameters, see ``pair_ewald``.
+
+       **Optional arguments:**
+
+       order
+            The order of the B-splines used to spread the charges on the grid.
+
+       The charges are spread on the grid with B-splines and the
+       reciprocal-space part of the potential is obtained with two FFTs, using
+       the smooth particle-mesh Ewald method. The real-space part
+       only includes the grid points within the cutoff of each periodic image
+       of a center. The result agrees with ``compute_esp_grid_cube`` (direct
+       method) up to the spline interpolation error, which decreases with the
+       order and with the number of grid points per k-vector.
+    '''
+    if not (ugrid.pbc == [1, 1, 1]).all():
+        raise NotImplementedError
+    assert esp.shape == tuple(ugrid.shape)
+    assert centers.shape == (len(charges), 3)
+    log.cite('essmann1995', 'the smooth particle-mesh Ewald method')
+    ms, indexes, kvecs, prefacs = _setup_ewald_reci(ugrid, alpha, gcut)
+    shape = ugrid.shape
+    if (2*abs(ms).max(axis=0) >= shape).any():
+        raise ValueError('The reciprocal cutoff is too large for the grid. '
+                         'Decrease gcut or use the direct method.')
+
+    # Spread the charges on the grid. In fractional grid coordinates, u, the
+    # charge contributes to grid points floor(u)-j with j=0..order-1.
+    cell = ugrid.get_cell()
+    us = np.dot(centers - ugrid.origin, cell.gvecs.T)*shape
+    floors = np.floor(us).astype(int)
+    js = np.arange(order)
+    splines = _eval_bspline((us - floors)[:,:,None] + js, order)
+    idx = (floors[:,:,None] - js) % shape[:,None]
+    flat = (idx[:,0,:,None,None]*shape[1] + idx[:,1,None,:,None])*shape[2] + idx[:,2,None,None,:]
+    values = charges[:,None,None,None]*splines[:,0,:,None,None]* \
+             splines[:,1,None,:,None]*splines[:,2,None,None,:]
+    spread = np.bincount(flat.ravel(), values.ravel(), ugrid.size)
+
+    # Approximate structure factors for all k-vectors within the cutoff
+    sfacs = np.fft.fftn(spread.reshape(shape)).ravel()[indexes].conj()
+    for i in xrange(3):
+        sfacs *= _get_bspline_moduli(ms[:,i], shape[i], order)
+
+    # Reciprocal-space potential on the grid
+    coeffs = np.zeros(ugrid.size, complex)
+    coeffs[indexes] = prefacs*sfacs
+    esp += np.fft.fftn(coeffs.reshape(shape)).real
+    # background correction (needed to make result independent of alpha)
+    esp -= np.pi/cell.volume/alpha**2*charges.sum()
+
+    # Real-space potential on the grid
+    for center, charge in zip(centers, charges):
+        compute_ewald_real_cube(ugrid, np.ascontiguousarray(center), esp, rcut, alpha, charge)
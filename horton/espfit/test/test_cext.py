@@ -23,6 +23,7 @@
 
 import numpy as np
 from horton import *
+from nose.tools import assert_raises
 from horton.test.common import get_random_cell
 
 
@@ -40,3 +41,75 @@ def test_pair_ewald3d_invariance_rcut():
         results.append(pair_ewald(delta, cell, rcut, alpha, gcut))
     results = np.array(results)
     assert abs(results - results.mean()).max() < 1e-7
+
+
+def test_ewald_unit_cubes():
+    np.random.seed(1)
+    origin = np.random.uniform(-3, 3, 3)
+    grid_rvecs = np.diag(np.random.uniform(1.5, 2.0, 3))
+    grid_rvecs += np.random.uniform(-0.1, 0.1, (3, 3))
+    shape = np.array([6, 5, 7])
+    pbc = np.array([1, 1, 1])
+    ugrid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    centers = np.random.normal(0, 3, (3, 3))
+    rcut = 15.0
+    alpha = 4.5/rcut
+    gcut = 1.5*alpha
+    # the direct sum over all pairs, with the same sign convention as the
+    # potential of unit charges
+    esp = np.zeros(shape)
+    for center, pot in zip(centers, iter_ewald_unit_cubes(ugrid, centers, rcut, alpha, gcut)):
+        esp[:] = 0.0
+        compute_esp_grid_cube(ugrid, esp, center.reshape(1, 3), np.ones(1), rcut, alpha, gcut)
+        assert abs(pot - esp).max() < 1e-6*abs(esp).max()
+
+
+def test_ewald_reci_cube():
+    np.random.seed(2)
+    origin = np.zeros(3)
+    grid_rvecs = np.identity(3)*0.8
+    shape = np.array([4, 4, 4])
+    pbc = np.array([1, 1, 1])
+    ugrid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    center = np.random.normal(0, 1, 3)
+    # a large gcut makes the k-vectors wrap around the FFT mesh
+    alpha = 0.8
+    gcut = 3.0*alpha
+    pot_reci = np.zeros(shape)
+    compute_ewald_reci_cube(ugrid, center, pot_reci, alpha, gcut)
+    pot_real = np.zeros(shape)
+    compute_ewald_real_cube(ugrid, center, pot_real, 20.0, alpha)
+    esp = np.zeros(shape)
+    compute_esp_grid_cube(ugrid, esp, center.reshape(1, 3), np.ones(1), 20.0, alpha, gcut)
+    assert abs(pot_reci + pot_real - esp).max() < 1e-8
+
+
+def test_esp_grid_cube_spme():
+    np.random.seed(3)
+    nrep = 20
+    origin = np.random.uniform(-1, 1, 3)
+    grid_rvecs = (np.identity(3)*12.0 + np.random.uniform(-0.1, 0.1, (3, 3)))/nrep
+    shape = np.array([nrep, nrep, nrep])
+    pbc = np.array([1, 1, 1])
+    ugrid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    centers = np.random.uniform(0, 12, (10, 3))
+    charges = np.random.normal(0, 1, 10)
+    rcut = 15.0
+    alpha = 4.5/rcut
+    gcut = 1.5*alpha
+    esp1 = ugrid.zeros()
+    compute_esp_grid_cube(ugrid, esp1, centers, charges, rcut, alpha, gcut)
+    esp2 = ugrid.zeros()
+    compute_esp_grid_cube(ugrid, esp2, centers, charges, rcut, alpha, gcut, 'spme')
+    assert abs(esp1 - esp2).max() < 1e-7*abs(esp1).max()
+    # The interpolation error decreases with the order of the B-splines
+    errors = []
+    for order in 4, 6, 8:
+        esp2[:] = 0.0
+        compute_esp_spme_cube(ugrid, esp2, centers, charges, rcut, alpha, gcut, order)
+        errors.append(abs(esp1 - esp2).max())
+    assert errors[0] > errors[1] > errors[2]
+    assert errors[2] < 1e-9*abs(esp1).max()
+    # A too large reciprocal cutoff can not be represented on the grid
+    with assert_raises(ValueError):
+        compute_esp_spme_cube(ugrid, esp2, centers, charges, rcut, alpha, 5*gcut)
@@ -23,6 +23,7 @@
 
 import numpy as np, h5py as h5
 from horton import *
+from nose.tools import assert_raises
 from horton.test.common import check_delta
 
 
@@ -367,6 +368,37 @@ def test_consistent():
     assert abs(charges - x[:-1]).max() < 1e-4
 
 
+def test_esp_cost_cube3d_fft():
+    # Some parameters
+    coordinates, numbers, origin, grid_rvecs, shape, pbc, vref, weights = \
+        get_random_esp_cost_cube3d_args()
+    sys = System(coordinates, numbers)
+    grid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    weights[0] = 0.0
+    # Both methods only differ in the truncation of the real-space sum, which
+    # is negligible with these parameters.
+    rcut = 20.0
+    alpha = 4.5/rcut
+    gcut = 1.5*alpha
+    cost1 = ESPCost.from_grid_data(sys, grid, vref, weights, rcut, alpha, gcut)
+    cost2 = ESPCost.from_grid_data(sys, grid, vref, weights, rcut, alpha, gcut, method='fft')
+    assert abs(cost1._A - cost2._A).max() < 1e-8*abs(cost1._A).max()
+    assert abs(cost1._B - cost2._B).max() < 1e-8*abs(cost1._B).max()
+    assert abs(cost1._C - cost2._C) < 1e-10
+    assert cost1.natom == cost2.natom
+
+
+def test_esp_cost_cube0d_fft():
+    coordinates, numbers, origin, grid_rvecs, shape, pbc, vref, weights = \
+        get_random_esp_cost_cube0d_args()
+    sys = System(coordinates, numbers)
+    grid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    with assert_raises(NotImplementedError):
+        ESPCost.from_grid_data(sys, grid, vref, weights, method='fft')
+    with assert_raises(ValueError):
+        ESPCost.from_grid_data(sys, grid, vref, weights, method='foo')
+
+
 def test_hdf5():
     with h5.File('horton.espfit.test.test_cost.test_hdf5.h5', driver='core', backing_store=False) as f:
         cost1 = get_random_esp_cost_cube3d()
@@ -376,3 +408,103 @@ def test_hdf5():
     assert abs(cost1._B - cost2._B).max() == 0
     assert cost1._C - cost2._C == 0
     assert cost1.natom == cost2.natom
+
+
+def check_accumulator(args):
+    coordinates, numbers, origin, grid_rvecs, shape, pbc, vref, weights = args
+    sys = System(coordinates, numbers)
+    grid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    cost1 = ESPCost.from_grid_data(sys, grid, vref, weights)
+    # Add the slabs in two accumulators, in a random order.
+    acc1 = ESPCostAccumulator(coordinates, grid)
+    acc2 = ESPCostAccumulator(coordinates, grid)
+    slabs = list(acc1.iter_slabs(2))
+    assert slabs == [(0, 2), (2, 4), (4, 5)]
+    acc1.add_slab(4, vref[4:], weights[4:])
+    assert list(acc1.iter_slabs(2)) == [(0, 2), (2, 4)]
+    assert list(acc1.iter_slabs(3)) == [(0, 3), (3, 4)]
+    acc2.add_slab(0, vref[:3], weights[:3])
+    with assert_raises(ValueError):
+        acc2.add_slab(2, vref[2:4], weights[2:4])
+    with assert_raises(ValueError):
+        acc2.add_slab(4, vref[3:], weights[3:])
+    with assert_raises(ValueError):
+        acc2.get_cost()
+    acc1.merge(acc2)
+    assert not acc1.complete
+    with assert_raises(ValueError):
+        acc1.merge(acc2)
+    acc1.add_slab(3, vref[3:4], weights[3:4])
+    assert acc1.complete
+    assert list(acc1.iter_slabs(2)) == []
+    cost2 = acc1.get_cost()
+    assert abs(cost1._A - cost2._A).max() < 1e-10*abs(cost1._A).max()
+    assert abs(cost1._B - cost2._B).max() < 1e-10*abs(cost1._B).max()
+    assert abs(cost1._C - cost2._C) < 1e-10*abs(cost1._C)
+    assert cost1.natom == cost2.natom
+
+
+def test_accumulator_cube3d():
+    check_accumulator(get_random_esp_cost_cube3d_args())
+
+
+def test_accumulator_cube0d():
+    check_accumulator(get_random_esp_cost_cube0d_args())
+
+
+def test_accumulator_merge_mismatch():
+    coordinates, numbers, origin, grid_rvecs, shape, pbc, vref, weights = \
+        get_random_esp_cost_cube3d_args()
+    grid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    acc1 = ESPCostAccumulator(coordinates, grid)
+    with assert_raises(ValueError):
+        acc1.merge(ESPCostAccumulator(coordinates, grid, rcut=10.0))
+    with assert_raises(ValueError):
+        acc1.merge(ESPCostAccumulator(coordinates+1, grid))
+    grid2 = UniformGrid(origin+1, grid_rvecs, shape, pbc)
+    with assert_raises(ValueError):
+        acc1.merge(ESPCostAccumulator(coordinates, grid2))
+    # The data of the added layers are checked with checksums.
+    acc1.add_slab(1, vref[1:3], weights[1:3])
+    acc1.check_data(vref, weights)
+    weights2 = weights.copy()
+    weights2[2] *= 0.5
+    with assert_raises(ValueError):
+        acc1.check_data(vref, weights2)
+    # Other layers are not checked.
+    weights2 = weights.copy()
+    weights2[3] *= 0.5
+    acc1.check_data(vref, weights2)
+    vref2 = vref.copy()
+    vref2[1] += 1.0
+    with assert_raises(ValueError):
+        acc1.check_data(vref2, weights)
+    # The checksums are also merged.
+    acc2 = ESPCostAccumulator(coordinates, grid)
+    acc2.merge(acc1)
+    with assert_raises(ValueError):
+        acc2.check_data(vref2, weights)
+
+
+def test_accumulator_hdf5():
+    coordinates, numbers, origin, grid_rvecs, shape, pbc, vref, weights = \
+        get_random_esp_cost_cube3d_args()
+    grid = UniformGrid(origin, grid_rvecs, shape, pbc)
+    acc1 = ESPCostAccumulator(coordinates, grid)
+    acc1.add_slab(1, vref[1:3], weights[1:3])
+    with h5.File('horton.espfit.test.test_cost.test_accumulator_hdf5.h5', driver='core', backing_store=False) as f:
+        acc1.to_hdf5(f)
+        acc2 = ESPCostAccumulator.from_hdf5(f, None)
+    assert (acc1.coordinates == acc2.coordinates).all()
+    assert (acc1.ugrid.shape == acc2.ugrid.shape).all()
+    assert (acc1.ugrid.origin == acc2.ugrid.origin).all()
+    assert acc1.alpha == acc2.alpha
+    assert (acc1._A == acc2._A).all()
+    assert (acc1._B == acc2._B).all()
+    assert acc1._C == acc2._C
+    assert (acc1._checksums == acc2._checksums).all()
+    assert list(acc2.iter_slabs(5)) == [(0, 1), (3, 5)]
+    assert list(acc2.iter_slabs(5, 2, 4)) == [(3, 4)]
+    assert list(acc2.iter_slabs(1, 0, 2)) == [(0, 1)]
+    with assert_raises(ValueError):
+        list(acc2.iter_slabs(1, 3, 6))
@@ -26,6 +26,8 @@ import numpy as np
 cimport numpy as np
 np.import_array()
 
+from libc.stdint cimport uint16_t, uint32_t
+
 cimport boys
 cimport cartpure
 cimport common
@@ -38,6 +40,13 @@ cimport iter_pow
 import atexit
 
 from horton.log import log
+from horton.matrix import DenseTwoBody, SparseTwoBody
+
+
+# The number of grid points that is treated at once by the blocked grid
+# routines of GOBasis. The basis functions are first evaluated in all points of
+# a block, after which the result is contracted with matrix-matrix products.
+grid_block_size = 256
 
 
 __all__ = [
@@ -50,7 +59,7 @@ __all__ = [
     'gpt_coeff', 'gb_overlap_int1d', 'nuclear_attraction_helper',
     # gbasis
     'gob_cart_normalization', 'gob_pure_normalization',
-    'GOBasis',
+    'GOBasis', 'GridBasisCache',
     # ints
     'GB2OverlapIntegral', 'GB2KineticIntegral',
     'GB2NuclearAttractionIntegral',
@@ -148,6 +157,129 @@ def gob_pure_normalization(double alpha, long l):
     return gbasis.gob_pure_normalization(alpha, l)
 
 
+class GridBasisCache(object):
+    '''Keeps basis functions evaluated on a fixed set of grid points in memory.
+
+       When a GridBasisCache is assigned to the ``grid_cache`` attribute of a
+       GOBasis object, the blocked grid routines of the GOBasis (densities,
+       gradients, Fock contributions, orbitals) reuse the basis functions (and
+       their gradients) from previous calls on the same points instead of
+       recomputing them. When a tolerance is used, only the significant shells
+       of each block are stored.
+    '''
+    def __init__(self, points, max_memory=None):
+        '''
+           **Arguments:**
+
+           points
+                A Numpy array with grid points, shape (npoint,3). Only calls
+                with this array (not a copy) make use of the cache. When the
+                points are modified in place afterwards, e.g. by
+                ``BeckeMolGrid.update_centers``, the stored blocks are
+                discarded at the next call.
+
+           **Optional arguments:**
+
+           max_memory
+                The maximum amount of memory in bytes used by the cache. When
+                the budget is exhausted, the remaining blocks are computed on
+                the fly. When not given, there is no limit.
+        '''
+        self._nbytes = 0
+        self._blocks = {}
+        if max_memory is not None and max_memory < 0:
+            raise ValueError('max_memory can not be negative.')
+        self._points = points
+        self._points_copy = points.copy()
+        self._centers_copy = None
+        self._max_memory = max_memory
+
+    def __del__(self):
+        self.clear()
+
+    def _get_max_memory(self):
+        return self._max_memory
+
+    max_memory = property(_get_max_memory)
+
+    def _get_nbytes(self):
+        return self._nbytes
+
+    nbytes = property(_get_nbytes)
+
+    def check_points(self, points, centers=None):
+        '''Returns True when the cache can be used for the given points
+
+           **Arguments:**
+
+           points
+                The grid points, which must be the array given to the
+                constructor (or an equivalent view).
+
+           **Optional arguments:**
+
+           centers
+                The centers of the basis functions.
+
+           When the points or the centers have changed since the previous
+           call, e.g. after ``System.update_coordinates``, all stored blocks
+           are discarded first.
+        '''
+        if not (points is self._points or (
+            points.shape == self._points.shape and
+            points.strides == self._points.strides and
+            points.ctypes.data == self._points.ctypes.data)):
+            return False
+        if not np.array_equal(points, self._points_copy):
+            self.clear()
+            self._points_copy[:] = points
+        if centers is not None:
+            if self._centers_copy is None or not np.array_equal(centers, self._centers_copy):
+                self.clear()
+                self._centers_copy = centers.copy()
+        return True
+
+    def clear(self):
+        '''Release all stored blocks'''
+        if self._nbytes > 0 and log is not None:
+            log.mem.denounce(self._nbytes)
+        self._nbytes = 0
+        self._blocks = {}
+
+    def load(self, begin, dim_work, tolerance):
+        '''Return the stored (basis, ibasis) of a block or None
+
+           The basis functions of a block are also found when only the block
+           with the gradients of the basis functions is stored.
+        '''
+        result = self._blocks.get((begin, dim_work, tolerance))
+        if result is None and dim_work == 1:
+            result = self._blocks.get((begin, 4, tolerance))
+            if result is not None:
+                result = (result[0][:,:,0], result[1])
+        return result
+
+    def dump(self, begin, dim_work, tolerance, basis, ibasis):
+        '''Store a copy of a block if this fits in the memory budget
+
+           **Returns:** True if the block is stored.
+        '''
+        nbytes = basis.nbytes
+        if ibasis is not None:
+            nbytes += ibasis.nbytes
+        if self._max_memory is not None and self._nbytes + nbytes > self._max_memory:
+            return False
+        basis = basis.copy()
+        basis.flags.writeable = False
+        if ibasis is not None:
+            ibasis = ibasis.copy()
+            ibasis.flags.writeable = False
+        self._blocks[(begin, dim_work, tolerance)] = (basis, ibasis)
+        self._nbytes += nbytes
+        log.mem.announce(nbytes)
+        return True
+
+
 cdef class GBasis:
     """
        This class describes basis sets applied to a certain molecular structure.
@@ -240,6 +372,10 @@ cdef class GBasis:
     cdef np.ndarray _shell_types
     cdef np.ndarray _alphas
     cdef np.ndarray _con_coeffs
+    # An optional GridBasisCache with basis functions on a fixed grid.
+    cdef public object grid_cache
+    # Memoized results of compute_shell_cutoffs for each tolerance and deriv.
+    cdef dict _shell_cutoffs
 
     def __cinit__(self, centers, shell_map, nprims, shell_types, alphas, con_coeffs):
         # Make private copies of the input arrays.
@@ -249,6 +385,7 @@ cdef class GBasis:
         self._shell_types = np.array(shell_types, dtype=int)
         self._alphas = np.array(alphas, dtype=float)
         self._con_coeffs = np.array(con_coeffs, dtype=float)
+        self._shell_cutoffs = {}
 
         self._centers.flags.writeable = True
         # Set arrays unwritable because:
@@ -448,7 +585,7 @@ cdef class GBasis:
         assert output.shape[0] == self.nbasis
         assert point.flags['C_CONTIGUOUS']
         assert point.shape[0] == 3
-        self._this.compute_grid_point1(&output[0], &point[0], grid_fn._this)
+        self._this.compute_grid_point1(&output[0], &point[0], grid_fn._this, NULL)
 
 
 cdef class GOBasis(GBasis):
@@ -513,14 +650,167 @@ cdef class GOBasis(GBasis):
         )
 
     def compute_electron_repulsion(self, electron_repulsion):
-        cdef np.ndarray[double, ndim=4] output = electron_repulsion._array
-        self.check_matrix_two_body(output)
-        (<gbasis.GOBasis*>self._this).compute_electron_repulsion(&output[0, 0, 0, 0])
+        '''Compute the electron repulsion integrals.
+
+           **Arguments:**
+
+           electron_repulsion
+                A two-body operator, DenseTwoBody or SparseTwoBody. In case of
+                a sparse operator, only the non-negligible symmetry-unique
+                integrals are computed, using Schwarz screening.
+        '''
+        cdef np.ndarray[double, ndim=4] output
+        if isinstance(electron_repulsion, SparseTwoBody):
+            self._compute_electron_repulsion_sparse(electron_repulsion)
+        elif isinstance(electron_repulsion, DenseTwoBody):
+            output = electron_repulsion._array
+            self.check_matrix_two_body(output)
+            (<gbasis.GOBasis*>self._this).compute_electron_repulsion(&output[0, 0, 0, 0])
+        else:
+            raise TypeError('The electron_repulsion argument must be a DenseTwoBody or SparseTwoBody instance.')
+
+    def _compute_electron_repulsion_sparse(self, electron_repulsion):
+        assert electron_repulsion.nbasis == self.nbasis
+        cdef np.ndarray[double, ndim=2] schwarz = self.compute_electron_repulsion_schwarz()
+        cdef double threshold = electron_repulsion.threshold
+        # A first pass only counts the elements, such that the second pass
+        # can write them directly into compact arrays of the final size.
+        cdef long nvalue = (<gbasis.GOBasis*>self._this).compute_electron_repulsion_sparse(
+            &schwarz[0, 0], threshold, 0, <uint16_t*>NULL, NULL)
+        index_dtype = SparseTwoBody.get_index_dtype(self.nbasis)
+        cdef np.ndarray indexes = np.zeros((nvalue, 4), index_dtype)
+        cdef np.ndarray[double, ndim=1] values = np.zeros(nvalue, float)
+        if nvalue > 0:
+            if index_dtype == np.uint16:
+                nvalue = (<gbasis.GOBasis*>self._this).compute_electron_repulsion_sparse(
+                    &schwarz[0, 0], threshold, len(values), <uint16_t*>indexes.data, &values[0])
+            else:
+                nvalue = (<gbasis.GOBasis*>self._this).compute_electron_repulsion_sparse(
+                    &schwarz[0, 0], threshold, len(values), <uint32_t*>indexes.data, &values[0])
+            assert nvalue == len(values)
+        electron_repulsion._set_packed(indexes, values, canonical=True)
+
+    def compute_electron_repulsion_schwarz(self):
+        '''Compute the Schwarz bounds for all pairs of shells.
+
+           **Returns:** a symmetric array with shape (nshell, nshell). Element
+           [a, b] is the square root of the largest (ij|ij), in chemists'
+           notation, where i and j are basis functions of the shells a and b,
+           respectively.
+        '''
+        cdef np.ndarray[double, ndim=2] output = np.zeros((self.nshell, self.nshell), float)
+        (<gbasis.GOBasis*>self._this).compute_electron_repulsion_schwarz(&output[0, 0])
+        return output
+
+    def compute_electron_repulsion_direct(self, dms, coulombs=None, exchanges=None, threshold=0.0, schwarz=None):
+        '''Contract the electron repulsion integrals with density matrices.
+
+           The integrals are computed on the fly and are never stored. Each
+           shell quartet is computed only once for all density matrices and
+           for both the Coulomb and the exchange contributions.
+
+           **Arguments:**
+
+           dms
+                A list of DenseOneBody density matrices.
+
+           **Optional arguments:**
+
+           coulombs
+                A list of DenseOneBody output arguments, one for each density
+                matrix, for the Coulomb operators, sum_kl <ik|jl> D_kl.
+
+           exchanges
+                A list of DenseOneBody output arguments, one for each density
+                matrix, for the exchange operators, sum_kl <ik|lj> D_kl.
+
+           threshold
+                Shell quartets are skipped when their Schwarz bound multiplied
+                by the largest relevant density matrix element is below this
+                threshold.
+
+           schwarz
+                The Schwarz bounds as returned by
+                ``compute_electron_repulsion_schwarz``. They are computed when
+                not given.
+
+           The contents of the output arguments are overwritten.
+        '''
+        ndm = len(dms)
+        if coulombs is not None and len(coulombs) != ndm:
+            raise TypeError('The number of Coulomb outputs must match the number of density matrices.')
+        if exchanges is not None and len(exchanges) != ndm:
+            raise TypeError('The number of exchange outputs must match the number of density matrices.')
+        if schwarz is None:
+            schwarz = self.compute_electron_repulsion_schwarz()
+        cdef np.ndarray[double, ndim=2] schwarz_array = schwarz
+        assert schwarz_array.flags['C_CONTIGUOUS']
+        assert schwarz_array.shape[0] == self.nshell
+        assert schwarz_array.shape[1] == self.nshell
+
+        cdef np.ndarray[double, ndim=3] dms_array = np.zeros((ndm, self.nbasis, self.nbasis), float)
+        for i in xrange(ndm):
+            self.check_matrix_one_body(dms[i]._array)
+            dms_array[i] = dms[i]._array
+        cdef np.ndarray[double, ndim=3] coulombs_array
+        cdef np.ndarray[double, ndim=3] exchanges_array
+        cdef double* coulombs_ptr = NULL
+        cdef double* exchanges_ptr = NULL
+        if coulombs is not None:
+            coulombs_array = np.zeros((ndm, self.nbasis, self.nbasis), float)
+            coulombs_ptr = &coulombs_array[0, 0, 0]
+        if exchanges is not None:
+            exchanges_array = np.zeros((ndm, self.nbasis, self.nbasis), float)
+            exchanges_ptr = &exchanges_array[0, 0, 0]
+
+        (<gbasis.GOBasis*>self._this).compute_electron_repulsion_direct(
+            &schwarz_array[0, 0], threshold, ndm, &dms_array[0, 0, 0],
+            coulombs_ptr, exchanges_ptr)
+
+        for i in xrange(ndm):
+            if coulombs is not None:
+                coulombs[i]._array[:] = coulombs_array[i]
+            if exchanges is not None:
+                exchanges[i]._array[:] = exchanges_array[i]
+
+    def compute_electron_repulsion_three_center(self, GOBasis aux not None,
+                                                np.ndarray[double, ndim=3] output not None):
+        '''Compute the three-index electron repulsion integrals (ij|P).
+
+           **Arguments:**
+
+           aux
+                The auxiliary basis, a GOBasis instance.
+
+           output
+                An output array with shape (aux.nbasis, nbasis, nbasis).
+                Element [P, i, j] is set to (ij|P), in chemists' notation.
+        '''
+        assert output.flags['C_CONTIGUOUS']
+        assert output.shape[0] == aux.nbasis
+        assert output.shape[1] == self.nbasis
+        assert output.shape[2] == self.nbasis
+        (<gbasis.GOBasis*>self._this).compute_electron_repulsion_three_center(
+            <gbasis.GOBasis*>aux._this, &output[0, 0, 0])
+
+    def compute_electron_repulsion_two_center(self, np.ndarray[double, ndim=2] output not None):
+        '''Compute the two-index electron repulsion integrals (P|Q).
+
+           This is the Coulomb metric of an auxiliary basis.
+
+           **Arguments:**
+
+           output
+                An output array with shape (nbasis, nbasis).
+        '''
+        self.check_matrix_one_body(output)
+        (<gbasis.GOBasis*>self._this).compute_electron_repulsion_two_center(&output[0, 0])
 
     def compute_grid_orbitals_exp(self, exp,
                                   np.ndarray[double, ndim=2] points not None,
                                   np.ndarray[long, ndim=1] iorbs not None,
-                                  np.ndarray[double, ndim=2] orbs not None):
+                                  np.ndarray[double, ndim=2] orbs not None,
+                                  double tolerance=0):
         '''Compute the orbtials on a grid for a given set of expansion coefficients.
 
            **Arguments:**
@@ -539,6 +829,12 @@ cdef class GOBasis(GBasis):
                 An output array, shape (npoint, len(iorbs)). The results are
                 added to this array.
 
+           **Optional arguments:**
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
+
            **Warning:** the results are added to the output array!
         '''
         cdef np.ndarray[double, ndim=2] coeffs = exp.coeffs
@@ -552,13 +848,212 @@ cdef class GOBasis(GBasis):
         assert orbs.flags['C_CONTIGUOUS']
         assert orbs.shape[0] == npoint
         assert orbs.shape[1] == norb
-        (<gbasis.GOBasis*>self._this).compute_grid1_exp(
-            nfn, &coeffs[0, 0], npoint, &points[0, 0],
-            norb, &iorbs[0], &orbs[0, 0])
+        # Work with blocks of grid points
+        coeffs_sel = coeffs[:,iorbs]
+        grid_fn = GB1DMGridDensityFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            if ibasis is None:
+                orbs[begin:end] += np.dot(basis, coeffs_sel)
+            else:
+                orbs[begin:end] += np.dot(basis, coeffs_sel[ibasis])
+
+    def compute_shell_cutoffs(self, double tolerance, bint deriv=False):
+        '''Compute a cutoff radius for each shell.
+
+           **Arguments:**
+
+           tolerance
+                Beyond the cutoff radius of a shell, the absolute values of all
+                its basis functions are smaller than tolerance.
+
+           **Optional arguments:**
+
+           deriv
+                When True, the cutoff radii are increased such that also the
+                absolute values of the derivatives of the basis functions are
+                below the tolerance.
+
+           **Returns:** an array with the cutoff radii, shape (nshell,).
+
+           The cutoffs do not depend on the centers, so they are computed only
+           once for each tolerance.
+        '''
+        if tolerance <= 0:
+            raise ValueError('The tolerance must be strictly positive.')
+        cdef np.ndarray[double, ndim=1] cutoffs
+        result = self._shell_cutoffs.get((tolerance, deriv))
+        if result is None:
+            cutoffs = np.zeros(self.nshell, float)
+            self._this.compute_shell_cutoffs(tolerance, deriv, &cutoffs[0])
+            self._shell_cutoffs[(tolerance, deriv)] = cutoffs
+            result = cutoffs
+        return result.copy()
+
+    def _iter_grid_blocks(self, points, grid_fn, tolerance=0):
+        '''Iterate over blocks of grid points with the basis functions evaluated.
+
+           **Arguments:**
+
+           points
+                A Numpy array with grid points, shape (npoint,3).
+
+           grid_fn
+                A grid function.
+
+           **Optional arguments:**
+
+           tolerance
+                When positive, only the shells that are significant in (a part
+                of) a block are included and basis functions in points beyond
+                the cutoff radius of their shell are set to zero.
+
+           **Yields:** tuples (begin, end, basis, ibasis). The rows of the
+           array basis correspond to points[begin:end] and contain the
+           results of the grid function for the selected basis functions.
+           ibasis is an array with the indexes of the selected basis
+           functions, or None when all basis functions are included. The basis
+           array is reused, so it is only valid until the next iteration.
+
+           When the ``grid_cache`` attribute is set to a GridBasisCache for
+           these points, the basis functions are taken from the cache when
+           possible and newly computed blocks are added to it. Blocks from
+           the cache are read-only arrays.
+        '''
+        assert points.flags['C_CONTIGUOUS']
+        assert points.shape[1] == 3
+        npoint = points.shape[0]
+        dim_work = grid_fn.dim_work
+        cache = self.grid_cache
+        if cache is not None and not cache.check_points(points, self.centers):
+            cache = None
+        shape = (self.nbasis,) if dim_work == 1 else (self.nbasis, dim_work)
+        work = np.zeros(grid_block_size*self.nbasis*dim_work, float)
+        shells = None
+        cutoffs = None
+        if tolerance > 0:
+            cutoffs = self.compute_shell_cutoffs(tolerance, grid_fn.dim_work > 1)
+            shell_centers = self.centers[self.shell_map]
+            shell_nbasis = np.array([get_shell_nbasis(shell_type) for shell_type in self.shell_types])
+            shell_begins = np.cumsum(shell_nbasis) - shell_nbasis
+        for begin in xrange(0, npoint, grid_block_size):
+            end = min(begin + grid_block_size, npoint)
+            size = end - begin
+            if cache is not None:
+                cached = cache.load(begin, dim_work, tolerance)
+                if cached is not None:
+                    yield begin, end, cached[0], cached[1]
+                    continue
+            if tolerance > 0:
+                # Select the shells that are not negligible in the block.
+                block = points[begin:end]
+                center = block.mean(axis=0)
+                radius = np.sqrt(((block - center)**2).sum(axis=1).max())
+                distances = np.sqrt(((shell_centers - center)**2).sum(axis=1))
+                shells = (distances < cutoffs + radius).nonzero()[0]
+                ibasis = np.concatenate([np.arange(shell_begins[ishell], shell_begins[ishell] + shell_nbasis[ishell]) for ishell in shells] + [np.zeros(0, int)])
+                basis = work[:size*len(ibasis)*dim_work].reshape((size, len(ibasis)) + shape[1:])
+            else:
+                ibasis = None
+                basis = work[:size*self.nbasis*dim_work].reshape((size,) + shape)
+            self._compute_grid1_basis(points[begin:end], grid_fn, basis, shells, cutoffs)
+            if cache is not None:
+                cache.dump(begin, dim_work, tolerance, basis, ibasis)
+            yield begin, end, basis, ibasis
+
+    def compute_grid_basis(self, np.ndarray[double, ndim=2] points not None,
+                           np.ndarray[double, ndim=2] basis not None):
+        '''Compute all basis functions on a set of grid points.
+
+           **Arguments:**
+
+           points
+                A Numpy array with grid points, shape (npoint,3).
+
+           basis
+                A Numpy array for the output, shape (npoint, nbasis).
+
+           **Warning:** the contents of the output array are overwritten.
+        '''
+        assert basis.shape[1] == self.nbasis
+        self._compute_grid1_basis(points, GB1DMGridDensityFn(self.max_shell_type), basis)
+
+    def compute_grid_basis_gradient(self, np.ndarray[double, ndim=2] points not None,
+                                    np.ndarray[double, ndim=3] basis not None):
+        '''Compute all basis functions and their gradients on a set of grid points.
+
+           **Arguments:**
+
+           points
+                A Numpy array with grid points, shape (npoint,3).
+
+           basis
+                A Numpy array for the output, shape (npoint, nbasis, 4). The
+                last index runs over the function value and the derivatives
+                towards x, y and z.
+
+           **Warning:** the contents of the output array are overwritten.
+        '''
+        assert basis.shape[1] == self.nbasis
+        assert basis.shape[2] == 4
+        self._compute_grid1_basis(points, GB1DMGridGradientFn(self.max_shell_type), basis)
+
+    def _compute_grid1_basis(self, np.ndarray[double, ndim=2] points not None,
+                             GB1DMGridFn grid_fn not None, np.ndarray output not None,
+                             shells=None, cutoffs=None):
+        '''Evaluate the basis functions with a grid function in a set of points.
+
+           **Arguments:**
+
+           points
+                A Numpy array with grid points, shape (npoint,3).
+
+           grid_fn
+                A grid function.
+
+           output
+                A Numpy array for the output, with npoint rows and
+                nbasis*grid_fn.dim_work elements in each row, where nbasis
+                is the number of basis functions in the selected shells.
+
+           **Optional arguments:**
+
+           shells
+                An array with the indexes of the shells to be evaluated. When
+                not given, all shells are included.
+
+           cutoffs
+                An array with the cutoff radii of all shells, shape (nshell,).
+                Basis functions in points beyond the cutoff radius are set to
+                zero.
+        '''
+        cdef np.ndarray[long, ndim=1] shells_sel
+        cdef np.ndarray[double, ndim=1] cutoffs_all
+        if shells is None:
+            shells_sel = np.arange(self.nshell)
+        else:
+            shells_sel = shells
+        assert shells_sel.flags['C_CONTIGUOUS']
+        nbasis_sel = sum([get_shell_nbasis(self.shell_types[ishell]) for ishell in shells_sel])
+        assert output.flags['C_CONTIGUOUS']
+        npoint = output.shape[0]
+        assert output.size == npoint*nbasis_sel*grid_fn.dim_work
+        assert points.flags['C_CONTIGUOUS']
+        assert points.shape[0] == npoint
+        assert points.shape[1] == 3
+        if cutoffs is not None:
+            cutoffs_all = cutoffs
+            assert cutoffs_all.flags['C_CONTIGUOUS']
+            assert cutoffs_all.shape[0] == self.nshell
+        if npoint == 0 or shells_sel.shape[0] == 0:
+            return
+        (<gbasis.GOBasis*>self._this).compute_grid1_basis(
+            npoint, &points[0, 0], grid_fn._this,
+            <double*>np.PyArray_DATA(output), shells_sel.shape[0], &shells_sel[0],
+            <double*>NULL if cutoffs is None else &cutoffs_all[0])
 
     def _compute_grid1_dm(self, dm, np.ndarray[double, ndim=2] points not None,
                           GB1DMGridFn grid_fn not None, np.ndarray output not None,
-                          double epsilon=0):
+                          double epsilon=0, double tolerance=0):
         '''Compute some density function on a grid for a given density matrix.
 
            **Arguments:**
@@ -581,6 +1076,10 @@ cdef class GOBasis(GBasis):
                 Allow errors on the density of this magnitude for the sake of
                 efficiency.
 
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
+
            **Warning:** the results are added to the output array! This may
            be useful to combine results from different spin components.
         '''
@@ -605,16 +1104,21 @@ cdef class GOBasis(GBasis):
         assert points.shape[0] == npoint
         assert points.shape[1] == 3
 
+        # Get the cutoff radii of the shells
+        cdef np.ndarray[double, ndim=1] cutoffs
+        if tolerance > 0:
+            cutoffs = self.compute_shell_cutoffs(tolerance, grid_fn.dim_work > 1)
+
         # Go!
         (<gbasis.GOBasis*>self._this).compute_grid1_dm(
             &dmar[0, 0], npoint, &points[0, 0],
             grid_fn._this, <double*>np.PyArray_DATA(output), epsilon,
-            &dmmaxrow[0])
+            &dmmaxrow[0], &cutoffs[0] if tolerance > 0 else <double*>NULL)
 
     def compute_grid_density_dm(self, dm,
                                 np.ndarray[double, ndim=2] points not None,
                                 np.ndarray[double, ndim=1] rhos not None,
-                                double epsilon=0):
+                                double epsilon=0, double tolerance=0):
         '''Compute the electron density on a grid for a given density matrix.
 
            **Arguments:**
@@ -632,17 +1136,36 @@ cdef class GOBasis(GBasis):
 
            epsilon
                 Allow errors on the density of this magnitude for the sake of
-                efficiency.
+                efficiency. When non-zero, the density is computed point by
+                point such that negligible contributions can be skipped.
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
 
            **Warning:** the results are added to the output array! This may
            be useful to combine results from different spin components.
         '''
-        self._compute_grid1_dm(dm, points, GB1DMGridDensityFn(self.max_shell_type), rhos, epsilon)
+        if epsilon > 0:
+            self._compute_grid1_dm(dm, points, GB1DMGridDensityFn(self.max_shell_type), rhos, epsilon, tolerance)
+            return
+        cdef np.ndarray[double, ndim=2] dmar = dm._array
+        self.check_matrix_one_body(dmar)
+        assert rhos.shape[0] == points.shape[0]
+        # rho = diag(basis dm basis^T), evaluated one block of points at a time.
+        grid_fn = GB1DMGridDensityFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            if ibasis is None:
+                tmp = np.dot(basis, dmar)
+            else:
+                tmp = np.dot(basis, dmar[ibasis[:,None], ibasis])
+            tmp *= basis
+            rhos[begin:end] += tmp.sum(axis=1)
 
     def compute_grid_gradient_dm(self, dm,
                                  np.ndarray[double, ndim=2] points not None,
                                  np.ndarray[double, ndim=2] gradrhos not None,
-                                 double epsilon=0):
+                                 double epsilon=0, double tolerance=0):
         '''Compute the electron density gradient on a grid for a given density matrix.
 
            **Arguments:**
@@ -659,17 +1182,39 @@ cdef class GOBasis(GBasis):
            **Optional arguments:**
 
            epsilon
-                Allow errors on the density of this magnitude for the sake of
-                efficiency.
+                Allow errors on the density gradient of this magnitude for the
+                sake of efficiency. When non-zero, the gradient is computed
+                point by point such that negligible contributions can be
+                skipped.
+
+           tolerance
+                Basis functions whose absolute value and derivatives are below
+                this tolerance are neglected. See ``compute_shell_cutoffs``
+                with ``deriv=True``.
 
            **Warning:** the results are added to the output array! This may
            be useful to combine results from different spin components.
         '''
-        self._compute_grid1_dm(dm, points, GB1DMGridGradientFn(self.max_shell_type), gradrhos, epsilon)
+        if epsilon > 0:
+            self._compute_grid1_dm(dm, points, GB1DMGridGradientFn(self.max_shell_type), gradrhos, epsilon, tolerance)
+            return
+        cdef np.ndarray[double, ndim=2] dmar = dm._array
+        self.check_matrix_one_body(dmar)
+        assert gradrhos.shape[0] == points.shape[0]
+        assert gradrhos.shape[1] == 3
+        # grad rho = 2 sum_ij grad(basis_i) dm_ij basis_j, per block of points.
+        grid_fn = GB1DMGridGradientFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            if ibasis is None:
+                tmp = np.dot(basis[:,:,0], dmar)
+            else:
+                tmp = np.dot(basis[:,:,0], dmar[ibasis[:,None], ibasis])
+            gradrhos[begin:end] += 2*(tmp[:,:,None]*basis[:,:,1:]).sum(axis=1)
 
     def compute_grid_hartree_dm(self, dm,
                                 np.ndarray[double, ndim=2] points not None,
-                                np.ndarray[double, ndim=1] output not None):
+                                np.ndarray[double, ndim=1] output not None,
+                                double threshold=0):
         '''Compute the Hartree potential on a grid for a given density matrix.
 
            **Arguments:**
@@ -686,6 +1231,16 @@ cdef class GOBasis(GBasis):
            output
                 A Numpy array for the output.
 
+           **Optional arguments:**
+
+           threshold
+                When zero (the default), all integrals are computed exactly.
+                When positive, pairs of shells whose contribution to the
+                potential is below this threshold are neglected. The charge
+                distribution of each remaining pair of shells is replaced by a
+                multipole expansion at grid points where the estimated error of
+                the expansion is below this threshold.
+
            **Warning:** the results are added to the output array! This may
            be useful to combine results from different spin components.
         '''
@@ -696,14 +1251,21 @@ cdef class GOBasis(GBasis):
         assert points.flags['C_CONTIGUOUS']
         assert points.shape[0] == npoint
         assert points.shape[1] == 3
-        (<gbasis.GOBasis*>self._this).compute_grid2_dm(
-            &dmar[0, 0], npoint, &points[0, 0],
-            &output[0])
+        assert threshold >= 0
+        if threshold > 0:
+            (<gbasis.GOBasis*>self._this).compute_grid2_dm_screened(
+                &dmar[0, 0], npoint, &points[0, 0],
+                &output[0], threshold)
+        else:
+            (<gbasis.GOBasis*>self._this).compute_grid2_dm(
+                &dmar[0, 0], npoint, &points[0, 0],
+                &output[0])
 
     def _compute_grid1_fock(self, np.ndarray[double, ndim=2] points not None,
                            np.ndarray[double, ndim=1] weights not None,
                            np.ndarray pots not None,
-                           GB1DMGridFn grid_fn not None, fock):
+                           GB1DMGridFn grid_fn not None, fock,
+                           double tolerance=0):
         '''Compute a one-body operator based on some potential grid in real-space
 
            **Arguments:**
@@ -724,6 +1286,12 @@ cdef class GOBasis(GBasis):
                 A one-body operator. For now, this must be a DenseOneBody
                 object.
 
+           **Optional arguments:**
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
+
            **Warning:** the results are added to the fock operator!
         '''
         cdef np.ndarray[double, ndim=2] output = fock._array
@@ -743,14 +1311,19 @@ cdef class GOBasis(GBasis):
             assert pots.shape[1] == grid_fn.dim_output
             assert pots.strides[1] % 8 == 0
             pot_stride *= (pots.strides[1] / 8)
+        cdef np.ndarray[double, ndim=1] cutoffs
+        if tolerance > 0:
+            cutoffs = self.compute_shell_cutoffs(tolerance, grid_fn.dim_work > 1)
         (<gbasis.GOBasis*>self._this).compute_grid1_fock(
             npoint, &points[0, 0], &weights[0],
             pot_stride, <double*>np.PyArray_DATA(pots),
-            grid_fn._this, &output[0, 0])
+            grid_fn._this, &output[0, 0],
+            &cutoffs[0] if tolerance > 0 else <double*>NULL)
 
     def compute_grid_density_fock(self, np.ndarray[double, ndim=2] points not None,
                                   np.ndarray[double, ndim=1] weights not None,
-                                  np.ndarray[double, ndim=1] pots not None, fock):
+                                  np.ndarray[double, ndim=1] pots not None, fock,
+                                  double tolerance=0):
         '''Compute a one-body operator based on a density potential grid in real-space
 
            **Arguments:**
@@ -768,13 +1341,34 @@ cdef class GOBasis(GBasis):
                 A one-body operator. For now, this must be a DenseOneBody
                 object.
 
+           **Optional arguments:**
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
+
            **Warning:** the results are added to the fock operator!
         '''
-        self._compute_grid1_fock(points, weights, pots, GB1DMGridDensityFn(self.max_shell_type), fock)
+        cdef np.ndarray[double, ndim=2] output = fock._array
+        self.check_matrix_one_body(output)
+        assert weights.shape[0] == points.shape[0]
+        assert pots.shape[0] == points.shape[0]
+        # fock += basis^T W basis, with W the diagonal matrix of weights*pots.
+        grid_fn = GB1DMGridDensityFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            wpots = weights[begin:end]*pots[begin:end]
+            tmp = np.dot(basis.T, basis*wpots[:,None])
+            # Rounding errors in the matrix product may break the symmetry.
+            tmp = 0.5*(tmp + tmp.T)
+            if ibasis is None:
+                output += tmp
+            else:
+                output[ibasis[:,None], ibasis] += tmp
 
     def compute_grid_gradient_fock(self, np.ndarray[double, ndim=2] points not None,
                                    np.ndarray[double, ndim=1] weights not None,
-                                   np.ndarray[double, ndim=2] pots not None, fock):
+                                   np.ndarray[double, ndim=2] pots not None, fock,
+                                   double tolerance=0):
         '''Compute a one-body operator based on a density potential grid in real-space
 
            **Arguments:**
@@ -792,9 +1386,121 @@ cdef class GOBasis(GBasis):
                 A one-body operator. For now, this must be a DenseOneBody
                 object.
 
+           **Optional arguments:**
+
+           tolerance
+                Basis functions whose absolute value and derivatives are below
+                this tolerance are neglected. See ``compute_shell_cutoffs``
+                with ``deriv=True``.
+
            **Warning:** the results are added to the fock operator!
         '''
-        self._compute_grid1_fock(points, weights, pots, GB1DMGridGradientFn(self.max_shell_type), fock)
+        cdef np.ndarray[double, ndim=2] output = fock._array
+        self.check_matrix_one_body(output)
+        assert weights.shape[0] == points.shape[0]
+        assert pots.shape[0] == points.shape[0]
+        assert pots.shape[1] == 3
+        # fock += A + A^T, with A = basis^T (weights*pots . grad(basis)).
+        grid_fn = GB1DMGridGradientFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            wpots = weights[begin:end,None]*pots[begin:end]
+            tmp = (basis[:,:,1:]*wpots[:,None,:]).sum(axis=2)
+            tmp = np.dot(basis[:,:,0].T, tmp)
+            if ibasis is None:
+                output += tmp + tmp.T
+            else:
+                output[ibasis[:,None], ibasis] += tmp + tmp.T
+
+    def compute_grid_fused_fock(self, dms, np.ndarray[double, ndim=2] points not None,
+                                np.ndarray[double, ndim=1] weights not None,
+                                callback, focks, gradient=True, double tolerance=0):
+        '''Compute densities and Fock contributions on a grid in a single pass.
+
+           The basis functions (and their gradients) are evaluated only once
+           in each block of grid points. They are used to compute the
+           densities (and their gradients) in the block, which are passed to
+           a callback function that returns the potentials in the block. The
+           potentials are then turned into contributions to the Fock
+           operators with the same basis functions.
+
+           **Arguments:**
+
+           dms
+                A list of density matrices. For now, these must be DenseOneBody
+                objects.
+
+           points
+                A Numpy array with grid points, shape (npoint,3).
+
+           weights
+                A Numpy array with integration weights, shape (npoint,).
+
+           callback
+                A function with arguments (begin, end, rhos, gradrhos). rhos
+                has shape (end-begin, len(dms)) and contains the densities of
+                all density matrices in points[begin:end]. gradrhos has shape
+                (end-begin, len(dms), 3) and contains the gradients of the
+                densities, or is None when gradient is False. The function
+                must return a tuple (dpots, gpots) with the density and
+                gradient potentials in the same format. gpots is ignored
+                when gradient is False.
+
+           focks
+                A list of one-body operators, one for each density matrix. For
+                now, these must be DenseOneBody objects.
+
+           **Optional arguments:**
+
+           gradient
+                When set to False, the gradients of the densities are not
+                computed and there are no gradient potentials.
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected. See ``compute_shell_cutoffs``.
+
+           **Warning:** the results are added to the Fock operators!
+        '''
+        ndm = len(dms)
+        if len(focks) != ndm:
+            raise TypeError('The number of Fock operators must match the number of density matrices.')
+        for dm in dms:
+            self.check_matrix_one_body(dm._array)
+        for fock in focks:
+            self.check_matrix_one_body(fock._array)
+        assert weights.shape[0] == points.shape[0]
+        if gradient:
+            grid_fn = GB1DMGridGradientFn(self.max_shell_type)
+        else:
+            grid_fn = GB1DMGridDensityFn(self.max_shell_type)
+        for begin, end, basis, ibasis in self._iter_grid_blocks(points, grid_fn, tolerance):
+            size = end - begin
+            values = basis[:,:,0] if gradient else basis
+            # Densities (and gradients) in the block
+            rhos = np.zeros((size, ndm), float)
+            gradrhos = np.zeros((size, ndm, 3), float) if gradient else None
+            for i in xrange(ndm):
+                if ibasis is None:
+                    tmp = np.dot(values, dms[i]._array)
+                else:
+                    tmp = np.dot(values, dms[i]._array[ibasis[:,None], ibasis])
+                rhos[:,i] = (tmp*values).sum(axis=1)
+                if gradient:
+                    gradrhos[:,i] = 2*(tmp[:,:,None]*basis[:,:,1:]).sum(axis=1)
+            dpots, gpots = callback(begin, end, rhos, gradrhos)
+            # Fock contributions of the block
+            for i in xrange(ndm):
+                # The factor 0.5 compensates for the symmetrization below.
+                tmp = 0.5*np.dot(values.T, values*(weights[begin:end]*dpots[:,i])[:,None])
+                if gradient:
+                    wpots = weights[begin:end,None]*gpots[:,i]
+                    tmp += np.dot(values.T, (basis[:,:,1:]*wpots[:,None,:]).sum(axis=2))
+                # Rounding errors in the matrix products may break the symmetry.
+                tmp = tmp + tmp.T
+                if ibasis is None:
+                    focks[i]._array[:] += tmp
+                else:
+                    focks[i]._array[ibasis[:,None], ibasis] += tmp
 
 #
 # ints wrappers (for testing only)
@@ -150,3 +150,18 @@ void nuclear_attraction_helper(double* work_g, long n0, long n1, double pa, doub
         work_g[index] = tmp;
     }
 }
+
+
+double gb_moment_int1d(long k, long n0, long n1, double pa, double pb, double pc, double gamma_inv) {
+    // Integral of (x-C)**k (x-A)**n0 (x-B)**n1 exp(-gamma (x-P)**2), where
+    // pa=P-A, pb=P-B and pc=P-C.
+    double result = 0.0;
+    for (long i=n0+n1; i>=0; i--) {
+        double coeff = gpt_coeff(i, n0, n1, pa, pb);
+        for (long j=k; j>=0; j--) {
+            if ((i+j)%2 == 1) continue;
+            result += coeff*binom(k, j)*pow(pc, k-j)*fac2(i+j-1)*pow(0.5*gamma_inv, (i+j)/2);
+        }
+    }
+    return sqrt(M_PI*gamma_inv)*result;
+}
@@ -38,5 +38,6 @@ void compute_gpt_center(double alpha0, const double* r0, double alpha1, const do
 double gpt_coeff(long k, long n0, long n1, double pa, double pb);
 double gb_overlap_int1d(long n0, long n1, double pa, double pb, double gamma_inv);
 void nuclear_attraction_helper(double* work_g, long n0, long n1, double pa, double pb, double pc, double gamma_inv);
+double gb_moment_int1d(long k, long n0, long n1, double pa, double pb, double pc, double gamma_inv);
 
 #endif
@@ -414,3 +414,31 @@ void GB2DMGridHartreeFn::add(double coeff, double alpha0, double alpha1, const d
         work_cart[i2p.offset] += pre*scales0[i2p.ibasis0]*scales1[i2p.ibasis1]*arg;
     } while (i2p.inc());
 }
+
+
+/*
+    GB2DMGridMomentFn
+*/
+
+void GB2DMGridMomentFn::add(double coeff, double alpha0, double alpha1, const double* scales0, const double* scales1) {
+    double pre, gamma_inv;
+    double gpt_center[3], pa[3], pb[3], pc[3];
+
+    gamma_inv = 1.0/(alpha0 + alpha1);
+    pre = coeff*exp(-alpha0*alpha1*gamma_inv*dist_sq(r0, r1));
+    compute_gpt_center(alpha0, r0, alpha1, r1, gamma_inv, gpt_center);
+    for (long i=0; i<3; i++) {
+        pa[i] = gpt_center[i] - r0[i];
+        pb[i] = gpt_center[i] - r1[i];
+        pc[i] = gpt_center[i] - point[i];
+    }
+    i2p.reset(abs(shell_type0), abs(shell_type1));
+    do {
+        work_cart[i2p.offset] += pre*(
+            gb_moment_int1d(px, i2p.n0[0], i2p.n1[0], pa[0], pb[0], pc[0], gamma_inv)*
+            gb_moment_int1d(py, i2p.n0[1], i2p.n1[1], pa[1], pb[1], pc[1], gamma_inv)*
+            gb_moment_int1d(pz, i2p.n0[2], i2p.n1[2], pa[2], pb[2], pc[2], gamma_inv)*
+            scales0[i2p.ibasis0]*scales1[i2p.ibasis1]
+        );
+    } while (i2p.inc());
+}
@@ -44,6 +44,8 @@ class GB1GridFn : public GBCalculator  {
         long get_dim_work() {return dim_work;};
         long get_dim_output() {return dim_output;};
         virtual void add(double coeff, double alpha0, const double* scales0) = 0;
+        // Create a new instance with its own work arrays, e.g. for each thread.
+        virtual GB1GridFn* clone() const = 0;
     };
 
 
@@ -64,6 +66,7 @@ class GB1ExpGridOrbitalFn : public GB1ExpGridFn  {
         long norb;
     public:
         GB1ExpGridOrbitalFn(long max_shell_type, long nfn, long* iorbs, long norb) : GB1ExpGridFn(max_shell_type, nfn, 1, norb), iorbs(iorbs), norb(norb) {};
+        virtual GB1ExpGridOrbitalFn* clone() const {return new GB1ExpGridOrbitalFn(max_shell_type, nfn, iorbs, norb);};
         virtual void add(double coeff, double alpha0, const double* scales0);
         virtual void compute_point_from_exp(double* work_basis, double* coeffs, long nbasis, double* output);
     };
@@ -74,6 +77,7 @@ class GB1ExpGridOrbitalFn : public GB1ExpGridFn  {
 class GB1DMGridFn : public GB1GridFn  {
     public:
         GB1DMGridFn(long max_shell_type, long dim_work, long dim_output) : GB1GridFn(max_shell_type, dim_work, dim_output) {};
+        virtual GB1DMGridFn* clone() const = 0;
         virtual void compute_point_from_dm(double* work_basis, double* dm, long nbasis, double* output, double epsilon, double* dmmaxrow) = 0;
         virtual void compute_fock_from_pot(double* pot, double* work_basis, long nbasis, double* output) = 0;
     };
@@ -85,6 +89,7 @@ class GB1DMGridDensityFn : public GB1DMGridFn  {
         long offset;
     public:
         GB1DMGridDensityFn(long max_shell_type): GB1DMGridFn(max_shell_type, 1, 1) {};
+        virtual GB1DMGridDensityFn* clone() const {return new GB1DMGridDensityFn(max_shell_type);};
 
         virtual void reset(long _shell_type0, const double* _r0, const double* _point);
         virtual void add(double coeff, double alpha0, const double* scales0);
@@ -96,6 +101,7 @@ class GB1DMGridDensityFn : public GB1DMGridFn  {
 class GB1DMGridGradientFn : public GB1DMGridFn  {
     public:
         GB1DMGridGradientFn(long max_shell_type): GB1DMGridFn(max_shell_type, 4, 3) {};
+        virtual GB1DMGridGradientFn* clone() const {return new GB1DMGridGradientFn(max_shell_type);};
 
         virtual void add(double coeff, double alpha0, const double* scales0);
         virtual void compute_point_from_dm(double* work_basis, double* dm, long nbasis, double* output, double epsilon, double* dmmaxrow);
@@ -137,6 +143,18 @@ class GB2DMGridHartreeFn : public GB2DMGridFn  {
     };
 
 
+class GB2DMGridMomentFn : public GB2DMGridFn  {
+    // Cartesian moment of a product of two basis functions around the 'grid point'.
+    private:
+        long px, py, pz;
+    public:
+        GB2DMGridMomentFn(long max_shell_type): GB2DMGridFn(max_shell_type), px(0), py(0), pz(0) {};
+
+        void set_powers(long _px, long _py, long _pz) {px = _px; py = _py; pz = _pz;};
+        virtual void add(double coeff, double alpha0, double alpha1, const double* scales0, const double* scales1);
+    };
+
+
 
 
 #endif
@@ -21,6 +21,7 @@
 //#define DEBUG
 
 #ifdef DEBUG
+#include <algorithm>
 #include <cstdio>
 #endif
 #include <cmath>
@@ -28,9 +29,13 @@
 #include <stdexcept>
 #include <cstdlib>
 #include <cstring>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 #include "gbasis.h"
 #include "common.h"
 #include "iter_gb.h"
+#include "iter_pow.h"
 using std::abs;
 
 /*
@@ -39,6 +44,17 @@ using std::abs;
 
 */
 
+template <class GridFn>
+static GridFn* get_thread_fn(GridFn* grid_fn) {
+    // The master thread uses the given grid function, such that its work
+    // arrays can still be inspected after a serial run. The other threads
+    // get a clone with their own work arrays.
+#ifdef _OPENMP
+    if (omp_get_thread_num() != 0) return grid_fn->clone();
+#endif
+    return grid_fn;
+}
+
 const double gob_cart_normalization(const double alpha, const long* n) {
     return sqrt(pow(4.0*alpha, n[0]+n[1]+n[2])*pow(2.0*alpha/M_PI, 1.5)
            /(fac2(2*n[0]-1)*fac2(2*n[1]-1)*fac2(2*n[2]-1)));
@@ -89,6 +105,13 @@ GBasis::GBasis(const double* centers, const long* shell_map, const long* nprims,
     shell_nbasis = get_shell_nbasis(shell_types[nshell-1]);
     nbasis = basis_offsets[nshell-1] + shell_nbasis;
 
+    // prim_offsets
+    prim_offsets = new long[nshell];
+    prim_offsets[0] = 0;
+    for (long ishell=1; ishell<nshell; ishell++) {
+        prim_offsets[ishell] = prim_offsets[ishell-1] + nprims[ishell-1];
+    }
+
     // nscales
     for (long ishell=0; ishell<nshell; ishell++) {
         shell_nbasis = get_shell_nbasis(abs(shell_types[ishell]));
@@ -102,6 +125,7 @@ GBasis::GBasis(const double* centers, const long* shell_map, const long* nprims,
 
 GBasis::~GBasis() {
     delete[] basis_offsets;
+    delete[] prim_offsets;
     delete[] scales;
     delete[] scales_offsets;
 }
@@ -169,17 +193,382 @@ void GBasis::compute_two_body(double* output, GB4Integral* integral) {
     } while (iter.inc_shell());
 }
 
-void GBasis::compute_grid_point1(double* output, double* point, GB1GridFn* grid_fn) {
+void GBasis::compute_shell_quartet(GB4Integral* integral, long ishell0, long ishell1, long ishell2, long ishell3) {
+    /*
+        Compute all integrals of a single shell quartet, in physicists'
+        notation. The result is stored in the work array of the integral
+        object.
+    */
+    const long shells[4] = {ishell0, ishell1, ishell2, ishell3};
+    const double* r[4];
+    for (long i=0; i<4; i++) {
+        r[i] = centers + 3*shell_map[shells[i]];
+    }
+    integral->reset(shell_types[ishell0], shell_types[ishell1], shell_types[ishell2], shell_types[ishell3],
+                    r[0], r[1], r[2], r[3]);
+    const long o0 = prim_offsets[ishell0];
+    const long o1 = prim_offsets[ishell1];
+    const long o2 = prim_offsets[ishell2];
+    const long o3 = prim_offsets[ishell3];
+    for (long p0=o0; p0<o0+nprims[ishell0]; p0++) {
+        for (long p1=o1; p1<o1+nprims[ishell1]; p1++) {
+            for (long p2=o2; p2<o2+nprims[ishell2]; p2++) {
+                for (long p3=o3; p3<o3+nprims[ishell3]; p3++) {
+                    integral->add(con_coeffs[p0]*con_coeffs[p1]*con_coeffs[p2]*con_coeffs[p3],
+                                  alphas[p0], alphas[p1], alphas[p2], alphas[p3],
+                                  get_scales(p0), get_scales(p1), get_scales(p2), get_scales(p3));
+                }
+            }
+        }
+    }
+    integral->cart_to_pure();
+}
+
+void GBasis::compute_schwarz(GB4Integral* integral, double* output) {
+    /*
+        Compute the Schwarz bounds for all pairs of shells:
+
+            output[a*nshell + b] = sqrt(max_(i in a, j in b) |(ij|ij)|)
+
+        where (ij|ij) is in chemists' notation. The output is symmetric.
+    */
+    for (long a=0; a<nshell; a++) {
+        const long na = get_shell_nbasis(shell_types[a]);
+        for (long b=0; b<=a; b++) {
+            const long nb = get_shell_nbasis(shell_types[b]);
+            // (ab|ab) = <aa|bb>
+            compute_shell_quartet(integral, a, a, b, b);
+            const double* work = integral->get_work();
+            double largest = 0.0;
+            for (long i=0; i<na; i++) {
+                for (long j=0; j<nb; j++) {
+                    double tmp = fabs(work[((i*na + i)*nb + j)*nb + j]);
+                    if (tmp > largest) largest = tmp;
+                }
+            }
+            output[a*nshell + b] = sqrt(largest);
+            output[b*nshell + a] = sqrt(largest);
+        }
+    }
+}
+
+template <typename T>
+long GBasis::compute_two_body_sparse(GB4Integral* integral, const double* schwarz, double threshold, long nvalue_max, T* indexes, double* values) {
+    /*
+        Compute only the symmetry-unique elements of a two-body operator whose
+        absolute value is not below the threshold. Shell quartets are skipped
+        when their Schwarz bound is below the threshold.
+
+        The indexes (four for each element) are in chemists' notation, (ij|kl)
+        with i >= j, k >= l and i*(i+1)/2+j >= k*(k+1)/2+l. They are written
+        to indexes, with shape (nvalue_max, 4), and the elements to values,
+        with shape (nvalue_max,). Elements beyond nvalue_max are only
+        counted. With nvalue_max=0, the output arguments may be NULL, which
+        lets the caller allocate the output with its final size.
+
+        The return value is the number of elements.
+    */
+    long nvalue = 0;
+
+    // Loop over all unique shell quartets (ab|cd)
+    for (long a=0; a<nshell; a++) {
+        const long na = get_shell_nbasis(shell_types[a]);
+        for (long b=0; b<=a; b++) {
+            const long nb = get_shell_nbasis(shell_types[b]);
+            const double bound_ab = schwarz[a*nshell + b];
+            for (long c=0; c<=a; c++) {
+                const long nc = get_shell_nbasis(shell_types[c]);
+                const long dmax = (c==a) ? b : c;
+                for (long d=0; d<=dmax; d++) {
+                    if (bound_ab*schwarz[c*nshell + d] < threshold) continue;
+                    const long nd = get_shell_nbasis(shell_types[d]);
+                    // (ab|cd) = <ac|bd>
+                    compute_shell_quartet(integral, a, c, b, d);
+                    const double* work = integral->get_work();
+                    for (long ia=0; ia<na; ia++) {
+                        const long i = basis_offsets[a] + ia;
+                        for (long ic=0; ic<nc; ic++) {
+                            long k = basis_offsets[c] + ic;
+                            for (long ib=0; ib<nb; ib++) {
+                                const long j = basis_offsets[b] + ib;
+                                // Skip elements whose symmetric partner is
+                                // also part of this shell quartet.
+                                if ((a == b) && (i < j)) continue;
+                                for (long id=0; id<nd; id++) {
+                                    const double value = work[((ia*nc + ic)*nb + ib)*nd + id];
+                                    if (fabs(value) < threshold) continue;
+                                    long l = basis_offsets[d] + id;
+                                    if ((c == d) && (k < l)) continue;
+                                    const long pair_ij = (i*(i+1))/2 + j;
+                                    const long pair_kl = (k*(k+1))/2 + l;
+                                    if ((a == c) && (b == d) && (pair_ij < pair_kl)) continue;
+                                    if (nvalue < nvalue_max) {
+                                        // Store the element in canonical order
+                                        T* row = indexes + 4*nvalue;
+                                        if (pair_ij >= pair_kl) {
+                                            row[0] = i;
+                                            row[1] = j;
+                                            row[2] = k;
+                                            row[3] = l;
+                                        } else {
+                                            row[0] = k;
+                                            row[1] = l;
+                                            row[2] = i;
+                                            row[3] = j;
+                                        }
+                                        values[nvalue] = value;
+                                    }
+                                    nvalue++;
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    return nvalue;
+}
+
+void GBasis::compute_two_body_direct(GB4Integral* integral, const double* schwarz, double threshold, long ndm, const double* dms, double* coulombs, double* exchanges) {
+    /*
+        Contract the two-body operator with ndm density matrices, without
+        storing the operator. Each shell quartet is computed once and its
+        contributions are added to the Coulomb and exchange matrices of all
+        density matrices in the same pass:
+
+            coulombs[m, i, j] = sum_kl (ij|kl) dms[m, k, l]
+            exchanges[m, i, k] = sum_jl (ij|kl) dms[m, j, l]
+
+        in chemists' notation. The dms, coulombs and exchanges arrays have
+        shape (ndm, nbasis, nbasis). The outputs are overwritten. One of them
+        may be NULL, in which case it is not computed.
+
+        Shell quartets are skipped when their Schwarz bound, multiplied by the
+        largest relevant density matrix element, is below the threshold.
+    */
+    const long nbasis2 = nbasis*nbasis;
+    const bool do_coulomb = (coulombs != NULL);
+    const bool do_exchange = (exchanges != NULL);
+
+    // Largest absolute density matrix element for each pair of shells, taken
+    // over all density matrices.
+    double* dmmax = new double[nshell*nshell];
+    for (long a=0; a<nshell; a++) {
+        const long na = get_shell_nbasis(shell_types[a]);
+        for (long b=0; b<nshell; b++) {
+            const long nb = get_shell_nbasis(shell_types[b]);
+            double largest = 0.0;
+            for (long m=0; m<ndm; m++) {
+                for (long ia=0; ia<na; ia++) {
+                    for (long ib=0; ib<nb; ib++) {
+                        double tmp = fabs(dms[m*nbasis2 + (basis_offsets[a] + ia)*nbasis + basis_offsets[b] + ib]);
+                        if (tmp > largest) largest = tmp;
+                    }
+                }
+            }
+            dmmax[a*nshell + b] = largest;
+        }
+    }
+
+    // Accumulate the contributions of the unique elements in temporary
+    // arrays. The transposes are added at the end.
+    double* tmp_coulombs = new double[ndm*nbasis2];
+    double* tmp_exchanges = new double[ndm*nbasis2];
+    std::fill(tmp_coulombs, tmp_coulombs + ndm*nbasis2, 0.0);
+    std::fill(tmp_exchanges, tmp_exchanges + ndm*nbasis2, 0.0);
+
+    // Loop over all unique shell quartets (ab|cd)
+    for (long a=0; a<nshell; a++) {
+        const long na = get_shell_nbasis(shell_types[a]);
+        for (long b=0; b<=a; b++) {
+            const long nb = get_shell_nbasis(shell_types[b]);
+            const double bound_ab = schwarz[a*nshell + b];
+            for (long c=0; c<=a; c++) {
+                const long nc = get_shell_nbasis(shell_types[c]);
+                const long dmax = (c==a) ? b : c;
+                for (long d=0; d<=dmax; d++) {
+                    double dmfactor = 0.0;
+                    if (do_coulomb) {
+                        dmfactor = std::max(dmfactor, dmmax[a*nshell + b]);
+                        dmfactor = std::max(dmfactor, dmmax[c*nshell + d]);
+                    }
+                    if (do_exchange) {
+                        dmfactor = std::max(dmfactor, dmmax[a*nshell + c]);
+                        dmfactor = std::max(dmfactor, dmmax[b*nshell + d]);
+                        dmfactor = std::max(dmfactor, dmmax[a*nshell + d]);
+                        dmfactor = std::max(dmfactor, dmmax[b*nshell + c]);
+                    }
+                    if (bound_ab*schwarz[c*nshell + d]*dmfactor < threshold) continue;
+                    const long nd = get_shell_nbasis(shell_types[d]);
+                    // (ab|cd) = <ac|bd>
+                    compute_shell_quartet(integral, a, c, b, d);
+                    const double* work = integral->get_work();
+                    for (long ia=0; ia<na; ia++) {
+                        const long i = basis_offsets[a] + ia;
+                        for (long ic=0; ic<nc; ic++) {
+                            const long k = basis_offsets[c] + ic;
+                            for (long ib=0; ib<nb; ib++) {
+                                const long j = basis_offsets[b] + ib;
+                                // Skip elements whose symmetric partner is
+                                // also part of this shell quartet.
+                                if ((a == b) && (i < j)) continue;
+                                for (long id=0; id<nd; id++) {
+                                    const long l = basis_offsets[d] + id;
+                                    if ((c == d) && (k < l)) continue;
+                                    if ((a == c) && (b == d) && ((i*(i+1))/2 + j < (k*(k+1))/2 + l)) continue;
+                                    // Divide by the number of times the
+                                    // contributions below are repeated.
+                                    double value = work[((ia*nc + ic)*nb + ib)*nd + id];
+                                    if (i == j) value *= 0.5;
+                                    if (k == l) value *= 0.5;
+                                    if ((i == k) && (j == l)) value *= 0.5;
+                                    for (long m=0; m<ndm; m++) {
+                                        const double* dm = dms + m*nbasis2;
+                                        if (do_coulomb) {
+                                            double* coulomb = tmp_coulombs + m*nbasis2;
+                                            coulomb[i*nbasis + j] += value*(dm[k*nbasis + l] + dm[l*nbasis + k]);
+                                            coulomb[k*nbasis + l] += value*(dm[i*nbasis + j] + dm[j*nbasis + i]);
+                                        }
+                                        if (do_exchange) {
+                                            double* exchange = tmp_exchanges + m*nbasis2;
+                                            exchange[i*nbasis + k] += value*dm[j*nbasis + l];
+                                            exchange[j*nbasis + k] += value*dm[i*nbasis + l];
+                                            exchange[i*nbasis + l] += value*dm[j*nbasis + k];
+                                            exchange[j*nbasis + l] += value*dm[i*nbasis + k];
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    // Symmetrize
+    for (long m=0; m<ndm; m++) {
+        for (long i=0; i<nbasis; i++) {
+            for (long j=0; j<nbasis; j++) {
+                const long ij = m*nbasis2 + i*nbasis + j;
+                const long ji = m*nbasis2 + j*nbasis + i;
+                if (do_coulomb) coulombs[ij] = tmp_coulombs[ij] + tmp_coulombs[ji];
+                if (do_exchange) exchanges[ij] = tmp_exchanges[ij] + tmp_exchanges[ji];
+            }
+        }
+    }
+
+    delete[] dmmax;
+    delete[] tmp_coulombs;
+    delete[] tmp_exchanges;
+}
+
+void GBasis::compute_three_center(GB4Integral* integral, GBasis* aux, double* output) {
+    /*
+        Compute three-index integrals between pairs of basis functions of this
+        basis and the functions of an auxiliary basis:
+
+            output[(p*nbasis + i)*nbasis + j] = (ij|p)
+
+        in chemists' notation. The missing fourth function is an s-type
+        Gaussian with a zero exponent, i.e. a constant equal to one, such that
+        the four-index integral code can be reused: (ij|p) = <ip|j1>.
+    */
+    const double one = 1.0;
+    for (long a=0; a<nshell; a++) {
+        const long na = get_shell_nbasis(shell_types[a]);
+        const double* ra = centers + 3*shell_map[a];
+        for (long b=0; b<=a; b++) {
+            const long nb = get_shell_nbasis(shell_types[b]);
+            const double* rb = centers + 3*shell_map[b];
+            for (long p=0; p<aux->nshell; p++) {
+                const long np = get_shell_nbasis(aux->shell_types[p]);
+                const double* rp = aux->centers + 3*aux->shell_map[p];
+                integral->reset(shell_types[a], aux->shell_types[p], shell_types[b], 0, ra, rp, rb, rp);
+                for (long p0=prim_offsets[a]; p0<prim_offsets[a]+nprims[a]; p0++) {
+                    for (long p1=aux->prim_offsets[p]; p1<aux->prim_offsets[p]+aux->nprims[p]; p1++) {
+                        for (long p2=prim_offsets[b]; p2<prim_offsets[b]+nprims[b]; p2++) {
+                            integral->add(con_coeffs[p0]*aux->con_coeffs[p1]*con_coeffs[p2],
+                                          alphas[p0], aux->alphas[p1], alphas[p2], 0.0,
+                                          get_scales(p0), aux->get_scales(p1), get_scales(p2), &one);
+                        }
+                    }
+                }
+                integral->cart_to_pure();
+                const double* work = integral->get_work();
+                for (long ia=0; ia<na; ia++) {
+                    const long i = basis_offsets[a] + ia;
+                    for (long ip=0; ip<np; ip++) {
+                        double* block = output + (aux->basis_offsets[p] + ip)*nbasis*nbasis;
+                        for (long ib=0; ib<nb; ib++) {
+                            const long j = basis_offsets[b] + ib;
+                            block[i*nbasis + j] = work[(ia*np + ip)*nb + ib];
+                            block[j*nbasis + i] = work[(ia*np + ip)*nb + ib];
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+void GBasis::compute_two_center(GB4Integral* integral, double* output) {
+    /*
+        Compute two-index integrals between all pairs of basis functions,
+
+            output[p*nbasis + q] = (p|q)
+
+        in chemists' notation. As in compute_three_center, the missing
+        functions are constants: (p|q) = <pq|11>.
+    */
+    const double one = 1.0;
+    for (long p=0; p<nshell; p++) {
+        const long np = get_shell_nbasis(shell_types[p]);
+        const double* rp = centers + 3*shell_map[p];
+        for (long q=0; q<=p; q++) {
+            const long nq = get_shell_nbasis(shell_types[q]);
+            const double* rq = centers + 3*shell_map[q];
+            integral->reset(shell_types[p], shell_types[q], 0, 0, rp, rq, rp, rq);
+            for (long p0=prim_offsets[p]; p0<prim_offsets[p]+nprims[p]; p0++) {
+                for (long p1=prim_offsets[q]; p1<prim_offsets[q]+nprims[q]; p1++) {
+                    integral->add(con_coeffs[p0]*con_coeffs[p1],
+                                  alphas[p0], alphas[p1], 0.0, 0.0,
+                                  get_scales(p0), get_scales(p1), &one, &one);
+                }
+            }
+            integral->cart_to_pure();
+            const double* work = integral->get_work();
+            for (long ip=0; ip<np; ip++) {
+                const long i = basis_offsets[p] + ip;
+                for (long iq=0; iq<nq; iq++) {
+                    const long j = basis_offsets[q] + iq;
+                    output[i*nbasis + j] = work[ip*nq + iq];
+                    output[j*nbasis + i] = work[ip*nq + iq];
+                }
+            }
+        }
+    }
+}
+
+void GBasis::compute_grid_point1(double* output, double* point, GB1GridFn* grid_fn, const double* cutoffs) {
     /*
         TODO
              When multiple different memory storage schemes are implemented for
              the operators, the iterator must also become an argument for this
              function
 
+        When cutoffs is not NULL, shells whose center is further from the
+        point than the cutoff radius are skipped. The corresponding part of
+        the output is left untouched.
     */
     IterGB1 iter = IterGB1(this);
     iter.update_shell();
     do {
+        if ((cutoffs != NULL) && (dist_sq(iter.r0, point) > cutoffs[iter.ishell0]*cutoffs[iter.ishell0])) {
+            continue;
+        }
         grid_fn->reset(iter.shell_type0, iter.r0, point);
         iter.update_prim();
         do {
@@ -190,6 +579,62 @@ void GBasis::compute_grid_point1(double* output, double* point, GB1GridFn* grid_
     } while (iter.inc_shell());
 }
 
+void GBasis::compute_shell_cutoffs(double tolerance, bool deriv, double* output) {
+    /*
+        For each shell, compute a radius beyond which the absolute values of
+        all basis functions in the shell are guaranteed to be below the
+        tolerance. Each primitive gets an equal share of the tolerance. The
+        outer root of amplitude*r^l*exp(-alpha*r^2) = 1 is found with a
+        fixed-point iteration that starts from the maximum of the radial part.
+
+        When deriv is true, the radius is widened such that also the Cartesian
+        derivatives of the basis functions are below the tolerance. For r >= 1,
+        their absolute values are bounded by
+        (l + 2*alpha)*amplitude*r^(l+1)*exp(-alpha*r^2).
+    */
+    for (long ishell=0; ishell<nshell; ishell++) {
+        const long shell_type = abs(shell_types[ishell]);
+        const long ncart = get_shell_nbasis(shell_type);
+        double radius = 0.0;
+        for (long iprim=0; iprim<nprims[ishell]; iprim++) {
+            const long oprim = prim_offsets[ishell] + iprim;
+            const double alpha = alphas[oprim];
+            const double* scales = get_scales(oprim);
+            double amplitude = 0.0;
+            for (long icart=0; icart<ncart; icart++) {
+                double tmp = fabs(con_coeffs[oprim]*scales[icart]);
+                if (tmp > amplitude) amplitude = tmp;
+            }
+            // Pure functions are linear combinations of Cartesian functions.
+            if (shell_types[ishell] < -1) amplitude *= ncart;
+            amplitude *= nprims[ishell]/tolerance;
+
+            long power = shell_type;
+            for (long ipass=0; ipass<(deriv?2:1); ipass++) {
+                if (ipass == 1) {
+                    // Bound on the derivatives, only valid for r >= 1.
+                    amplitude *= shell_type + 2*alpha;
+                    power += 1;
+                    if (radius < 1.0) radius = 1.0;
+                }
+                double r = sqrt(0.5*power/alpha);
+                if (amplitude*pow(r, power)*exp(-alpha*r*r) <= 1.0) continue;
+                for (long irep=0; irep<100; irep++) {
+                    double r_new = sqrt(log(amplitude*pow(r, power))/alpha);
+                    if (fabs(r_new - r) < 1e-8*r_new) {
+                        r = r_new;
+                        break;
+                    }
+                    r = r_new;
+                }
+                if (r > radius) radius = r;
+            }
+        }
+        output[ishell] = radius;
+    }
+}
+
+
 double GBasis::compute_grid_point2(double* dm, double* point, GB2DMGridFn* grid_fn) {
     /*
         TODO
@@ -245,104 +690,432 @@ void GOBasis::compute_electron_repulsion(double* output) {
     compute_two_body(output, &integral);
 }
 
-void GOBasis::compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output) {
-    // The work array contains the basis functions evaluated at the grid point,
-    // and optionally some of its derivatives.
-    GB1ExpGridOrbitalFn grid_fn = GB1ExpGridOrbitalFn(get_max_shell_type(), nfn, iorbs, norb);
+void GOBasis::compute_electron_repulsion_schwarz(double* output) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(get_max_shell_type());
+    compute_schwarz(&integral, output);
+}
 
-    long nwork = get_nbasis()*grid_fn.get_dim_work();
-    long dim_output = grid_fn.get_dim_output();
-    double* work_basis = new double[nwork];
+long GOBasis::compute_electron_repulsion_sparse(const double* schwarz, double threshold, long nvalue_max, uint16_t* indexes, double* values) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(get_max_shell_type());
+    return compute_two_body_sparse(&integral, schwarz, threshold, nvalue_max, indexes, values);
+}
 
-    for (long ipoint=0; ipoint<npoint; ipoint++) {
-        // A) clear the basis functions.
-        memset(work_basis, 0, nwork*sizeof(double));
+long GOBasis::compute_electron_repulsion_sparse(const double* schwarz, double threshold, long nvalue_max, uint32_t* indexes, double* values) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(get_max_shell_type());
+    return compute_two_body_sparse(&integral, schwarz, threshold, nvalue_max, indexes, values);
+}
 
-        // B) evaluate the basis functions in the current point.
-        compute_grid_point1(work_basis, points, &grid_fn);
+void GOBasis::compute_electron_repulsion_direct(const double* schwarz, double threshold, long ndm, const double* dms, double* coulombs, double* exchanges) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(get_max_shell_type());
+    compute_two_body_direct(&integral, schwarz, threshold, ndm, dms, coulombs, exchanges);
+}
 
-        // C) Use the basis function results and the density matrix to evaluate
-        // the function at the grid point. The result is added to the output.
-        grid_fn.compute_point_from_exp(work_basis, coeffs, get_nbasis(), output);
+void GOBasis::compute_electron_repulsion_three_center(GOBasis* aux, double* output) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(std::max(get_max_shell_type(), aux->get_max_shell_type()));
+    compute_three_center(&integral, aux, output);
+}
 
-        // D) Prepare for next iteration
-        output += dim_output;
-        points += 3;
+void GOBasis::compute_electron_repulsion_two_center(double* output) {
+    GB4ElectronReuplsionIntegralLibInt integral = GB4ElectronReuplsionIntegralLibInt(get_max_shell_type());
+    compute_two_center(&integral, output);
+}
+
+void GOBasis::compute_grid1_basis(long npoint, double* points, GB1GridFn* grid_fn, double* output, long nshell_sel, long* shells_sel, double* cutoffs) {
+    // Evaluate the basis functions, and optionally some of their derivatives,
+    // in a block of grid points. Only the shells in shells_sel are included,
+    // in the given order. Each point gets one row in the output array, such
+    // that the caller can contract the result with matrix-matrix products.
+    // When cutoffs is not NULL, shells beyond their cutoff radius are zero.
+    const long dim_work = grid_fn->get_dim_work();
+    long nwork = 0;
+    for (long isel=0; isel<nshell_sel; isel++) {
+        nwork += get_shell_nbasis(shell_types[shells_sel[isel]])*dim_work;
     }
 
-    delete[] work_basis;
+    #pragma omp parallel
+    {
+        // Each thread needs its own work arrays in the grid function.
+        GB1GridFn* thread_fn = get_thread_fn(grid_fn);
+
+        #pragma omp for schedule(static)
+        for (long ipoint=0; ipoint<npoint; ipoint++) {
+            const double* point = points + 3*ipoint;
+            double* tmp = output + nwork*ipoint;
+            memset(tmp, 0, nwork*sizeof(double));
+            for (long isel=0; isel<nshell_sel; isel++) {
+                const long ishell = shells_sel[isel];
+                const long shell_type = shell_types[ishell];
+                const double* r0 = centers + 3*shell_map[ishell];
+                const long n = get_shell_nbasis(shell_type)*dim_work;
+                if ((cutoffs == NULL) || (dist_sq(r0, point) <= cutoffs[ishell]*cutoffs[ishell])) {
+                    thread_fn->reset(shell_type, r0, point);
+                    const long begin = get_prim_offsets()[ishell];
+                    for (long oprim=begin; oprim<begin+nprims[ishell]; oprim++) {
+                        thread_fn->add(con_coeffs[oprim], alphas[oprim], get_scales(oprim));
+                    }
+                    thread_fn->cart_to_pure();
+                    memcpy(tmp, thread_fn->get_work(), n*sizeof(double));
+                }
+                tmp += n;
+            }
+        }
+
+        if (thread_fn != grid_fn) delete thread_fn;
+    }
+}
+
+void GOBasis::compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output, double* cutoffs) {
+    #pragma omp parallel
+    {
+        // The work array contains the basis functions evaluated at the grid point,
+        // and optionally some of its derivatives. Each thread has its own
+        // grid function and work array.
+        GB1ExpGridOrbitalFn grid_fn = GB1ExpGridOrbitalFn(get_max_shell_type(), nfn, iorbs, norb);
+
+        long nwork = get_nbasis()*grid_fn.get_dim_work();
+        long dim_output = grid_fn.get_dim_output();
+        double* work_basis = new double[nwork];
+
+        #pragma omp for schedule(dynamic, 16)
+        for (long ipoint=0; ipoint<npoint; ipoint++) {
+            // A) clear the basis functions.
+            memset(work_basis, 0, nwork*sizeof(double));
+
+            // B) evaluate the basis functions in the current point.
+            compute_grid_point1(work_basis, points + 3*ipoint, &grid_fn, cutoffs);
+
+            // C) Use the basis function results and the density matrix to evaluate
+            // the function at the grid point. The result is added to the output.
+            grid_fn.compute_point_from_exp(work_basis, coeffs, get_nbasis(), output + dim_output*ipoint);
+        }
+
+        delete[] work_basis;
+    }
 }
 
-void GOBasis::compute_grid1_dm(double* dm, long npoint, double* points, GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow) {
-    // The work array contains the basis functions evaluated at the grid point,
-    // and optionally some of its derivatives.
-    long nwork = get_nbasis()*grid_fn->get_dim_work();
-    long dim_output = grid_fn->get_dim_output();
-    double* work_basis = new double[nwork];
+void GOBasis::compute_grid1_dm(double* dm, long npoint, double* points, GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow, double* cutoffs) {
+    #pragma omp parallel
+    {
+        // The work array contains the basis functions evaluated at the grid point,
+        // and optionally some of its derivatives. Each thread has its own
+        // grid function and work array.
+        GB1DMGridFn* thread_fn = get_thread_fn(grid_fn);
+        long nwork = get_nbasis()*thread_fn->get_dim_work();
+        long dim_output = thread_fn->get_dim_output();
+        double* work_basis = new double[nwork];
 
-    for (long ipoint=0; ipoint<npoint; ipoint++) {
-        // A) clear the basis functions.
-        memset(work_basis, 0, nwork*sizeof(double));
+        #pragma omp for schedule(static)
+        for (long ipoint=0; ipoint<npoint; ipoint++) {
+            // A) clear the basis functions.
+            memset(work_basis, 0, nwork*sizeof(double));
 
-        // B) evaluate the basis functions in the current point.
-        compute_grid_point1(work_basis, points, grid_fn);
+            // B) evaluate the basis functions in the current point.
+            compute_grid_point1(work_basis, points + 3*ipoint, thread_fn, cutoffs);
 #ifdef DEBUG
-        for (int i=0; i<nwork; i++) printf("%f ", work_basis[i]);
-        printf("\n");
+            for (int i=0; i<nwork; i++) printf("%f ", work_basis[i]);
+            printf("\n");
 #endif
 
-        // C) Use the basis function results and the density matrix to evaluate
-        // the function at the grid point. The result is added to the output.
-        grid_fn->compute_point_from_dm(work_basis, dm, get_nbasis(), output, epsilon, dmmaxrow);
+            // C) Use the basis function results and the density matrix to evaluate
+            // the function at the grid point. The result is added to the output.
+            thread_fn->compute_point_from_dm(work_basis, dm, get_nbasis(), output + dim_output*ipoint, epsilon, dmmaxrow);
+        }
 
-        // D) Prepare for next iteration
-        output += dim_output;
-        points += 3;
+        delete[] work_basis;
+        if (thread_fn != grid_fn) delete thread_fn;
     }
-
-    delete[] work_basis;
 }
 
 void GOBasis::compute_grid2_dm(double* dm, long npoint, double* points, double* output) {
     // For the moment, it is only possible to compute the Hartree potential on
     // a grid with this routine. Generalizations with electrical field and
     // other things are for later.
-    GB2DMGridHartreeFn grid_fn = GB2DMGridHartreeFn(get_max_shell_type());
+    #pragma omp parallel
+    {
+        GB2DMGridHartreeFn grid_fn = GB2DMGridHartreeFn(get_max_shell_type());
+
+        #pragma omp for schedule(dynamic, 16)
+        for (long ipoint=0; ipoint<npoint; ipoint++) {
+            output[ipoint] += compute_grid_point2(dm, points + 3*ipoint, &grid_fn);
+        }
+    }
+}
+
+/*
+    Screened Hartree potential on a grid
+
+    The charge distribution of each pair of shells (contracted with the density
+    matrix) is replaced by a multipole expansion at grid points that are far
+    away from it. The expansion includes all Cartesian moments up to order
+    HARTREE_MULTIPOLE_ORDER. The moments of the next two orders are only used to
+    estimate the truncation error.
+*/
+
+#define HARTREE_MULTIPOLE_ORDER 4
+#define HARTREE_NMOMENT 35
+#define HARTREE_NMOMENT_CHECK 84
+#define HARTREE_BLOCK_SIZE 64
+
+static void fill_moment_powers(long* powers) {
+    // All Cartesian powers up to order HARTREE_MULTIPOLE_ORDER+2, sorted by
+    // order.
+    for (long order=0; order<=HARTREE_MULTIPOLE_ORDER+2; order++) {
+        for (long px=order; px>=0; px--) {
+            for (long py=order-px; py>=0; py--) {
+                powers[0] = px;
+                powers[1] = py;
+                powers[2] = order-px-py;
+                powers += 3;
+            }
+        }
+    }
+}
+
+static double compute_cart_bound(long shell_type, const double* scales, const double* pa, double gamma_inv) {
+    // Largest norm of the Cartesian functions of a shell, with the Gaussian
+    // replaced by exp(-gamma*(r-P)**2).
+    IterPow1 i1p;
+    i1p.reset(abs(shell_type));
+    double result = 0.0;
+    do {
+        double tmp = scales[i1p.ibasis0]*scales[i1p.ibasis0]*
+            gb_overlap_int1d(i1p.n0[0], i1p.n0[0], pa[0], pa[0], gamma_inv)*
+            gb_overlap_int1d(i1p.n0[1], i1p.n0[1], pa[1], pa[1], gamma_inv)*
+            gb_overlap_int1d(i1p.n0[2], i1p.n0[2], pa[2], pa[2], gamma_inv);
+        if (tmp > result) result = tmp;
+    } while (i1p.inc());
+    return sqrt(result);
+}
 
-    for (long ipoint=0; ipoint<npoint; ipoint++) {
-        *output += compute_grid_point2(dm, points, &grid_fn);
-        output++;
-        points += 3;
+static void compute_inv_dist_derivs(const double* delta, const long* powers, double* output) {
+    // Cartesian derivatives of 1/r up to order HARTREE_MULTIPOLE_ORDER, with
+    // the McMurchie-Davidson recurrence relations (for point charges).
+    const long nl = HARTREE_MULTIPOLE_ORDER+1;
+    double r[nl][nl][nl][nl];
+    double rsq_inv = 1.0/(delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2]);
+    double tmp = sqrt(rsq_inv);
+    for (long j=0; j<nl; j++) {
+        r[j][0][0][0] = tmp;
+        tmp *= -(2*j+1)*rsq_inv;
+    }
+    for (long n=1; n<nl; n++) {
+        for (long j=0; j<nl-n; j++) {
+            for (long t=n; t>=0; t--) {
+                for (long u=n-t; u>=0; u--) {
+                    long v = n-t-u;
+                    if (t > 0) {
+                        tmp = delta[0]*r[j+1][t-1][u][v];
+                        if (t > 1) tmp += (t-1)*r[j+1][t-2][u][v];
+                    } else if (u > 0) {
+                        tmp = delta[1]*r[j+1][t][u-1][v];
+                        if (u > 1) tmp += (u-1)*r[j+1][t][u-2][v];
+                    } else {
+                        tmp = delta[2]*r[j+1][t][u][v-1];
+                        if (v > 1) tmp += (v-1)*r[j+1][t][u][v-2];
+                    }
+                    r[j][t][u][v] = tmp;
+                }
+            }
+        }
+    }
+    for (long imoment=0; imoment<HARTREE_NMOMENT; imoment++) {
+        output[imoment] = r[0][powers[0]][powers[1]][powers[2]];
+        powers += 3;
     }
 }
 
-void GOBasis::compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, GB1DMGridFn* grid_fn, double* output) {
-    // The work array contains the basis functions evaluated at the grid point,
-    // and optionally some of its derivatives.
-    long nwork = get_nbasis()*grid_fn->get_dim_work();
-    double* work_basis = new double[nwork];
-    long dim_output = grid_fn->get_dim_output();
-    double* work_pot = new double[dim_output];
+void GOBasis::compute_grid2_dm_screened(double* dm, long npoint, double* points, double* output, double threshold) {
+    if (threshold <= 0) {
+        throw std::domain_error("The threshold must be strictly positive.");
+    }
+    long powers[3*HARTREE_NMOMENT_CHECK];
+    fill_moment_powers(powers);
+
+    // Per shell pair: skip flag, center of the expansion, squared radius
+    // beyond which the expansion is used and the expansion coefficients.
+    const long npair = (nshell*(nshell+1))/2;
+    const long stride = 5 + HARTREE_NMOMENT;
+    double* pairs = new double[npair*stride];
+
+    // Serial precomputation of the multipole expansions.
+    GB2DMGridMomentFn moment_fn = GB2DMGridMomentFn(get_max_shell_type());
+    const long max_nbasis = get_shell_nbasis(get_max_shell_type());
+    double* ones = new double[max_nbasis*max_nbasis];
+    std::fill(ones, ones + max_nbasis*max_nbasis, 1.0);
+    IterGB2 iter = IterGB2(this);
+    iter.update_shell();
+    long ipair = 0;
+    do {
+        double* pair = pairs + ipair*stride;
+        double* center = pair + 1;
+        double* coeffs = pair + 5;
+
+        // The center of the most diffuse primitive pair is used for the
+        // expansion.
+        double gamma_min = 0.0, gamma_max = 0.0;
+        iter.update_prim();
+        do {
+            double gamma = iter.alpha0 + iter.alpha1;
+            if ((gamma_min == 0.0) || (gamma < gamma_min)) {
+                gamma_min = gamma;
+                compute_gpt_center(iter.alpha0, iter.r0, iter.alpha1, iter.r1, 1.0/gamma, center);
+            }
+            if (gamma > gamma_max) gamma_max = gamma;
+        } while (iter.inc_prim());
 
-    for (long ipoint=0; ipoint<npoint; ipoint++) {
-        // A) clear the work array.
-        memset(work_basis, 0, nwork*sizeof(double));
+        // Upper bound for the absolute charge of the pair distribution, with
+        // the Cauchy-Schwarz inequality for each product of primitives.
+        double dmax = 0.0;
+        double qabs = 0.0;
+        iter.update_prim();
+        do {
+            double gpt_center[3], pa[3], pb[3];
+            double gamma_inv = 1.0/(iter.alpha0 + iter.alpha1);
+            compute_gpt_center(iter.alpha0, iter.r0, iter.alpha1, iter.r1, gamma_inv, gpt_center);
+            double d = sqrt(dist_sq(gpt_center, center));
+            if (d > dmax) dmax = d;
+            for (long i=0; i<3; i++) {
+                pa[i] = gpt_center[i] - iter.r0[i];
+                pb[i] = gpt_center[i] - iter.r1[i];
+            }
+            qabs += fabs(iter.con_coeff)*exp(-iter.alpha0*iter.alpha1*gamma_inv*dist_sq(iter.r0, iter.r1))*
+                compute_cart_bound(iter.shell_type0, iter.scales0, pa, gamma_inv)*
+                compute_cart_bound(iter.shell_type1, iter.scales1, pb, gamma_inv);
+        } while (iter.inc_prim());
+        qabs *= iter.dot_abs(ones, dm);
 
-        // B) evaluate the basis functions in the current point.
-        compute_grid_point1(work_basis, points, grid_fn);
+        // Neglect the pair if its potential is certainly below the threshold.
+        pair[0] = (qabs*std::max(1.0, 2.0*sqrt(gamma_max/M_PI)) < threshold);
+        if (pair[0] == 0.0) {
+            // Compute the moments, contracted with the density matrix.
+            double check[2] = {0.0, 0.0};
+            for (long imoment=0; imoment<HARTREE_NMOMENT_CHECK; imoment++) {
+                const long* p = powers + 3*imoment;
+                moment_fn.set_powers(p[0], p[1], p[2]);
+                moment_fn.reset(iter.shell_type0, iter.shell_type1, iter.r0, iter.r1, center);
+                iter.update_prim();
+                do {
+                    moment_fn.add(iter.con_coeff, iter.alpha0, iter.alpha1, iter.scales0, iter.scales1);
+                } while (iter.inc_prim());
+                moment_fn.cart_to_pure();
+                long order = p[0] + p[1] + p[2];
+                double moment = iter.dot(moment_fn.get_work(), dm)/(fac(p[0])*fac(p[1])*fac(p[2]));
+                if (order <= HARTREE_MULTIPOLE_ORDER) {
+                    coeffs[imoment] = (order%2 == 1) ? -moment : moment;
+                } else {
+                    check[order - HARTREE_MULTIPOLE_ORDER - 1] += fabs(moment);
+                }
+            }
 
-        // C) Add the contribution from this grid point to the operator
-        for (long i=dim_output-1; i>=0; i--) {
-            work_pot[i] = (*weights)*pots[i];
+            // The expansion is only used outside the region where the Gaussian
+            // tails are significant and where the estimated truncation error
+            // is below the threshold.
+            double rfar = dmax + (sqrt(log(std::max(qabs/threshold, 1.0))) + 1.0)/sqrt(gamma_min);
+            for (long i=0; i<2; i++) {
+                long order = HARTREE_MULTIPOLE_ORDER + 1 + i;
+                double rtrunc = pow(fac(order)*check[i]/threshold, 1.0/(order+1));
+                if (rtrunc > rfar) rfar = rtrunc;
+            }
+            pair[4] = rfar*rfar;
         }
-        grid_fn->compute_fock_from_pot(work_pot, work_basis, get_nbasis(), output);
+        ipair++;
+    } while (iter.inc_shell());
+    delete[] ones;
 
-        // D) Prepare for next iteration
-        points += 3;
-        weights++;
-        pots += pot_stride;
+    // Parallel loop over blocks of grid points. Within one block, each pair
+    // of shells is treated for all points in the block.
+    const long nblock = (npoint + HARTREE_BLOCK_SIZE - 1)/HARTREE_BLOCK_SIZE;
+    #pragma omp parallel
+    {
+        GB2DMGridHartreeFn grid_fn = GB2DMGridHartreeFn(get_max_shell_type());
+        IterGB2 thread_iter = IterGB2(this);
+        double derivs[HARTREE_NMOMENT];
+
+        #pragma omp for schedule(dynamic, 1)
+        for (long iblock=0; iblock<nblock; iblock++) {
+            long begin = iblock*HARTREE_BLOCK_SIZE;
+            long end = std::min(begin + HARTREE_BLOCK_SIZE, npoint);
+            thread_iter.update_shell();
+            long ipair = 0;
+            do {
+                const double* pair = pairs + ipair*stride;
+                ipair++;
+                if (pair[0] != 0.0) continue;
+                for (long ipoint=begin; ipoint<end; ipoint++) {
+                    double* point = points + 3*ipoint;
+                    double delta[3];
+                    delta[0] = point[0] - pair[1];
+                    delta[1] = point[1] - pair[2];
+                    delta[2] = point[2] - pair[3];
+                    if (delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2] > pair[4]) {
+                        // Multipole expansion
+                        compute_inv_dist_derivs(delta, powers, derivs);
+                        double tmp = 0.0;
+                        for (long imoment=0; imoment<HARTREE_NMOMENT; imoment++) {
+                            tmp += pair[5+imoment]*derivs[imoment];
+                        }
+                        output[ipoint] += tmp;
+                    } else {
+                        // Exact integrals
+                        grid_fn.reset(thread_iter.shell_type0, thread_iter.shell_type1, thread_iter.r0, thread_iter.r1, point);
+                        thread_iter.update_prim();
+                        do {
+                            grid_fn.add(thread_iter.con_coeff, thread_iter.alpha0, thread_iter.alpha1, thread_iter.scales0, thread_iter.scales1);
+                        } while (thread_iter.inc_prim());
+                        grid_fn.cart_to_pure();
+                        output[ipoint] += thread_iter.dot(grid_fn.get_work(), dm);
+                    }
+                }
+            } while (thread_iter.inc_shell());
+        }
     }
 
-    delete[] work_basis;
-    delete[] work_pot;
+    delete[] pairs;
+}
+
+void GOBasis::compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, GB1DMGridFn* grid_fn, double* output, double* cutoffs) {
+    const long nbasis = get_nbasis();
+
+    #pragma omp parallel
+    {
+        // The work array contains the basis functions evaluated at the grid point,
+        // and optionally some of its derivatives. Each thread has its own
+        // grid function, work arrays and a private operator, which are summed
+        // at the end.
+        GB1DMGridFn* thread_fn = get_thread_fn(grid_fn);
+        long nwork = nbasis*thread_fn->get_dim_work();
+        double* work_basis = new double[nwork];
+        long dim_output = thread_fn->get_dim_output();
+        double* work_pot = new double[dim_output];
+        double* thread_output = new double[nbasis*nbasis];
+        memset(thread_output, 0, nbasis*nbasis*sizeof(double));
+
+        #pragma omp for schedule(static)
+        for (long ipoint=0; ipoint<npoint; ipoint++) {
+            // A) clear the work array.
+            memset(work_basis, 0, nwork*sizeof(double));
+
+            // B) evaluate the basis functions in the current point.
+            compute_grid_point1(work_basis, points + 3*ipoint, thread_fn, cutoffs);
+
+            // C) Add the contribution from this grid point to the operator
+            for (long i=dim_output-1; i>=0; i--) {
+                work_pot[i] = weights[ipoint]*pots[pot_stride*ipoint + i];
+            }
+            thread_fn->compute_fock_from_pot(work_pot, work_basis, nbasis, thread_output);
+        }
+
+        // D) Reduction of the contributions from all threads.
+        #pragma omp critical
+        {
+            for (long i=nbasis*nbasis-1; i>=0; i--) {
+                output[i] += thread_output[i];
+            }
+        }
+
+        delete[] work_basis;
+        delete[] work_pot;
+        delete[] thread_output;
+        if (thread_fn != grid_fn) delete thread_fn;
+    }
 }
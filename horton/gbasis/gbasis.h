@@ -22,6 +22,7 @@
 #ifndef HORTON_GBASIS_GBASIS_H
 #define HORTON_GBASIS_GBASIS_H
 
+#include <stdint.h>
 #include "ints.h"
 #include "fns.h"
 
@@ -34,6 +35,7 @@ class GBasis {
     private:
         // Auxiliary arrays that contain convenient derived information.
         long* basis_offsets;
+        long* prim_offsets;
         long* scales_offsets;
         double* scales; // pre-computed normalization constants.
         long nbasis, nscales;
@@ -57,13 +59,22 @@ class GBasis {
         void init_scales();
         void compute_one_body(double* output, GB2Integral* integral);
         void compute_two_body(double* output, GB4Integral* integral);
-        void compute_grid_point1(double* output, double* point, GB1GridFn* grid_fn);
+        void compute_shell_quartet(GB4Integral* integral, long ishell0, long ishell1, long ishell2, long ishell3);
+        void compute_schwarz(GB4Integral* integral, double* output);
+        template <typename T>
+        long compute_two_body_sparse(GB4Integral* integral, const double* schwarz, double threshold, long nvalue_max, T* indexes, double* values);
+        void compute_two_body_direct(GB4Integral* integral, const double* schwarz, double threshold, long ndm, const double* dms, double* coulombs, double* exchanges);
+        void compute_three_center(GB4Integral* integral, GBasis* aux, double* output);
+        void compute_two_center(GB4Integral* integral, double* output);
+        void compute_grid_point1(double* output, double* point, GB1GridFn* grid_fn, const double* cutoffs=NULL);
+        void compute_shell_cutoffs(double tolerance, bool deriv, double* output);
         double compute_grid_point2(double* dm, double* point, GB2DMGridFn* grid_fn);
 
         const long get_nbasis() const {return nbasis;};
         const long get_nscales() const {return nscales;};
         const long get_max_shell_type() const {return max_shell_type;};
         const long* get_basis_offsets() const {return basis_offsets;};
+        const long* get_prim_offsets() const {return prim_offsets;};
         const double* get_scales(long iprim) const {return scales + scales_offsets[iprim];};
     };
 
@@ -80,10 +91,18 @@ class GOBasis : public GBasis {
         void compute_kinetic(double* output);
         void compute_nuclear_attraction(double* charges, double* centers, long ncharge, double* output);
         void compute_electron_repulsion(double* output);
-        void compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output);
-        void compute_grid1_dm(double* dm, long npoint, double* points, GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow);
+        void compute_electron_repulsion_schwarz(double* output);
+        long compute_electron_repulsion_sparse(const double* schwarz, double threshold, long nvalue_max, uint16_t* indexes, double* values);
+        long compute_electron_repulsion_sparse(const double* schwarz, double threshold, long nvalue_max, uint32_t* indexes, double* values);
+        void compute_electron_repulsion_direct(const double* schwarz, double threshold, long ndm, const double* dms, double* coulombs, double* exchanges);
+        void compute_electron_repulsion_three_center(GOBasis* aux, double* output);
+        void compute_electron_repulsion_two_center(double* output);
+        void compute_grid1_basis(long npoint, double* points, GB1GridFn* grid_fn, double* output, long nshell_sel, long* shells_sel, double* cutoffs);
+        void compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output, double* cutoffs);
+        void compute_grid1_dm(double* dm, long npoint, double* points, GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow, double* cutoffs);
         void compute_grid2_dm(double* dm, long npoint, double* points, double* output);
-        void compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, GB1DMGridFn* grid_fn, double* output);
+        void compute_grid2_dm_screened(double* dm, long npoint, double* points, double* output, double threshold);
+        void compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, GB1DMGridFn* grid_fn, double* output, double* cutoffs);
     };
 
 #endif
@@ -20,6 +20,9 @@
 #--
 
 
+from libcpp cimport bool
+from libc.stdint cimport uint16_t, uint32_t
+
 cimport fns
 
 cdef extern from "gbasis.h":
@@ -43,7 +46,8 @@ cdef extern from "gbasis.h":
         double* get_scales(long iprim)
 
         # low-level compute routines
-        void compute_grid_point1(double* output, double* point, fns.GB1DMGridFn* grid_fn)
+        void compute_grid_point1(double* output, double* point, fns.GB1DMGridFn* grid_fn, double* cutoffs)
+        void compute_shell_cutoffs(double tolerance, bool deriv, double* output)
         double compute_grid_point2(double* dm, double* point, fns.GB2DMGridFn* grid_fn)
 
     cdef cppclass GOBasis:
@@ -55,7 +59,15 @@ cdef extern from "gbasis.h":
         void compute_kinetic(double* output)
         void compute_nuclear_attraction(double* charges, double* centers, long ncharge, double* output)
         void compute_electron_repulsion(double* output)
-        void compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output)
-        void compute_grid1_dm(double* dm, long npoint, double* points, fns.GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow)
+        void compute_electron_repulsion_schwarz(double* output)
+        long compute_electron_repulsion_sparse(double* schwarz, double threshold, long nvalue_max, uint16_t* indexes, double* values)
+        long compute_electron_repulsion_sparse(double* schwarz, double threshold, long nvalue_max, uint32_t* indexes, double* values)
+        void compute_electron_repulsion_direct(double* schwarz, double threshold, long ndm, double* dms, double* coulombs, double* exchanges)
+        void compute_electron_repulsion_three_center(GOBasis* aux, double* output)
+        void compute_electron_repulsion_two_center(double* output)
+        void compute_grid1_basis(long npoint, double* points, fns.GB1DMGridFn* grid_fn, double* output, long nshell_sel, long* shells_sel, double* cutoffs)
+        void compute_grid1_exp(long nfn, double* coeffs, long npoint, double* points, long norb, long* iorbs, double* output, double* cutoffs)
+        void compute_grid1_dm(double* dm, long npoint, double* points, fns.GB1DMGridFn* grid_fn, double* output, double epsilon, double* dmmaxrow, double* cutoffs)
         void compute_grid2_dm(double* dm, long npoint, double* points, double* output)
-        void compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, fns.GB1DMGridFn* grid_fn, double* output)
+        void compute_grid2_dm_screened(double* dm, long npoint, double* points, double* output, double threshold) except +
+        void compute_grid1_fock(long npoint, double* points, double* weights, long pot_stride, double* pots, fns.GB1DMGridFn* grid_fn, double* output, double* cutoffs)
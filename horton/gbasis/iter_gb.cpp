@@ -19,6 +19,7 @@
 //--
 
 
+#include <cmath>
 #include <cstdlib>
 #include <cstring>
 #include "common.h"
@@ -253,6 +254,28 @@ double IterGB2::dot(const double *work, const double *dm) {
 }
 
 
+double IterGB2::dot_abs(const double *work, const double *dm) {
+    // Same as dot, but with the absolute values of all factors. This is an
+    // upper bound for the absolute value of the result of dot.
+    long i0, i1;
+    const long n0 = get_shell_nbasis(shell_type0);
+    const long n1 = get_shell_nbasis(shell_type1);
+    const long nbasis = gbasis->get_nbasis();
+    const double* tmp;
+    double result = 0.0;
+    tmp = work;
+    for (i0=0; i0<n0; i0++) {
+        for (i1=0; i1<n1; i1++) {
+            result += fabs(dm[(i0+ibasis0)*nbasis+i1+ibasis1]*(*tmp));
+            if (ibasis0 != ibasis1)
+                result += fabs(dm[(i1+ibasis1)*nbasis+i0+ibasis0]*(*tmp));
+            tmp++;
+        }
+    }
+    return result;
+}
+
+
 
 
 
@@ -65,6 +65,7 @@ class IterGB2 {
         void update_prim();
         void store(const double* work, double* output);
         double dot(const double* work, const double* dm);
+        double dot_abs(const double* work, const double* dm);
 
         // 'public' iterator fields
         long shell_type0, shell_type1;
@@ -303,6 +303,32 @@ def test_grid_co_ccpv5z_pure_hf_esp_some_points():
     assert abs(esps - ref[:,3]).max() < 1e-5
 
 
+def check_grid_hartree_screened(fn):
+    sys = System.from_file(context.get_fn(fn))
+    x = np.linspace(-8, 8, 8)
+    points = np.array(np.meshgrid(x, x, x, indexing='ij')).reshape(3,-1).T.copy()
+    ref = sys.compute_grid_hartree(points)
+    for threshold in 1e-6, 1e-8, 1e-10:
+        hartree = sys.compute_grid_hartree(points, threshold=threshold)
+        assert abs(hartree - ref).max() < 10*threshold
+    # The results are added to the output array.
+    hartree = ref.copy()
+    sys.obasis.compute_grid_hartree_dm(sys.wfn.dm_full, points, hartree, 1e-10)
+    assert abs(hartree - 2*ref).max() < 1e-9
+    # Check the ESP as well.
+    esp_ref = sys.compute_grid_esp(points)
+    esp = sys.compute_grid_esp(points, threshold=1e-10)
+    assert abs(esp - esp_ref).max() < 1e-9
+
+
+def test_grid_hartree_screened_water_sto3g():
+    check_grid_hartree_screened('test/water_sto3g_hf_g03.fchk')
+
+
+def test_grid_hartree_screened_lih_321g():
+    check_grid_hartree_screened('test/li_h_3-21G_hf_g09.fchk')
+
+
 def test_grid_one_body_ne():
     sys = System.from_file(context.get_fn('test/li_h_3-21G_hf_g09.fchk'))
     rtf = ExpRTransform(1e-3, 2e1, 100)
@@ -320,6 +346,349 @@ def test_grid_one_body_ne():
     na_grid.check_symmetry()
 
 
+def check_grid_blocks(fn_fchk):
+    from horton.gbasis.cext import grid_block_size
+    sys = System.from_file(context.get_fn(fn_fchk))
+    obasis = sys.obasis
+    dm = sys.wfn.dm_full
+    # enough points to cover several blocks, including a partial one
+    npoint = 2*grid_block_size + 17
+    points = np.random.normal(0, 1.5, (npoint, 3))
+    weights = np.random.uniform(0, 1, npoint)
+
+    # densities
+    rhos1 = np.zeros(npoint)
+    obasis.compute_grid_density_dm(dm, points, rhos1)
+    rhos2 = np.zeros(npoint)
+    obasis._compute_grid1_dm(dm, points, GB1DMGridDensityFn(obasis.max_shell_type), rhos2)
+    assert abs(rhos1 - rhos2).max() < 1e-10*abs(rhos2).max()
+
+    # gradients
+    gradrhos1 = np.zeros((npoint, 3))
+    obasis.compute_grid_gradient_dm(dm, points, gradrhos1)
+    gradrhos2 = np.zeros((npoint, 3))
+    obasis._compute_grid1_dm(dm, points, GB1DMGridGradientFn(obasis.max_shell_type), gradrhos2)
+    assert abs(gradrhos1 - gradrhos2).max() < 1e-10*abs(gradrhos2).max()
+    # with epsilon, the gradients are computed point by point
+    gradrhos3 = np.zeros((npoint, 3))
+    obasis.compute_grid_gradient_dm(dm, points, gradrhos3, epsilon=1e-10)
+    assert abs(gradrhos3 - gradrhos2).max() < 1e-8
+
+    # density fock
+    pots = np.random.uniform(-1, 1, npoint)
+    fock1 = sys.lf.create_one_body()
+    obasis.compute_grid_density_fock(points, weights, pots, fock1)
+    fock2 = sys.lf.create_one_body()
+    obasis._compute_grid1_fock(points, weights, pots, GB1DMGridDensityFn(obasis.max_shell_type), fock2)
+    assert abs(fock1._array - fock2._array).max() < 1e-10*abs(fock2._array).max()
+    fock1.check_symmetry()
+
+    # gradient fock
+    pots = np.random.uniform(-1, 1, (npoint, 3))
+    fock1 = sys.lf.create_one_body()
+    obasis.compute_grid_gradient_fock(points, weights, pots, fock1)
+    fock2 = sys.lf.create_one_body()
+    obasis._compute_grid1_fock(points, weights, pots, GB1DMGridGradientFn(obasis.max_shell_type), fock2)
+    assert abs(fock1._array - fock2._array).max() < 1e-10*abs(fock2._array).max()
+    fock1.check_symmetry()
+
+    # orbitals
+    iorbs = np.array([0, 2, 1])
+    orbs = np.zeros((npoint, len(iorbs)))
+    obasis.compute_grid_orbitals_exp(sys.wfn.exp_alpha, points, iorbs, orbs)
+    basis = np.zeros((npoint, obasis.nbasis))
+    obasis.compute_grid_basis(points, basis)
+    assert abs(orbs - np.dot(basis, sys.wfn.exp_alpha.coeffs[:,iorbs])).max() < 1e-10
+
+    # basis functions and their gradients, compared to the point-wise routine
+    basis_gradient = np.zeros((npoint, obasis.nbasis, 4))
+    obasis.compute_grid_basis_gradient(points, basis_gradient)
+    grid_fn = GB1DMGridDensityFn(obasis.max_shell_type)
+    for ipoint in 0, grid_block_size, npoint-1:
+        output = np.zeros(obasis.nbasis)
+        obasis.compute_grid_point1(output, points[ipoint], grid_fn)
+        assert abs(basis[ipoint] - output).max() < 1e-10
+        assert abs(basis_gradient[ipoint,:,0] - output).max() < 1e-10
+
+
+def test_grid_blocks_lih_321g_hf():
+    check_grid_blocks('test/li_h_3-21G_hf_g09.fchk')
+
+
+def test_grid_blocks_o2_cc_pvtz_pure():
+    check_grid_blocks('test/o2_cc_pvtz_pure.fchk')
+
+
+def test_grid_blocks_o2_cc_pvtz_cart():
+    check_grid_blocks('test/o2_cc_pvtz_cart.fchk')
+
+
+def check_shell_cutoffs(fn_fchk, tolerance):
+    sys = System.from_file(context.get_fn(fn_fchk))
+    obasis = sys.obasis
+    cutoffs = obasis.compute_shell_cutoffs(tolerance)
+    assert cutoffs.shape == (obasis.nshell,)
+    assert (cutoffs > 0).all()
+    # basis functions just outside the cutoff radius must be negligible
+    grid_fn = GB1DMGridDensityFn(obasis.max_shell_type)
+    ibasis = 0
+    for ishell in xrange(obasis.nshell):
+        nbasis = get_shell_nbasis(obasis.shell_types[ishell])
+        center = obasis.centers[obasis.shell_map[ishell]]
+        for irep in xrange(10):
+            direction = np.random.normal(0, 1, 3)
+            direction /= np.linalg.norm(direction)
+            for radius in cutoffs[ishell]*1.001, cutoffs[ishell]*1.5:
+                point = center + radius*direction
+                output = np.zeros(obasis.nbasis)
+                obasis.compute_grid_point1(output, point, grid_fn)
+                # contributions from other shells are not relevant here
+                assert abs(output[ibasis:ibasis+nbasis]).max() < tolerance
+        ibasis += nbasis
+    # with deriv=True, also the derivatives are negligible
+    cutoffs_deriv = obasis.compute_shell_cutoffs(tolerance, deriv=True)
+    assert (cutoffs_deriv >= cutoffs).all()
+    grid_fn = GB1DMGridGradientFn(obasis.max_shell_type)
+    ibasis = 0
+    for ishell in xrange(obasis.nshell):
+        nbasis = get_shell_nbasis(obasis.shell_types[ishell])
+        center = obasis.centers[obasis.shell_map[ishell]]
+        directions = np.random.normal(0, 1, (10, 3))
+        directions /= np.sqrt((directions**2).sum(axis=1)).reshape(-1, 1)
+        for radius in cutoffs_deriv[ishell]*1.001, cutoffs_deriv[ishell]*1.5:
+            points = center + radius*directions
+            for begin, end, basis, ibasis_sel in obasis._iter_grid_blocks(points, grid_fn):
+                assert abs(basis[:,ibasis:ibasis+nbasis]).max() < tolerance
+        ibasis += nbasis
+    # the memoized result is the same
+    cutoffs[:] = 0.0
+    cutoffs = obasis.compute_shell_cutoffs(tolerance)
+    assert (cutoffs > 0).all()
+    # a smaller tolerance gives larger radii
+    assert (obasis.compute_shell_cutoffs(tolerance*1e-3) > cutoffs).all()
+    with assert_raises(ValueError):
+        obasis.compute_shell_cutoffs(0.0)
+
+
+def test_shell_cutoffs_lih_321g_hf():
+    check_shell_cutoffs('test/li_h_3-21G_hf_g09.fchk', 1e-8)
+
+
+def test_shell_cutoffs_o2_cc_pvtz_pure():
+    check_shell_cutoffs('test/o2_cc_pvtz_pure.fchk', 1e-6)
+
+
+def test_shell_cutoffs_o2_cc_pvtz_cart():
+    check_shell_cutoffs('test/o2_cc_pvtz_cart.fchk', 1e-6)
+
+
+def check_grid_screening(fn_fchk, tolerance, threshold):
+    from horton.gbasis.cext import grid_block_size
+    sys = System.from_file(context.get_fn(fn_fchk))
+    obasis = sys.obasis
+    dm = sys.wfn.dm_full
+    # Points spread over a large box, such that shells get screened in some
+    # blocks. The points are sorted to obtain more compact blocks.
+    npoint = 3*grid_block_size + 5
+    points = np.random.uniform(-10, 10, (npoint, 3))
+    points = points[np.argsort(points[:,0])].copy()
+    weights = np.random.uniform(0, 1, npoint)
+
+    # densities
+    rhos1 = np.zeros(npoint)
+    obasis.compute_grid_density_dm(dm, points, rhos1, tolerance=tolerance)
+    rhos2 = np.zeros(npoint)
+    obasis.compute_grid_density_dm(dm, points, rhos2)
+    assert abs(rhos1 - rhos2).max() < threshold
+    rhos3 = np.zeros(npoint)
+    obasis._compute_grid1_dm(dm, points, GB1DMGridDensityFn(obasis.max_shell_type), rhos3, tolerance=tolerance)
+    assert abs(rhos3 - rhos2).max() < threshold
+
+    # gradients
+    gradrhos1 = np.zeros((npoint, 3))
+    obasis.compute_grid_gradient_dm(dm, points, gradrhos1, tolerance=tolerance)
+    gradrhos2 = np.zeros((npoint, 3))
+    obasis.compute_grid_gradient_dm(dm, points, gradrhos2)
+    assert abs(gradrhos1 - gradrhos2).max() < threshold
+
+    # density fock
+    pots = np.random.uniform(-1, 1, npoint)
+    fock1 = sys.lf.create_one_body()
+    obasis.compute_grid_density_fock(points, weights, pots, fock1, tolerance)
+    fock2 = sys.lf.create_one_body()
+    obasis.compute_grid_density_fock(points, weights, pots, fock2)
+    assert abs(fock1._array - fock2._array).max() < threshold
+    fock1.check_symmetry()
+
+    # gradient fock
+    pots = np.random.uniform(-1, 1, (npoint, 3))
+    fock1 = sys.lf.create_one_body()
+    obasis.compute_grid_gradient_fock(points, weights, pots, fock1, tolerance)
+    fock2 = sys.lf.create_one_body()
+    obasis.compute_grid_gradient_fock(points, weights, pots, fock2)
+    assert abs(fock1._array - fock2._array).max() < threshold
+    fock1.check_symmetry()
+
+    # orbitals
+    iorbs = np.array([0, 2, 1])
+    orbs1 = np.zeros((npoint, len(iorbs)))
+    obasis.compute_grid_orbitals_exp(sys.wfn.exp_alpha, points, iorbs, orbs1, tolerance)
+    orbs2 = np.zeros((npoint, len(iorbs)))
+    obasis.compute_grid_orbitals_exp(sys.wfn.exp_alpha, points, iorbs, orbs2)
+    assert abs(orbs1 - orbs2).max() < threshold
+
+
+def test_grid_screening_lih_321g_hf():
+    check_grid_screening('test/li_h_3-21G_hf_g09.fchk', 1e-12, 1e-9)
+
+
+def test_grid_screening_o2_cc_pvtz_pure():
+    check_grid_screening('test/o2_cc_pvtz_pure.fchk', 1e-12, 1e-9)
+
+
+def test_grid_screening_o2_cc_pvtz_cart():
+    check_grid_screening('test/o2_cc_pvtz_cart.fchk', 1e-12, 1e-9)
+
+
+def check_grid_fused(fn_fchk, gradient, tolerance):
+    from horton.gbasis.cext import grid_block_size
+    sys = System.from_file(context.get_fn(fn_fchk))
+    obasis = sys.obasis
+    dms = [sys.wfn.dm_alpha, sys.wfn.dm_full]
+    npoint = 2*grid_block_size + 17
+    points = np.random.normal(0, 1.5, (npoint, 3))
+    weights = np.random.uniform(0, 1, npoint)
+
+    # Reference: densities and Fock contributions with separate grid passes.
+    # The potentials are simple non-linear functions of the densities.
+    focks1 = [sys.lf.create_one_body() for dm in dms]
+    for dm, fock in zip(dms, focks1):
+        rhos = np.zeros(npoint)
+        obasis.compute_grid_density_dm(dm, points, rhos, tolerance=tolerance)
+        obasis.compute_grid_density_fock(points, weights, rhos**2, fock, tolerance)
+        if gradient:
+            gradrhos = np.zeros((npoint, 3))
+            obasis.compute_grid_gradient_dm(dm, points, gradrhos, tolerance=tolerance)
+            gpots = gradrhos*rhos.reshape(-1,1)
+            obasis.compute_grid_gradient_fock(points, weights, gpots, fock, tolerance)
+
+    # Fused evaluation
+    blocks = []
+    def callback(begin, end, rhos, gradrhos):
+        assert rhos.shape == (end-begin, len(dms))
+        if gradient:
+            assert gradrhos.shape == (end-begin, len(dms), 3)
+            gpots = gradrhos*rhos.reshape(end-begin, len(dms), 1)
+        else:
+            assert gradrhos is None
+            gpots = None
+        blocks.append((begin, end))
+        return rhos**2, gpots
+    focks2 = [sys.lf.create_one_body() for dm in dms]
+    obasis.compute_grid_fused_fock(dms, points, weights, callback, focks2, gradient, tolerance)
+    assert blocks[0][0] == 0
+    assert blocks[-1][1] == npoint
+    for fock1, fock2 in zip(focks1, focks2):
+        assert abs(fock1._array - fock2._array).max() < 1e-10*abs(fock1._array).max()
+        fock2.check_symmetry()
+
+
+def test_grid_fused_lih_321g_hf():
+    check_grid_fused('test/li_h_3-21G_hf_g09.fchk', True, 0)
+
+
+def test_grid_fused_lih_321g_hf_density():
+    check_grid_fused('test/li_h_3-21G_hf_g09.fchk', False, 0)
+
+
+def test_grid_fused_o2_cc_pvtz_pure_screened():
+    check_grid_fused('test/o2_cc_pvtz_pure.fchk', True, 1e-12)
+
+
+def check_grid_cache(fn_fchk, tolerance):
+    from horton.gbasis.cext import grid_block_size
+    sys = System.from_file(context.get_fn(fn_fchk))
+    obasis = sys.obasis
+    dm = sys.wfn.dm_full
+    npoint = 3*grid_block_size + 5
+    points = np.random.normal(0, 3.0, (npoint, 3))
+    points = points[np.argsort(points[:,0])].copy()
+    weights = np.random.uniform(0, 1, npoint)
+    pots = np.random.uniform(-1, 1, npoint)
+    gpots = np.random.uniform(-1, 1, (npoint, 3))
+
+    def compute_all():
+        rhos = np.zeros(npoint)
+        obasis.compute_grid_density_dm(dm, points, rhos, tolerance=tolerance)
+        gradrhos = np.zeros((npoint, 3))
+        obasis.compute_grid_gradient_dm(dm, points, gradrhos, tolerance=tolerance)
+        fock = sys.lf.create_one_body()
+        obasis.compute_grid_density_fock(points, weights, pots, fock, tolerance)
+        obasis.compute_grid_gradient_fock(points, weights, gpots, fock, tolerance)
+        return rhos, gradrhos, fock._array
+
+    try:
+        obasis.grid_cache = None
+        expected = compute_all()
+        # Unlimited cache: the second round only uses stored blocks.
+        obasis.grid_cache = GridBasisCache(points)
+        for irep in xrange(2):
+            results = compute_all()
+            for result, ref in zip(results, expected):
+                assert abs(result - ref).max() < 1e-10*abs(ref).max()
+        nbytes = obasis.grid_cache.nbytes
+        assert nbytes > 0
+        compute_all()
+        assert obasis.grid_cache.nbytes == nbytes
+        # The density blocks can be taken from the gradient blocks.
+        obasis.grid_cache.clear()
+        gradrhos = np.zeros((npoint, 3))
+        obasis.compute_grid_gradient_dm(dm, points, gradrhos, tolerance=tolerance)
+        nbytes = obasis.grid_cache.nbytes
+        rhos = np.zeros(npoint)
+        obasis.compute_grid_density_dm(dm, points, rhos, tolerance=tolerance)
+        assert obasis.grid_cache.nbytes == nbytes
+        assert abs(rhos - expected[0]).max() < 1e-10*abs(expected[0]).max()
+        # Limited cache: only some blocks are stored.
+        obasis.grid_cache = GridBasisCache(points, nbytes/2)
+        for irep in xrange(2):
+            results = compute_all()
+            for result, ref in zip(results, expected):
+                assert abs(result - ref).max() < 1e-10*abs(ref).max()
+        assert obasis.grid_cache.nbytes > 0
+        assert obasis.grid_cache.nbytes <= nbytes/2
+        # A cache for other points is not used.
+        obasis.grid_cache = GridBasisCache(points.copy())
+        compute_all()
+        assert obasis.grid_cache.nbytes == 0
+        # Moving the points or the centers in place discards the stored blocks.
+        for array in points, obasis.centers:
+            obasis.grid_cache = GridBasisCache(points)
+            compute_all()
+            assert obasis.grid_cache.nbytes > 0
+            array += 0.1
+            results = compute_all()
+            obasis.grid_cache = None
+            expected = compute_all()
+            for result, ref in zip(results, expected):
+                assert abs(result - ref).max() < 1e-10*abs(ref).max()
+    finally:
+        obasis.grid_cache = None
+
+
+def test_grid_cache_lih_321g_hf():
+    check_grid_cache('test/li_h_3-21G_hf_g09.fchk', 0)
+
+
+def test_grid_cache_o2_cc_pvtz_pure_screened():
+    check_grid_cache('test/o2_cc_pvtz_pure.fchk', 1e-12)
+
+
+def test_grid_cache_invalid():
+    with assert_raises(ValueError):
+        GridBasisCache(np.zeros((10, 3)), -1)
+
+
 def test_gob_normalization():
     assert abs(gob_pure_normalization(0.09515, 0) - 0.122100288) < 1e-5
     assert abs(gob_pure_normalization(0.1687144, 1) - 0.154127551) < 1e-5
@@ -25,7 +25,7 @@ import numpy as np
 
 from horton.grid.utils import parse_args_integrate
 from horton.grid.cext import dot_multi, eval_spline_grid, \
-    dot_multi_moments
+    eval_spline_grid_multi, dot_multi_moments
 from horton.cext import Cell
 
 
@@ -147,3 +147,12 @@ class IntGrid(object):
         if cell is None:
             cell = Cell(None)
         eval_spline_grid(cubic_spline, center, output, self.points, cell)
+
+    def eval_spline_multi(self, splines, centers, coeffs, output, cell=None):
+        '''Add a linear combination of spherically symmetric functions to output
+
+           See eval_spline_grid_multi for the meaning of the arguments.
+        '''
+        if cell is None:
+            cell = Cell(None)
+        eval_spline_grid_multi(splines, centers, coeffs, output, self.points, cell)
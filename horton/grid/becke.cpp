@@ -24,8 +24,10 @@
 #ifdef DEBUG
 #include <cstdio>
 #endif
+#include <algorithm>
 #include <cmath>
 #include <stdexcept>
+#include <vector>
 
 #include "becke.h"
 
@@ -86,7 +88,7 @@ void becke_helper_atom(int npoint, double* points, double* weights, int natom,
     double p, s; // Used to build up the value of the switching function
 
     // precompute the the alpha parameters for each atom pair
-    double alphas[(natom*(natom+1))/2];
+    std::vector<double> alphas((natom*(natom+1))/2);
     long offset = 0;
     for (int iatom0 = 0; iatom0 < natom; iatom0++) {
         for (int iatom1 = 0; iatom1 <= iatom0; iatom1++) {
@@ -106,7 +108,7 @@ void becke_helper_atom(int npoint, double* points, double* weights, int natom,
     }
 
     // precompute interatomic distances
-    double atomic_dists[(natom*(natom+1))/2];
+    std::vector<double> atomic_dists((natom*(natom+1))/2);
     offset = 0;
     for (int iatom0 = 0; iatom0 < natom; iatom0++) {
         for (int iatom1 = 0; iatom1 <= iatom0; iatom1++) {
@@ -115,8 +117,10 @@ void becke_helper_atom(int npoint, double* points, double* weights, int natom,
         }
     }
 
-    // actual computations of Becke weights
+    // actual computations of Becke weights, each point is independent
+    #pragma omp parallel for private(nom, denom, p, s, offset) schedule(dynamic, 64)
     for (int ipoint = npoint-1; ipoint>=0; ipoint--) {
+        double* point = points + 3*ipoint;
         nom = 0;
         denom = 0;
         for (int iatom0 = 0; iatom0 < natom; iatom0++) {
@@ -132,8 +136,8 @@ void becke_helper_atom(int npoint, double* points, double* weights, int natom,
                 }
 
                 // Diatomic switching function
-                s = (dist(points, &centers[3*iatom0])
-                     -dist(points, &centers[3*iatom1]))
+                s = (dist(point, &centers[3*iatom0])
+                     -dist(point, &centers[3*iatom1]))
                     /atomic_dists[offset]; // Eq. (11)
                 s = s + alphas[offset]*(1 - 2*(iatom0<iatom1))*(1-s*s); // Eq. (A2)
 
@@ -156,10 +160,240 @@ void becke_helper_atom(int npoint, double* points, double* weights, int natom,
 #endif
 
         // Weight function at this grid point:
-        *weights *= nom/denom; // Eq. (22)
+        weights[ipoint] *= nom/denom; // Eq. (22)
+    }
+}
+
+
+/* becke_alpha
+
+   The parameter for the heteronuclear assignment of the boundary between two
+   atoms with the given radii. (Appendix in Becke's paper.)
+*/
+static double becke_alpha(double radius0, double radius1) {
+    double alpha = (radius0 - radius1)/(radius0 + radius1); // Eq. (A6)
+    alpha = alpha/(alpha*alpha-1); // Eq. (A5)
+    // Eq. (A3), except that we use some safe margin (0.45 instead of 0.5)
+    // to stay away from a ridiculous imbalance.
+    if (alpha > 0.45) {
+        alpha = 0.45;
+    } else if (alpha < -0.45) {
+        alpha = -0.45;
+    }
+    return alpha;
+}
+
+
+/* becke_switch
+
+   The value of the switching function for given (heteronuclear) elliptical
+   coordinate. See Eqs. (18-20) in Becke's paper.
+*/
+static double becke_switch(double s, int order) {
+    for (int k=1; k <= order; k++) {
+        s = 0.5*s*(3-s*s);
+    }
+    return 0.5*(1-s);
+}
+
+
+/* Sort atom indexes by their distance to a reference atom. */
+struct DistanceOrder {
+    const double* dists;
+    DistanceOrder(const double* dists) : dists(dists) {}
+    bool operator()(long i, long j) const { return dists[i] < dists[j]; }
+};
+
+
+/* becke_helper_atoms
+
+   Computes the Becke weighting function for every point in the grid, with a
+   different selected atom for each point. This is typically used to compute
+   the weights of a molecular grid composed of atomic grids in one call.
+
+   npoint
+        The number of grid points
+
+   points
+        The grid points. row-major storate of (npoint,3) array.
+
+   weights
+        The output, i.e. the Becke weights for the grid points. Note that the
+        becke weight is **multiplied** with the original contents of the array!
+
+   natom
+        The number of atoms
+
+   radii
+        The radii of the atoms
+
+   centers
+        The positions of the atoms.
+
+   selects
+        The selected atom for each grid point.
+
+   order
+        The order of the switching function in the Becke scheme.
 
-        // go to next point
-        points += 3;
-        weights++;
+   epsilon
+        When zero, all atoms are included in the cell functions, just like in
+        becke_helper_atom. When positive, only atoms whose cell function can
+        be larger than epsilon in a grid point are taken into account for that
+        point. These atoms are found with neighbor lists, starting from the
+        atom nearest to the grid point. The weights still form an exact
+        partition of unity, such that molecular integrals are not affected.
+*/
+void becke_helper_atoms(int npoint, double* points, double* weights, int natom,
+                        double* radii, double* centers, long* selects, int order,
+                        double epsilon)
+{
+    // precompute the alpha parameters and distances for all atom pairs
+    std::vector<double> alphas(natom*natom);
+    std::vector<double> atomic_dists(natom*natom);
+    for (int iatom0 = 0; iatom0 < natom; iatom0++) {
+        for (int iatom1 = 0; iatom1 < natom; iatom1++) {
+            alphas[iatom0*natom + iatom1] = becke_alpha(radii[iatom0], radii[iatom1]);
+            atomic_dists[iatom0*natom + iatom1] = dist(&centers[3*iatom0], &centers[3*iatom1]);
+        }
+    }
+
+    // Neighbor lists: for each atom, all atoms sorted by distance. Also find
+    // the largest elliptical coordinate for which the switching function
+    // can exceed epsilon, for the largest heteronuclear correction.
+    std::vector<long> neighbors;
+    double mu_cut = 1.0;
+    if (epsilon > 0) {
+        double alpha_max = 0.0;
+        for (int i = 0; i < natom*natom; i++) {
+            if (fabs(alphas[i]) > alpha_max) alpha_max = fabs(alphas[i]);
+        }
+        neighbors.resize(natom*natom);
+        for (int iatom0 = 0; iatom0 < natom; iatom0++) {
+            long* begin = &neighbors[iatom0*natom];
+            for (int iatom1 = 0; iatom1 < natom; iatom1++) begin[iatom1] = iatom1;
+            std::sort(begin, begin + natom, DistanceOrder(&atomic_dists[iatom0*natom]));
+        }
+        double mu_low = -1.0;
+        for (int i = 0; i < 100; i++) {
+            double mu = 0.5*(mu_low + mu_cut);
+            if (becke_switch(mu - alpha_max*(1 - mu*mu), order) > epsilon) {
+                mu_low = mu;
+            } else {
+                mu_cut = mu;
+            }
+        }
+    }
+
+    #pragma omp parallel
+    {
+        std::vector<long> active(natom);
+        // Distances between the current point and the atoms. They are only
+        // valid for the atoms with a stamp equal to the current point index.
+        std::vector<double> point_dists(natom);
+        std::vector<int> stamps(natom, -1);
+
+        #pragma omp for schedule(dynamic, 64)
+        for (int ipoint = npoint-1; ipoint>=0; ipoint--) {
+            double* point = points + 3*ipoint;
+            long select = selects[ipoint];
+            long nactive = 0;
+            if (epsilon > 0) {
+                // Find the nearest atom. It is at most twice the distance
+                // to the selected atom away from the selected atom.
+                long inear = select;
+                double dnear = dist(point, &centers[3*select]);
+                point_dists[select] = dnear;
+                stamps[select] = ipoint;
+                double rmax = 2*dnear;
+                for (int i = 0; i < natom; i++) {
+                    long iatom = neighbors[select*natom + i];
+                    if (iatom == select) continue;
+                    if (atomic_dists[select*natom + iatom] > rmax) break;
+                    double d = dist(point, &centers[3*iatom]);
+                    point_dists[iatom] = d;
+                    stamps[iatom] = ipoint;
+                    if (d < dnear) {
+                        inear = iatom;
+                        dnear = d;
+                    }
+                }
+                // The weight is negligible when the cell function of the
+                // selected atom is negligible.
+                if (inear != select) {
+                    double s = (point_dists[select] - dnear)/atomic_dists[select*natom + inear];
+                    s = s + alphas[select*natom + inear]*(1-s*s);
+                    if (becke_switch(s, order) <= epsilon) {
+                        weights[ipoint] = 0.0;
+                        continue;
+                    }
+                }
+                // Select the atoms whose cell function can be significant,
+                // based on their switching function with the nearest atom.
+                active[0] = inear;
+                nactive = 1;
+                rmax = (mu_cut < 1) ? 2*dnear/(1 - mu_cut) : HUGE_VAL;
+                for (int i = 0; i < natom; i++) {
+                    long iatom = neighbors[inear*natom + i];
+                    if (iatom == inear) continue;
+                    double r = atomic_dists[inear*natom + iatom];
+                    if (r >= rmax) break;
+                    if (stamps[iatom] != ipoint) {
+                        point_dists[iatom] = dist(point, &centers[3*iatom]);
+                        stamps[iatom] = ipoint;
+                    }
+                    double s = (point_dists[iatom] - dnear)/r;
+                    s = s + alphas[iatom*natom + inear]*(1-s*s);
+                    if (becke_switch(s, order) > epsilon) {
+                        active[nactive] = iatom;
+                        nactive++;
+                    }
+                }
+            } else {
+                for (int iatom = 0; iatom < natom; iatom++) {
+                    active[iatom] = iatom;
+                    point_dists[iatom] = dist(point, &centers[3*iatom]);
+                }
+                nactive = natom;
+            }
+
+            double nom = 0;
+            double denom = 0;
+            for (long i0 = 0; i0 < nactive; i0++) {
+                long iatom0 = active[i0];
+                double p = 1;
+                if (epsilon > 0) {
+                    // Only include the atoms for which the switching function
+                    // can differ from one by more than epsilon.
+                    double d0 = point_dists[iatom0];
+                    double rmax = (mu_cut < 1) ? 2*d0/(1 - mu_cut) : HUGE_VAL;
+                    for (int i1 = 0; i1 < natom; i1++) {
+                        long iatom1 = neighbors[iatom0*natom + i1];
+                        if (iatom0 == iatom1) continue;
+                        long offset = iatom0*natom + iatom1;
+                        if (atomic_dists[offset] >= rmax) break;
+                        if (stamps[iatom1] != ipoint) {
+                            point_dists[iatom1] = dist(point, &centers[3*iatom1]);
+                            stamps[iatom1] = ipoint;
+                        }
+                        double s = (d0 - point_dists[iatom1])/atomic_dists[offset]; // Eq. (11)
+                        s = s + alphas[offset]*(1-s*s); // Eq. (A2)
+                        p *= becke_switch(s, order); // Eq. (13)
+                    }
+                } else {
+                    for (long i1 = 0; i1 < nactive; i1++) {
+                        long iatom1 = active[i1];
+                        if (iatom0 == iatom1) continue;
+                        long offset = iatom0*natom + iatom1;
+                        double s = (point_dists[iatom0] - point_dists[iatom1])/atomic_dists[offset]; // Eq. (11)
+                        s = s + alphas[offset]*(1-s*s); // Eq. (A2)
+                        p *= becke_switch(s, order); // Eq. (13)
+                    }
+                }
+                if (iatom0 == select) nom = p;
+                denom += p; // Eq. (22)
+            }
+            weights[ipoint] *= nom/denom; // Eq. (22)
+        }
     }
 }
@@ -24,5 +24,8 @@
 
 void becke_helper_atom(int npoint, double* points, double* weights, int natom,
                        double* radii, double* centers, int select, int order);
+void becke_helper_atoms(int npoint, double* points, double* weights, int natom,
+                        double* radii, double* centers, long* selects, int order,
+                        double epsilon);
 
 #endif
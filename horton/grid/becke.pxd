@@ -23,4 +23,8 @@
 cdef extern from "becke.h":
     void becke_helper_atom(int npoint, double* points, double* weights,
                            int natom, double* radii, double* centers, int
-                           select, int order)
+                           select, int order) nogil
+
+    void becke_helper_atoms(int npoint, double* points, double* weights,
+                            int natom, double* radii, double* centers,
+                            long* selects, int order, double epsilon)
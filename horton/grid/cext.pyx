@@ -40,6 +40,7 @@ cimport rtransform
 cimport uniform
 cimport utils
 
+cimport horton.cell
 cimport horton.cext
 
 
@@ -50,13 +51,14 @@ __all__ = [
     # lebedev_laikov
     'lebedev_laikov_npoint', 'lebedev_laikov_sphere', 'lebedev_laikov_npoints',
     # becke
-    'becke_helper_atom',
+    'becke_helper_atom', 'becke_helper_atoms',
     # cubic_spline
     'Extrapolation', 'ZeroExtrapolation', 'CuspExtrapolation',
     'PowerExtrapolation', 'tridiagsym_solve', 'CubicSpline',
     'compute_cubic_spline_int_weights',
     # evaluate
     'index_wrap', 'eval_spline_cube', 'eval_spline_grid',
+    'eval_spline_cube_multi', 'eval_spline_grid_multi',
     # rtransform
     'RTransform', 'IdentityRTransform', 'LinearRTransform', 'ExpRTransform',
     'ShiftedExpRTransform', 'PowerRTransform',
@@ -161,8 +163,83 @@ def becke_helper_atom(np.ndarray[double, ndim=2] points not None,
     assert select >= 0 and select < natom
     assert order > 0
 
-    becke.becke_helper_atom(points.shape[0], &points[0, 0], &weights[0], natom,
-                            &radii[0], &centers[0, 0], select, order)
+    cdef int npoint_c = npoint
+    cdef int natom_c = natom
+    cdef double* points_ptr = &points[0, 0]
+    cdef double* weights_ptr = &weights[0]
+    cdef double* radii_ptr = &radii[0]
+    cdef double* centers_ptr = &centers[0, 0]
+    with nogil:
+        becke.becke_helper_atom(npoint_c, points_ptr, weights_ptr, natom_c,
+                                radii_ptr, centers_ptr, select, order)
+
+
+def becke_helper_atoms(np.ndarray[double, ndim=2] points not None,
+                       np.ndarray[double, ndim=1] weights not None,
+                       np.ndarray[double, ndim=1] radii not None,
+                       np.ndarray[double, ndim=2] centers not None,
+                       np.ndarray[long, ndim=1] selects not None,
+                       int order, double epsilon=0):
+    '''becke_helper_atoms(points, weights, radii, centers, selects, k, epsilon=0)
+
+       Compute the Becke weights on a grid, with a selected atom per point.
+
+       **Arguments:**
+
+       points
+            The Cartesian coordinates of the grid points. Numpy array with
+            shape (npoint, 3)
+
+       weights
+            The output array where the Becke partitioning weights are written.
+            Numpy array with shape (npoint,)
+
+       radii
+            The covalent radii used to shrink/enlarge basins in the Becke
+            scheme.
+
+       centers
+            The positions of the nuclei.
+
+       selects
+            The selected atom for each grid point, for which the weight should
+            be created. Numpy array with shape (npoint,)
+
+       order
+            The order of the switching functions. (That is k in Becke's paper.)
+
+       **Optional arguments:**
+
+       epsilon
+            When positive, only the atoms whose cell function may exceed
+            epsilon in a grid point are included in the Becke weight of that
+            point. This reduces the cost for large systems from quadratic to
+            linear in the number of atoms per grid point. The weights of all
+            atoms in one point still sum up to one.
+
+       See Becke's paper for the details: http://dx.doi.org/10.1063/1.454033
+    '''
+    assert points.flags['C_CONTIGUOUS']
+    assert points.shape[1] == 3
+    npoint = points.shape[0]
+    assert weights.flags['C_CONTIGUOUS']
+    assert weights.shape[0] == npoint
+    assert radii.flags['C_CONTIGUOUS']
+    natom = radii.shape[0]
+    assert centers.flags['C_CONTIGUOUS']
+    assert centers.shape[0] == natom
+    assert centers.shape[1] == 3
+    assert selects.flags['C_CONTIGUOUS']
+    assert selects.shape[0] == npoint
+    assert npoint == 0 or (selects.min() >= 0 and selects.max() < natom)
+    assert order > 0
+    assert epsilon >= 0
+    if npoint == 0:
+        return
+
+    becke.becke_helper_atoms(npoint, &points[0, 0], &weights[0], natom,
+                             &radii[0], &centers[0, 0], &selects[0], order,
+                             epsilon)
 
 
 #
@@ -477,8 +554,12 @@ def eval_spline_cube(CubicSpline spline not None,
     assert output.shape[1] == ugrid.shape[1]
     assert output.shape[2] == ugrid.shape[2]
 
-    evaluate.eval_spline_cube(spline._this, &center[0], &output[0, 0, 0],
-                              ugrid._this)
+    cdef cubic_spline.CubicSpline* spline_ptr = spline._this
+    cdef double* center_ptr = &center[0]
+    cdef double* output_ptr = &output[0, 0, 0]
+    cdef uniform.UniformGrid* ugrid_ptr = ugrid._this
+    with nogil:
+        evaluate.eval_spline_cube(spline_ptr, center_ptr, output_ptr, ugrid_ptr)
 
 def eval_spline_grid(CubicSpline spline not None,
                      np.ndarray[double, ndim=1] center not None,
@@ -512,8 +593,149 @@ def eval_spline_grid(CubicSpline spline not None,
     assert points.shape[1] == 3
     assert points.shape[0] == output.shape[0]
 
-    evaluate.eval_spline_grid(spline._this, &center[0], &output[0],
-                              &points[0, 0], cell._this, output.shape[0])
+    cdef long npoint = output.shape[0]
+    if npoint == 0:
+        return
+    cdef cubic_spline.CubicSpline* spline_ptr = spline._this
+    cdef double* center_ptr = &center[0]
+    cdef double* output_ptr = &output[0]
+    cdef double* points_ptr = &points[0, 0]
+    cdef horton.cell.Cell* cell_ptr = cell._this
+    with nogil:
+        evaluate.eval_spline_grid(spline_ptr, center_ptr, output_ptr,
+                                  points_ptr, cell_ptr, npoint)
+
+
+cdef cubic_spline.CubicSpline** _get_spline_pointers(splines):
+    cdef long nspline = len(splines)
+    cdef cubic_spline.CubicSpline** result = <cubic_spline.CubicSpline**>malloc(
+        max(nspline, 1)*sizeof(cubic_spline.CubicSpline*))
+    cdef CubicSpline spline
+    for i in xrange(nspline):
+        spline = splines[i]
+        result[i] = spline._this
+    return result
+
+
+def eval_spline_cube_multi(splines,
+                           np.ndarray[double, ndim=2] centers not None,
+                           np.ndarray[double, ndim=1] coeffs not None,
+                           np.ndarray[double, ndim=3] output not None,
+                           UniformGrid ugrid not None):
+    '''Evaluate a linear combination of spherically symmetric functions on a uniform grid
+
+       **Arguments:**
+
+       splines
+            A list of cubic splines, one for each term in the linear
+            combination.
+
+       centers
+            The centers of the spherically symmetric functions, an array with
+            shape (len(splines), 3).
+
+       coeffs
+            The coefficients of the terms in the linear combination.
+
+       output
+            The output array to which the result is added.
+
+       ugrid
+            An instance of UniformGrid that specifies the grid points.
+
+       This is equivalent to (but faster than) a loop over eval_spline_cube
+       calls, in which the outputs are scaled with the coefficients. See
+       eval_spline_cube for remarks on periodic boundary conditions.
+    '''
+    cdef long nspline = len(splines)
+    assert centers.flags['C_CONTIGUOUS']
+    assert centers.shape[0] == nspline
+    assert centers.shape[1] == 3
+    assert coeffs.flags['C_CONTIGUOUS']
+    assert coeffs.shape[0] == nspline
+    assert output.flags['C_CONTIGUOUS']
+    assert output.shape[0] == ugrid.shape[0]
+    assert output.shape[1] == ugrid.shape[1]
+    assert output.shape[2] == ugrid.shape[2]
+
+    if nspline == 0:
+        return
+    cdef cubic_spline.CubicSpline** spline_ptrs = _get_spline_pointers(splines)
+    cdef double* centers_ptr = &centers[0, 0]
+    cdef double* coeffs_ptr = &coeffs[0]
+    cdef double* output_ptr = &output[0, 0, 0]
+    cdef uniform.UniformGrid* ugrid_ptr = ugrid._this
+    try:
+        with nogil:
+            evaluate.eval_spline_cube_multi(spline_ptrs, centers_ptr, coeffs_ptr,
+                                            nspline, output_ptr, ugrid_ptr)
+    finally:
+        free(spline_ptrs)
+
+
+def eval_spline_grid_multi(splines,
+                           np.ndarray[double, ndim=2] centers not None,
+                           np.ndarray[double, ndim=1] coeffs not None,
+                           np.ndarray[double, ndim=1] output not None,
+                           np.ndarray[double, ndim=2] points not None,
+                           horton.cext.Cell cell not None):
+    '''Evaluate a linear combination of spherically symmetric functions on a general grid
+
+       **Arguments:**
+
+       splines
+            A list of cubic splines, one for each term in the linear
+            combination.
+
+       centers
+            The centers of the spherically symmetric functions, an array with
+            shape (len(splines), 3).
+
+       coeffs
+            The coefficients of the terms in the linear combination.
+
+       output
+            The output array to which the result is added.
+
+       points
+            An array with grid points, with shape (N, 3)
+
+       cell
+            A specification of the periodic boundary conditions.
+
+       This is equivalent to (but faster than) a loop over eval_spline_grid
+       calls, in which the outputs are scaled with the coefficients. All
+       terms are evaluated in one pass over the grid. The grid points are
+       sorted into small bins, such that each term only visits the bins
+       within its cutoff radius.
+    '''
+    cdef long nspline = len(splines)
+    assert centers.flags['C_CONTIGUOUS']
+    assert centers.shape[0] == nspline
+    assert centers.shape[1] == 3
+    assert coeffs.flags['C_CONTIGUOUS']
+    assert coeffs.shape[0] == nspline
+    assert output.flags['C_CONTIGUOUS']
+    assert points.flags['C_CONTIGUOUS']
+    assert points.shape[1] == 3
+    assert points.shape[0] == output.shape[0]
+
+    cdef long npoint = output.shape[0]
+    if npoint == 0 or nspline == 0:
+        return
+    cdef cubic_spline.CubicSpline** spline_ptrs = _get_spline_pointers(splines)
+    cdef double* centers_ptr = &centers[0, 0]
+    cdef double* coeffs_ptr = &coeffs[0]
+    cdef double* output_ptr = &output[0]
+    cdef double* points_ptr = &points[0, 0]
+    cdef horton.cell.Cell* cell_ptr = cell._this
+    try:
+        with nogil:
+            evaluate.eval_spline_grid_multi(spline_ptrs, centers_ptr, coeffs_ptr,
+                                            nspline, output_ptr, points_ptr,
+                                            cell_ptr, npoint)
+    finally:
+        free(spline_ptrs)
 
 
 #
@@ -1064,6 +1286,13 @@ cdef class UniformGrid(object):
 
         evaluate.eval_spline_cube(spline._this, &center[0], &output[0, 0, 0], self._this)
 
+    def eval_spline_multi(self, splines, centers, coeffs, output):
+        '''Add a linear combination of spherically symmetric functions to output
+
+           See eval_spline_cube_multi for the meaning of the arguments.
+        '''
+        eval_spline_cube_multi(splines, centers, coeffs, output, self)
+
     def integrate(self, *args):
         '''Integrate the product of all arguments
 
@@ -1570,8 +1799,12 @@ def dot_multi(*integranda, np.ndarray[long, ndim=1] segments=None):
     segments, nsegment = _parse_segments(segments, npoint)
     cdef np.ndarray[double, ndim=1] output = np.zeros(nsegment)
     cdef double** pointers = _parse_integranda(integranda)
+    cdef long nvector = len(integranda)
+    cdef long* segments_ptr = &segments[0]
+    cdef double* output_ptr = &output[0]
     try:
-        utils.dot_multi(npoint, len(integranda), pointers, &segments[0], &output[0])
+        with nogil:
+            utils.dot_multi(npoint, nvector, pointers, segments_ptr, output_ptr)
     finally:
         free(pointers)
     if nsegment == 1:
@@ -1633,8 +1866,13 @@ def dot_multi_moments_cube(integranda, UniformGrid ugrid not None,
     cdef long nmoment = _get_nmoment(lmax, mtype)
     cdef np.ndarray[double, ndim=1] output = np.zeros(nmoment)
     cdef double** pointers = _parse_integranda(integranda)
+    cdef long nvector = len(integranda)
+    cdef uniform.UniformGrid* ugrid_ptr = ugrid._this
+    cdef double* center_ptr = &center[0]
+    cdef double* output_ptr = &output[0]
     try:
-        utils.dot_multi_moments_cube(len(integranda), pointers, ugrid._this, &center[0], lmax, mtype, &output[0], nmoment)
+        with nogil:
+            utils.dot_multi_moments_cube(nvector, pointers, ugrid_ptr, center_ptr, lmax, mtype, output_ptr, nmoment)
     finally:
         free(pointers)
     return output
@@ -1684,10 +1922,15 @@ def dot_multi_moments(integranda,
     segments, nsegment = _parse_segments(segments, npoint)
     cdef np.ndarray[double, ndim=2] output = np.zeros((nsegment, nmoment))
     cdef double** pointers = _parse_integranda(integranda)
+    cdef long nvector = len(integranda)
+    cdef double* points_ptr = &points[0, 0]
+    cdef double* center_ptr = &center[0]
+    cdef long* segments_ptr = &segments[0]
+    cdef double* output_ptr = &output[0, 0]
     try:
-        utils.dot_multi_moments(npoint, len(integranda), pointers,
-            &points[0, 0], &center[0], lmax, mtype,
-            &segments[0], &output[0, 0], nmoment)
+        with nogil:
+            utils.dot_multi_moments(npoint, nvector, pointers, points_ptr,
+                center_ptr, lmax, mtype, segments_ptr, output_ptr, nmoment)
     finally:
         free(pointers)
     if nsegment == 1:
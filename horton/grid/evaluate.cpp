@@ -26,14 +26,102 @@
 
 #include <cmath>
 #include <stdexcept>
+#include <vector>
 #include "evaluate.h"
+#include "rtransform.h"
 
 
-void eval_spline_cube(CubicSpline* spline, double* center, double* output,
-                      UniformGrid* ugrid) {
+/*
+   SplineEvaluator class
+
+   Evaluates a cubic spline in one point at a time, without virtual function
+   calls for the common radial transformations. Points beyond the grid of the
+   spline are passed to the extrapolation object of the spline.
+*/
+
+enum {RTF_GENERIC, RTF_IDENTITY, RTF_LINEAR, RTF_EXP, RTF_SHIFTED_EXP, RTF_POWER};
+
+class SplineEvaluator {
+    private:
+        CubicSpline* spline;
+        RTransform* rtf;
+        int kind;
+        double rmin, rshift, alpha, power;
+        double first_x, last_x;
+        double* y;
+        double* dt;
+        int n;
+        bool tail;
+    public:
+        SplineEvaluator(CubicSpline* spline);
+
+        double get_rcut() const {return last_x;};
+        bool has_tail() const {return tail;};
+
+        inline double inv(double r) const {
+            switch (kind) {
+                case RTF_IDENTITY: return r;
+                case RTF_LINEAR: return (r-rmin)/alpha;
+                case RTF_EXP: return log(r/rmin)/alpha;
+                case RTF_SHIFTED_EXP: return log((r + rshift)/rmin)/alpha;
+                case RTF_POWER: return pow(r/rmin, 1.0/power)-1;
+                default: return rtf->inv(r);
+            }
+        }
+
+        inline double eval(double x) const {
+            if ((x < first_x) || (x > last_x)) {
+                double s;
+                spline->eval(&x, &s, 1);
+                return s;
+            }
+            double t = inv(x);
+            int j = (int)floor(t);
+            if (j > n - 2) j = n - 2;
+            if (j < 0) j = 0;
+            double u = t - j;
+            double z = y[j+1] - y[j];
+            return y[j] + u*(dt[j] + u*(3*z - 2*dt[j] - dt[j+1] + u*(-2*z + dt[j] + dt[j+1])));
+        }
+};
+
+
+SplineEvaluator::SplineEvaluator(CubicSpline* spline):
+    spline(spline), rtf(spline->get_rtransform()), kind(RTF_GENERIC), rmin(0.0),
+    rshift(0.0), alpha(1.0), power(1.0), first_x(spline->get_first_x()),
+    last_x(spline->get_last_x()), y(spline->y), dt(spline->dt), n(spline->n),
+    tail(spline->get_extrapolation()->has_tail())
+{
+    if (dynamic_cast<IdentityRTransform*>(rtf) != NULL) {
+        kind = RTF_IDENTITY;
+    } else if (LinearRTransform* lin = dynamic_cast<LinearRTransform*>(rtf)) {
+        kind = RTF_LINEAR;
+        rmin = lin->get_rmin();
+        alpha = lin->get_alpha();
+    } else if (ExpRTransform* etf = dynamic_cast<ExpRTransform*>(rtf)) {
+        kind = RTF_EXP;
+        rmin = etf->get_rmin();
+        alpha = etf->get_alpha();
+    } else if (ShiftedExpRTransform* sexp = dynamic_cast<ShiftedExpRTransform*>(rtf)) {
+        kind = RTF_SHIFTED_EXP;
+        // In this case, rmin is used to store r0.
+        rmin = sexp->get_r0();
+        rshift = sexp->get_rshift();
+        alpha = sexp->get_alpha();
+    } else if (PowerRTransform* pwr = dynamic_cast<PowerRTransform*>(rtf)) {
+        kind = RTF_POWER;
+        rmin = pwr->get_rmin();
+        power = pwr->get_power();
+    }
+}
+
+
+static void eval_spline_cube_low(const SplineEvaluator& se, double* center,
+                                 double coeff, double* output,
+                                 UniformGrid* ugrid) {
 
     // Find the ranges for the triple loop
-    double rcut = spline->get_last_x();
+    double rcut = se.get_rcut();
     long begin[3], end[3];
     ugrid->set_ranges_rcut(center, rcut, begin, end);
 
@@ -60,71 +148,278 @@ void eval_spline_cube(CubicSpline* spline, double* center, double* output,
             double d = ugrid->dist_grid_point(center, j);
 
             // Evaluate spline if needed
-            if ((d < rcut) || spline->get_extrapolation()->has_tail()) {
-                double s;
-                spline->eval(&d, &s, 1);
-                *(ugrid->get_pointer(output, jwrap)) += s;
+            if ((d < rcut) || se.has_tail()) {
+                *(ugrid->get_pointer(output, jwrap)) += coeff*se.eval(d);
             }
 
         }
     }
 }
 
+
+void eval_spline_cube(CubicSpline* spline, double* center, double* output,
+                      UniformGrid* ugrid) {
+    SplineEvaluator se(spline);
+    eval_spline_cube_low(se, center, 1.0, output, ugrid);
+}
+
+
+void eval_spline_cube_multi(CubicSpline** splines, double* centers,
+                            double* coeffs, long nspline, double* output,
+                            UniformGrid* ugrid) {
+    for (long ispline=0; ispline < nspline; ispline++) {
+        SplineEvaluator se(splines[ispline]);
+        eval_spline_cube_low(se, centers + 3*ispline, coeffs[ispline], output, ugrid);
+    }
+}
+
+
+static double eval_spline_point(const SplineEvaluator& se, double* center,
+                                double* point, Cell* cell) {
+    // Sum of the spline over all periodic images of the center within the
+    // cutoff of the spline (or over all images in the ranges in case of a
+    // tail).
+    double rcut = se.get_rcut();
+    double result = 0.0;
+
+    // Find the ranges for the triple loop
+    double delta[3];
+    delta[0] = point[0] - center[0];
+    delta[1] = point[1] - center[1];
+    delta[2] = point[2] - center[2];
+    long ranges_begin[3], ranges_end[3];
+    cell->set_ranges_rcut(delta, rcut, ranges_begin, ranges_end);
+
+    for (int i=cell->get_nvec(); i < 3; i++) {
+        ranges_begin[i] = 0;
+        ranges_end[i] = 1;
+    }
+
+    // Run the triple loop
+    for (long i0 = ranges_begin[0]; i0 < ranges_end[0]; i0++) {
+        for (long i1 = ranges_begin[1]; i1 < ranges_end[1]; i1++) {
+            for (long i2 = ranges_begin[2]; i2 < ranges_end[2]; i2++) {
+                // Compute the distance between the point and the image of the center
+                double frac[3], cart[3];
+                frac[0] = i0;
+                frac[1] = i1;
+                frac[2] = i2;
+                cell->to_cart(frac, cart);
+                double x = cart[0] + delta[0];
+                double y = cart[1] + delta[1];
+                double z = cart[2] + delta[2];
+                double d = sqrt(x*x+y*y+z*z);
+
+                // Evaluate spline if needed
+                if ((d < rcut) || se.has_tail()) {
+                    double s = se.eval(d);
+#ifdef DEBUG
+                    printf("i=[%li,%li,%li] d=%f s=%f ||", i0, i1, i2, d, s);
+#endif
+                    result += s;
+                }
+            }
+        }
+    }
+    return result;
+}
+
+
 void eval_spline_grid(CubicSpline* spline, double* center, double* output,
                       double* points, Cell* cell, long npoint) {
-    double rcut = spline->get_last_x();
+    SplineEvaluator se(spline);
 
-    while (npoint > 0) {
-        // Find the ranges for the triple loop
+    // All grid points are independent (parallel)
+    #pragma omp parallel for schedule(dynamic, 64)
+    for (long ipoint=0; ipoint < npoint; ipoint++) {
+        output[ipoint] += eval_spline_point(se, center, points + 3*ipoint, cell);
+    }
+
+#ifdef DEBUG
+    printf("\n");
+#endif
+
+}
+
+
+static double dist_sq_box(double* pos, double* box_lo, double* box_hi) {
+    // The square of the distance between a position and a rectangular box.
+    double result = 0.0;
+    for (int i=0; i < 3; i++) {
+        double d = 0.0;
+        if (pos[i] < box_lo[i]) {
+            d = box_lo[i] - pos[i];
+        } else if (pos[i] > box_hi[i]) {
+            d = pos[i] - box_hi[i];
+        }
+        result += d*d;
+    }
+    return result;
+}
+
+
+void eval_spline_grid_multi(CubicSpline** splines, double* centers,
+                            double* coeffs, long nspline, double* output,
+                            double* points, Cell* cell, long npoint) {
+    if ((npoint == 0) || (nspline == 0)) return;
+
+    std::vector<SplineEvaluator> evaluators;
+    evaluators.reserve(nspline);
+    for (long ispline=0; ispline < nspline; ispline++) {
+        evaluators.push_back(SplineEvaluator(splines[ispline]));
+    }
+
+    // 1) Sort the grid points in a list of rectangular bins, with on average
+    //    about 32 points per bin.
+    double lo[3], hi[3];
+    for (int i=0; i < 3; i++) {
+        lo[i] = points[i];
+        hi[i] = points[i];
+    }
+    for (long ipoint=1; ipoint < npoint; ipoint++) {
+        for (int i=0; i < 3; i++) {
+            double x = points[3*ipoint+i];
+            if (x < lo[i]) lo[i] = x;
+            if (x > hi[i]) hi[i] = x;
+        }
+    }
+    double volume = 1.0;
+    for (int i=0; i < 3; i++) {
+        volume *= fmax(hi[i] - lo[i], 1e-3);
+    }
+    double width = cbrt(volume*32.0/npoint);
+    long nbins[3];
+    double widths[3];
+    for (int i=0; i < 3; i++) {
+        nbins[i] = (long)((hi[i] - lo[i])/width);
+        if (nbins[i] < 1) nbins[i] = 1;
+        widths[i] = (hi[i] - lo[i])/nbins[i];
+    }
+    long nbin = nbins[0]*nbins[1]*nbins[2];
+
+    std::vector<long> point_bins(npoint);
+    std::vector<long> bin_begins(nbin+1, 0);
+    for (long ipoint=0; ipoint < npoint; ipoint++) {
+        long ibin = 0;
+        for (int i=0; i < 3; i++) {
+            long j = 0;
+            if (widths[i] > 0) j = (long)((points[3*ipoint+i] - lo[i])/widths[i]);
+            if (j >= nbins[i]) j = nbins[i] - 1;
+            ibin = ibin*nbins[i] + j;
+        }
+        point_bins[ipoint] = ibin;
+        bin_begins[ibin+1]++;
+    }
+    for (long ibin=0; ibin < nbin; ibin++) {
+        bin_begins[ibin+1] += bin_begins[ibin];
+    }
+    std::vector<long> order(npoint);
+    std::vector<long> fill(bin_begins.begin(), bin_begins.end()-1);
+    for (long ipoint=0; ipoint < npoint; ipoint++) {
+        order[fill[point_bins[ipoint]]++] = ipoint;
+    }
+
+    // 2) Collect the periodic images of the centers that are within the
+    //    cutoff of the bounding box of the grid. Splines with a tail are
+    //    treated separately.
+    double box_center[3], box_radius = 0.0;
+    for (int i=0; i < 3; i++) {
+        box_center[i] = 0.5*(lo[i] + hi[i]);
+        box_radius += 0.25*(hi[i] - lo[i])*(hi[i] - lo[i]);
+    }
+    box_radius = sqrt(box_radius);
+    std::vector<double> images;
+    std::vector<long> image_splines;
+    std::vector<long> tail_splines;
+    for (long ispline=0; ispline < nspline; ispline++) {
+        if (evaluators[ispline].has_tail()) {
+            tail_splines.push_back(ispline);
+            continue;
+        }
+        double rcut = evaluators[ispline].get_rcut();
+        double* center = centers + 3*ispline;
         double delta[3];
-        delta[0] = points[0] - center[0];
-        delta[1] = points[1] - center[1];
-        delta[2] = points[2] - center[2];
+        delta[0] = box_center[0] - center[0];
+        delta[1] = box_center[1] - center[1];
+        delta[2] = box_center[2] - center[2];
         long ranges_begin[3], ranges_end[3];
-        cell->set_ranges_rcut(delta, rcut, ranges_begin, ranges_end);
-
+        cell->set_ranges_rcut(delta, rcut + box_radius, ranges_begin, ranges_end);
         for (int i=cell->get_nvec(); i < 3; i++) {
             ranges_begin[i] = 0;
             ranges_end[i] = 1;
         }
-
-        // Run the triple loop
         for (long i0 = ranges_begin[0]; i0 < ranges_end[0]; i0++) {
             for (long i1 = ranges_begin[1]; i1 < ranges_end[1]; i1++) {
                 for (long i2 = ranges_begin[2]; i2 < ranges_end[2]; i2++) {
-                    // Compute the distance between the point and the image of the center
-                    double frac[3], cart[3];
+                    double frac[3], cart[3], image[3];
                     frac[0] = i0;
                     frac[1] = i1;
                     frac[2] = i2;
                     cell->to_cart(frac, cart);
-                    double x = cart[0] + delta[0];
-                    double y = cart[1] + delta[1];
-                    double z = cart[2] + delta[2];
-                    double d = sqrt(x*x+y*y+z*z);
-
-                    // Evaluate spline if needed
-                    if ((d < rcut) || spline->get_extrapolation()->has_tail()) {
-                        double s;
-                        spline->eval(&d, &s, 1);
-#ifdef DEBUG
-                        printf("i=[%li,%li,%li] d=%f s=%f ||", i0, i1, i2, d, s);
-#endif
-                        *output += s;
+                    image[0] = center[0] - cart[0];
+                    image[1] = center[1] - cart[1];
+                    image[2] = center[2] - cart[2];
+                    if (dist_sq_box(image, lo, hi) < rcut*rcut) {
+                        images.push_back(image[0]);
+                        images.push_back(image[1]);
+                        images.push_back(image[2]);
+                        image_splines.push_back(ispline);
                     }
-
                 }
             }
         }
-
-        // move on
-        points += 3;
-        output++;
-        npoint--;
     }
+    long nimage = image_splines.size();
+    long ntail = tail_splines.size();
 
-#ifdef DEBUG
-    printf("\n");
-#endif
+    // 3) Loop over all bins (parallel). Each bin is only updated by one
+    //    thread.
+    #pragma omp parallel for schedule(dynamic, 1)
+    for (long ibin=0; ibin < nbin; ibin++) {
+        long begin = bin_begins[ibin];
+        long end = bin_begins[ibin+1];
+        if (begin == end) continue;
 
+        // The bounding box of the points in this bin.
+        double bin_lo[3], bin_hi[3];
+        for (int i=0; i < 3; i++) {
+            bin_lo[i] = points[3*order[begin]+i];
+            bin_hi[i] = bin_lo[i];
+        }
+        for (long k=begin+1; k < end; k++) {
+            double* point = points + 3*order[k];
+            for (int i=0; i < 3; i++) {
+                if (point[i] < bin_lo[i]) bin_lo[i] = point[i];
+                if (point[i] > bin_hi[i]) bin_hi[i] = point[i];
+            }
+        }
+
+        for (long iimage=0; iimage < nimage; iimage++) {
+            const SplineEvaluator& se = evaluators[image_splines[iimage]];
+            double rcut = se.get_rcut();
+            double* image = &images[3*iimage];
+            if (dist_sq_box(image, bin_lo, bin_hi) >= rcut*rcut) continue;
+            double coeff = coeffs[image_splines[iimage]];
+            for (long k=begin; k < end; k++) {
+                long ipoint = order[k];
+                double* point = points + 3*ipoint;
+                double x = point[0] - image[0];
+                double y = point[1] - image[1];
+                double z = point[2] - image[2];
+                double d = sqrt(x*x+y*y+z*z);
+                if (d < rcut) {
+                    output[ipoint] += coeff*se.eval(d);
+                }
+            }
+        }
+
+        for (long itail=0; itail < ntail; itail++) {
+            long ispline = tail_splines[itail];
+            for (long k=begin; k < end; k++) {
+                long ipoint = order[k];
+                output[ipoint] += coeffs[ispline]*eval_spline_point(
+                    evaluators[ispline], centers + 3*ispline, points + 3*ipoint, cell);
+            }
+        }
+    }
 }
@@ -35,4 +35,12 @@ void eval_spline_cube(CubicSpline* spline, double* center, double* output,
 void eval_spline_grid(CubicSpline* spline, double* center, double* output,
                       double* points, Cell* cell, long npoint);
 
+void eval_spline_cube_multi(CubicSpline** splines, double* centers,
+                            double* coeffs, long nspline, double* output,
+                            UniformGrid* ugrid);
+
+void eval_spline_grid_multi(CubicSpline** splines, double* centers,
+                            double* coeffs, long nspline, double* output,
+                            double* points, Cell* cell, long npoint);
+
 #endif
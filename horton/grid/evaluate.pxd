@@ -26,8 +26,17 @@ cimport uniform
 
 cdef extern from "evaluate.h":
     void eval_spline_cube(cubic_spline.CubicSpline* spline, double* center,
-                          double* output, uniform.UniformGrid* ugrid)
+                          double* output, uniform.UniformGrid* ugrid) nogil
 
     void eval_spline_grid(cubic_spline.CubicSpline* spline, double* center,
                           double* output, double* points, cell.Cell* cell,
-                          long npoint)
+                          long npoint) nogil
+
+    void eval_spline_cube_multi(cubic_spline.CubicSpline** splines,
+                                double* centers, double* coeffs, long nspline,
+                                double* output, uniform.UniformGrid* ugrid) nogil
+
+    void eval_spline_grid_multi(cubic_spline.CubicSpline** splines,
+                                double* centers, double* coeffs, long nspline,
+                                double* output, double* points,
+                                cell.Cell* cell, long npoint) nogil
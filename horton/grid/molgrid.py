@@ -26,7 +26,7 @@ import numpy as np
 
 from horton.grid.base import IntGrid
 from horton.grid.atgrid import AtomicGrid, AtomicGridSpec
-from horton.grid.cext import becke_helper_atom
+from horton.grid.cext import becke_helper_atoms
 from horton.log import log, timer
 from horton.periodic import periodic
 from horton.system import System
@@ -42,7 +42,7 @@ class BeckeMolGrid(IntGrid):
     '''Molecular integration grid using Becke weights'''
 
     @timer.with_section('Becke-Lebedev')
-    def __init__(self, system, agspec='medium', k=3, random_rotate=True, mode='discard'):
+    def __init__(self, system, agspec='medium', k=3, random_rotate=True, mode='discard', epsilon=0):
         '''
            **Arguments:**
 
@@ -76,6 +76,14 @@ class BeckeMolGrid(IntGrid):
                 * ``'only'`` means that only the subgrids are constructed and
                   that the computation of the molecular integration weights
                   (based on the Becke partitioning) is skipped.
+
+           epsilon
+                When positive, only the atoms whose Becke cell function may
+                exceed epsilon in a grid point are taken into account for the
+                Becke weight in that point. These atoms are found with
+                neighbor lists, which makes the construction of the grid
+                linear scaling for large systems. The weights remain an exact
+                partition of unity. The default (zero) includes all atoms.
         '''
         if isinstance(system, System):
             self._centers = system.coordinates.copy()
@@ -99,6 +107,7 @@ class BeckeMolGrid(IntGrid):
         self._k = k
         self._random_rotate = random_rotate
         self._mode = mode
+        self._epsilon = epsilon
 
         # allocate memory for the grid
         size = sum(agspec.get_size(self.numbers[i], self.pseudo_numbers[i]) for i in xrange(natom))
@@ -114,8 +123,8 @@ class BeckeMolGrid(IntGrid):
         offset = 0
 
         if mode != 'only':
-            # More recent covalent radii are used than in the original work of Becke.
-            cov_radii = np.array([periodic[n].cov_radius for n in self.numbers])
+            # The atom to which each grid point belongs.
+            selects = np.zeros(size, int)
 
         # The actual work:
         if log.do_medium:
@@ -129,20 +138,28 @@ class BeckeMolGrid(IntGrid):
                 points[offset:offset+atsize])
             if mode != 'only':
                 weights[offset:offset+atsize] = atgrid.weights
-                becke_helper_atom(
-                    points[offset:offset+atsize], weights[offset:offset+atsize],
-                    cov_radii, self.centers, i, self._k)
+                selects[offset:offset+atsize] = i
             if mode != 'discard':
                 atgrids.append(atgrid)
             offset += atsize
             pb()
 
+        if mode != 'only':
+            # All Becke weights are computed in one (parallel) call.
+            self._compute_becke_weights(points, weights, selects)
+
         # finish
         IntGrid.__init__(self, points, weights, atgrids)
 
         # Some screen info
         self._log_init()
 
+    def _compute_becke_weights(self, points, weights, selects):
+        '''Multiply the weights with the Becke weights of the selected atoms'''
+        # More recent covalent radii are used than in the original work of Becke.
+        cov_radii = np.array([periodic[n].cov_radius for n in self.numbers])
+        becke_helper_atoms(points, weights, cov_radii, self.centers, selects, self._k, self._epsilon)
+
     def __del__(self):
         if log is not None and hasattr(self, 'weights'):
             log.mem.denounce(self.points.nbytes + self.weights.nbytes)
@@ -155,6 +172,7 @@ class BeckeMolGrid(IntGrid):
             grp['k'][()],
             grp['random_rotate'][()],
             grp.attrs['mode'],
+            grp['epsilon'][()] if 'epsilon' in grp else 0,
         )
 
     def to_hdf5(self, grp):
@@ -167,6 +185,7 @@ class BeckeMolGrid(IntGrid):
         grp['random_rotate'] = self._random_rotate
         grp['k'] = self._k
         grp.attrs['mode'] = self._mode
+        grp['epsilon'] = self._epsilon
 
     def _get_centers(self):
         '''The positions of the nuclei'''
@@ -210,12 +229,19 @@ class BeckeMolGrid(IntGrid):
 
     mode = property(_get_mode)
 
+    def _get_epsilon(self):
+        '''The threshold for the neighbor lists in the Becke weights'''
+        return self._epsilon
+
+    epsilon = property(_get_epsilon)
+
     def _log_init(self):
         if log.do_medium:
             log('Initialized: %s' % self)
             log.deflist([
                 ('Size', self.size),
                 ('Switching function', 'k=%i' % self._k),
+                ('Becke epsilon', '%.1e' % self._epsilon),
             ])
             log.blank()
         # Cite reference
@@ -235,16 +261,13 @@ class BeckeMolGrid(IntGrid):
         if (self.numbers != system.numbers).any() or (self.pseudo_numbers != system.pseudo_numbers).any():
             raise ValueError('The elements of the grid and the system do not match.')
         offset = 0
-        # More recent covalent radii are used than in the original work of Becke.
         self.centers[:] = system.coordinates
-        cov_radii = np.array([periodic[n].cov_radius for n in self.numbers])
+        selects = np.zeros(self.size, int)
         for i in xrange(system.natom):
             atgrid = self.subgrids[i]
             atsize = atgrid.size
             atgrid.update_center(self.centers[i])
             self.weights[offset:offset+atsize] = atgrid.weights
-            becke_helper_atom(
-                self.points[offset:offset+atsize],
-                self.weights[offset:offset+atsize],
-                cov_radii, self.centers, i, self._k)
+            selects[offset:offset+atsize] = i
             offset += atgrid.size
+        self._compute_becke_weights(self.points, self.weights, selects)
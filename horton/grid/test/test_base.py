@@ -321,3 +321,70 @@ def test_eval_spline_grid_add_random():
         g.eval_spline(cs, center2, output3, cell)
 
         assert abs(output1 + output2 - output3).max() < 1e-10
+
+
+def get_multi_splines():
+    # A few splines with different radial transformations and extrapolations
+    splines = [get_cosine_spline()]
+    for rtf in ExpRTransform(1e-3, 3.0, 80), PowerRTransform(1e-4, 3.0, 60), \
+               ShiftedExpRTransform(1e-3, 1e-2, 2.0, 70):
+        x = rtf.get_radii()
+        y = np.exp(-x)
+        d = -np.exp(-x)*rtf.get_deriv()
+        splines.append(CubicSpline(y, d, rtf, CuspExtrapolation()))
+    return splines
+
+
+def test_eval_spline_grid_multi_random():
+    splines = get_multi_splines()
+    nspline = len(splines)
+    for npoint in 10, 1000:
+        for i in xrange(10):
+            cell = get_random_cell(1.0, np.random.randint(4))
+            points = np.random.normal(-2, 3, (npoint,3))
+            g = IntGrid(points, np.random.normal(0, 1.0, npoint))
+            centers = np.random.uniform(-2, 2, (nspline, 3))
+            coeffs = np.random.normal(0, 1, nspline)
+
+            output1 = np.zeros(npoint)
+            for j in xrange(nspline):
+                tmp = np.zeros(npoint)
+                g.eval_spline(splines[j], centers[j], tmp, cell)
+                output1 += coeffs[j]*tmp
+
+            output2 = np.zeros(npoint)
+            g.eval_spline_multi(splines, centers, coeffs, output2, cell)
+            assert abs(output1 - output2).max() < 1e-10
+
+
+def test_eval_spline_grid_multi_tail():
+    # A spline with a tail is also evaluated beyond its last grid point.
+    rtf = ExpRTransform(1e-3, 2.0, 50)
+    x = rtf.get_radii()
+    spline = CubicSpline(1/x, -1/x**2*rtf.get_deriv(), rtf, PowerExtrapolation(-1))
+    splines = [spline, get_cosine_spline()]
+    for nvec in 0, 1:
+        cell = get_random_cell(5.0, nvec)
+        npoint = 100
+        points = np.random.normal(0, 4, (npoint,3))
+        g = IntGrid(points, np.random.normal(0, 1.0, npoint))
+        centers = np.random.uniform(-1, 1, (2, 3))
+        coeffs = np.array([0.5, 2.0])
+
+        output1 = np.zeros(npoint)
+        g.eval_spline(splines[0], centers[0], output1, cell)
+        output1 *= 0.5
+        tmp = np.zeros(npoint)
+        g.eval_spline(splines[1], centers[1], tmp, cell)
+        output1 += 2.0*tmp
+
+        output2 = np.zeros(npoint)
+        g.eval_spline_multi(splines, centers, coeffs, output2, cell)
+        assert abs(output1 - output2).max() < 1e-10
+
+
+def test_eval_spline_grid_multi_empty():
+    g = IntGrid(np.random.normal(0, 1, (10, 3)), np.ones(10))
+    output = np.zeros(10)
+    g.eval_spline_multi([], np.zeros((0, 3)), np.zeros(0), output)
+    assert (output == 0.0).all()
@@ -83,3 +83,65 @@ def test_becke_special_points():
     assert abs(weights[0]) < 1e-10
     assert abs(weights[1]) < 1e-10
     assert abs(weights[2] - 1.0) < 1e-10
+
+
+def test_becke_helper_atoms_exact():
+    npoint = 100
+    points = np.random.uniform(-5, 5, (npoint, 3))
+    radii = np.array([0.5, 0.8, 5.0])
+    centers = np.array([[1.2, 2.3, 0.1], [-0.4, 0.0, -2.2], [2.2, -1.5, 0.0]])
+    selects = np.random.randint(0, 3, npoint)
+    weights0 = np.random.uniform(0, 1, npoint)
+    weights1 = weights0.copy()
+    becke_helper_atoms(points, weights1, radii, centers, selects, 3)
+    for i in xrange(3):
+        mask = selects == i
+        tmp = weights0[mask]
+        becke_helper_atom(points[mask].copy(), tmp, radii, centers, i, 3)
+        weights0[mask] = tmp
+    assert abs(weights0 - weights1).max() < 1e-14
+
+
+def get_lattice_args(npoint):
+    # A small cubic lattice of atoms with random radii
+    g = np.arange(3)*2.5
+    centers = np.array([[x, y, z] for x in g for y in g for z in g])
+    centers += np.random.normal(0, 0.2, centers.shape)
+    radii = np.random.uniform(0.5, 1.5, len(centers))
+    selects = np.random.randint(0, len(centers), npoint)
+    points = centers[selects] + np.random.normal(0, 1.5, (npoint, 3))
+    return points, radii, centers, selects
+
+
+def test_becke_helper_atoms_epsilon():
+    npoint = 1000
+    points, radii, centers, selects = get_lattice_args(npoint)
+    weights0 = np.ones(npoint, float)
+    becke_helper_atoms(points, weights0, radii, centers, selects, 3)
+    for epsilon in 1e-6, 1e-10:
+        weights1 = np.ones(npoint, float)
+        becke_helper_atoms(points, weights1, radii, centers, selects, 3, epsilon)
+        assert abs(weights0 - weights1).max() < 100*epsilon
+
+
+def test_becke_helper_atoms_epsilon_sum_one():
+    npoint = 100
+    points, radii, centers, selects = get_lattice_args(npoint)
+    total = np.zeros(npoint, float)
+    for i in xrange(len(centers)):
+        weights = np.ones(npoint, float)
+        becke_helper_atoms(points, weights, radii, centers, np.zeros(npoint, int) + i, 3, 1e-6)
+        total += weights
+    assert abs(total - 1).max() < 1e-10
+
+
+def test_becke_helper_atoms_special_points():
+    radii = np.array([0.5, 0.8, 5.0])
+    centers = np.array([[1.2, 2.3, 0.1], [-0.4, 0.0, -2.2], [2.2, -1.5, 0.0]])
+    for epsilon in 0, 1e-8:
+        for i in xrange(3):
+            weights = np.ones(3, float)
+            becke_helper_atoms(centers, weights, radii, centers, np.array([i, i, i]), 3, epsilon)
+            expected = np.zeros(3, float)
+            expected[i] = 1
+            assert abs(weights - expected).max() < 1e-10
@@ -174,6 +174,22 @@ def test_family():
     assert grid.size == 1536+1612
 
 
+def test_integrate_hydrogen_trimer_1s_epsilon():
+    numbers = np.array([1, 1, 1], int)
+    coordinates = np.array([[0.0, 0.0, -0.5], [0.0, 0.0, 0.5], [0.0, 0.5, 0.0]], float)
+    sys = System(coordinates, numbers)
+    rtf = ExpRTransform(1e-3, 1e1, 100)
+    rgrid = RadialGrid(rtf)
+
+    mg0 = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False)
+    mg1 = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, epsilon=1e-8)
+    assert mg1.epsilon == 1e-8
+    assert (mg0.points == mg1.points).all()
+    assert abs(mg0.weights - mg1.weights).max() < 1e-6
+    fn = sum(np.exp(-2*np.sqrt(((center - mg1.points)**2).sum(axis=1)))/np.pi for center in coordinates)
+    assert abs(mg0.integrate(fn) - mg1.integrate(fn)) < 1e-6
+
+
 def test_update_centers():
     numbers = np.array([6, 8], int)
     coordinates = np.array([[0.0, 0.2, -0.5], [0.1, 0.0, 0.5]], float)
@@ -202,7 +218,7 @@ def test_molgrid_hdf5():
     sys = System(coordinates, numbers)
     rtf = ExpRTransform(1e-3, 1e1, 100)
     rgrid = RadialGrid(rtf)
-    mg1 = BeckeMolGrid(sys, (rgrid, 110), k=2, random_rotate=False, mode='keep')
+    mg1 = BeckeMolGrid(sys, (rgrid, 110), k=2, random_rotate=False, mode='keep', epsilon=1e-8)
 
     # run the routines that need testing
     with h5.File('horton.grid.test.test_molgrid.test_molgrid_hdf5', driver='core', backing_store=False) as f:
@@ -212,6 +228,7 @@ def test_molgrid_hdf5():
     assert (mg1.centers == mg2.centers).all()
     assert (mg1.numbers == mg2.numbers).all()
     assert (mg1.pseudo_numbers == mg2.pseudo_numbers).all()
+    assert mg2.epsilon == 1e-8
     assert sorted(mg2.agspec.members.keys()) == [6, 8]
     assert mg1.k == mg2.k
     assert mg1.random_rotate == mg2.random_rotate
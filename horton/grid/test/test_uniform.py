@@ -166,6 +166,28 @@ def test_uig_eval_spline_3d_random():
         assert abs(output1 - output2).max() < 1e-10
 
 
+def test_uig_eval_spline_multi():
+    cs1 = get_cosine_spline()
+    cs2 = get_exp_spline()
+    origin = np.random.uniform(-1, 1, 3)
+    grid_cell = get_random_cell(0.3, 3)
+    shape = np.random.randint(10, 20, 3)
+    pbc = np.array([1, 1, 0])
+    uig = UniformGrid(origin, grid_cell.rvecs, shape, pbc)
+
+    centers = np.random.uniform(-3, 3, (2, 3))
+    coeffs = np.array([0.5, -1.5])
+    output1 = np.zeros(uig.shape)
+    uig.eval_spline(cs1, centers[0], output1)
+    output1 *= coeffs[0]
+    tmp = np.zeros(uig.shape)
+    uig.eval_spline(cs2, centers[1], tmp)
+    output1 += coeffs[1]*tmp
+    output2 = np.zeros(uig.shape)
+    uig.eval_spline_multi([cs1, cs2], centers, coeffs, output2)
+    assert abs(output1 - output2).max() < 1e-10
+
+
 def test_uig_eval_spline_2d_random():
     cs = get_cosine_spline()
 
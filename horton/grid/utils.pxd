@@ -23,9 +23,9 @@ cimport uniform
 
 cdef extern from "utils.h":
     void dot_multi(long npoint, long nvector, double** data, long* segments,
-        double* output)
+        double* output) nogil
     void dot_multi_moments_cube(long nvector, double** data, uniform.UniformGrid* ugrid,
-        double* center, long lmax, long mtype, double* output, long nmoment) except +
+        double* center, long lmax, long mtype, double* output, long nmoment) nogil except +
     void dot_multi_moments(long npoint, long nvector, double** data, double* points,
         double* center, long lmax, long mtype, long* segments, double* output,
-        long nmoment) except +
+        long nmoment) nogil except +
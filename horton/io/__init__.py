@@ -33,6 +33,7 @@ from horton.io.cif import *
 from horton.io.cp2k import *
 from horton.io.common import *
 from horton.io.cube import *
+from horton.io.cubeh5 import *
 from horton.io.gaussian import *
 from horton.io.lockedh5 import *
 from horton.io.molden import *
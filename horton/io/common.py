@@ -25,7 +25,7 @@ import numpy as np
 from horton.gbasis.cext import gob_cart_normalization
 
 
-__all__ = ['renorm_helper', 'get_orca_signs']
+__all__ = ['renorm_helper', 'get_orca_signs', 'iter_text_block', 'read_text_block']
 
 
 def renorm_helper(con_coeff, alpha, shell_type, reverse=False):
@@ -87,3 +87,128 @@ def get_orca_signs(obasis):
     for shell_type in obasis.shell_types:
         signs.extend(sign_rules[shell_type])
     return np.array(signs, dtype=int)
+
+
+def _parse_text(text, dtype):
+    '''Convert all words in a string to a numpy array'''
+    if len(text) == 0 or text.isspace():
+        # np.fromstring returns [-1] for a string with only whitespace
+        return np.zeros(0, dtype)
+    return np.fromstring(text, dtype, sep=' ')
+
+
+def iter_text_block(f, size, dtype=float, regular=True, chunk_size=262144):
+    '''Iterate over chunks of numbers in a block of a text file.
+
+       **Arguments:**
+
+       f
+            A file object opened for reading, positioned at the beginning of
+            the block. Only ``readline`` and ``read`` are used, such that it
+            can be combined with other code that uses these methods.
+
+       size
+            The number of values in the block.
+
+       **Optional arguments:**
+
+       dtype
+            The data type of the values, float or int.
+
+       regular
+            When True, all lines of the block, except the last, contain the
+            same number of values as the first line. The file is then read
+            line by line and the file object is positioned right after the
+            block when the iterator is exhausted. When False, the block is
+            assumed to run until the end of the file and the number of values
+            per line may vary.
+
+       chunk_size
+            The (approximate) number of values that are parsed in one go.
+
+       Each chunk is converted with a single call to ``np.fromstring``, such
+       that no Python code is executed per value. An IOError is raised when
+       the block contains too few values or when some words can not be
+       interpreted.
+    '''
+    remaining = size
+    if regular:
+        line = f.readline()
+        nword = len(line.split())
+        if nword == 0:
+            raise IOError('Expecting a line with numbers, got: %s' % line[:-1])
+        chunk_nline = max(1, chunk_size/nword)
+        lines = [line]
+        while True:
+            values = _parse_text(''.join(lines), dtype)
+            expected = min(len(lines)*nword, remaining)
+            if len(values) != expected:
+                if len(lines[-1]) == 0:
+                    raise IOError('Unexpected end of file while reading a block of numbers.')
+                raise IOError('Could not interpret all words in a block of numbers.')
+            remaining -= expected
+            yield values
+            if remaining == 0:
+                break
+            nline = min((remaining - 1)/nword + 1, chunk_nline)
+            lines = [f.readline() for iline in xrange(nline)]
+    else:
+        # The last (possibly incomplete) word of each chunk is carried over to
+        # the next one.
+        carry = ''
+        while True:
+            text = f.read(16*chunk_size)
+            if len(text) == 0:
+                text = carry
+                carry = ''
+            else:
+                text = carry + text
+                pos = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'))
+                if pos == -1:
+                    carry = text
+                    continue
+                carry = text[pos:]
+                text = text[:pos]
+            values = _parse_text(text, dtype)
+            if len(values) > remaining:
+                raise IOError('Too many values in a block of numbers.')
+            if len(values) > 0:
+                remaining -= len(values)
+                yield values
+            if len(carry) == 0 and len(text) == 0:
+                break
+        # Words that can not be interpreted end the parsing of a chunk
+        # prematurely, which is detected here.
+        if remaining > 0:
+            raise IOError('Unexpected end of file or uninterpretable words in a block of numbers.')
+
+
+def read_text_block(f, out, regular=True, chunk_size=262144):
+    '''Read a block of numbers from a text file into an existing array.
+
+       **Arguments:**
+
+       f
+            A file object opened for reading, positioned at the beginning of
+            the block.
+
+       out
+            A C-contiguous output array, e.g. a numpy.memmap. It is filled in
+            C order and its size determines the number of values that are
+            read.
+
+       **Optional arguments:**
+
+       regular, chunk_size
+            See ``iter_text_block``.
+
+       **Returns:** the output array.
+    '''
+    if not out.flags.c_contiguous:
+        raise TypeError('The output array must be C-contiguous.')
+    flat = out.reshape(-1)
+    begin = 0
+    for values in iter_text_block(f, out.size, out.dtype, regular, chunk_size):
+        flat[begin:begin+len(values)] = values
+        begin += len(values)
+    return out
@@ -24,6 +24,7 @@
 import numpy as np
 from horton.cext import Cell
 from horton.grid.cext import UniformGrid
+from horton.io.common import read_text_block
 
 
 __all__ = ['load_cube', 'dump_cube']
@@ -77,25 +78,34 @@ def _read_cube_header(f):
     return coordinates, numbers, cell, ugrid, pseudo_numbers
 
 
-def _read_cube_data(f, ugrid):
-    data = np.zeros(tuple(ugrid.shape), float)
-    tmp = data.ravel()
-    counter = 0
-    while True:
-        line = f.readline()
-        if len(line) == 0:
-            break
-        words = line.split()
-        for word in words:
-            tmp[counter] = float(word)
-            counter += 1
-    return data
+def _read_cube_data(f, ugrid, cube_data=None):
+    if cube_data is None:
+        cube_data = np.zeros(tuple(ugrid.shape), float)
+    elif cube_data.shape != tuple(ugrid.shape):
+        raise TypeError('The shape of the cube_data array does not match the grid in the cube file.')
+    # Some programs start a new line for each row along the Z-axis, so the
+    # number of values per line is not fixed.
+    return read_text_block(f, cube_data, regular=False)
+
+
+def load_cube(filename, cube_data=None):
+    '''Load data from a cube file
+
+       **Arguments:**
+
+       filename
+            The name of the cube file.
 
+       **Optional arguments:**
 
-def load_cube(filename):
+       cube_data
+            A preallocated float array with the shape of the grid (e.g. a
+            numpy.memmap) in which the data from the cube file is stored. When
+            not given, a new array is allocated.
+    '''
     with open(filename) as f:
         coordinates, numbers, cell, ugrid, pseudo_numbers = _read_cube_header(f)
-        data = _read_cube_data(f, ugrid)
+        data = _read_cube_data(f, ugrid, cube_data)
         extra = {
             'cube_data': data,
         }
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Horton is a development platform for electronic structure methods.
+# Copyright (C) 2011-2013 Toon Verstraelen <Toon.Verstraelen@UGent.be>
+#
+# This file is part of Horton.
+#
+# Horton is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# Horton is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+'''Binary container for data on a uniform grid (``*.cube.h5``)
+
+   Large cube or CHGCAR files take a long time to parse. The same information
+   can be stored in an HDF5 file, with the grid data in a chunked and
+   optionally compressed dataset. Reading this file is limited by the disk
+   bandwidth. The grid data can be subsampled with a stride and a chop while
+   reading, but there is no support for reading arbitrary windows of the grid.
+'''
+
+
+import numpy as np
+from horton.cext import Cell
+from horton.grid.cext import UniformGrid
+from horton.io.lockedh5 import LockedH5File
+
+
+__all__ = ['load_cube_h5', 'dump_cube_h5']
+
+
+def load_cube_h5(filename, stride=1, chop=0):
+    '''Load a uniform grid, the geometry and the grid data from an HDF5 file
+
+       **Arguments:**
+
+       filename
+            The name of the ``*.cube.h5`` file.
+
+       **Optional arguments:**
+
+       stride
+            Only every stride-th grid point along each axis is read.
+
+       chop
+            The number of slices to chop off the end of the grid in each
+            direction before subsampling.
+
+       When stride or chop are given, the returned grid is reduced accordingly
+       and the grid data are subsampled while they are read from disk. These
+       are the only supported reductions: other subsets of the grid can only
+       be selected after loading.
+    '''
+    if chop < 0:
+        raise ValueError('Chop must be positive or zero.')
+    with LockedH5File(filename, 'r') as f:
+        ugrid = UniformGrid.from_hdf5(f['grid'], None)
+        end = ugrid.shape - chop
+        if (end % stride != 0).any():
+            raise ValueError('The stride is not commensurate with all three grid dimensions.')
+        if stride > 1 or chop > 0:
+            ugrid = UniformGrid(ugrid.origin, ugrid.grid_rvecs*stride, end/stride, ugrid.pbc)
+        cube_data = f['cube_data'][:end[0]:stride, :end[1]:stride, :end[2]:stride]
+        result = {
+            'coordinates': f['coordinates'][:],
+            'numbers': f['numbers'][:],
+            'pseudo_numbers': f['pseudo_numbers'][:],
+            'grid': ugrid,
+            'extra': {
+                'cube_data': cube_data,
+            },
+        }
+        if 'cell' in f:
+            result['cell'] = Cell.from_hdf5(f['cell'], None)
+    return result
+
+
+def dump_cube_h5(filename, system, compression=None, chunk_size=32):
+    '''Write the uniform grid, the geometry and the grid data to an HDF5 file
+
+       **Arguments:**
+
+       filename
+            The name of the ``*.cube.h5`` file.
+
+       system
+            A System instance with a UniformGrid and a cube_data array in the
+            extra dictionary.
+
+       **Optional arguments:**
+
+       compression
+            The compression filter for the grid data: None, 'gzip' or 'lzf'.
+
+       chunk_size
+            The (maximum) size of the chunks of the grid data along each axis.
+    '''
+    if system.grid is None or not isinstance(system.grid, UniformGrid):
+        raise ValueError('The system grid must be a UniformGrid instance.')
+    cube_data = system.extra.get('cube_data')
+    if cube_data is None:
+        raise ValueError('A cube data array must be defined in the system properties (cube_data).')
+    if compression not in [None, 'gzip', 'lzf']:
+        raise ValueError('Unsupported compression filter: %s' % compression)
+    with LockedH5File(filename, 'w') as f:
+        f['coordinates'] = system.coordinates
+        f['numbers'] = system.numbers
+        f['pseudo_numbers'] = system.pseudo_numbers
+        if system.cell is not None:
+            system.cell.to_hdf5(f.create_group('cell'))
+        system.grid.to_hdf5(f.create_group('grid'))
+        chunks = tuple(min(size, chunk_size) for size in cube_data.shape)
+        f.create_dataset('cube_data', data=cube_data, chunks=chunks,
+                         compression=compression,
+                         shuffle=(compression is not None))
@@ -23,6 +23,7 @@
 
 import numpy as np
 
+from horton.io.common import read_text_block
 from horton.meanfield.wfn import AufbauOccModel, RestrictedWFN, UnrestrictedWFN
 
 
@@ -204,20 +205,11 @@ class FCHKFile(object):
                     raise IOError("Unexpected line in formatted checkpoint file %s\n%s" % (filename, line[:-1]))
                 length = int(words[2])
                 value = np.zeros(length, datatype)
-                counter = 0
-                try:
-                    while counter < length:
-                        line = f.readline()
-                        if line == "":
-                            raise IOError("Unexpected end of formatted checkpoint file %s" % filename)
-                        for word in line.split():
-                            try:
-                                value[counter] = datatype(word)
-                            except (ValueError, OverflowError), e:
-                                raise IOError('Could not interpret word while reading %s: %s' % (word, filename))
-                            counter += 1
-                except ValueError:
-                    return True
+                if length > 0:
+                    try:
+                        read_text_block(f, value)
+                    except IOError, e:
+                        raise IOError('%s while reading field "%s" from %s' % (str(e)[:-1], label, filename))
             else:
                 raise IOError("Unexpected line in formatted checkpoint file %s\n%s" % (filename, line[:-1]))
 
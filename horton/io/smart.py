@@ -51,6 +51,9 @@ def load_system_args(filename, lf):
        cache argument always has to be a dictionary (and not yet a Cache
        instance). See System constructor for details.
     '''
+    if isinstance(filename, basestring) and filename.endswith('.cube.h5'):
+        from horton.io.cubeh5 import load_cube_h5
+        return load_cube_h5(filename)
     if isinstance(filename, h5.Group) or filename.endswith('.h5'):
         from horton.io.chk import load_checkpoint
         return load_checkpoint(filename, lf)
@@ -95,7 +98,10 @@ def load_system_args(filename, lf):
 
 
 def dump_system(filename, system):
-    if isinstance(filename, h5.Group) or filename.endswith('.h5'):
+    if isinstance(filename, basestring) and filename.endswith('.cube.h5'):
+        from horton.io.cubeh5 import dump_cube_h5
+        dump_cube_h5(filename, system)
+    elif isinstance(filename, h5.Group) or filename.endswith('.h5'):
         from horton.io.chk import dump_checkpoint
         dump_checkpoint(filename, system)
     elif filename.endswith('.xyz'):
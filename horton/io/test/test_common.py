@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Horton is a development platform for electronic structure methods.
+# Copyright (C) 2011-2013 Toon Verstraelen <Toon.Verstraelen@UGent.be>
+#
+# This file is part of Horton.
+#
+# Horton is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# Horton is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+#pylint: skip-file
+
+
+from cStringIO import StringIO
+
+import numpy as np
+from nose.tools import assert_raises
+
+from horton import *
+
+
+def get_text_block(data, nword, tail='tail\n'):
+    lines = []
+    for i in xrange(0, len(data), nword):
+        lines.append(' '.join('%.10e' % value for value in data[i:i+nword]))
+    return '\n'.join(lines) + '\n' + tail
+
+
+def test_read_text_block_regular():
+    data = np.random.normal(0, 1, 47)
+    for nword in 1, 5, 6:
+        for chunk_size in 1, 7, 1000:
+            f = StringIO(get_text_block(data, nword))
+            out = np.zeros((47,))
+            read_text_block(f, out, chunk_size=chunk_size)
+            assert abs(out - data).max() < 1e-8
+            # the file must be positioned right after the block.
+            assert f.readline() == 'tail\n'
+
+
+def test_read_text_block_irregular():
+    data = np.random.normal(0, 1, (4, 5))
+    # one line per row, with a line break within each row.
+    text = ''.join('%.10e %.10e %.10e\n%.10e %.10e\n' % tuple(row) for row in data)
+    for chunk_size in 1, 3, 1000:
+        f = StringIO(text)
+        out = np.zeros((4, 5))
+        read_text_block(f, out, regular=False, chunk_size=chunk_size)
+        assert abs(out - data).max() < 1e-8
+
+
+def test_read_text_block_int():
+    f = StringIO('1 2 3\n4 5\n')
+    out = np.zeros(5, int)
+    read_text_block(f, out)
+    assert (out == [1, 2, 3, 4, 5]).all()
+
+
+def test_read_text_block_errors():
+    data = np.random.normal(0, 1, 10)
+    # too short
+    with assert_raises(IOError):
+        read_text_block(StringIO(get_text_block(data, 3, '')), np.zeros(12))
+    with assert_raises(IOError):
+        read_text_block(StringIO(get_text_block(data, 3, '')), np.zeros(12), regular=False)
+    # too long
+    with assert_raises(IOError):
+        read_text_block(StringIO(get_text_block(data, 3, '')), np.zeros(8), regular=False)
+    # garbage
+    with assert_raises(IOError):
+        read_text_block(StringIO('1 2 3\n4 foo 6\n7 8\n'), np.zeros(8))
+    with assert_raises(IOError):
+        read_text_block(StringIO('1 2 3\n4 foo 6\n7 8\n'), np.zeros(8), regular=False)
+    with assert_raises(IOError):
+        read_text_block(StringIO('1 2 3\n4.5 5 6\n'), np.zeros(6, int))
+    # not contiguous
+    with assert_raises(TypeError):
+        read_text_block(StringIO('1 2 3\n'), np.zeros((3, 2))[:,0])
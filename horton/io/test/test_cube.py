@@ -23,6 +23,8 @@
 
 import numpy as np
 
+from nose.tools import assert_raises
+
 from horton import *
 from horton.test.common import tmpdir
 
@@ -72,3 +74,20 @@ def test_load_dump_load_aelta():
         assert (ugrid1.shape == ugrid2.shape).all()
         assert abs(sys1.extra['cube_data'] - sys2.extra['cube_data']).max() < 1e-4
         assert abs(sys1.pseudo_numbers - sys2.pseudo_numbers).max() < 1e-4
+
+
+def test_load_aelta_memmap():
+    fn_cube = context.get_fn('test/aelta.cube')
+    sys1 = System.from_file(fn_cube)
+    with tmpdir('horton.io.test.test_cube.test_load_aelta_memmap') as dn:
+        cube_data = np.memmap('%s/cube_data.bin' % dn, float, 'w+', shape=(12, 12, 12))
+        result = load_cube(fn_cube, cube_data)
+        assert result['extra']['cube_data'] is cube_data
+        assert abs(cube_data - sys1.extra['cube_data']).max() < 1e-15
+        del cube_data, result
+
+
+def test_load_aelta_wrong_shape():
+    fn_cube = context.get_fn('test/aelta.cube')
+    with assert_raises(TypeError):
+        load_cube(fn_cube, np.zeros((12, 12, 11)))
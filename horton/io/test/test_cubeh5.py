@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Horton is a development platform for electronic structure methods.
+# Copyright (C) 2011-2013 Toon Verstraelen <Toon.Verstraelen@UGent.be>
+#
+# This file is part of Horton.
+#
+# Horton is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# Horton is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+#pylint: skip-file
+
+
+import numpy as np
+from nose.tools import assert_raises
+
+from horton import *
+from horton.test.common import tmpdir
+
+
+def check_load_dump_aelta(compression):
+    sys1 = System.from_file(context.get_fn('test/aelta.cube'))
+    with tmpdir('horton.io.test.test_cubeh5.test_load_dump_aelta_%s' % compression) as dn:
+        fn_h5 = '%s/aelta.cube.h5' % dn
+        dump_cube_h5(fn_h5, sys1, compression)
+        sys2 = System.from_file(fn_h5)
+    assert sys2.chk is None
+    assert (sys1.numbers == sys2.numbers).all()
+    assert (sys1.coordinates == sys2.coordinates).all()
+    assert (sys1.pseudo_numbers == sys2.pseudo_numbers).all()
+    assert (sys1.cell.rvecs == sys2.cell.rvecs).all()
+    assert (sys1.grid.origin == sys2.grid.origin).all()
+    assert (sys1.grid.grid_rvecs == sys2.grid.grid_rvecs).all()
+    assert (sys1.grid.shape == sys2.grid.shape).all()
+    assert (sys1.grid.pbc == sys2.grid.pbc).all()
+    assert (sys1.extra['cube_data'] == sys2.extra['cube_data']).all()
+
+
+def test_load_dump_aelta():
+    check_load_dump_aelta(None)
+
+
+def test_load_dump_aelta_gzip():
+    check_load_dump_aelta('gzip')
+
+
+def test_load_dump_aelta_lzf():
+    check_load_dump_aelta('lzf')
+
+
+def test_load_aelta_stride_chop():
+    from horton.scripts.common import reduce_data
+    sys1 = System.from_file(context.get_fn('test/aelta.cube'))
+    with tmpdir('horton.io.test.test_cubeh5.test_load_aelta_stride_chop') as dn:
+        fn_h5 = '%s/aelta.cube.h5' % dn
+        sys1.to_file(fn_h5)
+        for stride, chop in (2, 0), (3, 0), (5, 2), (1, 1):
+            data1, ugrid1 = reduce_data(sys1.extra['cube_data'], sys1.grid, stride, chop)
+            result = load_cube_h5(fn_h5, stride, chop)
+            ugrid2 = result['grid']
+            assert (result['extra']['cube_data'] == data1).all()
+            assert (ugrid1.shape == ugrid2.shape).all()
+            assert abs(ugrid1.grid_rvecs - ugrid2.grid_rvecs).max() < 1e-10
+            assert (ugrid1.origin == ugrid2.origin).all()
+            assert (result['cell'].rvecs == sys1.cell.rvecs).all()
+        with assert_raises(ValueError):
+            load_cube_h5(fn_h5, 5, 0)
+        with assert_raises(ValueError):
+            load_cube_h5(fn_h5, 1, -1)
+
+
+def test_dump_errors():
+    sys = System.from_file(context.get_fn('test/aelta.cube'))
+    with tmpdir('horton.io.test.test_cubeh5.test_dump_errors') as dn:
+        fn_h5 = '%s/aelta.cube.h5' % dn
+        with assert_raises(ValueError):
+            dump_cube_h5(fn_h5, sys, 'foo')
+        del sys.extra['cube_data']
+        with assert_raises(ValueError):
+            dump_cube_h5(fn_h5, sys)
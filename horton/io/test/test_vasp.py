@@ -23,24 +23,13 @@
 
 import numpy as np
 
+from nose.tools import assert_raises
+
 from horton import *
 from horton.test.common import get_random_cell, tmpdir
 
 
 
-def test_unravel_counter():
-    from horton.io.vasp import unravel_counter
-    assert unravel_counter(0, [3, 3, 3]) == [0, 0, 0]
-    assert unravel_counter(0, [2, 4, 3]) == [0, 0, 0]
-    assert unravel_counter(1, [2, 4, 3]) == [1, 0, 0]
-    assert unravel_counter(2, [2, 4, 3]) == [0, 1, 0]
-    assert unravel_counter(3, [2, 4, 3]) == [1, 1, 0]
-    assert unravel_counter(8, [2, 4, 3]) == [0, 0, 1]
-    assert unravel_counter(9, [2, 4, 3]) == [1, 0, 1]
-    assert unravel_counter(11, [2, 4, 3]) == [1, 1, 1]
-    assert unravel_counter(24, [2, 4, 3]) == [0, 0, 0]
-
-
 def test_load_chgcar_oxygen():
     fn = context.get_fn('test/CHGCAR.oxygen')
     sys = System.from_file(fn)
@@ -111,3 +100,30 @@ def test_load_dump_consistency():
     assert abs(sys0.coordinates[0] - sys1.coordinates[1]).max() < 1e-10
     assert abs(sys0.coordinates[2] - sys1.coordinates[2]).max() < 1e-10
     assert abs(sys0.cell.rvecs - sys1.cell.rvecs).max() < 1e-10
+
+
+def test_load_chgcar_transpose_memmap():
+    # Write a small CHGCAR file with a non-cubic grid and compare with the
+    # reference ordering of the values.
+    shape = np.array([3, 4, 5])
+    data = np.random.uniform(0, 1, shape.prod())
+    with tmpdir('horton.io.test.test_vasp.test_load_chgcar_transpose_memmap') as dn:
+        fn = '%s/CHGCAR' % dn
+        with open(fn, 'w') as f:
+            with open(context.get_fn('test/CHGCAR.oxygen')) as fref:
+                for i in xrange(10):
+                    f.write(fref.readline())
+            print >> f, '%5i %5i %5i' % tuple(shape)
+            for i in xrange(0, len(data), 5):
+                print >> f, ' '.join('%18.11E' % value for value in data[i:i+5])
+            print >> f, 'augmentation occupancies   1  1'
+        cube_data = np.memmap('%s/cube_data.bin' % dn, float, 'w+', shape=tuple(shape))
+        result = load_chgcar(fn, cube_data)
+        assert result['extra']['cube_data'] is cube_data
+        volume = result['cell'].volume
+        # The first index runs fastest in the file.
+        expected = data.reshape(shape[::-1]).T/volume
+        assert abs(cube_data - expected).max() < 1e-10
+        with assert_raises(TypeError):
+            load_chgcar(fn, np.zeros((5, 4, 3)))
+        del cube_data, result
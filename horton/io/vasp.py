@@ -26,19 +26,12 @@ from horton.units import angstrom, electronvolt
 from horton.periodic import periodic
 from horton.cext import Cell
 from horton.grid.cext import UniformGrid
+from horton.io.common import iter_text_block
 
 
 __all__ = ['load_chgcar', 'load_locpot', 'load_poscar', 'dump_poscar']
 
 
-def unravel_counter(counter, shape):
-    result = []
-    for i in xrange(0, len(shape)):
-        result.append(counter % shape[i])
-        counter /= shape[i]
-    return result
-
-
 def _load_vasp_header(f, nskip):
     '''Load the cell and atoms from a VASP file
 
@@ -51,20 +44,20 @@ def _load_vasp_header(f, nskip):
             The number of lines to skip after the line with elements
     '''
     # skip first two lines
-    f.next()
-    f.next()
+    f.readline()
+    f.readline()
 
     # read cell parameters in angstrom. each row is one cell vector
     rvecs = []
     for i in xrange(3):
-        rvecs.append([float(w) for w in f.next().split()])
+        rvecs.append([float(w) for w in f.readline().split()])
     rvecs = np.array(rvecs)*angstrom
 
     # Convert to cell object
     cell = Cell(rvecs)
 
-    vasp_numbers = [periodic[w].number for w in f.next().split()]
-    vasp_counts = [int(w) for w in f.next().split()]
+    vasp_numbers = [periodic[w].number for w in f.readline().split()]
+    vasp_counts = [int(w) for w in f.readline().split()]
     numbers = []
     for n, c in zip(vasp_numbers, vasp_counts):
         numbers.extend([n]*c)
@@ -72,12 +65,13 @@ def _load_vasp_header(f, nskip):
 
     # skip some lines
     for i in xrange(nskip):
-        f.next()
-    assert f.next().startswith('Direct')
+        f.readline()
+    assert f.readline().startswith('Direct')
 
     # read the fractional coordinates and convert to Cartesian
     coordinates = []
-    for line in f:
+    while True:
+        line = f.readline()
         if len(line.strip()) == 0:
             break
         coordinates.append([float(w) for w in line.split()[:3]])
@@ -86,28 +80,53 @@ def _load_vasp_header(f, nskip):
     return cell, numbers, coordinates
 
 
-def load_vasp_grid(filename):
-    '''Load a grid data file from VASP 5'''
+def load_vasp_grid(filename, cube_data=None):
+    '''Load a grid data file from VASP 5
+
+       **Arguments:**
+
+       filename
+            The name of the VASP file.
+
+       **Optional arguments:**
+
+       cube_data
+            A preallocated float array with the shape of the grid (e.g. a
+            numpy.memmap) in which the data is stored. When not given, a new
+            array is allocated.
+    '''
     with open(filename) as f:
         # Load header
         cell, numbers, coordinates = _load_vasp_header(f, 0)
 
         # read the shape of the data
-        shape = np.array([int(w) for w in f.next().split()])
+        shape = np.array([int(w) for w in f.readline().split()])
 
         # read data
-        cube_data = np.zeros(shape, float)
-        counter = 0
-        for line in f:
-            if counter >= cube_data.size:
-                break
-            for w in line.split():
-                i0, i1, i2 = unravel_counter(counter, shape)
-                # Fill in the data with transposed indexes. In horton, X is
-                # the slowest index while Z is the fastest.
-                cube_data[i0, i1, i2] = float(w)
-                counter += 1
-        assert counter == cube_data.size
+        if cube_data is None:
+            cube_data = np.zeros(shape, float)
+        elif cube_data.shape != tuple(shape):
+            raise TypeError('The shape of the cube_data array does not match the grid in the VASP file.')
+        # In the file, X is the fastest index while Z is the slowest. In
+        # horton, it is the other way around. The data are transposed one
+        # plane of constant Z at a time, such that the memory overhead remains
+        # small, even when cube_data is a memory-mapped array.
+        cube_data_t = cube_data.transpose(2, 1, 0)
+        plane = np.zeros((shape[1], shape[0]), float)
+        plane_flat = plane.ravel()
+        iplane = 0
+        pos = 0
+        for values in iter_text_block(f, cube_data.size):
+            begin = 0
+            while begin < len(values):
+                end = min(len(values), begin + plane.size - pos)
+                plane_flat[pos:pos+end-begin] = values[begin:end]
+                pos += end - begin
+                begin = end
+                if pos == plane.size:
+                    cube_data_t[iplane] = plane
+                    iplane += 1
+                    pos = 0
 
     return {
         'coordinates': coordinates,
@@ -120,17 +139,23 @@ def load_vasp_grid(filename):
     }
 
 
-def load_chgcar(filename):
-    '''Reads a vasp 5 chgcar file.'''
-    result = load_vasp_grid(filename)
+def load_chgcar(filename, cube_data=None):
+    '''Reads a vasp 5 chgcar file.
+
+       See ``load_vasp_grid`` for the arguments.
+    '''
+    result = load_vasp_grid(filename, cube_data)
     # renormalize electron density
     result['extra']['cube_data'] /= result['cell'].volume
     return result
 
 
-def load_locpot(filename):
-    '''Reads a vasp 5 locpot file.'''
-    result = load_vasp_grid(filename)
+def load_locpot(filename, cube_data=None):
+    '''Reads a vasp 5 locpot file.
+
+       See ``load_vasp_grid`` for the arguments.
+    '''
+    result = load_vasp_grid(filename, cube_data)
     # convert locpot to atomic units
     result['extra']['cube_data'] *= electronvolt
     return result
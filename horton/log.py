@@ -463,7 +463,7 @@ class MemoryLogger(object):
             self.log('Allocated:    %.1f MB. Current: %.1f MB. RSS: %.1f MB' %(
                 amount/unit, self._big/unit, self.get_rss()/unit
             ))
-            self._big += amount
+        self._big += amount
         if self.log.do_debug:
             traceback.print_stack()
             self.log.blank()
@@ -474,11 +474,15 @@ class MemoryLogger(object):
             self.log('Deallocated:  %.1f MB. Current: %.1f MB. RSS: %.1f MB' %(
                 amount/unit, self._big/unit, self.get_rss()/unit
             ))
-            self._big -= amount
+        self._big -= amount
         if self.log.do_debug:
             traceback.print_stack()
             self.log.blank()
 
+    def get_current(self):
+        '''The amount of memory (in bytes) that is currently announced'''
+        return self._big
+
     def get_rss(self):
         return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*resource.getpagesize()
 
@@ -58,6 +58,7 @@ from horton.log import log
 __all__ = [
     'LinalgFactory', 'LinalgObject', 'Expansion', 'OneBody',
     'DenseLinalgFactory', 'DenseExpansion', 'DenseOneBody', 'DenseTwoBody',
+    'SparseLinalgFactory', 'SparseTwoBody',
 ]
 
 
@@ -719,3 +720,310 @@ class DenseTwoBody(LinalgObject):
         self._array *= signs.reshape(-1,1)
         self._array *= signs.reshape(-1,-1,1)
         self._array *= signs.reshape(-1,-1,-1,1)
+
+
+class SparseLinalgFactory(DenseLinalgFactory):
+    """Dense one-body operators combined with sparse two-body operators.
+
+       The two-body operators only store the symmetry-unique elements that are
+       not negligible. See SparseTwoBody for more details.
+    """
+    def __init__(self, default_nbasis=None, threshold=1e-12):
+        '''
+           **Optional arguments:**
+
+           default_nbasis
+                The default basis size when constructing new
+                operators/expansions.
+
+           threshold
+                Two-body matrix elements below this threshold are neglected.
+        '''
+        DenseLinalgFactory.__init__(self, default_nbasis)
+        self._threshold = threshold
+
+    def _get_threshold(self):
+        '''The threshold for negligible two-body matrix elements'''
+        return self._threshold
+
+    threshold = property(_get_threshold)
+
+    def create_two_body(self, nbasis=None):
+        nbasis = nbasis or self._default_nbasis
+        return SparseTwoBody(nbasis, self._threshold)
+
+    def _check_two_body_init_args(self, two_body, nbasis=None):
+        nbasis = nbasis or self._default_nbasis
+        two_body.__check_init_args__(nbasis, self._threshold)
+
+    create_two_body.__check_init_args__ = _check_two_body_init_args
+
+    def get_memory_two_body(self, nbasis=None):
+        # Upper bound, i.e. without neglecting any elements.
+        npair = (nbasis*(nbasis+1))/2
+        nunique = (npair*(npair+1))/2
+        return nunique*(8 + 4*np.dtype(SparseTwoBody.get_index_dtype(nbasis)).itemsize)
+
+
+class SparseTwoBody(LinalgObject):
+    """Sparse symmetric four-dimensional matrix.
+
+       Only the symmetry-unique elements whose absolute value is not below a
+       threshold are stored, in a packed layout. Internally, the chemists'
+       notation is used: a row (i, j, k, l) of the indexes array refers to
+       the element (ij|kl) = <ik|jl>, with i >= j, k >= l and (i, j) >= (k, l).
+       (Pairs are compared through the index i*(i+1)/2+j.) The methods of this
+       class use the physicists' notation, just like DenseTwoBody.
+    """
+    # The number of matrix elements processed at once in the apply methods.
+    # This limits the size of temporary arrays.
+    chunk_size = 2**20
+
+    def __init__(self, nbasis, threshold=1e-12):
+        """
+           **Arguments:**
+
+           nbasis
+                The number of basis functions.
+
+           **Optional arguments:**
+
+           threshold
+                Matrix elements whose absolute value is below this threshold
+                are not stored.
+        """
+        self._nbasis = nbasis
+        self._threshold = threshold
+        self._indexes = np.zeros((0, 4), self.get_index_dtype(nbasis))
+        self._values = np.zeros(0, float)
+        # Elements added with set_element, which are only merged into the
+        # packed arrays when needed.
+        self._pending = {}
+
+    def __del__(self):
+        if log is not None:
+            log.mem.denounce(self._indexes.nbytes + self._values.nbytes)
+
+    def __check_init_args__(self, nbasis, threshold=1e-12):
+        assert nbasis == self.nbasis
+        assert threshold == self.threshold
+
+    @staticmethod
+    def get_index_dtype(nbasis):
+        '''The smallest unsigned integer type that can hold the indexes'''
+        if nbasis <= 2**16:
+            return np.uint16
+        else:
+            return np.uint32
+
+    @classmethod
+    def from_hdf5(cls, grp, lf):
+        result = cls(grp.attrs['nbasis'], grp.attrs['threshold'])
+        result._set_packed(grp['indexes'][:], grp['values'][:])
+        return result
+
+    def to_hdf5(self, grp):
+        self._flush()
+        grp.attrs['class'] = self.__class__.__name__
+        grp.attrs['nbasis'] = self._nbasis
+        grp.attrs['threshold'] = self._threshold
+        grp['indexes'] = self._indexes
+        grp['values'] = self._values
+
+    def _get_nbasis(self):
+        '''The number of basis functions'''
+        return self._nbasis
+
+    nbasis = property(_get_nbasis)
+
+    def _get_threshold(self):
+        '''Matrix elements below this threshold are not stored'''
+        return self._threshold
+
+    threshold = property(_get_threshold)
+
+    def _get_size(self):
+        '''The number of stored matrix elements'''
+        self._flush()
+        return len(self._values)
+
+    size = property(_get_size)
+
+    def _set_packed(self, indexes, values, canonical=False):
+        '''Replace all matrix elements.
+
+           **Arguments:**
+
+           indexes
+                An integer array with shape (n, 4) with indexes of the elements
+                in chemists' notation. They need not to be canonical.
+
+           values
+                The corresponding values, shape (n,).
+
+           **Optional arguments:**
+
+           canonical
+                When True, the indexes are already canonical, have the dtype
+                of ``get_index_dtype`` and all values are above the threshold.
+                The arrays are then stored without making copies.
+
+           Duplicate elements are not allowed. Elements below the threshold
+           are discarded.
+        '''
+        log.mem.denounce(self._indexes.nbytes + self._values.nbytes)
+        if canonical:
+            assert indexes.dtype == self.get_index_dtype(self._nbasis)
+            assert values.dtype == float
+            assert indexes.shape == (len(values), 4)
+            self._indexes = indexes
+            self._values = values
+        else:
+            mask = abs(values) >= self._threshold
+            indexes = self._canonicalize(np.asarray(indexes)[mask])
+            self._indexes = indexes.astype(self.get_index_dtype(self._nbasis))
+            self._values = np.array(values[mask], float)
+        log.mem.announce(self._indexes.nbytes + self._values.nbytes)
+        self._pending = {}
+
+    @staticmethod
+    def _canonicalize(indexes):
+        '''Return the canonical form of a set of indexes in chemists' notation'''
+        indexes = indexes.astype(int)
+        i = np.maximum(indexes[:,0], indexes[:,1])
+        j = np.minimum(indexes[:,0], indexes[:,1])
+        k = np.maximum(indexes[:,2], indexes[:,3])
+        l = np.minimum(indexes[:,2], indexes[:,3])
+        swap = (i*(i+1))/2 + j < (k*(k+1))/2 + l
+        result = np.array([i, j, k, l]).T
+        result[swap] = result[swap][:,[2, 3, 0, 1]]
+        return result
+
+    def _flush(self):
+        '''Merge the elements from set_element into the packed arrays'''
+        if len(self._pending) == 0:
+            return
+        keys = self._pending.keys()
+        new_indexes = np.array(keys, int).reshape(-1, 4)
+        new_values = np.array([self._pending[key] for key in keys])
+        # Drop the old copies of elements that are overwritten
+        old_indexes = self._indexes.astype(int)
+        old_keys = self._get_keys(old_indexes)
+        keep = ~np.in1d(old_keys, self._get_keys(new_indexes))
+        self._set_packed(
+            np.concatenate([old_indexes[keep], new_indexes]),
+            np.concatenate([self._values[keep], new_values]),
+        )
+
+    def _get_keys(self, indexes):
+        '''Convert canonical indexes into unique integer keys'''
+        n = self._nbasis
+        return ((indexes[:,0]*n + indexes[:,1])*n + indexes[:,2])*n + indexes[:,3]
+
+    def set_element(self, i, j, k, l, value):
+        key = tuple(self._canonicalize(np.array([[i, k, j, l]]))[0])
+        self._pending[key] = value
+
+    def get_element(self, i, j, k, l):
+        key = tuple(self._canonicalize(np.array([[i, k, j, l]]))[0])
+        if key in self._pending:
+            return self._pending[key]
+        mask = (self._indexes == key).all(axis=1)
+        if mask.any():
+            return self._values[mask][0]
+        return 0.0
+
+    def check_symmetry(self):
+        """Check that the indexes of the stored elements are canonical."""
+        self._flush()
+        indexes = self._indexes.astype(int)
+        assert (self._canonicalize(indexes) == indexes).all()
+        assert len(np.unique(self._get_keys(indexes))) == len(indexes)
+
+    def _iter_chunks(self):
+        '''Iterate over chunks of stored elements with their degeneracy factors
+
+           **Yields:** i, j, k, l, values. The values are multiplied by
+           one half for each of the conditions i==j, k==l and (i,j)==(k,l).
+        '''
+        self._flush()
+        for begin in xrange(0, len(self._values), self.chunk_size):
+            end = begin + self.chunk_size
+            i, j, k, l = self._indexes[begin:end].astype(int).T
+            values = self._values[begin:end].copy()
+            values[i == j] *= 0.5
+            values[k == l] *= 0.5
+            values[(i == k) & (j == l)] *= 0.5
+            yield i, j, k, l, values
+
+    def apply_direct(self, dm, output):
+        """Compute the direct dot product with a density matrix."""
+        if not isinstance(dm, DenseOneBody):
+            raise TypeError('The dm argument must be a DenseOneBody class')
+        if not isinstance(output, DenseOneBody):
+            raise TypeError('The output argument must be a DenseOneBody class')
+        n = self._nbasis
+        dmar = dm._array
+        tmp = np.zeros(n*n, float)
+        for i, j, k, l, values in self._iter_chunks():
+            tmp += np.bincount(i*n + j, values*(dmar[k,l] + dmar[l,k]), n*n)
+            tmp += np.bincount(k*n + l, values*(dmar[i,j] + dmar[j,i]), n*n)
+        tmp = tmp.reshape(n, n)
+        output._array[:] = tmp + tmp.T
+
+    def apply_exchange(self, dm, output):
+        """Compute the exchange dot product with a density matrix."""
+        if not isinstance(dm, DenseOneBody):
+            raise TypeError('The dm argument must be a DenseOneBody class')
+        if not isinstance(output, DenseOneBody):
+            raise TypeError('The output argument must be a DenseOneBody class')
+        n = self._nbasis
+        dmar = dm._array
+        tmp = np.zeros(n*n, float)
+        for i, j, k, l, values in self._iter_chunks():
+            tmp += np.bincount(i*n + k, values*dmar[j,l], n*n)
+            tmp += np.bincount(j*n + k, values*dmar[i,l], n*n)
+            tmp += np.bincount(i*n + l, values*dmar[j,k], n*n)
+            tmp += np.bincount(j*n + l, values*dmar[i,k], n*n)
+        tmp = tmp.reshape(n, n)
+        output._array[:] = tmp + tmp.T
+
+    def assign(self, other):
+        '''Assign the (non-negligible) elements of another two-body operator.
+
+           **Arguments:**
+
+           other
+                A DenseTwoBody or SparseTwoBody instance.
+        '''
+        if isinstance(other, SparseTwoBody):
+            other._flush()
+            self._set_packed(other._indexes, other._values)
+        elif isinstance(other, DenseTwoBody):
+            n = self._nbasis
+            # All canonical indexes in chemists' notation
+            i, j = np.tril_indices(n)
+            npair = len(i)
+            p, q = np.tril_indices(npair)
+            indexes = np.array([i[p], j[p], i[q], j[q]]).T
+            values = other._array[indexes[:,0], indexes[:,2], indexes[:,1], indexes[:,3]]
+            self._set_packed(indexes, values)
+        else:
+            raise TypeError('The other object must be a DenseTwoBody or SparseTwoBody instance.')
+
+    def clear(self):
+        self._set_packed(np.zeros((0, 4), int), np.zeros(0, float))
+
+    def apply_basis_permutation(self, permutation):
+        '''Reorder the coefficients for a given permutation of basis functions.
+        '''
+        self._flush()
+        # The new index of basis function permutation[i] is i.
+        inverse = np.zeros(self._nbasis, int)
+        inverse[permutation] = np.arange(self._nbasis)
+        self._set_packed(inverse[self._indexes.astype(int)], self._values)
+
+    def apply_basis_signs(self, signs):
+        '''Correct for different sign conventions of the basis functions.'''
+        self._flush()
+        self._values *= signs[self._indexes.astype(int)].prod(axis=1)
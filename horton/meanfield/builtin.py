@@ -27,7 +27,88 @@ from horton.meanfield.observable import Observable
 from horton.meanfield.wfn import RestrictedWFN, UnrestrictedWFN
 
 
-__all__ = ['Hartree', 'HartreeFockExchange', 'DiracExchange']
+__all__ = [
+    'Hartree', 'HartreeFockExchange', 'RIHartree', 'RIHartreeFockExchange',
+    'DiracExchange',
+]
+
+
+def _update_direct(observable):
+    '''Recompute the Hartree and exchange operators with direct integrals
+
+       All Coulomb and exchange operators needed by the Hamiltonian are
+       computed in one pass over the shell quartets. This is used when the
+       Hamiltonian has ``eri_mode='direct'``. In incremental mode, only the
+       contribution of the change in density matrix is computed, except for
+       every ``rebuild_interval``-th build.
+    '''
+    hamiltonian = observable._hamiltonian
+    system = observable.system
+    cache = observable.cache
+    lf = system.lf
+    selects = ['alpha']
+    if isinstance(system.wfn, UnrestrictedWFN):
+        selects.append('beta')
+
+    do_hartree = any(isinstance(term, Hartree) and not isinstance(term, RIHartree)
+                     for term in hamiltonian.terms)
+    do_exchange = any(isinstance(term, HartreeFockExchange) and not isinstance(term, RIHartreeFockExchange)
+                      for term in hamiltonian.terms)
+    keys = []
+    if do_hartree:
+        keys.append('op_hartree')
+    if do_exchange:
+        keys.extend('op_exchange_hartree_fock_%s' % select for select in selects)
+    if all(key in cache for key in keys):
+        return
+
+    # Coulomb and exchange operators for each density matrix
+    dms = [system.wfn.get_dm(select) for select in selects]
+    coulombs = [lf.create_one_body() for select in selects] if do_hartree else None
+    exchanges = [lf.create_one_body() for select in selects] if do_exchange else None
+
+    # The operators of the previous build can only be updated when they were
+    # computed for the same basis functions, i.e. the same basis and centers.
+    obasis = system.obasis
+    previous = hamiltonian._eri_previous
+    if hamiltonian.incremental and previous is not None and \
+       hamiltonian._eri_nincremental < hamiltonian.rebuild_interval and \
+       previous[0] is obasis and (previous[1] == obasis.centers).all() and \
+       len(previous[2]) == len(dms) and \
+       (previous[3] is None) == (coulombs is None) and \
+       (previous[4] is None) == (exchanges is None):
+        # Only compute the contribution of the change in density matrix
+        prev_dms, prev_coulombs, prev_exchanges = previous[2:]
+        delta_dms = []
+        for dm, prev_dm in zip(dms, prev_dms):
+            delta_dm = dm.copy()
+            delta_dm.iadd(prev_dm, -1)
+            delta_dms.append(delta_dm)
+        system.compute_electron_repulsion_direct(delta_dms, coulombs, exchanges, hamiltonian.eri_threshold)
+        if do_hartree:
+            for coulomb, prev_coulomb in zip(coulombs, prev_coulombs):
+                coulomb.iadd(prev_coulomb)
+        if do_exchange:
+            for exchange, prev_exchange in zip(exchanges, prev_exchanges):
+                exchange.iadd(prev_exchange)
+        hamiltonian._eri_nincremental += 1
+    else:
+        system.compute_electron_repulsion_direct(dms, coulombs, exchanges, hamiltonian.eri_threshold)
+        hamiltonian._eri_nincremental = 0
+    if hamiltonian.incremental:
+        hamiltonian._eri_previous = obasis, obasis.centers.copy(), [dm.copy() for dm in dms], coulombs, exchanges
+
+    # Store the results in the cache
+    if do_hartree:
+        hartree = cache.load('op_hartree', alloc=lf.create_one_body)[0]
+        hartree.assign(coulombs[0])
+        if len(selects) == 1:
+            hartree.iscale(2)
+        else:
+            hartree.iadd(coulombs[1])
+    if do_exchange:
+        for select, exchange in zip(selects, exchanges):
+            cache.load('op_exchange_hartree_fock_%s' % select, alloc=lf.create_one_body)[0].assign(exchange)
 
 
 class Hartree(Observable):
@@ -36,6 +117,9 @@ class Hartree(Observable):
 
     def _update_hartree(self):
         '''Recompute the Hartree operator if it has become invalid'''
+        if self._hamiltonian.eri_mode == 'direct':
+            _update_direct(self)
+            return
         hartree, new = self.cache.load('op_hartree', alloc=self.system.lf.create_one_body)
         if new:
             electron_repulsion = self.system.get_electron_repulsion()
@@ -70,6 +154,10 @@ class HartreeFockExchange(Observable):
 
     def _update_exchange(self):
         '''Recompute the Exchange operator(s) if invalid'''
+        if self._hamiltonian.eri_mode == 'direct':
+            _update_direct(self)
+            return
+
         def helper(select):
             dm = self.system.wfn.get_dm(select)
             exchange, new = self.cache.load('op_exchange_hartree_fock_%s' % select, alloc=self.system.lf.create_one_body)
@@ -96,11 +184,84 @@ class HartreeFockExchange(Observable):
             fock_beta.iadd(self.cache.load('op_exchange_hartree_fock_beta'), -self.fraction_exchange*scale)
 
 
+class RIHartree(Hartree):
+    '''The Hartree term with density fitting (RI-J)'''
+    def __init__(self, auxbasis, label='hartree'):
+        '''
+           **Arguments:**
+
+           auxbasis
+                The auxiliary basis used to fit products of orbital basis
+                functions: a string with the name of a basis set family, a
+                GOBasisDesc or a GOBasis instance.
+
+           **Optional arguments:**
+
+           label
+                A label for this term.
+        '''
+        self.auxbasis = auxbasis
+        Hartree.__init__(self, label)
+
+    def _update_hartree(self):
+        '''Recompute the Hartree operator if it has become invalid'''
+        hartree, new = self.cache.load('op_hartree', alloc=self.system.lf.create_one_body)
+        if new:
+            factor = self.system.get_electron_repulsion_ri(self.auxbasis)
+            if isinstance(self.system.wfn, RestrictedWFN):
+                dm = self.system.wfn.dm_alpha._array*2
+            else:
+                dm = self.system.wfn.dm_full._array
+            # J_ij = sum_P B[P,i,j] sum_kl B[P,k,l] D_kl
+            coeffs = np.tensordot(factor, dm, ([1, 2], [0, 1]))
+            hartree._array[:] = np.tensordot(coeffs, factor, (0, 0))
+
+
+class RIHartreeFockExchange(HartreeFockExchange):
+    '''The Hartree-Fock exchange term with density fitting (RI-K)'''
+    def __init__(self, auxbasis, label='exchange_hartree_fock', fraction_exchange=1.0):
+        '''
+           **Arguments:**
+
+           auxbasis
+                The auxiliary basis used to fit products of orbital basis
+                functions: a string with the name of a basis set family, a
+                GOBasisDesc or a GOBasis instance.
+
+           **Optional arguments:**
+
+           label
+                A label for this term.
+
+           fraction_exchange
+                The amount of exact exchange.
+        '''
+        self.auxbasis = auxbasis
+        HartreeFockExchange.__init__(self, label, fraction_exchange)
+
+    def _update_exchange(self):
+        '''Recompute the Exchange operator(s) if invalid'''
+        def helper(select):
+            dm = self.system.wfn.get_dm(select)
+            exchange, new = self.cache.load('op_exchange_hartree_fock_%s' % select, alloc=self.system.lf.create_one_body)
+            if new:
+                factor = self.system.get_electron_repulsion_ri(self.auxbasis)
+                # K_ik = sum_P sum_jl B[P,i,j] D_jl B[P,l,k]
+                tmp = np.tensordot(factor, dm._array, (2, 0))
+                tmp = np.tensordot(tmp, factor, ([0, 2], [0, 1]))
+                exchange._array[:] = 0.5*(tmp + tmp.T)
+
+        helper('alpha')
+        if isinstance(self.system.wfn, UnrestrictedWFN):
+            helper('beta')
+
+
 # TODO: Make base class for grid functionals where alpha and beta contributions are independent.
 class DiracExchange(Observable):
     '''An implementation of the Dirac Exchange Functional'''
     require_grid = True
     exchange = True
+    grid_block = True
 
     def __init__(self, label='exchange_dirac', coeff=None):
         '''
@@ -138,12 +299,21 @@ class DiracExchange(Observable):
         if isinstance(self.system.wfn, UnrestrictedWFN):
             helper('beta')
 
+    def compute_grid_block(self, rhos, gradrhos, dpots, gpots):
+        pots = self.derived_coeff*rhos**(1.0/3.0)
+        dpots += pots
+        edens = (pots*rhos).sum(axis=1)
+        if rhos.shape[1] == 1:
+            edens *= 2
+        edens *= 3.0/4.0
+        return edens
+
     def compute(self):
         self._update_exchange(postpone_grid=None)
 
         def helper(select):
             pot = self.cache.load('pot_exchange_dirac_%s' % select)
-            rho = self.cache.load('rho_%s' % select)
+            rho = self.update_rho(select)
             return self.grid.integrate(pot, rho)
 
         energy = helper('alpha')
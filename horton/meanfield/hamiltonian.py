@@ -21,8 +21,11 @@
 '''Mean-field DFT/HF Hamiltonian data structures'''
 
 
+import numpy as np
+
 from horton.log import log
 from horton.cache import Cache
+from horton.gbasis.cext import GridBasisCache
 from horton.meanfield.core import KineticEnergy, ExternalPotential
 from horton.meanfield.builtin import Hartree
 from horton.meanfield.wfn import UnrestrictedWFN
@@ -34,7 +37,9 @@ __all__ = [
 
 
 class Hamiltonian(object):
-    def __init__(self, system, terms, grid=None, idiot_proof=True):
+    def __init__(self, system, terms, grid=None, idiot_proof=True, tolerance=0,
+                 eri_mode='stored', eri_threshold=1e-12, incremental=False,
+                 rebuild_interval=10, fuse_grid=False, grid_cache_memory=None):
         '''
            **Arguments:**
 
@@ -53,6 +58,55 @@ class Hamiltonian(object):
                 When set to False, the kinetic energy, external potential and
                 Hartree terms are not added automatically and a error is raised
                 when no exchange is present.
+
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected when evaluating densities and Fock matrices on
+                the grid. The default (zero) disables this screening.
+
+           eri_mode
+                Controls how the Hartree and Hartree-Fock exchange operators
+                are computed. With 'stored' (default), the electron repulsion
+                integrals are computed once and kept in the cache of the
+                system. With 'direct', the integrals are recomputed in each
+                SCF iteration and contracted with the density matrices right
+                away, such that the four-index tensor is never stored.
+
+           eri_threshold
+                The screening threshold for the integral-direct mode. Shell
+                quartets are skipped when their Schwarz bound times the
+                largest relevant density matrix element is below this
+                threshold.
+
+           incremental
+                When set to True, the Hartree and exchange operators are
+                updated with the contribution of the change in density matrix
+                since the previous build, instead of being recomputed from
+                scratch. Near convergence, most shell quartets are then
+                screened away. This is only supported in combination with
+                ``eri_mode='direct'``.
+
+           rebuild_interval
+                The number of incremental builds after which the operators are
+                recomputed from the full density matrices, to avoid the
+                accumulation of screening errors.
+
+           fuse_grid
+                When set to True, the densities on the grid and the Fock
+                contributions of all terms that support it (see
+                ``Observable.grid_block``) are computed in a single pass over
+                the grid, such that the basis functions are evaluated only once
+                per block of grid points. The intermediate densities and
+                potentials on the full grid are then never stored.
+
+           grid_cache_memory
+                When given, the basis functions (and their gradients) on the
+                grid are kept in memory after their first evaluation, such that
+                later SCF iterations can reuse them. This is the maximum amount
+                of memory (in bytes) used for this purpose. Blocks of grid
+                points that do not fit in this budget are recomputed when
+                needed. The cache is stored in the ``grid_cache`` attribute of
+                the orbital basis of the system.
         '''
         # check arguments:
         if len(terms) == 0:
@@ -60,11 +114,37 @@ class Hamiltonian(object):
         for term in terms:
             if term.require_grid and grid is None:
                 raise TypeError('The term %s requires a grid, but not grid is given.' % term)
+        if eri_mode not in ['stored', 'direct']:
+            raise ValueError('The eri_mode argument must be \'stored\' or \'direct\'.')
+        if incremental and eri_mode != 'direct':
+            raise ValueError('Incremental builds are only supported with eri_mode=\'direct\'.')
+        if rebuild_interval < 0:
+            raise ValueError('The rebuild_interval argument can not be negative.')
+        if grid_cache_memory is not None and grid_cache_memory < 0:
+            raise ValueError('The grid_cache_memory argument can not be negative.')
 
         # Assign attributes
         self.system = system
         self.terms = list(terms)
         self.grid = grid
+        self.tolerance = tolerance
+        self.eri_mode = eri_mode
+        self.eri_threshold = eri_threshold
+        self.incremental = incremental
+        self.rebuild_interval = rebuild_interval
+        self.fuse_grid = fuse_grid
+        # The orbital basis, its centers, the density matrices and the
+        # operators of the last direct build, and the number of incremental
+        # builds since the last full build.
+        self._eri_previous = None
+        self._eri_nincremental = 0
+
+        if grid_cache_memory is not None and grid is not None:
+            obasis = system.obasis
+            if obasis.grid_cache is None or \
+               not obasis.grid_cache.check_points(grid.points) or \
+               obasis.grid_cache.max_memory != grid_cache_memory:
+                obasis.grid_cache = GridBasisCache(grid.points, grid_cache_memory)
 
         if idiot_proof:
             # Check if an exchange term is present
@@ -105,6 +185,48 @@ class Hamiltonian(object):
         '''
         self.cache.clear()
 
+    def _get_fused_terms(self):
+        '''Return the terms that are evaluated in the fused grid pass'''
+        if not self.fuse_grid:
+            return []
+        return [term for term in self.terms if term.grid_block]
+
+    def _update_fused(self):
+        '''Compute the energies and Fock contributions of all fused terms
+
+           The results are stored in the cache as ``energy_fused`` (one energy
+           per fused term) and ``op_fused_alpha`` (and ``op_fused_beta``).
+        '''
+        terms = self._get_fused_terms()
+        selects = ['alpha']
+        if isinstance(self.system.wfn, UnrestrictedWFN):
+            selects.append('beta')
+        energies, new = self.cache.load('energy_fused', alloc=len(terms))
+        focks = []
+        for select in selects:
+            fock, fock_new = self.cache.load('op_fused_%s' % select, alloc=self.system.lf.create_one_body)
+            new |= fock_new
+            focks.append(fock)
+        if not new:
+            return
+
+        energies[:] = 0.0
+        for fock in focks:
+            fock.clear()
+        dms = [self.system.wfn.get_dm(select) for select in selects]
+        gradient = any(term.require_gradient for term in terms)
+        weights = self.grid.weights
+
+        def callback(begin, end, rhos, gradrhos):
+            dpots = np.zeros(rhos.shape)
+            gpots = np.zeros(gradrhos.shape) if gradient else None
+            for i, term in enumerate(terms):
+                edens = term.compute_grid_block(rhos, gradrhos, dpots, gpots)
+                energies[i] += np.dot(edens, weights[begin:end])
+            return dpots, gpots
+
+        self.system.compute_grid_fused_fock(dms, self.grid.points, weights, callback, focks, gradient, self.tolerance)
+
     def compute(self):
         '''Compute the energy.
 
@@ -112,9 +234,16 @@ class Hamiltonian(object):
 
            The total energy, including nuclear-nuclear repulsion.
         '''
+        fused_terms = self._get_fused_terms()
+        if len(fused_terms) > 0:
+            self._update_fused()
+            energies = self.cache.load('energy_fused')
         total = 0.0
         for term in self.terms:
-            energy = term.compute()
+            if term in fused_terms:
+                energy = energies[fused_terms.index(term)]
+            else:
+                energy = term.compute()
             self.system.extra['energy_%s' % term.label] = energy
             total += energy
         energy = self.system.compute_nucnuc()
@@ -156,8 +285,16 @@ class Hamiltonian(object):
         # Loop over all terms and add contributions to the Fock matrix. Some
         # terms will actually only evaluate potentials on grids and add these
         # results to the total potential on a grid.
+        fused_terms = self._get_fused_terms()
         for term in self.terms:
-            term.add_fock_matrix(fock_alpha, fock_beta, postpone_grid=True)
+            if term not in fused_terms:
+                term.add_fock_matrix(fock_alpha, fock_beta, postpone_grid=True)
+        # The fused terms are evaluated in one pass over the grid.
+        if len(fused_terms) > 0:
+            self._update_fused()
+            fock_alpha.iadd(self.cache.load('op_fused_alpha'))
+            if isinstance(self.system.wfn, UnrestrictedWFN):
+                fock_beta.iadd(self.cache.load('op_fused_beta'))
         # Collect all the total potentials and turn them into contributions
         # for the fock matrix/matrices.
 
@@ -165,19 +302,19 @@ class Hamiltonian(object):
         # d = density
         if 'dpot_total_alpha' in self.cache:
             dpot = self.cache.load('dpot_total_alpha')
-            self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, fock_alpha)
+            self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, fock_alpha, self.tolerance)
         # g = gradient
         if 'gpot_total_alpha' in self.cache:
             gpot = self.cache.load('gpot_total_alpha')
-            self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, fock_alpha)
+            self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, fock_alpha, self.tolerance)
 
         if isinstance(self.system.wfn, UnrestrictedWFN):
             # Colect potentials for beta electrons
             # d = density
             if 'dpot_total_beta' in self.cache:
                 dpot = self.cache.load('dpot_total_beta')
-                self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, fock_beta)
+                self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, fock_beta, self.tolerance)
             # g = gradient
             if 'gpot_total_beta' in self.cache:
                 gpot = self.cache.load('gpot_total_beta')
-                self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, fock_beta)
+                self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, fock_beta, self.tolerance)
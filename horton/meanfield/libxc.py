@@ -57,6 +57,8 @@ class LibXCLDA(LibXCEnergy):
     '''Any LDA functional from LibXC'''
 
     require_grid = True
+    grid_block = True
+
     def __init__(self, name):
         '''
            **Arguments:**
@@ -89,6 +91,24 @@ class LibXCLDA(LibXCEnergy):
             self._handle_dpot(pot_both[:,0], postpone_grid, 'op_libxc_%s_alpha' % self._name, 'alpha')
             self._handle_dpot(pot_both[:,1], postpone_grid, 'op_libxc_%s_beta' % self._name, 'beta')
 
+    def compute_grid_block(self, rhos, gradrhos, dpots, gpots):
+        edens = np.zeros(len(rhos))
+        if rhos.shape[1] == 1:
+            rho = 2*rhos[:,0]
+            pot = np.zeros(len(rhos))
+            self._libxc_wrapper.compute_lda_vxc_unpol(rho, pot)
+            dpots[:,0] += pot
+            self._libxc_wrapper.compute_lda_exc_unpol(rho, edens)
+            edens *= rho
+        else:
+            rho_both = np.ascontiguousarray(rhos)
+            pot_both = np.zeros(rhos.shape)
+            self._libxc_wrapper.compute_lda_vxc_pol(rho_both, pot_both)
+            dpots += pot_both
+            self._libxc_wrapper.compute_lda_exc_pol(rho_both, edens)
+            edens *= rho_both.sum(axis=1)
+        return edens
+
     @timer.with_section('LDA edens')
     def compute(self):
         if isinstance(self.system.wfn, RestrictedWFN):
@@ -113,6 +133,10 @@ class LibXCLDA(LibXCEnergy):
 
 class LibXCGGA(LibXCEnergy):
     '''Any GGA functional from LibXC'''
+
+    grid_block = True
+    require_gradient = True
+
     def __init__(self, name):
         '''
            **Arguments:**
@@ -166,6 +190,39 @@ class LibXCGGA(LibXCEnergy):
             self._handle_gpot(gpot_alpha, postpone_grid, 'op_libxc_%s_alpha' % self._name, 'alpha')
             self._handle_gpot(gpot_beta, postpone_grid, 'op_libxc_%s_beta' % self._name, 'beta')
 
+    def compute_grid_block(self, rhos, gradrhos, dpots, gpots):
+        edens = np.zeros(len(rhos))
+        if rhos.shape[1] == 1:
+            rho = 2*rhos[:,0]
+            grad_rho = 2*gradrhos[:,0]
+            sigma = (grad_rho**2).sum(axis=1)
+            dpot = np.zeros(len(rhos))
+            spot = np.zeros(len(rhos))
+            self._libxc_wrapper.compute_gga_vxc_unpol(rho, sigma, dpot, spot)
+            dpots[:,0] += dpot
+            gpots[:,0] += (2*spot).reshape(-1,1)*grad_rho
+            self._libxc_wrapper.compute_gga_exc_unpol(rho, sigma, edens)
+            edens *= rho
+        else:
+            rho_both = np.ascontiguousarray(rhos)
+            grad_alpha = gradrhos[:,0]
+            grad_beta = gradrhos[:,1]
+            sigma_all = np.zeros((len(rhos), 3))
+            sigma_all[:,0] = (grad_alpha**2).sum(axis=1)
+            sigma_all[:,1] = (grad_alpha*grad_beta).sum(axis=1)
+            sigma_all[:,2] = (grad_beta**2).sum(axis=1)
+            dpot_both = np.zeros((len(rhos), 2))
+            spot_all = np.zeros((len(rhos), 3))
+            self._libxc_wrapper.compute_gga_vxc_pol(rho_both, sigma_all, dpot_both, spot_all)
+            dpots += dpot_both
+            gpots[:,0] += (2*spot_all[:,0].reshape(-1,1))*grad_alpha
+            gpots[:,0] += (spot_all[:,1].reshape(-1,1))*grad_beta
+            gpots[:,1] += (2*spot_all[:,2].reshape(-1,1))*grad_beta
+            gpots[:,1] += (spot_all[:,1].reshape(-1,1))*grad_alpha
+            self._libxc_wrapper.compute_gga_exc_pol(rho_both, sigma_all, edens)
+            edens *= rho_both.sum(axis=1)
+        return edens
+
     @timer.with_section('GGA edens')
     def compute(self):
         if isinstance(self.system.wfn, RestrictedWFN):
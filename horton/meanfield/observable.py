@@ -29,6 +29,8 @@ __all__ = [
 class Observable(object):
     require_grid = False
     exchange = False # Set to True for exhange functionals. Is needed for idiot proof option
+    grid_block = False # Set to True when compute_grid_block is implemented
+    require_gradient = False # Set to True when compute_grid_block needs density gradients
 
     def __init__(self, label):
         self.label = label
@@ -63,32 +65,32 @@ class Observable(object):
     def update_rho(self, select):
         if select == 'both':
             # This is needed for libxc
-            rho, new = self.cache.load('rho_both', alloc=(self.grid.size, 2))
+            rho, new = self.cache.load('rho_both', alloc=(self.grid.size, 2), tags='r')
             if new:
                 rho_alpha = self.update_rho('alpha')
                 rho_beta = self.update_rho('beta')
                 rho[:,0] = rho_alpha
                 rho[:,1] = rho_beta
         else:
-            rho, new = self.cache.load('rho_%s' % select, alloc=self.grid.size)
+            rho, new = self.cache.load('rho_%s' % select, alloc=self.grid.size, tags='r')
             if new:
-                self.system.compute_grid_density(self.grid.points, rhos=rho, select=select)
+                self.system.compute_grid_density(self.grid.points, rhos=rho, select=select, tolerance=self._hamiltonian.tolerance)
         return rho
 
     def update_grad_rho(self, select):
-        grad_rho, new = self.cache.load('grad_rho_%s' % select, alloc=(self.grid.size, 3))
+        grad_rho, new = self.cache.load('grad_rho_%s' % select, alloc=(self.grid.size, 3), tags='r')
         if new:
-            self.system.compute_grid_gradient(self.grid.points, gradrhos=grad_rho, select=select)
+            self.system.compute_grid_gradient(self.grid.points, gradrhos=grad_rho, select=select, tolerance=self._hamiltonian.tolerance)
         return grad_rho
 
     def update_sigma(self, select):
         if select == 'all':
-            sigma, new = self.cache.load('sigma_all', alloc=(self.grid.size, 3))
+            sigma, new = self.cache.load('sigma_all', alloc=(self.grid.size, 3), tags='r')
             sigma[:,0] = self.update_sigma('alpha')
             sigma[:,1] = self.update_sigma('cross')
             sigma[:,2] = self.update_sigma('beta')
         else:
-            sigma, new = self.cache.load('sigma_%s' % select, alloc=self.grid.size)
+            sigma, new = self.cache.load('sigma_%s' % select, alloc=self.grid.size, tags='r')
             if new:
                 if select == 'cross':
                     grad_rho_alpha = self.update_grad_rho('alpha')
@@ -131,6 +133,37 @@ class Observable(object):
         '''
         raise NotImplementedError
 
+    def compute_grid_block(self, rhos, gradrhos, dpots, gpots):
+        '''Compute the energy density and the potentials in a block of grid points
+
+           This is used by the Hamiltonian when grid terms are evaluated in a
+           single pass over the grid, see the fuse_grid option of the
+           Hamiltonian.
+
+           **Arguments:**
+
+           rhos
+                The alpha (and beta) densities in the block, shape (npoint, 1)
+                in the restricted case or (npoint, 2) in the unrestricted case.
+
+           gradrhos
+                The gradients of the alpha (and beta) densities, shape
+                (npoint, 1, 3) or (npoint, 2, 3). This is None when none of
+                the terms requires gradients.
+
+           dpots
+                Output array for the density potentials, same shape as rhos.
+
+           gpots
+                Output array for the gradient potentials, same shape as
+                gradrhos.
+
+           **Returns:** the energy density in each point (energy per volume).
+
+           **Warning:** the potentials are added to the output arrays!
+        '''
+        raise NotImplementedError
+
     def _handle_dpot(self, dpot, postpone_grid, op_name, spin):
         '''Take care of a density potential, either make a fock contribution or collect grid data
 
@@ -170,7 +203,7 @@ class Observable(object):
         elif postpone_grid is False:
             operator, new = self.cache.load(op_name, alloc=self.system.lf.create_one_body)
             if new:
-                self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, operator)
+                self.system.compute_grid_density_fock(self.grid.points, self.grid.weights, dpot, operator, self._hamiltonian.tolerance)
         elif postpone_grid is not None:
             raise ValueError('postpone_grid must be True, False or None')
 
@@ -213,6 +246,6 @@ class Observable(object):
         elif postpone_grid is False:
             operator, new = self.cache.load(op_name, alloc=self.system.lf.create_one_body)
             if new:
-                self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, operator)
+                self.system.compute_grid_gradient_fock(self.grid.points, self.grid.weights, gpot, operator, self._hamiltonian.tolerance)
         elif postpone_grid is not None:
             raise ValueError('postpone_grid must be True, False or None')
@@ -270,3 +270,213 @@ def test_ghost_hf():
     # The convergence should be reasonable, not perfect because of limited
     # precision in Gaussian fchk file:
     assert convergence_error_eigen(ham) < 1e-5
+
+
+def check_eri_mode_direct(fn_fchk):
+    sys = System.from_file(context.get_fn(fn_fchk))
+    unrestricted = isinstance(sys.wfn, UnrestrictedWFN)
+    ham1 = Hamiltonian(sys, [HartreeFockExchange()])
+    energy1 = ham1.compute()
+    fock_alpha1 = sys.lf.create_one_body()
+    fock_beta1 = sys.lf.create_one_body() if unrestricted else None
+    ham1.compute_fock(fock_alpha1, fock_beta1)
+
+    ham2 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=0.0)
+    energy2 = ham2.compute()
+    fock_alpha2 = sys.lf.create_one_body()
+    fock_beta2 = sys.lf.create_one_body() if unrestricted else None
+    ham2.compute_fock(fock_alpha2, fock_beta2)
+
+    assert abs(energy1 - energy2) < 1e-10
+    assert abs(fock_alpha1._array - fock_alpha2._array).max() < 1e-10
+    if unrestricted:
+        assert abs(fock_beta1._array - fock_beta2._array).max() < 1e-10
+
+    # screened integrals give nearly the same result
+    ham3 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=1e-8)
+    energy3 = ham3.compute()
+    assert abs(energy1 - energy3) < 1e-6
+
+
+def test_eri_mode_direct_water_sto3g_hf():
+    check_eri_mode_direct('test/water_sto3g_hf_g03.fchk')
+
+
+def test_eri_mode_direct_li_h_321g_hf():
+    check_eri_mode_direct('test/li_h_3-21G_hf_g09.fchk')
+
+
+def test_eri_mode_invalid():
+    fn_fchk = context.get_fn('test/water_hfs_321g.fchk')
+    sys = System.from_file(fn_fchk)
+    with assert_raises(ValueError):
+        ham = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='foo')
+
+
+def test_eri_incremental_water_sto3g_hf():
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    guess_hamiltonian_core(sys)
+    overlap = sys.get_overlap()
+    ham1 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=0.0, incremental=True, rebuild_interval=2)
+    ham2 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=0.0)
+    fock1 = sys.lf.create_one_body()
+    fock2 = sys.lf.create_one_body()
+    for i in xrange(5):
+        for ham, fock in (ham1, fock1), (ham2, fock2):
+            ham.clear()
+            fock.clear()
+            ham.compute_fock(fock, None)
+        assert ham1._eri_nincremental == [0, 1, 2, 0, 1][i]
+        assert abs(fock1._array - fock2._array).max() < 1e-10
+        assert abs(ham1.compute() - ham2.compute()) < 1e-10
+        # take a plain SCF step
+        sys.wfn.clear()
+        sys.wfn.update_exp(fock2, overlap)
+
+
+def test_eri_incremental_update_coordinates():
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    guess_hamiltonian_core(sys)
+    ham1 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=0.0, incremental=True)
+    fock1 = sys.lf.create_one_body()
+    ham1.compute_fock(fock1, None)
+    # After moving the atoms, the operators are rebuilt from scratch.
+    sys.update_coordinates(sys.coordinates + np.array([0.1, -0.2, 0.3]))
+    ham1.clear()
+    fock1.clear()
+    ham1.compute_fock(fock1, None)
+    assert ham1._eri_nincremental == 0
+    ham2 = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', eri_threshold=0.0)
+    fock2 = sys.lf.create_one_body()
+    ham2.compute_fock(fock2, None)
+    assert abs(fock1._array - fock2._array).max() < 1e-10
+
+
+def test_eri_incremental_invalid():
+    fn_fchk = context.get_fn('test/water_hfs_321g.fchk')
+    sys = System.from_file(fn_fchk)
+    with assert_raises(ValueError):
+        ham = Hamiltonian(sys, [HartreeFockExchange()], incremental=True)
+    with assert_raises(ValueError):
+        ham = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', incremental=True, rebuild_interval=-1)
+
+
+def get_he_ri_basis_sets():
+    # A small uncontracted orbital basis for Helium and an auxiliary basis that
+    # spans all products of orbital basis functions exactly.
+    centers = np.zeros((1, 3), float)
+    obasis = GOBasis(centers, np.array([0, 0, 0]), np.array([1, 1, 1]),
+                     np.array([0, 0, 1]), np.array([0.5, 2.0, 1.0]),
+                     np.array([1.0, 1.0, 1.0]))
+    auxbasis = GOBasis(centers, np.zeros(6, int), np.ones(6, int),
+                       np.array([0, 0, 0, 1, 1, 2]),
+                       np.array([1.0, 2.5, 4.0, 1.5, 3.0, 2.0]),
+                       np.ones(6, float))
+    return obasis, auxbasis
+
+
+def test_ri_exact_he():
+    obasis, auxbasis = get_he_ri_basis_sets()
+    sys = System(np.zeros((1, 3), float), np.array([2]), obasis=obasis)
+    setup_mean_field_wfn(sys, charge=0)
+    guess_hamiltonian_core(sys)
+
+    ham1 = Hamiltonian(sys, [HartreeFockExchange()])
+    energy1 = ham1.compute()
+    fock1 = sys.lf.create_one_body()
+    ham1.compute_fock(fock1, None)
+
+    ham2 = Hamiltonian(sys, [RIHartree(auxbasis), RIHartreeFockExchange(auxbasis)])
+    assert sum(isinstance(term, Hartree) for term in ham2.terms) == 1
+    energy2 = ham2.compute()
+    fock2 = sys.lf.create_one_body()
+    ham2.compute_fock(fock2, None)
+    fock2.check_symmetry()
+
+    assert abs(energy1 - energy2) < 1e-8
+    assert abs(fock1._array - fock2._array).max() < 1e-8
+
+
+def check_fuse_grid(fn_fchk, make_terms):
+    sys = System.from_file(context.get_fn(fn_fchk))
+    grid = BeckeMolGrid(sys, 'coarse', random_rotate=False)
+    hams = []
+    for fuse_grid in False, True:
+        terms = make_terms() + [ExternalPotential()]
+        hams.append(Hamiltonian(sys, terms, grid, idiot_proof=False, fuse_grid=fuse_grid))
+
+    # Energies
+    energies = []
+    for ham in hams:
+        energies.append(ham.compute())
+        energies.extend(sys.extra['energy_%s' % term.label] for term in ham.terms)
+    assert abs(np.array(energies[:len(energies)/2]) - np.array(energies[len(energies)/2:])).max() < 1e-10
+
+    # Fock matrices
+    focks = []
+    for ham in hams:
+        fock_alpha = sys.lf.create_one_body()
+        fock_beta = None
+        if isinstance(sys.wfn, UnrestrictedWFN):
+            fock_beta = sys.lf.create_one_body()
+        ham.compute_fock(fock_alpha, fock_beta)
+        focks.append((fock_alpha, fock_beta))
+    for fock1, fock2 in zip(*focks):
+        if fock1 is not None:
+            assert abs(fock1._array - fock2._array).max() < 1e-10
+            fock2.check_symmetry()
+
+    # The intermediate results on the grid are not stored in fused mode
+    for key in 'rho_alpha', 'rho_full', 'rho_both':
+        assert key not in hams[1].cache
+
+
+def test_fuse_grid_dirac_n2_hfs_sto3g():
+    check_fuse_grid('test/n2_hfs_sto3g.fchk', lambda: [DiracExchange()])
+
+
+def test_fuse_grid_dirac_h3_hfs_321g():
+    check_fuse_grid('test/h3_hfs_321g.fchk', lambda: [DiracExchange()])
+
+
+def test_fuse_grid_lda_h3_hfs_321g():
+    check_fuse_grid('test/h3_hfs_321g.fchk', lambda: [LibXCLDA('x'), DiracExchange()])
+
+
+def test_grid_cache_memory_h3_hfs_321g():
+    sys = System.from_file(context.get_fn('test/h3_hfs_321g.fchk'))
+    grid = BeckeMolGrid(sys, 'coarse', random_rotate=False)
+    ham1 = Hamiltonian(sys, [DiracExchange(), ExternalPotential()], grid, idiot_proof=False)
+    energy1 = ham1.compute()
+    ham2 = Hamiltonian(sys, [DiracExchange(), ExternalPotential()], grid, idiot_proof=False, grid_cache_memory=10*1024**2)
+    assert sys.obasis.grid_cache.check_points(grid.points)
+    assert sys.obasis.grid_cache.max_memory == 10*1024**2
+    energy2 = ham2.compute()
+    assert sys.obasis.grid_cache.nbytes > 0
+    assert abs(energy1 - energy2) < 1e-10
+    # A second Hamiltonian with the same settings reuses the cache.
+    cache = sys.obasis.grid_cache
+    ham3 = Hamiltonian(sys, [DiracExchange(), ExternalPotential()], grid, idiot_proof=False, grid_cache_memory=10*1024**2)
+    assert sys.obasis.grid_cache is cache
+    with assert_raises(ValueError):
+        Hamiltonian(sys, [DiracExchange()], grid, idiot_proof=False, grid_cache_memory=-1)
+
+
+def test_grid_cache_memory_update_coordinates_h3_hfs_321g():
+    sys = System.from_file(context.get_fn('test/h3_hfs_321g.fchk'))
+    grid = BeckeMolGrid(sys, 'coarse', random_rotate=False, mode='keep')
+    sys.update_grid(grid)
+    ham1 = Hamiltonian(sys, [DiracExchange(), ExternalPotential()], grid, idiot_proof=False, grid_cache_memory=10*1024**2)
+    ham1.compute()
+    assert sys.obasis.grid_cache.nbytes > 0
+    # Move the atoms. The grid points and the basis functions are updated in
+    # place, so the stored basis functions are no longer valid.
+    sys.update_coordinates(sys.coordinates + np.array([0.1, -0.2, 0.3]))
+    ham1.clear()
+    energy1 = ham1.compute()
+    sys.obasis.grid_cache = None
+    ham2 = Hamiltonian(sys, [DiracExchange(), ExternalPotential()], grid, idiot_proof=False)
+    energy2 = ham2.compute()
+    assert abs(energy1 - energy2) < 1e-10
@@ -365,3 +365,31 @@ def test_info():
     t.kind
     t.family
     t.refs
+
+
+def check_fuse_grid_gga(fn_fchk):
+    sys = System.from_file(context.get_fn(fn_fchk))
+    grid = BeckeMolGrid(sys, 'coarse', random_rotate=False)
+    ham1 = Hamiltonian(sys, [LibXCGGA('x_pbe'), LibXCLDA('c_vwn')], grid, idiot_proof=False)
+    ham2 = Hamiltonian(sys, [LibXCGGA('x_pbe'), LibXCLDA('c_vwn')], grid, idiot_proof=False, fuse_grid=True)
+    assert abs(ham1.compute() - ham2.compute()) < 1e-10
+    fock_alpha1 = sys.lf.create_one_body()
+    fock_alpha2 = sys.lf.create_one_body()
+    fock_beta1 = None
+    fock_beta2 = None
+    if isinstance(sys.wfn, UnrestrictedWFN):
+        fock_beta1 = sys.lf.create_one_body()
+        fock_beta2 = sys.lf.create_one_body()
+    ham1.compute_fock(fock_alpha1, fock_beta1)
+    ham2.compute_fock(fock_alpha2, fock_beta2)
+    assert abs(fock_alpha1._array - fock_alpha2._array).max() < 1e-10
+    if fock_beta1 is not None:
+        assert abs(fock_beta1._array - fock_beta2._array).max() < 1e-10
+
+
+def test_fuse_grid_gga_water_hfs_321g():
+    check_fuse_grid_gga('test/water_hfs_321g.fchk')
+
+
+def test_fuse_grid_gga_h3_hfs_321g():
+    check_fuse_grid_gga('test/h3_hfs_321g.fchk')
@@ -63,6 +63,18 @@ def test_scf_os():
     assert abs(sys.extra['energy_nn'] - 0.6731318487) < 1e-8
 
 
+def test_scf_os_incremental():
+    fn_fchk = context.get_fn('test/li_h_3-21G_hf_g09.fchk')
+    sys = System.from_file(fn_fchk)
+
+    guess_hamiltonian_core(sys)
+    ham = Hamiltonian(sys, [HartreeFockExchange()], eri_mode='direct', incremental=True)
+    converge_scf(ham)
+    assert convergence_error_eigen(ham) < 1e-8
+    ham.compute()
+    assert abs(sys.extra['energy'] - -7.687331212191962E+00) < 1e-8
+
+
 def test_hf_water_321g_mistake():
     fn_xyz = context.get_fn('test/water.xyz')
     sys = System.from_file(fn_xyz, obasis='3-21G')
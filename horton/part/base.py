@@ -21,9 +21,14 @@
 '''Base classes for partitioning algorithms'''
 
 
+import os, tempfile, threading
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 from horton.cache import JustOnceClass, just_once, Cache
+from horton.cext import get_num_threads, set_num_threads
+from horton.exceptions import SymmetryError
 from horton.log import log
 from horton.moments import get_ncart_cumul, get_npure_cumul
 from horton.meanfield.wfn import RestrictedWFN
@@ -36,7 +41,7 @@ class Part(JustOnceClass):
     name = None
     linear = False # whether the populations are linear in the density matrix.
 
-    def __init__(self, system, grid, local, slow, lmax, moldens=None):
+    def __init__(self, system, grid, local, slow, lmax, moldens=None, nproc=1):
         '''
            **Arguments:**
 
@@ -60,13 +65,23 @@ class Part(JustOnceClass):
 
            moldens
                 The all-electron density grid data.
+
+           nproc
+                The number of threads used to carry out the per-atom work
+                (proatoms, atomic weights, integrals, ...) in parallel. The
+                grid data are shared by all threads.
         '''
+        if nproc < 1:
+            raise ValueError('The nproc argument must be strictly positive.')
         JustOnceClass.__init__(self)
         self._system = system
         self._grid = grid
         self._local = local
         self._slow = slow
         self._lmax = lmax
+        self._nproc = nproc
+        # Lock to protect arrays to which several atoms contribute.
+        self._lock = threading.Lock()
 
         # Caching stuff, to avoid recomputation of earlier results
         self._cache = Cache()
@@ -113,6 +128,11 @@ class Part(JustOnceClass):
 
     lmax = property(_get_lmax)
 
+    def _get_nproc(self):
+        return self._nproc
+
+    nproc = property(_get_nproc)
+
     def _get_cache(self):
         return self._cache
 
@@ -144,6 +164,76 @@ class Part(JustOnceClass):
                 self._init_subgrids()
             self.clear()
 
+    def get_unique_atoms(self):
+        '''Return the indexes of the atoms whose per-atom results are computed
+
+           The results of all other atoms are copied from an equivalent atom.
+           (See ``get_equivalent_atom``.) By default, all atoms are unique.
+        '''
+        return range(self.system.natom)
+
+    def get_equivalent_atom(self, index):
+        '''Return the index of the unique atom that is equivalent to the given atom'''
+        return index
+
+    def map_atoms(self, fn, unique=False):
+        '''Call a function for each atom, in parallel if nproc > 1
+
+           **Arguments:**
+
+           fn
+                A function that takes the index of an atom as argument. Calls
+                for different atoms must be independent. Contributions to
+                arrays shared between atoms must be made while holding
+                ``self._lock``.
+
+           **Optional arguments:**
+
+           unique
+                When set to True, the function is only called for the unique
+                atoms. The results for the other atoms must be copied
+                afterwards with ``copy_equivalent_atoms``.
+
+           The heavy lifting in the per-atom work is done in compiled code
+           that releases the GIL, such that threads run concurrently while
+           sharing all grid data without copies. The OpenMP threads (see
+           ``set_num_threads``) are divided over the workers, such that the
+           total number of threads does not exceed the requested number.
+        '''
+        if unique:
+            indexes = self.get_unique_atoms()
+        else:
+            indexes = range(self.system.natom)
+        if self._nproc == 1 or len(indexes) < 2:
+            for index in indexes:
+                fn(index)
+        else:
+            npool = min(self._nproc, len(indexes))
+            # The OpenMP settings of the calling thread are not inherited by
+            # the workers, so they are set explicitly in each worker.
+            nthread = max(1, get_num_threads()//npool)
+            pool = ThreadPool(npool, set_num_threads, (nthread,))
+            try:
+                pool.map(fn, indexes, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+    def copy_equivalent_atoms(self, fn):
+        '''Call a function for each atom that is not unique
+
+           **Arguments:**
+
+           fn
+                A function that takes two arguments: the index of an atom that
+                is not unique and the index of the equivalent unique atom.
+                It should copy the results of the latter to the former.
+        '''
+        for index in xrange(self.system.natom):
+            source = self.get_equivalent_atom(index)
+            if source != index:
+                fn(index, source)
+
     def get_grid(self, index=None):
         '''Return an integration grid
 
@@ -175,6 +265,10 @@ class Part(JustOnceClass):
             output[:] = result
         return result
 
+    def _grid_alloc(self, shape):
+        '''Return the alloc argument of Cache.load for an array on a grid'''
+        return shape
+
     def get_wcor(self, index):
         '''Return the weight corrections on a grid
 
@@ -254,8 +348,15 @@ class Part(JustOnceClass):
             pseudo_populations = self.cache.load('pseudo_populations', alloc=self.system.natom, tags='o')[0]
             if log.do_medium:
                 log('Computing atomic populations.')
-            for i in xrange(self.system.natom):
+
+            def helper(i):
                 pseudo_populations[i] = self.compute_pseudo_population(i)
+
+            def helper_copy(i, source):
+                pseudo_populations[i] = pseudo_populations[source]
+
+            self.map_atoms(helper, unique=True)
+            self.copy_equivalent_atoms(helper_copy)
             populations[:] = pseudo_populations
             populations += self.system.numbers - self.system.pseudo_numbers
 
@@ -307,7 +408,9 @@ class Part(JustOnceClass):
 
         if new1 or new2:
             self.do_partitioning()
-            for i in xrange(self._system.natom):
+            self.do_moldens()
+
+            def helper(i):
                 # 1) Define a 'window' of the integration grid for this atom
                 center = self._system.coordinates[i]
                 grid = self.get_grid(i)
@@ -335,6 +438,8 @@ class Part(JustOnceClass):
                 # for the negative electron charge.
                 radial_moments[i] = grid.integrate(aim, wcor, center=center, lmax=self.lmax, mtype=3)
 
+            self.map_atoms(helper)
+
     def do_all(self):
         '''Computes all properties and return a list of their names.'''
         slow_methods = ['do_overlap_operators', 'do_bond_order', 'do_noninteracting_response']
@@ -351,7 +456,7 @@ class WPart(Part):
     # user-provided grids.
 
     '''Base class for density partitioning schemes'''
-    def __init__(self, system, grid, local=True, slow=False, lmax=3, epsilon=0):
+    def __init__(self, system, grid, local=True, slow=False, lmax=3, epsilon=0, nproc=1):
         '''
            **Arguments:**
 
@@ -374,11 +479,14 @@ class WPart(Part):
            epsilon
                 Allow errors on the computed electron density of this magnitude
                 for the sake of efficiency.
+
+           nproc
+                The number of threads used for the per-atom work.
         '''
         if local and grid.subgrids is None:
             raise ValueError('Atomic grids are discarded from molecular grid object, but are needed for local integrations.')
         self._epsilon = epsilon
-        Part.__init__(self, system, grid, local, slow, lmax)
+        Part.__init__(self, system, grid, local, slow, lmax, nproc=nproc)
 
     def _get_epsilon(self):
         return self._epsilon
@@ -442,7 +550,7 @@ class WPart(Part):
 
 class CPart(Part):
     '''Base class for density partitioning schemes of cube files'''
-    def __init__(self, system, grid, local, moldens, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3):
+    def __init__(self, system, grid, local, moldens, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, nproc=1, symmetry=None, tmpdir=None):
         '''
            **Arguments:**
 
@@ -472,6 +580,23 @@ class CPart(Part):
 
            lmax
                 The maximum angular momentum in multipole expansions.
+
+           nproc
+                The number of threads used for the per-atom work.
+
+           symmetry
+                A Symmetry object that describes the crystal. When given, the
+                atomic populations (and the proatom parameters of iterative
+                schemes) are only computed for one atom per set of equivalent
+                atoms, i.e. for each atom in the primitive unit. The results
+                are copied to the other atoms.
+
+           tmpdir
+                When given, the large arrays on the grid (the densities, the
+                atomic weights, the weight corrections and the results kept
+                with the greedy option) are stored in memory-mapped files in
+                this directory instead of in memory. The files are removed
+                automatically.
         '''
         if wcor_numbers is None:
             self._wcor_numbers = range(1, 119)
@@ -479,13 +604,76 @@ class CPart(Part):
             self._wcor_numbers = wcor_numbers
         self._wcor_rcut_max = wcor_rcut_max
         self._wcor_rcond = wcor_rcond
-        Part.__init__(self, system, grid, local, True, lmax, moldens)
+        self._tmpdir = tmpdir
+        if tmpdir is not None:
+            if not os.path.isdir(tmpdir):
+                raise ValueError('The tmpdir argument must be an existing directory.')
+            mm_moldens = self._create_memmap(moldens.shape)
+            mm_moldens[:] = moldens
+            moldens = mm_moldens
+        self._init_symmetry(system, symmetry)
+        Part.__init__(self, system, grid, local, True, lmax, moldens, nproc)
+
+    def _init_symmetry(self, system, symmetry):
+        self._symmetry = symmetry
+        if symmetry is None:
+            self._unique_atoms = range(system.natom)
+            self._equivalent_atoms = np.arange(system.natom)
+            return
+        links = symmetry.identify(system)
+        if (symmetry.numbers[links[:,0]] != system.numbers).any():
+            raise SymmetryError('The elements in the system do not match those of the primitive unit.')
+        # The first atom linked to an atom in the primitive unit is used as the
+        # unique atom for all its equivalent atoms.
+        self._unique_atoms = []
+        self._equivalent_atoms = np.zeros(system.natom, int)
+        firsts = {}
+        for index in xrange(system.natom):
+            iprim = links[index,0]
+            if iprim not in firsts:
+                firsts[iprim] = index
+                self._unique_atoms.append(index)
+            self._equivalent_atoms[index] = firsts[iprim]
 
     def _get_wcor_numbers(self):
         return self._wcor_numbers
 
     wcor_numbers = property(_get_wcor_numbers)
 
+    def _get_symmetry(self):
+        return self._symmetry
+
+    symmetry = property(_get_symmetry)
+
+    def _get_tmpdir(self):
+        return self._tmpdir
+
+    tmpdir = property(_get_tmpdir)
+
+    def _create_memmap(self, shape):
+        # The file is removed when it is closed, but the memory map remains
+        # valid until the array is deallocated.
+        with tempfile.TemporaryFile(dir=self._tmpdir) as f:
+            return np.memmap(f, dtype=float, mode='w+', shape=shape)
+
+    def _check_memmap_init_args(self, array, shape):
+        assert isinstance(array, np.memmap)
+        assert array.shape == shape
+
+    _create_memmap.__check_init_args__ = _check_memmap_init_args
+
+    def _grid_alloc(self, shape):
+        if self._tmpdir is None:
+            return shape
+        else:
+            return (self._create_memmap, tuple(shape))
+
+    def get_unique_atoms(self):
+        return self._unique_atoms
+
+    def get_equivalent_atom(self, index):
+        return self._equivalent_atoms[index]
+
     def _init_subgrids(self):
         # grids for non-periodic integrations
         self._subgrids = []
@@ -506,6 +694,8 @@ class CPart(Part):
                 ('Weight corr. numbers', ' '.join(str(n) for n in self.wcor_numbers)),
                 ('Weight corr. max rcut', '%10.5f' % self._wcor_rcut_max),
                 ('Weight corr. rcond', '%10.5e' % self._wcor_rcond),
+                ('Unique atoms', '%i of %i' % (len(self._unique_atoms), self.system.natom)),
+                ('Memory-mapped arrays in', self._tmpdir),
             ])
 
     def get_memory_estimates(self):
@@ -532,7 +722,15 @@ class CPart(Part):
 
         if not self.local:
             index = None
-        wcor, new = self.cache.load(label, index, alloc=grid.shape)
+        if index is None:
+            # The weight corrections on the full grid are shared by all atoms.
+            with self._lock:
+                return self._load_wcor(label, index, grid, funcs)
+        else:
+            return self._load_wcor(label, index, grid, funcs)
+
+    def _load_wcor(self, label, index, grid, funcs):
+        wcor, new = self.cache.load(label, index, alloc=self._grid_alloc(grid.shape), tags='r')
         if new:
             grid.compute_weight_corrections(funcs, output=wcor)
         return wcor
@@ -35,11 +35,11 @@ __all__ = ['BeckeWPart']
 
 class BeckeWPart(WPart):
     name = 'b'
-    options = ['slow', 'lmax', 'epsilon', 'k']
+    options = ['slow', 'lmax', 'epsilon', 'k', 'nproc']
     linear = True
 
     '''Class for Becke partitioning'''
-    def __init__(self, system, grid, local=True, slow=False, lmax=3, epsilon=0, k=3):
+    def __init__(self, system, grid, local=True, slow=False, lmax=3, epsilon=0, k=3, nproc=1):
         '''
            **Arguments:**
 
@@ -65,9 +65,12 @@ class BeckeWPart(WPart):
 
            k
                 The order of the polynomials used in the Becke partitioning.
+
+           nproc
+                The number of threads used for the per-atom work.
         '''
         self._k = k
-        WPart.__init__(self, system, grid, local, slow, lmax, epsilon)
+        WPart.__init__(self, system, grid, local, slow, lmax, epsilon, nproc)
 
     def _init_log_scheme(self):
         if log.do_medium:
@@ -98,13 +101,16 @@ class BeckeWPart(WPart):
 
         # Actual work
         pb = log.progress(self.system.natom)
-        for index in xrange(self.system.natom):
+
+        def helper(index):
             grid = self.get_grid(index)
             at_weights = self.cache.load('at_weights', index, alloc=grid.shape)[0]
             at_weights[:] = 1
             becke_helper_atom(grid.points, at_weights, radii, self.system.coordinates, index, self._k)
             pb()
 
+        self.map_atoms(helper)
+
     def _get_k(self):
         '''The order of the Becke switching function.'''
         return self._k
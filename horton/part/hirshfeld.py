@@ -43,7 +43,7 @@ def check_proatomdb(system, proatomdb):
 
 class HirshfeldMixin(object):
     name = 'h'
-    options = ['slow', 'lmax']
+    options = ['slow', 'lmax', 'nproc']
     linear = True
 
     def __init__(self, proatomdb):
@@ -116,22 +116,22 @@ class HirshfeldMixin(object):
 
 
 class HirshfeldWPart(HirshfeldMixin, StockholderWPart):
-    options = HirshfeldMixin.options + ['epsilon']
+    options = HirshfeldMixin.options + ['epsilon', 'proatom_tolerance']
 
-    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0):
+    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0, proatom_tolerance=0, nproc=1):
         check_proatomdb(system, proatomdb)
         HirshfeldMixin. __init__(self, proatomdb)
-        StockholderWPart.__init__(self, system, grid, local, slow, lmax, epsilon)
+        StockholderWPart.__init__(self, system, grid, local, slow, lmax, epsilon, proatom_tolerance, nproc)
 
 
 class HirshfeldCPart(HirshfeldMixin, StockholderCPart):
-    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3):
+    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, nproc=1, symmetry=None, tmpdir=None):
         '''
            See CPart base class for the description of the arguments.
         '''
         check_proatomdb(system, proatomdb)
         HirshfeldMixin. __init__(self, proatomdb)
-        StockholderCPart.__init__(self, system, grid, local, moldens, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax)
+        StockholderCPart.__init__(self, system, grid, local, moldens, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax, nproc, symmetry, tmpdir)
 
     def get_cutoff_radius(self, index):
         '''The radius at which the weight function goes to zero'''
@@ -185,6 +185,7 @@ class HirshfeldEMixin(object):
                 ('Scheme', 'Hirshfeld-E'),
                 ('Convergence threshold', '%.1e' % self._threshold),
                 ('Maximum iterations', self._maxiter),
+                ('DIIS history size', self._diis),
                 ('Proatomic DB',  self._proatomdb),
             ])
             log.cite('verstraelen2013', 'the use of Hirshfeld-E partitioning')
@@ -264,6 +265,19 @@ class HirshfeldEMixin(object):
         self._cache.dump('propars', propars, tags='o')
         return propars
 
+    def _get_propars_range(self, index):
+        begin = self.hebasis.get_atom_begin(index)
+        return begin, begin + self.hebasis.get_atom_nbasis(index)
+
+    def _fix_propars(self, propars):
+        # Respect the lower bounds of the coefficients.
+        for index in xrange(self.system.natom):
+            begin = self.hebasis.get_atom_begin(index)
+            for j in xrange(self.hebasis.get_atom_nbasis(index)):
+                lower_bound = self.hebasis.get_lower_bound(index, j)
+                propars[begin+j] = max(propars[begin+j], lower_bound)
+        return True
+
     def _update_propars_atom(self, index):
         # Prepare some things
         charges = self._cache.load('charges', alloc=self.system.natom, tags='o')[0]
@@ -394,10 +408,10 @@ class HirshfeldEMixin(object):
 
 
 class HirshfeldEWPart(HirshfeldEMixin, HirshfeldIWPart):
-    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500, greedy=False):
+    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500, greedy=False, proatom_tolerance=0, nproc=1, diis=0):
         hebasis = HEBasis(system.numbers, proatomdb)
         HirshfeldEMixin.__init__(self, hebasis)
-        HirshfeldIWPart.__init__(self, system, grid, proatomdb, local, slow, lmax, epsilon, threshold, maxiter, greedy)
+        HirshfeldIWPart.__init__(self, system, grid, proatomdb, local, slow, lmax, epsilon, threshold, maxiter, greedy, proatom_tolerance, nproc, diis)
 
     def get_wcor_fit(self, index):
         return None
@@ -416,13 +430,13 @@ class HirshfeldEWPart(HirshfeldEMixin, HirshfeldIWPart):
 
 
 class HirshfeldECPart(HirshfeldEMixin, HirshfeldICPart):
-    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, threshold=1e-6, maxiter=500, greedy=False):
+    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, threshold=1e-6, maxiter=500, greedy=False, nproc=1, diis=0, symmetry=None, tmpdir=None):
         '''
            See CPart base class for the description of the arguments.
         '''
         hebasis = HEBasis(system.numbers, proatomdb)
         HirshfeldEMixin.__init__(self, hebasis)
-        HirshfeldICPart.__init__(self, system, grid, local, moldens, proatomdb, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax, threshold, maxiter, greedy)
+        HirshfeldICPart.__init__(self, system, grid, local, moldens, proatomdb, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax, threshold, maxiter, greedy, nproc, diis, symmetry, tmpdir)
 
     def get_memory_estimates(self):
         if self.local:
@@ -33,13 +33,14 @@ __all__ = ['HirshfeldIWPart', 'HirshfeldICPart']
 
 class HirshfeldIMixin(IterativeProatomMixin):
     name = 'hi'
-    options = ['slow', 'lmax', 'threshold', 'maxiter', 'greedy']
+    options = ['slow', 'lmax', 'threshold', 'maxiter', 'greedy', 'nproc', 'diis']
     linear = False
 
-    def __init__(self, threshold=1e-6, maxiter=500, greedy=False):
+    def __init__(self, threshold=1e-6, maxiter=500, greedy=False, diis=0):
         self._threshold = threshold
         self._maxiter = maxiter
         self._greedy = greedy
+        self._diis = diis
 
     def _init_log_scheme(self):
         if log.do_medium:
@@ -47,6 +48,7 @@ class HirshfeldIMixin(IterativeProatomMixin):
                 ('Scheme', 'Hirshfeld-I'),
                 ('Convergence threshold', '%.1e' % self._threshold),
                 ('Maximum iterations', self._maxiter),
+                ('DIIS history size', self._diis),
                 ('Proatomic DB',  self._proatomdb),
             ])
             log.cite('bultinck2007', 'the use of Hirshfeld-I partitioning')
@@ -82,7 +84,7 @@ class HirshfeldIMixin(IterativeProatomMixin):
             grid = self.get_grid(index)
         key = key + (index, id(grid))
         if self._greedy:
-            result, new = self.cache.load(*key, alloc=grid.shape)
+            result, new = self.cache.load(*key, alloc=self._grid_alloc(grid.shape), tags='r')
         else:
             result = grid.zeros()
             new = True
@@ -113,6 +115,24 @@ class HirshfeldIMixin(IterativeProatomMixin):
         self.cache.dump('propars', charges, tags='o')
         return charges
 
+    def _get_propars_range(self, index):
+        return index, index+1
+
+    def _fix_propars(self, propars):
+        # The charges must be within the range of the proatom database.
+        for index in xrange(self.system.natom):
+            charges = self.proatomdb.get_charges(self.system.numbers[index])
+            if propars[index] < min(charges):
+                return False
+            pseudo_number = self.system.pseudo_numbers[index]
+            if pseudo_number - max(charges) == 1:
+                # The last record may be scaled down to zero electrons.
+                if propars[index] >= pseudo_number:
+                    return False
+            elif propars[index] > max(charges):
+                return False
+        return True
+
     def _update_propars_atom(self, index):
         # Compute population
         pseudo_population = self.compute_pseudo_population(index)
@@ -123,9 +143,9 @@ class HirshfeldIMixin(IterativeProatomMixin):
 
 
 class HirshfeldIWPart(HirshfeldIMixin, HirshfeldWPart):
-    options = HirshfeldIMixin.options + ['epsilon']
+    options = HirshfeldIMixin.options + ['epsilon', 'proatom_tolerance']
 
-    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500, greedy=False):
+    def __init__(self, system, grid, proatomdb, local=True, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500, greedy=False, proatom_tolerance=0, nproc=1, diis=0):
         '''
            **Optional arguments:** (that are not present in the base class)
 
@@ -137,9 +157,19 @@ class HirshfeldIWPart(HirshfeldIMixin, HirshfeldWPart):
            maxiter
                 The maximum number of iterations. If no convergence is reached
                 in the end, no warning is given.
+
+           proatom_tolerance
+                See StockholderWPart. This screening is not used in combination
+                with the greedy option.
+
+           diis
+                The number of previous iterations used to extrapolate the
+                charges with DIIS. The extrapolated charges are kept within
+                the range of the proatom database. The default (zero) results
+                in plain fixed-point iterations.
         '''
-        HirshfeldIMixin.__init__(self, threshold, maxiter, greedy)
-        HirshfeldWPart.__init__(self, system, grid, proatomdb, local, slow, lmax, epsilon)
+        HirshfeldIMixin.__init__(self, threshold, maxiter, greedy, diis)
+        HirshfeldWPart.__init__(self, system, grid, proatomdb, local, slow, lmax, epsilon, proatom_tolerance, nproc)
 
     def get_memory_estimates(self):
         return (
@@ -153,9 +183,13 @@ class HirshfeldIWPart(HirshfeldIMixin, HirshfeldWPart):
         else:
             HirshfeldWPart.eval_proatom(self, index, output, grid)
 
+    def _use_proatom_screening(self):
+        # The greedy version keeps the isolated atoms on the full grids.
+        return not self._greedy and HirshfeldWPart._use_proatom_screening(self)
+
 
 class HirshfeldICPart(HirshfeldIMixin, HirshfeldCPart):
-    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, threshold=1e-6, maxiter=500, greedy=False):
+    def __init__(self, system, grid, local, moldens, proatomdb, wcor_numbers=None, wcor_rcut_max=2.0, wcor_rcond=0.1, lmax=3, threshold=1e-6, maxiter=500, greedy=False, nproc=1, diis=0, symmetry=None, tmpdir=None):
         '''
            **Optional arguments:** (that are not present in the base class)
 
@@ -167,9 +201,13 @@ class HirshfeldICPart(HirshfeldIMixin, HirshfeldCPart):
            maxiter
                 The maximum number of iterations. If no convergence is reached
                 in the end, no warning is given.
+
+           diis
+                The number of previous iterations used to extrapolate the
+                charges with DIIS. See HirshfeldIWPart.
         '''
-        HirshfeldIMixin.__init__(self, threshold, maxiter, greedy)
-        HirshfeldCPart.__init__(self, system, grid, local, moldens, proatomdb, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax)
+        HirshfeldIMixin.__init__(self, threshold, maxiter, greedy, diis)
+        HirshfeldCPart.__init__(self, system, grid, local, moldens, proatomdb, wcor_numbers, wcor_rcut_max, wcor_rcond, lmax, nproc, symmetry, tmpdir)
 
     def get_memory_estimates(self):
         return (
@@ -54,8 +54,8 @@ class IterativeProatomMixin():
         self.update_at_weights()
 
         # Update the proatoms
-        for index in xrange(self.system.natom):
-            self._update_propars_atom(index)
+        self.map_atoms(self._update_propars_atom, unique=True)
+        self.copy_equivalent_atoms(self._copy_propars_atom)
 
         # Keep track of history
         self.history_charges.append(self.cache.load('charges').copy())
@@ -63,6 +63,99 @@ class IterativeProatomMixin():
     def _update_propars_atom(self, index):
         raise NotImplementedError
 
+    def _get_propars_range(self, index):
+        '''Return the begin and end of the proatom parameters of one atom'''
+        raise NotImplementedError
+
+    def _copy_propars_atom(self, index, source):
+        '''Copy the charge and proatom parameters of an equivalent atom'''
+        charges = self.cache.load('charges')
+        charges[index] = charges[source]
+        propars = self.cache.load('propars')
+        begin, end = self._get_propars_range(index)
+        source_begin, source_end = self._get_propars_range(source)
+        propars[begin:end] = propars[source_begin:source_end]
+
+    def _get_propars_weights(self):
+        '''Return the weights for the inner product of two sets of proatom parameters
+
+           The default (None) corresponds to the ordinary dot product.
+        '''
+        return None
+
+    def _fix_propars(self, propars):
+        '''Make extrapolated proatom parameters feasible (in-place)
+
+           **Returns:** False if the parameters can not be fixed.
+        '''
+        return True
+
+    def _extrapolate_propars(self, propars, old_propars, diis_history):
+        '''Replace the proatom parameters by a DIIS extrapolation
+
+           **Arguments:**
+
+           propars
+                The proatom parameters after the last update. They are
+                overwritten by the extrapolated parameters.
+
+           old_propars
+                The proatom parameters that were used for the last update.
+
+           diis_history
+                A list with pairs of updated parameters and the corresponding
+                residuals, from previous iterations. It is updated in-place.
+
+           The extrapolation is a linear combination of the updated parameters
+           from the history, whose coefficients minimize the norm of the same
+           combination of residuals (Pulay's DIIS, or Anderson mixing without
+           damping). When the last residual is larger than all those in the
+           history, or when the extrapolated parameters are not feasible, the
+           history is discarded and a plain fixed-point step is taken.
+        '''
+        weights = self._get_propars_weights()
+        residual = propars - old_propars
+        if weights is None:
+            norm = np.dot(residual, residual)
+        else:
+            norm = np.dot(residual*weights, residual)
+        if len(diis_history) > 0 and norm > max(item[2] for item in diis_history):
+            del diis_history[:]
+        diis_history.append((propars.copy(), residual, norm))
+        if len(diis_history) > self._diis:
+            del diis_history[0]
+
+        nvector = len(diis_history)
+        if nvector < 2:
+            return
+
+        # Set up the linear system for the DIIS coefficients, with the
+        # constraint that their sum equals one.
+        a = np.zeros((nvector+1, nvector+1), float)
+        b = np.zeros(nvector+1, float)
+        for i0 in xrange(nvector):
+            r0 = diis_history[i0][1]
+            if weights is not None:
+                r0 = r0*weights
+            for i1 in xrange(i0+1):
+                a[i0, i1] = np.dot(r0, diis_history[i1][1])
+                a[i1, i0] = a[i0, i1]
+        # Rescale for the sake of numerical stability
+        scale = abs(np.diag(a)[:nvector]).max()
+        a[:nvector,:nvector] /= scale
+        a[nvector,:nvector] = 1
+        a[:nvector,nvector] = 1
+        b[nvector] = 1
+        coeffs = np.linalg.lstsq(a, b, rcond=1e-12)[0][:nvector]
+
+        extrapolated = 0.0
+        for coeff, (updated, residual, norm) in zip(coeffs, diis_history):
+            extrapolated += coeff*updated
+        if self._fix_propars(extrapolated):
+            propars[:] = extrapolated
+        else:
+            del diis_history[:-1]
+
     def _finalize_propars(self):
         charges = self._cache.load('charges')
         self.cache.dump('history_propars', np.array(self.history_propars), tags='o')
@@ -88,6 +181,7 @@ class IterativeProatomMixin():
 
             counter = 0
             change = 1e100
+            diis_history = []
 
             while True:
                 counter += 1
@@ -103,6 +197,10 @@ class IterativeProatomMixin():
                 if change < self._threshold or counter >= self._maxiter:
                     break
 
+                # Accelerate the convergence
+                if self._diis > 0:
+                    self._extrapolate_propars(propars, old_propars, diis_history)
+
             if log.medium:
                 log.hline()
 
@@ -114,13 +212,31 @@ class IterativeProatomMixin():
 class IterativeStockholderWPart(IterativeProatomMixin, StockholderWPart):
     '''Class for Iterative Stockholder Partitioning'''
     name = 'is'
-    options = ['slow', 'lmax', 'threshold', 'maxiter', 'epsilon']
+    options = ['slow', 'lmax', 'threshold', 'maxiter', 'epsilon', 'proatom_tolerance', 'nproc', 'diis']
     linear = False
 
-    def __init__(self, system, grid, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500):
+    def __init__(self, system, grid, slow=False, lmax=3, epsilon=0, threshold=1e-6, maxiter=500, proatom_tolerance=0, nproc=1, diis=0):
+        '''
+           See StockholderWPart for the description of the other arguments.
+
+           **Optional arguments:** (that are not present in the base class)
+
+           threshold
+                The procedure is considered to be converged when the change of
+                the proatoms between two iterations drops below this threshold.
+
+           maxiter
+                The maximum number of iterations.
+
+           diis
+                The number of previous iterations used to extrapolate the
+                proatoms with DIIS. The default (zero) results in plain
+                fixed-point iterations.
+        '''
         self._threshold = threshold
         self._maxiter = maxiter
-        StockholderWPart.__init__(self, system, grid, True, slow, lmax, epsilon)
+        self._diis = diis
+        StockholderWPart.__init__(self, system, grid, True, slow, lmax, epsilon, proatom_tolerance, nproc)
 
     def _init_log_scheme(self):
         if log.do_medium:
@@ -128,6 +244,7 @@ class IterativeStockholderWPart(IterativeProatomMixin, StockholderWPart):
                 ('Scheme', 'Iterative Stockholder'),
                 ('Convergence threshold', '%.1e' % self._threshold),
                 ('Maximum iterations', self._maxiter),
+                ('DIIS history size', self._diis),
             ])
             log.cite('lillestolen2008', 'the use of Iterative Stockholder partitioning')
 
@@ -146,8 +263,22 @@ class IterativeStockholderWPart(IterativeProatomMixin, StockholderWPart):
             npoint = self.get_rgrid(index).size
             self._ranges.append(self._ranges[-1]+npoint)
         ntotal = self._ranges[-1]
+        # The charges are allocated here because the proatoms of different
+        # atoms may be updated in parallel.
+        self.cache.load('charges', alloc=self.system.natom, tags='o')
         return self.cache.load('propars', alloc=ntotal, tags='o')[0]
 
+    def _get_propars_range(self, index):
+        return self._ranges[index], self._ranges[index+1]
+
+    def _get_propars_weights(self):
+        # The radial integration weights, consistent with compute_change.
+        return np.concatenate([self.get_rgrid(index).weights for index in xrange(self.system.natom)])
+
+    def _fix_propars(self, propars):
+        np.clip(propars, 1e-100, np.inf, out=propars)
+        return True
+
     def _update_propars_atom(self, index):
         # compute spherical average
         atgrid = self.get_grid(index)
@@ -21,8 +21,9 @@
 '''Pro-atom databases'''
 
 
-import os
+import os, threading
 import h5py as h5, numpy as np
+from collections import OrderedDict
 
 from horton.context import context
 from horton.grid.atgrid import AtomicGrid, AtomicGridSpec
@@ -293,6 +294,13 @@ class ProAtomDB(object):
 
            Based on the records present it is determined which records are
            safe to use, i.e. apparently not bound by the basis set.
+
+           Densities and splines of combinations of pro-atoms (see ``get_rho``
+           and ``get_spline``) are memoized. The attribute ``cache_size``
+           controls the number of results that are kept (least recently used
+           results are discarded first) and ``cache_decimals`` controls the
+           number of decimals to which the coefficients of a combination are
+           rounded.
         '''
         # Search for diplicates (same number and charge) and only retain the
         # lowest in energy for each combination.
@@ -328,6 +336,12 @@ class ProAtomDB(object):
                     r1 = self.get_record(number, charge1)
                     r0.update_safe(r1)
 
+        # Memoized densities and splines
+        self.cache_size = 256
+        self.cache_decimals = 10
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+
         # Screen info
         self._log_init()
 
@@ -435,7 +449,7 @@ class ProAtomDB(object):
         return cls.from_files(fns_chk, agspec)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, numbers=None, mmap=False):
         '''Construct an dabase from an HDF5 file
 
            **Arguments:**
@@ -444,16 +458,32 @@ class ProAtomDB(object):
                 A string with the filename of the hdf5 file, or a h5.File or
                 h5.Group object.
 
+           **Optional arguments:**
+
+           numbers
+                A list of element numbers. When given, only the records of
+                these elements are loaded. Other groups in the HDF5 file are
+                not read.
+
+           mmap
+                When set to True, the densities and their derivatives are
+                memory-mapped (copy-on-write) from an HDF5 file instead of
+                being read. Only the parts that are used are then loaded from
+                disk. This only works for uncompressed datasets in a file given
+                by its filename. Other datasets are just read.
+
            Note that the records are loaded and given as argument to the
            constructor, which may weed out duplicates.
         '''
         if isinstance(filename, h5.Group):
-            records = load_proatom_records_h5_group(filename)
+            records = load_proatom_records_h5_group(filename, numbers)
         elif isinstance(filename, basestring):
             if filename.endswith('.h5'):
-                records = load_proatom_records_h5_file(filename)
+                records = load_proatom_records_h5_file(filename, numbers, mmap)
             elif filename.endswith('.atdens'):
                 records = load_proatom_records_atdens(filename)
+                if numbers is not None:
+                    records = [r for r in records if r.number in numbers]
             else:
                 raise ValueError('Proatomdb file type not supported')
         else:
@@ -529,6 +559,10 @@ class ProAtomDB(object):
                 When set to True, the derivative of rho is also returned. In
                 case the derivative is not available, the second return value is
                 None.
+
+           The combinations are memoized and the coefficients are rounded to
+           ``cache_decimals`` decimals. The returned arrays are shared between
+           calls and must not be modified.
         '''
         if isinstance(parameters, int):
             charge = parameters
@@ -538,38 +572,8 @@ class ProAtomDB(object):
             else:
                 return record.rho
         elif isinstance(parameters, dict):
-            rho = 0.0
-            if do_deriv:
-                deriv = 0.0
-            else:
-                deriv = None
-            if combine == 'linear':
-                for charge, coeff in parameters.iteritems():
-                    if coeff != 0.0:
-                        record = self.get_record(number, charge)
-                        rho += coeff*record.rho
-                        if do_deriv and record.deriv is not None and deriv is not None:
-                            deriv += coeff*record.deriv
-                        else:
-                            deriv = None
-            elif combine == 'geometric':
-                for charge, coeff in parameters.iteritems():
-                    if coeff != 0.0:
-                        record = self.get_record(number, charge)
-                        rho += coeff*np.log(record.rho)
-                        if do_deriv and record.deriv is not None and deriv is not None:
-                            deriv += coeff*record.deriv/record.rho
-                        else:
-                            deriv = None
-                rho = np.exp(rho)
-                if do_deriv and deriv is not None:
-                    deriv = rho*deriv
-            else:
-                raise ValueError('Combine argument "%s" not supported.' % combine)
-            if not isinstance(rho, np.ndarray):
-                rho = self.get_rgrid(number).zeros()
-                if do_deriv:
-                    deriv = self.get_rgrid(number).zeros()
+            key = self._get_lico_key(number, parameters, combine)
+            rho, deriv = self._lru_load(('rho',) + key, self._compute_rho, *key)
             if do_deriv:
                 return rho, deriv
             else:
@@ -577,14 +581,96 @@ class ProAtomDB(object):
         else:
             raise TypeError('Could not interpret parameters argument')
 
+    def _get_lico_key(self, number, parameters, combine):
+        '''Return a hashable and rounded version of the get_rho arguments'''
+        lico = tuple(sorted(
+            (charge, round(coeff, self.cache_decimals))
+            for charge, coeff in parameters.iteritems()
+        ))
+        return number, lico, combine
+
+    def _lru_load(self, key, fn, *args):
+        '''Return a memoized result of fn(*args)
+
+           This method may be called from several threads at once. The
+           computation itself is done without holding the lock, such that two
+           threads may occasionally compute the same result.
+        '''
+        with self._lru_lock:
+            result = self._lru.pop(key, None)
+            if result is not None and self.cache_size > 0:
+                self._lru[key] = result
+        if result is None:
+            result = fn(*args)
+            with self._lru_lock:
+                if self.cache_size > 0:
+                    self._lru.pop(key, None)
+                    while len(self._lru) >= self.cache_size:
+                        self._lru.popitem(last=False)
+                    self._lru[key] = result
+        return result
+
+    def _compute_rho(self, number, lico, combine):
+        '''Compute a combination of proatom densities and their derivatives'''
+        rho = 0.0
+        deriv = 0.0
+        if combine == 'linear':
+            for charge, coeff in lico:
+                if coeff != 0.0:
+                    record = self.get_record(number, charge)
+                    rho += coeff*record.rho
+                    if record.deriv is not None and deriv is not None:
+                        deriv += coeff*record.deriv
+                    else:
+                        deriv = None
+        elif combine == 'geometric':
+            for charge, coeff in lico:
+                if coeff != 0.0:
+                    record = self.get_record(number, charge)
+                    rho += coeff*np.log(record.rho)
+                    if record.deriv is not None and deriv is not None:
+                        deriv += coeff*record.deriv/record.rho
+                    else:
+                        deriv = None
+            rho = np.exp(rho)
+            if deriv is not None:
+                deriv = rho*deriv
+        else:
+            raise ValueError('Combine argument "%s" not supported.' % combine)
+        if not isinstance(rho, np.ndarray):
+            rho = self.get_rgrid(number).zeros()
+            deriv = self.get_rgrid(number).zeros()
+        # The results are shared, so they should not be modified.
+        rho.flags.writeable = False
+        if deriv is not None:
+            deriv.flags.writeable = False
+        return rho, deriv
+
     def get_spline(self, number, parameters=0, combine='linear'):
         '''Construct a proatom spline.
 
            **Arguments:** See ``get_rho`` method.
+
+           The splines are memoized in the same way as the combinations of
+           proatom densities.
         '''
+        if isinstance(parameters, int):
+            key = ('spline', number, parameters)
+        elif isinstance(parameters, dict):
+            key = ('spline',) + self._get_lico_key(number, parameters, combine)
+        else:
+            raise TypeError('Could not interpret parameters argument')
+        return self._lru_load(key, self._compute_spline, number, parameters, combine)
+
+    def _compute_spline(self, number, parameters, combine):
         rho, deriv = self.get_rho(number, parameters, combine, do_deriv=True)
         return CubicSpline(rho, deriv, self.get_rgrid(number).rtransform)
 
+    def clear_cache(self):
+        '''Discard all memoized densities and splines'''
+        with self._lru_lock:
+            self._lru.clear()
+
     def compact(self, nel_lost):
         '''Make the pro-atoms more compact
 
@@ -598,6 +684,7 @@ class ProAtomDB(object):
            Note that only 'safe' atoms are considered to determine the cutoff
            radius.
         '''
+        self.clear_cache()
         if log.do_medium:
             log('Reducing extents of the pro-atoms')
             log('   Z     npiont           radius')
@@ -623,6 +710,7 @@ class ProAtomDB(object):
             log.hline()
 
     def normalize(self):
+        self.clear_cache()
         if log.do_medium:
             log('Normalizing proatoms to integer populations')
             log('   Z  charge             before             after')
@@ -641,13 +729,42 @@ class ProAtomDB(object):
                     ))
 
 
-def load_proatom_records_h5_group(f):
-    '''Load proatom records from the given HDF5 group'''
+def _load_dataset(ds, mmap):
+    '''Read a dataset or map it in memory when possible'''
+    if mmap and ds.chunks is None and ds.compression is None:
+        offset = ds.id.get_offset()
+        if offset is not None:
+            return np.memmap(ds.file.filename, ds.dtype, 'c', offset, ds.shape)
+    return ds[:]
+
+
+def load_proatom_records_h5_group(f, numbers=None, mmap=False):
+    '''Load proatom records from the given HDF5 group
+
+       **Arguments:**
+
+       f
+            An HDF5 group with a subgroup for each record.
+
+       **Optional arguments:**
+
+       numbers, mmap
+            See ``ProAtomDB.from_file``.
+    '''
     records = []
-    for grp in f.itervalues():
+    for name, grp in f.iteritems():
         assert isinstance(grp, h5.Group)
+        if numbers is not None:
+            # The group name has the form Z=${number}_Q=${charge}. Checking the
+            # name avoids reading the attributes of groups that are not needed.
+            if name.startswith('Z='):
+                number = int(name[2:name.index('_')])
+            else:
+                number = grp.attrs['number']
+            if number not in numbers:
+                continue
         if 'deriv' in grp:
-            deriv = grp['deriv'][:]
+            deriv = _load_dataset(grp['deriv'], mmap)
         else:
             deriv = None
         records.append(ProAtomRecord(
@@ -656,7 +773,7 @@ def load_proatom_records_h5_group(f):
             energy=grp.attrs['energy'],
             homo_energy=grp.attrs.get('homo_energy'),
             rgrid=RadialGrid(RTransform.from_string(grp.attrs['rtransform'])),
-            rho=grp['rho'][:],
+            rho=_load_dataset(grp['rho'], mmap),
             deriv=deriv,
             pseudo_number=grp.attrs.get('pseudo_number'),
             ipot_energy=grp.attrs.get('ipot_energy'),
@@ -664,10 +781,10 @@ def load_proatom_records_h5_group(f):
     return records
 
 
-def load_proatom_records_h5_file(filename):
+def load_proatom_records_h5_file(filename, numbers=None, mmap=False):
     '''Load proatom records from the given HDF5 file'''
     with LockedH5File(filename) as f:
-        return load_proatom_records_h5_group(f)
+        return load_proatom_records_h5_group(f, numbers, mmap)
 
 
 def load_proatom_records_atdens(filename):
@@ -24,7 +24,8 @@
 import numpy as np
 
 from horton.log import log
-from horton.grid.cext import CubicSpline
+from horton.cext import Cell
+from horton.grid.cext import CubicSpline, eval_spline_grid
 from horton.part.base import WPart, CPart
 
 __all__ = [
@@ -58,6 +59,8 @@ class StockHolderMixin(object):
         # Check for negative parts
         original = rgrid.integrate(rho)
         if rho.min() < 0:
+            # Work on a copy, rho may be shared with the proatom database.
+            rho = rho.copy()
             rho[rho<0] = 0.0
             deriv = None
             error = rgrid.integrate(rho) - original
@@ -96,39 +99,207 @@ class StockHolderMixin(object):
     def update_at_weights(self):
         # This will reconstruct the promolecular density and atomic weights
         # based on the current proatomic splines.
-        promoldens = self.cache.load('promoldens', alloc=self.grid.shape)[0]
+        promoldens = self.cache.load('promoldens', alloc=self._grid_alloc(self.grid.shape))[0]
         promoldens[:] = 0
 
         # update the promolecule density and store the proatoms in the at_weights
         # arrays for later.
-        for index in xrange(self.system.natom):
+        def helper_pro(index):
             grid = self.get_grid(index)
-            at_weights = self.cache.load('at_weights', index, alloc=grid.shape)[0]
+            at_weights = self.cache.load('at_weights', index, alloc=self._grid_alloc(grid.shape))[0]
             self.update_pro(index, at_weights, promoldens)
 
+        self.map_atoms(helper_pro)
+
         # Compute the atomic weights by taking the ratios between proatoms and
         # promolecules.
-        for index in xrange(self.system.natom):
+        def helper_weights(index):
             at_weights = self.cache.load('at_weights', index)
             at_weights /= self.to_atomic_grid(index, promoldens)
             np.clip(at_weights, 0, 1, out=at_weights)
 
+        self.map_atoms(helper_weights)
+
     def update_pro(self, index, proatdens, promoldens):
+        '''Compute a proatom and add it to the promolecular density
+
+           **Arguments:**
+
+           index
+                The index of the atom.
+
+           proatdens
+                The output array for the proatom density.
+
+           promoldens
+                The promolecular density, which is shared by all atoms. It
+                should only be updated while holding ``self._lock``.
+        '''
         raise NotImplementedError
 
 
 class StockholderWPart(StockHolderMixin, WPart):
+    def __init__(self, system, grid, local=True, slow=False, lmax=3, epsilon=0, proatom_tolerance=0, nproc=1):
+        '''
+           See WPart base class for the description of the other arguments.
+
+           **Optional arguments:** (that are not present in the base class)
+
+           proatom_tolerance
+                When larger than zero, each proatom is only evaluated on the
+                radial shells of the atomic grids that intersect with the
+                sphere beyond which its radial density drops below this
+                tolerance. This requires a molecular grid with atomic
+                subgrids, e.g. a BeckeMolGrid with mode 'keep' or 'only'. The
+                default (zero) evaluates all proatoms on the entire molecular
+                grid.
+        '''
+        if proatom_tolerance < 0:
+            raise ValueError('The proatom_tolerance argument can not be negative.')
+        self._proatom_tolerance = proatom_tolerance
+        WPart.__init__(self, system, grid, local, slow, lmax, epsilon, nproc)
+
+    def _get_proatom_tolerance(self):
+        return self._proatom_tolerance
+
+    proatom_tolerance = property(_get_proatom_tolerance)
+
+    def get_proatom_cutoff_spline(self, index):
+        '''Return a spline for the proatom that is chopped at the cutoff radius
+
+           **Arguments:**
+
+           index
+                The index of the atom.
+
+           **Returns:** the chopped spline and the cutoff radius. Beyond this
+           radius, the radial density of the proatom is below the
+           ``proatom_tolerance``.
+        '''
+        rho, deriv = self.get_proatom_rho(index)
+        rho, deriv = self.fix_proatom_rho(index, rho, deriv)
+        rtf = self.get_rgrid(index).rtransform
+        # Keep one extra grid point to have a smooth transition to zero.
+        mask = (rho > self._proatom_tolerance).nonzero()[0]
+        if len(mask) == 0:
+            npoint = 2
+        else:
+            npoint = max(2, min(mask[-1] + 2, rtf.npoint))
+        if npoint < rtf.npoint:
+            rtf = rtf.chop(npoint)
+            rho = rho[:npoint].copy()
+            if deriv is not None:
+                deriv = deriv[:npoint].copy()
+        return CubicSpline(rho, deriv, rtf), rtf.radius(npoint-1)
+
+    def get_subgrid_shells(self, index):
+        '''Return the radial shells of the atomic grid of an atom
+
+           **Arguments:**
+
+           index
+                The index of the atom.
+
+           **Returns:** the radii of the spherical shells and the offsets of
+           their first points in the atomic grid. The last offset is the size
+           of the atomic grid. The points of shell ``i`` are
+           ``points[offsets[i]:offsets[i+1]]``.
+        '''
+        result = self.cache.load('subgrid_shells', index, default=None)
+        if result is None:
+            subgrid = self.grid.subgrids[index]
+            offsets = np.zeros(len(subgrid.nlls)+1, int)
+            offsets[1:] = np.cumsum(subgrid.nlls)
+            result = subgrid.rgrid.radii, offsets
+            # Only store the complete result. Other threads may be looking it
+            # up at the same time.
+            with self._lock:
+                if ('subgrid_shells', index) not in self.cache:
+                    self.cache.dump('subgrid_shells', index, result)
+                result = self.cache.load('subgrid_shells', index)
+        return result
+
+    def get_subgrid_rmax(self):
+        '''Return the radii of the outermost shells of all atomic grids'''
+        rmax = self.cache.load('subgrid_rmax', default=None)
+        if rmax is None:
+            rmax = np.array([
+                self.get_subgrid_shells(index)[0][-1]
+                for index in xrange(self.system.natom)
+            ])
+            # Only store the complete result. Other threads may be looking it
+            # up at the same time.
+            with self._lock:
+                if 'subgrid_rmax' not in self.cache:
+                    self.cache.dump('subgrid_rmax', rmax)
+                rmax = self.cache.load('subgrid_rmax')
+        return rmax
+
+    def _use_proatom_screening(self):
+        return self._proatom_tolerance > 0 and self.grid.subgrids is not None
+
     def update_pro(self, index, proatdens, promoldens):
-        work = self.grid.zeros()
-        self.eval_proatom(index, work, self.grid)
-        promoldens += work
-        proatdens[:] = self.to_atomic_grid(index, work)
+        if self._use_proatom_screening():
+            self._update_pro_screened(index, proatdens, promoldens)
+        else:
+            work = self.grid.zeros()
+            self.eval_proatom(index, work, self.grid)
+            with self._lock:
+                promoldens += work
+            proatdens[:] = self.to_atomic_grid(index, work)
+
+    def _update_pro_screened(self, index, proatdens, promoldens):
+        spline, rcut = self.get_proatom_cutoff_spline(index)
+        center = self.system.coordinates[index]
+        cell = Cell(None)
+
+        # The shells of the atomic grids serve as a spatial index: only those
+        # shells whose distance to the proatom center can be below the cutoff
+        # radius are considered.
+        deltas = self.system.coordinates - center
+        distances = np.sqrt((deltas*deltas).sum(axis=1))
+
+        # Each point of proatdens gets a tiny contribution to avoid divisions
+        # by zero. The same contribution is added to the promolecule, such
+        # that the atomic weights still sum to one where no proatom reaches.
+        proatdens[:] = 1e-100
+        with self._lock:
+            if self.local:
+                subgrid = self.grid.subgrids[index]
+                promoldens[subgrid.begin:subgrid.end] += 1e-100
+            else:
+                promoldens += 1e-100
+        for other in (distances < rcut + self.get_subgrid_rmax()).nonzero()[0]:
+            radii, offsets = self.get_subgrid_shells(other)
+            ishell0 = radii.searchsorted(distances[other] - rcut)
+            ishell1 = radii.searchsorted(distances[other] + rcut, 'right')
+            if ishell0 >= ishell1:
+                continue
+            subgrid = self.grid.subgrids[other]
+            begin = offsets[ishell0]
+            end = offsets[ishell1]
+            work = np.zeros(end - begin)
+            eval_spline_grid(spline, center, work, subgrid.points[begin:end], cell)
+            begin += subgrid.begin
+            end += subgrid.begin
+            with self._lock:
+                promoldens[begin:end] += work
+            if not self.local:
+                proatdens[begin:end] += work
+            elif other == index:
+                proatdens[begin-subgrid.begin:end-subgrid.begin] += work
 
 
 class StockholderCPart(StockHolderMixin, CPart):
     def update_pro(self, index, proatdens, promoldens):
         self.eval_proatom(index, proatdens)
-        promoldens += self.to_sys_grid(index, proatdens)
+        with self._lock:
+            if self.local:
+                # Add the proatom to the promolecule without a temporary copy
+                # on the full grid.
+                self.get_grid(index).wrap(proatdens, promoldens)
+            else:
+                promoldens += proatdens
 
     def to_sys_grid(self, index, data):
         if self.local:
@@ -30,6 +30,7 @@ from horton import *
 __all__ = [
     'get_proatomdb_cp2k', 'get_proatomdb_hf_sto3g',
     'get_proatomdb_hf_lan', 'get_fake_co', 'get_fake_pseudo_oo',
+    'get_fake_pseudo_oo_sym',
     'check_names', 'check_proatom_splines',
 ]
 
@@ -113,6 +114,39 @@ def get_fake_pseudo_oo():
     return sys, ugrid, moldens, proatomdb
 
 
+def get_fake_pseudo_oo_sym():
+    # Define a periodic system with two oxygens that are related by a mirror
+    # plane, also on the grid.
+    symmetry = Symmetry(
+        'mirror',
+        [np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]]),
+         np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, -1, 0]])],
+        np.array([[0.0, 0.0, 7.0/30.0]]),
+        np.array([8]),
+        Cell(np.identity(3, float)*6.0),
+    )
+    coordinates, numbers, links = symmetry.generate()
+    pseudo_numbers = np.array([6, 6])
+    sys = System(coordinates, numbers, pseudo_numbers=pseudo_numbers, cell=symmetry.cell)
+
+    # Load some pro-atoms
+    proatomdb = get_proatomdb_cp2k()
+    proatomdb.compact(0.02)
+
+    # Make fake cube data
+    origin = np.zeros(3, float)
+    rvecs = np.identity(3, float)*0.2
+    shape = np.array([30, 30, 30])
+    ugrid = UniformGrid(origin, rvecs, shape, np.ones(3, int))
+
+    moldens = np.zeros(ugrid.shape)
+    for i in xrange(sys.natom):
+        spline = proatomdb.get_spline(8, {+1: 0.5, 0: 0.3, -1: 0.2})
+        ugrid.eval_spline(spline, sys.coordinates[i], moldens)
+
+    return sys, ugrid, moldens, proatomdb, symmetry
+
+
 def check_names(names, part):
     for name in names:
         assert name in part.cache
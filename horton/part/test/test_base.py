@@ -58,7 +58,7 @@ def test_wpart_schemes():
     assert 'hi' in wpart_schemes
     assert 'he' in wpart_schemes
     assert wpart_schemes['hi'] is HirshfeldIWPart
-    assert wpart_schemes['hi'].options == ['slow', 'lmax', 'threshold', 'maxiter', 'greedy', 'epsilon']
+    assert wpart_schemes['hi'].options == ['slow', 'lmax', 'threshold', 'maxiter', 'greedy', 'nproc', 'diis', 'epsilon', 'proatom_tolerance']
     assert not wpart_schemes['hi'].linear
     assert wpart_schemes['h'].linear
     assert wpart_schemes['b'].linear
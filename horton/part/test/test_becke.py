@@ -45,6 +45,39 @@ def test_becke_n2_hfs_sto3g():
     assert abs(bp['charges']).max() < 1e-4
 
 
+def test_becke_n2_hfs_sto3g_nproc():
+    fn_fchk = context.get_fn('test/n2_hfs_sto3g.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(1e-3, 1e1, 100)
+    rgrid = RadialGrid(rtf)
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode='only')
+    bp = BeckeWPart(sys, grid, nproc=2)
+    bp.do_charges()
+    assert abs(bp['populations'] - 7).max() < 1e-4
+    assert abs(bp['charges']).max() < 1e-4
+
+
+def test_map_atoms_num_threads():
+    fn_fchk = context.get_fn('test/n2_hfs_sto3g.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(1e-3, 1e1, 100)
+    rgrid = RadialGrid(rtf)
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode='only')
+    bp = BeckeWPart(sys, grid, nproc=2)
+    nthread = get_num_threads()
+    try:
+        set_num_threads(4)
+        results = {}
+        def fn(index):
+            results[index] = get_num_threads()
+        bp.map_atoms(fn)
+        assert results == {0: 2, 1: 2}
+        # The settings of the calling thread are not affected.
+        assert get_num_threads() == 4
+    finally:
+        set_num_threads(nthread)
+
+
 def test_becke_nonlocal_lih_hf_321g():
     fn_fchk = context.get_fn('test/li_h_3-21G_hf_g09.fchk')
     sys = System.from_file(fn_fchk)
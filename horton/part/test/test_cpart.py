@@ -21,9 +21,12 @@
 #pylint: skip-file
 
 
+import numpy as np
+from nose.tools import assert_raises
 from horton import *
+from horton.test.common import tmpdir
 from horton.part.test.common import check_names, check_proatom_splines, \
-    get_fake_co, get_fake_pseudo_oo
+    get_fake_co, get_fake_pseudo_oo, get_fake_pseudo_oo_sym
 
 
 def check_jbw_coarse(local):
@@ -112,6 +115,13 @@ def test_hirshfeld_fake_pseudo_nowcor_global():
     check_fake('h', pseudo=True, dowcor=True, local=False, absmean=0.213)
 
 
+def test_hirshfeld_fake_pseudo_local_nproc():
+    check_fake('h', pseudo=True, dowcor=True, local=True, absmean=0.213, nproc=2)
+
+
+def test_hirshfeld_fake_pseudo_global_nproc():
+    check_fake('h', pseudo=True, dowcor=True, local=False, absmean=0.213, nproc=2)
+
 
 def test_hirshfeld_i_fake_local():
     check_fake('hi', pseudo=False, dowcor=True, local=True, absmean=0.428, threshold=1e-5)
@@ -125,6 +135,10 @@ def test_hirshfeld_i_fake_pseudo_local():
     check_fake('hi', pseudo=True, dowcor=True, local=True, absmean=0.400, threshold=1e-4)
 
 
+def test_hirshfeld_i_fake_pseudo_local_diis():
+    check_fake('hi', pseudo=True, dowcor=True, local=True, absmean=0.400, threshold=1e-4, diis=4)
+
+
 def test_hirshfeld_i_fake_pseudo_global():
     check_fake('hi', pseudo=True, dowcor=True, local=False, absmean=0.400, threshold=1e-4)
 
@@ -175,6 +189,10 @@ def test_hirshfeld_e_fake_pseudo_local():
     check_fake('he', pseudo=True, dowcor=True, local=True, absmean=0.396, threshold=1e-4)
 
 
+def test_hirshfeld_e_fake_pseudo_local_diis():
+    check_fake('he', pseudo=True, dowcor=True, local=True, absmean=0.396, threshold=1e-4, diis=4)
+
+
 def test_hirshfeld_e_fake_pseudo_global():
     check_fake('he', pseudo=True, dowcor=True, local=False, absmean=0.396, threshold=1e-4)
 
@@ -209,3 +227,86 @@ def test_hirshfeld_e_fake_pseudo_nowcor_local_greedy():
 
 def test_hirshfeld_e_fake_pseudo_nowcor_global_greedy():
     check_fake('he', pseudo=True, dowcor=True, local=False, absmean=0.396, threshold=1e-4, greedy=True)
+
+
+def check_fake_symmetry(scheme, local, **kwargs):
+    sys, ugrid, mol_dens, proatomdb, symmetry = get_fake_pseudo_oo_sym()
+    CPartClass = cpart_schemes[scheme]
+    cpart1 = CPartClass(sys, ugrid, local, mol_dens, proatomdb, range(119), **kwargs)
+    cpart1.do_charges()
+    cpart2 = CPartClass(sys, ugrid, local, mol_dens, proatomdb, range(119), symmetry=symmetry, **kwargs)
+    assert cpart2.get_unique_atoms() == [0]
+    assert cpart2.get_equivalent_atom(1) == 0
+    cpart2.do_charges()
+    assert abs(cpart2['charges'][0] - cpart2['charges'][1]) < 1e-10
+    assert abs(cpart1['charges'] - cpart2['charges']).max() < 1e-6
+    if 'niter' in cpart1.cache:
+        assert cpart1['niter'] == cpart2['niter']
+
+
+def test_hirshfeld_fake_symmetry_local():
+    check_fake_symmetry('h', True)
+
+
+def test_hirshfeld_fake_symmetry_global():
+    check_fake_symmetry('h', False)
+
+
+def test_hirshfeld_i_fake_symmetry_local():
+    check_fake_symmetry('hi', True)
+
+
+def test_hirshfeld_i_fake_symmetry_global():
+    check_fake_symmetry('hi', False)
+
+
+def test_hirshfeld_e_fake_symmetry_local():
+    check_fake_symmetry('he', True)
+
+
+def test_hirshfeld_e_fake_symmetry_local_diis():
+    check_fake_symmetry('he', True, diis=4)
+
+
+def test_hirshfeld_fake_symmetry_error():
+    sys, ugrid, mol_dens, proatomdb, symmetry = get_fake_pseudo_oo_sym()
+    sys.coordinates[1, 2] += 1.0
+    with assert_raises(SymmetryError):
+        HirshfeldCPart(sys, ugrid, True, mol_dens, proatomdb, symmetry=symmetry)
+
+
+def check_fake_tmpdir(scheme, local, **kwargs):
+    sys, ugrid, mol_dens, proatomdb = get_fake_pseudo_oo()
+    CPartClass = cpart_schemes[scheme]
+    cpart1 = CPartClass(sys, ugrid, local, mol_dens, proatomdb, range(119), **kwargs)
+    cpart1.do_charges()
+    with tmpdir('horton.part.test.test_cpart.check_fake_tmpdir') as dn:
+        cpart2 = CPartClass(sys, ugrid, local, mol_dens, proatomdb, range(119), tmpdir=dn, **kwargs)
+        cpart2.do_charges()
+        assert isinstance(cpart2['moldens'], np.memmap)
+        assert isinstance(cpart2['promoldens'], np.memmap)
+        assert isinstance(cpart2['at_weights', 0], np.memmap)
+        assert isinstance(cpart2.get_wcor(0), np.memmap)
+        assert abs(cpart1['charges'] - cpart2['charges']).max() < 1e-10
+
+
+def test_hirshfeld_fake_tmpdir_local():
+    check_fake_tmpdir('h', True)
+
+
+def test_hirshfeld_fake_tmpdir_global():
+    check_fake_tmpdir('h', False)
+
+
+def test_hirshfeld_i_fake_tmpdir_local_greedy():
+    check_fake_tmpdir('hi', True, greedy=True)
+
+
+def test_hirshfeld_e_fake_tmpdir_global_greedy():
+    check_fake_tmpdir('he', False, greedy=True, threshold=1e-4)
+
+
+def test_tmpdir_error():
+    sys, ugrid, mol_dens, proatomdb = get_fake_pseudo_oo()
+    with assert_raises(ValueError):
+        HirshfeldCPart(sys, ugrid, True, mol_dens, proatomdb, tmpdir='/nonexisting/directory')
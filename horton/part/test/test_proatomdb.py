@@ -21,6 +21,7 @@
 #pylint: skip-file
 
 
+import sys, threading
 import numpy as np, h5py as h5
 
 from horton import *
@@ -123,6 +124,89 @@ def test_io_filename():
         compare_padbs(padb1, padb2)
 
 
+def test_io_numbers_mmap():
+    padb1 = get_proatomdb_cp2k()
+    with tmpdir('horton.dpart.test.test_proatomdb.test_io_numbers_mmap') as dn:
+        filename = '%s/test.h5' % dn
+        padb1.to_file(filename)
+        padb2 = ProAtomDB.from_file(filename, numbers=[8], mmap=True)
+        assert padb2.get_numbers() == [8]
+        assert padb2.get_charges(8) == padb1.get_charges(8)
+        for charge in padb2.get_charges(8):
+            r1 = padb1.get_record(8, charge)
+            r2 = padb2.get_record(8, charge)
+            assert isinstance(r2.rho, np.memmap)
+            assert r1 == r2
+        # Modifications must not end up in the file.
+        padb2.normalize()
+        padb3 = ProAtomDB.from_file(filename, numbers=[14, 8])
+        compare_padbs(padb1, padb3)
+        del padb2
+
+
+def test_get_rho_memoized():
+    padb = get_proatomdb_cp2k()
+    rho1, deriv1 = padb.get_rho(8, {0: 0.3, -1: 0.7}, do_deriv=True)
+    assert not rho1.flags.writeable
+    # Same result for (nearly) the same parameters
+    rho2, deriv2 = padb.get_rho(8, {-1: 0.7, 0: 0.3+1e-13}, do_deriv=True)
+    assert rho1 is rho2
+    assert deriv1 is deriv2
+    assert padb.get_rho(8, {0: 0.3, -1: 0.7}) is rho1
+    # Different results for other parameters
+    rho3 = padb.get_rho(8, {0: 0.3, -1: 0.7}, combine='geometric')
+    assert rho3 is not rho1
+    rho4 = padb.get_rho(8, {0: 0.4, -1: 0.6})
+    assert abs(rho4 - 0.4*padb.get_record(8, 0).rho - 0.6*padb.get_record(8, -1).rho).max() < 1e-10
+    # Splines
+    spline1 = padb.get_spline(8, {0: 0.3, -1: 0.7})
+    assert padb.get_spline(8, {0: 0.3, -1: 0.7}) is spline1
+    assert padb.get_spline(8, 0) is padb.get_spline(8, 0)
+    # LRU policy
+    padb.cache_size = 2
+    padb.get_rho(8, {0: 0.1})
+    padb.get_rho(8, {0: 0.2})
+    padb.get_rho(8, {0: 0.1})
+    padb.get_rho(8, {0: 0.3})
+    assert len(padb._lru) == 2
+    assert ('rho', 8, ((0, 0.1),), 'linear') in padb._lru
+    assert ('rho', 8, ((0, 0.2),), 'linear') not in padb._lru
+    # Changes to the records clear the cache
+    padb.compact(0.1)
+    assert len(padb._lru) == 0
+    rho5 = padb.get_rho(8, {0: 0.4, -1: 0.6})
+    assert rho5.shape == (padb.get_rgrid(8).size,)
+
+
+def test_get_rho_memoized_threads():
+    padb = get_proatomdb_cp2k()
+    padb.cache_size = 3
+    errors = []
+    def work(ithread):
+        try:
+            for i in xrange(500):
+                coeff = 0.1*((i + ithread)%7)
+                rho = padb.get_rho(8, {0: coeff, -1: 1-coeff})
+                expected = coeff*padb.get_record(8, 0).rho + (1-coeff)*padb.get_record(8, -1).rho
+                assert abs(rho - expected).max() < 1e-10
+                padb.get_spline(8, {0: coeff})
+        except Exception, e:
+            errors.append(e)
+    # Switch between threads as often as possible
+    old_interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        threads = [threading.Thread(target=work, args=(ithread,)) for ithread in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setcheckinterval(old_interval)
+    assert errors == []
+    assert len(padb._lru) == 3
+
+
 def test_compute_radii():
     rgrid = RadialGrid(ExpRTransform(1e-3, 1e1, 100))
     padb = ProAtomDB.from_refatoms([1, 6], 0, 0, (rgrid, 110))
@@ -21,9 +21,11 @@
 #pylint: skip-file
 
 
-import numpy as np
+import os, sys as sys_module, threading, numpy as np
+from nose.tools import assert_raises
 
 from horton import *
+from horton.test.common import tmpdir
 from horton.part.test.common import check_names, check_proatom_splines, \
     get_proatomdb_hf_sto3g, get_proatomdb_hf_lan
 
@@ -87,6 +89,47 @@ def test_hirshfeld_i_water_hf_sto3g_global_greedy():
     check_water_hf_sto3g('hi', expecting, local=False, greedy=True)
 
 
+def check_water_hf_sto3g_greedy_memory(scheme, local, spill):
+    # The results must not depend on the memory budget of the cache.
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(5e-4, 2e1, 120)
+    rgrid = RadialGrid(rtf)
+    mode = 'only' if local else 'discard'
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode=mode)
+    WPartClass = wpart_schemes[scheme]
+    wpart1 = WPartClass(sys, grid, proatomdb, local=local, greedy=True)
+    wpart1.do_charges()
+    wpart2 = WPartClass(sys, grid, proatomdb, local=local, greedy=True)
+    max_memory = grid.size*8
+    with tmpdir('horton.part.test.test_wpart.check_water_hf_sto3g_greedy_memory') as dn:
+        wpart2.cache.set_memory_policy(max_memory, dn if spill else None)
+        wpart2.do_charges()
+        assert wpart2.cache.max_memory == max_memory
+        assert abs(wpart1['charges'] - wpart2['charges']).max() < 1e-10
+        # Only the most recently used isolated atoms are kept in memory.
+        nbytes = sum(item.value.nbytes for item in wpart2.cache._store.itervalues() if 'r' in item.tags)
+        assert nbytes <= max_memory
+        nkey1 = len(list(wpart1.cache.iterkeys(tags='r')))
+        nkey2 = len(list(wpart2.cache.iterkeys(tags='r')))
+        if spill:
+            assert nkey1 == nkey2
+            assert len(os.listdir(dn)) == 1
+        else:
+            assert nkey2 < nkey1
+        wpart2.cache.set_memory_policy()
+        assert len(os.listdir(dn)) == 0
+
+
+def test_hirshfeld_i_water_hf_sto3g_local_greedy_memory():
+    check_water_hf_sto3g_greedy_memory('hi', True, False)
+
+
+def test_hirshfeld_i_water_hf_sto3g_global_greedy_memory_spill():
+    check_water_hf_sto3g_greedy_memory('hi', False, True)
+
+
 def test_hirshfeld_e_water_hf_sto3g_local():
     expecting = np.array([-0.422794483125, 0.211390419810, 0.211404063315]) # From HiPart
     check_water_hf_sto3g('he', expecting, local=True)
@@ -112,6 +155,236 @@ def test_is_water_hf_sto3g():
     check_water_hf_sto3g('is', expecting, needs_padb=False)
 
 
+def test_hirshfeld_water_hf_sto3g_local_proatom_tolerance():
+    expecting = np.array([-0.246171541212, 0.123092011074, 0.123079530138]) # from HiPart
+    check_water_hf_sto3g('h', expecting, local=True, proatom_tolerance=1e-10)
+
+
+def test_hirshfeld_i_water_hf_sto3g_local_proatom_tolerance():
+    expecting = np.array([-0.4214, 0.2107, 0.2107]) # From HiPart
+    check_water_hf_sto3g('hi', expecting, local=True, proatom_tolerance=1e-10)
+
+
+def test_hirshfeld_i_water_hf_sto3g_local_greedy_proatom_tolerance():
+    expecting = np.array([-0.4214, 0.2107, 0.2107]) # From HiPart
+    check_water_hf_sto3g('hi', expecting, local=True, greedy=True, proatom_tolerance=1e-10)
+
+
+def test_hirshfeld_e_water_hf_sto3g_local_proatom_tolerance():
+    expecting = np.array([-0.422794483125, 0.211390419810, 0.211404063315]) # From HiPart
+    check_water_hf_sto3g('he', expecting, local=True, proatom_tolerance=1e-10)
+
+
+def test_is_water_hf_sto3g_proatom_tolerance():
+    expecting = np.array([-0.490017586929, 0.245018706885, 0.244998880045]) # From HiPart
+    check_water_hf_sto3g('is', expecting, needs_padb=False, proatom_tolerance=1e-10)
+
+
+def check_proatom_tolerance(local):
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(5e-4, 2e1, 120)
+    rgrid = RadialGrid(rtf)
+    mode = 'only' if local else 'keep'
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode=mode)
+
+    proatom_tolerance = 1e-6
+    wpart1 = HirshfeldWPart(sys, grid, proatomdb, local)
+    wpart1.do_charges()
+    wpart2 = HirshfeldWPart(sys, grid, proatomdb, local, proatom_tolerance=proatom_tolerance)
+    assert wpart2.proatom_tolerance == proatom_tolerance
+    wpart2.do_charges()
+
+    # The chopped splines are below the tolerance at the cutoff radius
+    for index in xrange(sys.natom):
+        spline, rcut = wpart2.get_proatom_cutoff_spline(index)
+        assert rcut < rtf.rmax
+        assert spline.y[-1] <= proatom_tolerance
+        assert spline.y[-2] > proatom_tolerance
+
+    # The promolecular density is only affected by the screening below the
+    # tolerance.
+    error = abs(wpart1['promoldens'] - wpart2['promoldens'])
+    assert error.max() > 0
+    assert error.max() < sys.natom*proatom_tolerance
+    assert abs(wpart1['charges'] - wpart2['charges']).max() < 1e-5
+
+
+def test_proatom_tolerance_local():
+    check_proatom_tolerance(True)
+
+
+def test_proatom_tolerance_global():
+    check_proatom_tolerance(False)
+
+
+def test_proatom_tolerance_global_weights():
+    # The atomic weights sum to one, also where no proatom reaches.
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    grid = BeckeMolGrid(sys, random_rotate=False, mode='keep')
+    wpart = HirshfeldWPart(sys, grid, proatomdb, local=False, proatom_tolerance=1e-4)
+    wpart.do_partitioning()
+    total = sum(wpart.cache.load('at_weights', index) for index in xrange(sys.natom))
+    assert abs(total - 1).max() < 1e-10
+
+
+def test_proatom_tolerance_nproc():
+    # The screened promolecule must not depend on the number of threads.
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(5e-4, 2e1, 120)
+    rgrid = RadialGrid(rtf)
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode='only')
+    wpart1 = HirshfeldWPart(sys, grid, proatomdb, proatom_tolerance=1e-6)
+    wpart1.do_partitioning()
+    expected = wpart1.get_subgrid_rmax().copy()
+    old_interval = sys_module.getcheckinterval()
+    sys_module.setcheckinterval(1)
+    try:
+        for irep in xrange(5):
+            wpart2 = HirshfeldWPart(sys, grid, proatomdb, proatom_tolerance=1e-6, nproc=3)
+            wpart2.do_partitioning()
+            assert abs(wpart1['promoldens'] - wpart2['promoldens']).max() < 1e-12
+        # Concurrent lookups of the subgrid radii only see complete results.
+        for irep in xrange(50):
+            wpart2.cache.clear_item('subgrid_rmax')
+            for index in xrange(sys.natom):
+                wpart2.cache.clear_item('subgrid_shells', index)
+            results = []
+            start = threading.Event()
+            def helper():
+                start.wait()
+                results.append(wpart2.get_subgrid_rmax().copy())
+            threads = [threading.Thread(target=helper) for ithread in xrange(4)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+            for result in results:
+                assert (result == expected).all()
+    finally:
+        sys_module.setcheckinterval(old_interval)
+
+
+def test_proatom_tolerance_negative():
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    grid = BeckeMolGrid(sys, random_rotate=False, mode='only')
+    with assert_raises(ValueError):
+        HirshfeldWPart(sys, grid, proatomdb, proatom_tolerance=-1e-10)
+
+
+def test_hirshfeld_water_hf_sto3g_local_nproc():
+    expecting = np.array([-0.246171541212, 0.123092011074, 0.123079530138]) # from HiPart
+    check_water_hf_sto3g('h', expecting, local=True, nproc=2)
+
+
+def test_hirshfeld_water_hf_sto3g_global_nproc():
+    expecting = np.array([-0.246171541212, 0.123092011074, 0.123079530138]) # from HiPart
+    check_water_hf_sto3g('h', expecting, local=False, nproc=2)
+
+
+def test_hirshfeld_i_water_hf_sto3g_local_greedy_nproc():
+    expecting = np.array([-0.4214, 0.2107, 0.2107]) # From HiPart
+    check_water_hf_sto3g('hi', expecting, local=True, greedy=True, nproc=2)
+
+
+def test_hirshfeld_e_water_hf_sto3g_local_nproc():
+    expecting = np.array([-0.422794483125, 0.211390419810, 0.211404063315]) # From HiPart
+    check_water_hf_sto3g('he', expecting, local=True, nproc=2)
+
+
+def test_is_water_hf_sto3g_nproc():
+    expecting = np.array([-0.490017586929, 0.245018706885, 0.244998880045]) # From HiPart
+    check_water_hf_sto3g('is', expecting, needs_padb=False, nproc=2, proatom_tolerance=1e-10)
+
+
+def test_hirshfeld_i_water_hf_sto3g_local_diis():
+    expecting = np.array([-0.4214, 0.2107, 0.2107]) # From HiPart
+    check_water_hf_sto3g('hi', expecting, local=True, diis=4)
+
+
+def test_hirshfeld_i_water_hf_sto3g_global_greedy_diis():
+    expecting = np.array([-0.4214, 0.2107, 0.2107]) # From HiPart
+    check_water_hf_sto3g('hi', expecting, local=False, greedy=True, diis=4)
+
+
+def test_hirshfeld_e_water_hf_sto3g_local_diis():
+    expecting = np.array([-0.422794483125, 0.211390419810, 0.211404063315]) # From HiPart
+    check_water_hf_sto3g('he', expecting, local=True, diis=4)
+
+
+def test_is_water_hf_sto3g_diis():
+    expecting = np.array([-0.490017586929, 0.245018706885, 0.244998880045]) # From HiPart
+    check_water_hf_sto3g('is', expecting, needs_padb=False, diis=4)
+
+
+def check_diis_niter(scheme, needs_padb=True):
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(5e-4, 2e1, 120)
+    rgrid = RadialGrid(rtf)
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode='only')
+    kwargs = {'threshold': 1e-8}
+    if needs_padb:
+        kwargs['proatomdb'] = get_proatomdb_hf_sto3g()
+
+    WPartClass = wpart_schemes[scheme]
+    wpart1 = WPartClass(sys, grid, **kwargs)
+    wpart1.do_charges()
+    wpart2 = WPartClass(sys, grid, diis=4, **kwargs)
+    wpart2.do_charges()
+    assert wpart2['niter'] < wpart1['niter']/2
+    assert wpart2['change'] < 1e-8
+    assert abs(wpart1['charges'] - wpart2['charges']).max() < 1e-6
+
+
+def test_diis_niter_hi():
+    check_diis_niter('hi')
+
+
+def test_diis_niter_he():
+    check_diis_niter('he')
+
+
+def test_diis_niter_is():
+    check_diis_niter('is', needs_padb=False)
+
+
+def test_nproc_consistency():
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    rtf = ExpRTransform(5e-4, 2e1, 120)
+    rgrid = RadialGrid(rtf)
+    grid = BeckeMolGrid(sys, (rgrid, 110), random_rotate=False, mode='only')
+
+    wpart1 = HirshfeldIWPart(sys, grid, proatomdb)
+    wpart1.do_moments()
+    wpart2 = HirshfeldIWPart(sys, grid, proatomdb, nproc=3)
+    assert wpart2.nproc == 3
+    wpart2.do_moments()
+    assert wpart1['niter'] == wpart2['niter']
+    assert abs(wpart1['charges'] - wpart2['charges']).max() < 1e-10
+    assert abs(wpart1['cartesian_multipoles'] - wpart2['cartesian_multipoles']).max() < 1e-10
+    assert abs(wpart1['radial_moments'] - wpart2['radial_moments']).max() < 1e-10
+
+
+def test_nproc_invalid():
+    proatomdb = get_proatomdb_hf_sto3g()
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    grid = BeckeMolGrid(sys, random_rotate=False, mode='only')
+    with assert_raises(ValueError):
+        HirshfeldWPart(sys, grid, proatomdb, nproc=0)
+
+
 def check_msa_hf_lan(scheme, expecting, needs_padb=True, **kwargs):
     if needs_padb:
         proatomdb = get_proatomdb_hf_lan()
@@ -187,6 +460,16 @@ def test_hirshfeld_e_msa_hf_lan_global_greedy():
     check_msa_hf_lan('he', expecting, local=False, greedy=True)
 
 
+def test_hirshfeld_i_msa_hf_lan_local_diis():
+    expecting = np.array([1.14305602, -0.52958298, -0.51787452, -0.51302759, -0.50033981, 0.21958586, 0.23189187, 0.22657354, 0.23938904])
+    check_msa_hf_lan('hi', expecting, local=True, diis=4)
+
+
+def test_hirshfeld_e_msa_hf_lan_local_diis():
+    expecting = np.array([1.06135407, -0.51795437, -0.50626239, -0.50136175, -0.48867641, 0.22835963, 0.240736, 0.23528162, 0.24816043])
+    check_msa_hf_lan('he', expecting, local=True, diis=4)
+
+
 def test_is_msa_hf_lan():
     expecting = np.array([1.1721364, -0.5799622, -0.5654549, -0.5599638, -0.5444145, 0.2606699, 0.2721848, 0.2664377, 0.2783666]) # from HiPart
     check_msa_hf_lan('is', expecting, needs_padb=False)
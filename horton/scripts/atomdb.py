@@ -23,15 +23,18 @@
 
 from string import Template as BaseTemplate
 from glob import glob
-import re, os, stat
+import re, os, stat, subprocess
 
-from horton import periodic, log, System
+from horton import periodic, log, System, ProAtomRecord, ProAtomDB, \
+    LockedH5File
+from horton.part.proatomdb import load_proatom_records_h5_group
 from horton.scripts.common import iter_elements
 
 
 __all__ = [
     'iter_mults', 'iter_states',
-    'Template', 'EnergyTable', 'atom_programs',
+    'Template', 'EnergyTable', 'atom_programs', 'get_atom_program',
+    'iter_state_dirs', 'iter_mult_dirs', 'convert_state', 'load_state_record',
 ]
 
 
@@ -178,6 +181,121 @@ def iter_states(elements, max_kation, max_anion, hund):
                 yield number, charge, mult
 
 
+def iter_state_dirs():
+    '''Iterate over all directories with atomic states, sorted by name'''
+    for dn_state in sorted(glob('[01]??_??_[01]??_q[+-]??')):
+        yield dn_state
+
+
+def iter_mult_dirs(dn_state=None):
+    '''Iterate over all directories with atomic computations, sorted by name
+
+       **Optional arguments:**
+
+       dn_state
+            When given, only the spin multiplicities of this atomic state are
+            considered.
+    '''
+    if dn_state is None:
+        dn_state = '[01]??_??_[01]??_q[+-]??'
+    for dn_mult in sorted(glob('%s/mult??' % dn_state)):
+        yield dn_mult
+
+
+def get_atom_program():
+    '''Return the AtomProgram that corresponds to the run script present'''
+    run_scripts = glob("run_*.sh")
+    if len(run_scripts) != 1:
+        raise RuntimeError('Found %i run_*.sh scripts while exactly one is needed to know which program was used to run the atomic computations.' % len(run_scripts))
+    return atom_programs[run_scripts[0][4:-3]]
+
+
+def _is_cache_valid(fn_cache, dn_state, grid):
+    '''Check if a cached record is present and up to date'''
+    if not os.path.isfile(fn_cache):
+        return False
+    mtime = os.path.getmtime(fn_cache)
+    for dn_mult in iter_mult_dirs(dn_state):
+        for fn in glob('%s/*' % dn_mult):
+            if os.path.getmtime(fn) > mtime:
+                return False
+    with LockedH5File(fn_cache, 'r') as f:
+        return f.attrs.get('grid') == grid
+
+
+def convert_state(program, dn_state, grid):
+    '''Construct a proatom record for one atomic state and store it on disk
+
+       **Arguments:**
+
+       program
+            An AtomProgram instance.
+
+       dn_state
+            The directory of the atomic state, containing one subdirectory for
+            each spin multiplicity.
+
+       grid
+            The specification of the atomic grid, i.e. the first argument of
+            the AtomicGridSpec constructor.
+
+       The computation with the lowest energy is converted into a record,
+       which is written to ``record.h5`` in the state directory. When this
+       file is already present, was made with the same grid and is more
+       recent than all files in the subdirectories, nothing is recomputed.
+       Hence, an interrupted conversion can be resumed. This function is
+       executed in the worker processes of a parallel conversion.
+
+       **Returns:** True when a record was found or computed, False otherwise.
+    '''
+    fn_cache = '%s/record.h5' % dn_state
+    if _is_cache_valid(fn_cache, dn_state, grid):
+        if log.do_medium:
+            log('Cached:            ', dn_state)
+        return True
+
+    cases = []
+    for dn_mult in iter_mult_dirs(dn_state):
+        if log.do_medium:
+            log('Loading from', dn_mult)
+        system, energy = program.load_atom(dn_mult)
+        if energy is None:
+            if log.do_medium:
+                log('No (sensible) results found:  ', dn_mult)
+            continue
+        cases.append((energy, system))
+
+    if len(cases) == 0:
+        if log.do_medium:
+            log('Nothing found in:  ', dn_state)
+        return False
+
+    # Get the lowest in energy and write to chk file
+    cases.sort()
+    energy, system = cases[0]
+
+    # Write system to Horton file if possible
+    if system is not None:
+        system.assign_chk('%s/horton.h5' % dn_state)
+
+    # Construct a record for the proatomdb and store it
+    record = ProAtomRecord.from_system(system, grid)
+    with LockedH5File(fn_cache, 'w') as f:
+        ProAtomDB([record]).to_file(f)
+        f.attrs['grid'] = grid
+
+    # Let user know we are alive.
+    if log.do_medium:
+        log('Succesfull:        ', dn_state)
+    return True
+
+
+def load_state_record(dn_state):
+    '''Load the record written by ``convert_state``'''
+    with LockedH5File('%s/record.h5' % dn_state, 'r') as f:
+        return load_proatom_records_h5_group(f)[0]
+
+
 class Template(BaseTemplate):
     '''A template with modifications to support inclusion of other files.'''
     idpattern = r'[_a-z0-9.:-]+'
@@ -352,6 +470,26 @@ class AtomProgram(object):
         os.chmod(fn_script, stat.S_IXUSR | os.stat(fn_script).st_mode)
 
 
+    def run_atom(self, dn_mult):
+        '''Run the computation in one directory with the run script
+
+           **Arguments:**
+
+           dn_mult
+                The directory with the input file.
+
+           The output of the run script is written to ``run.log`` in the same
+           directory.
+
+           **Returns:** the exit code of the run script.
+        '''
+        fn_script = 'run_%s.sh' % self.name
+        with open(fn_script) as f:
+            if 'set --' not in f.read():
+                raise RuntimeError('The script %s does not accept directories as arguments. Remove it and write a new one with "horton-atomdb.py input".' % fn_script)
+        with open('%s/run.log' % dn_mult, 'w') as f:
+            return subprocess.call(['bash', fn_script, dn_mult], stdout=f, stderr=subprocess.STDOUT)
+
     def _get_energy(self, system, dn_mult):
         return system.extra['energy']
 
@@ -399,7 +537,12 @@ function do_atom {
     cd -
 }
 
-for ATOMDIR in [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]; do
+# When directories are given as arguments, only these are computed.
+if [ $# -eq 0 ]; then
+    set -- [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]
+fi
+
+for ATOMDIR in "$@"; do
     do_atom ${ATOMDIR}
 done
 '''
@@ -453,7 +596,12 @@ function do_atom {
     cd -
 }
 
-for ATOMDIR in [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]; do
+# When directories are given as arguments, only these are computed.
+if [ $# -eq 0 ]; then
+    set -- [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]
+fi
+
+for ATOMDIR in "$@"; do
     do_atom ${ATOMDIR}
 done
 '''
@@ -522,7 +670,12 @@ function do_atom {
     cd -
 }
 
-for ATOMDIR in [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]; do
+# When directories are given as arguments, only these are computed.
+if [ $# -eq 0 ]; then
+    set -- [01][0-9][0-9]_??_[01][0-9][0-9]_q[-+][0-9][0-9]/mult[0-9][0-9]
+fi
+
+for ATOMDIR in "$@"; do
     do_atom ${ATOMDIR}
 done
 '''
@@ -24,11 +24,11 @@
 import os, sys, datetime, numpy as np
 
 from horton import UniformGrid, angstrom, periodic, log, dump_hdf5_low, \
-    LockedH5File
+    LockedH5File, System, load_cube_h5
 
 
 __all__ = [
-    'iter_elements', 'reduce_ugrid', 'reduce_data',
+    'iter_elements', 'reduce_ugrid', 'reduce_data', 'load_cube_data',
     'parse_h5', 'check_output', 'parse_ewald_args', 'parse_pbc', 'store_args',
     'write_part_output', 'write_script_output',
 ]
@@ -112,6 +112,42 @@ def reduce_data(cube_data, ugrid, stride, chop):
     return new_cube_data, new_ugrid
 
 
+def load_cube_data(fn_cube, stride=1, chop=0):
+    '''Load a system with data on a uniform grid, reduced by stride and chop
+
+       **Arguments:**
+
+       fn_cube
+            A file with data on a uniform grid, e.g. a cube or a CHGCAR file.
+
+       **Optional arguments:**
+
+       stride
+            The reduction factor.
+
+       chop
+            The number of slices to chop off the end of the grid in each
+            direction.
+
+       Returns: a System object, the reduced array and the reduced ugrid.
+
+       For files in Horton's binary grid format (``*.cube.h5``), the grid data
+       are subsampled while they are read from disk. Other files are loaded
+       completely and then reduced with ``reduce_data``.
+    '''
+    if fn_cube.endswith('.cube.h5'):
+        sys = System(**load_cube_h5(fn_cube, stride, chop))
+        return sys, sys.extra['cube_data'], sys.grid
+    sys = System.from_file(fn_cube)
+    ugrid = sys.grid
+    if not isinstance(ugrid, UniformGrid):
+        raise TypeError('The specified file does not contain data on a rectangular grid.')
+    cube_data = sys.extra['cube_data']
+    if stride > 1 or chop > 0:
+        cube_data, ugrid = reduce_data(cube_data, ugrid, stride, chop)
+    return sys, cube_data, ugrid
+
+
 def parse_h5(arg_h5, name, path_optional=True):
     '''Parse an HDF5 command line argument of the form file.h5:group or file.h5:dataset
 
@@ -24,12 +24,12 @@
 import numpy as np
 
 from horton import System, angstrom, ESPCost, LockedH5File
-from horton.scripts.common import reduce_data, parse_h5
+from horton.scripts.common import load_cube_data, parse_h5
 from horton.part.proatomdb import ProAtomDB
 
 
 __all__ = [
-    'parse_wdens', 'parse_wnear', 'parse_wfar',
+    'parse_wdens', 'parse_wnear', 'parse_wfar', 'parse_layers',
     'load_rho', 'load_cost', 'load_charges',
     'save_weights', 'max_at_edge',
 ]
@@ -103,6 +103,20 @@ def parse_wfar(arg):
     return r0, gamma
 
 
+def parse_layers(arg):
+    '''Parse the argument to the --layers option of horton-esp-cost.py'''
+    if arg is None:
+        return 0, None
+    words = arg.split(':')
+    if len(words) != 2:
+        raise ValueError('The argument to --layers must contain two fields separated by a colon.')
+    begin = int(words[0])
+    end = int(words[1])
+    if begin < 0 or end <= begin:
+        raise ValueError('The argument to --layers must be a non-empty range of layers.')
+    return begin, end
+
+
 def load_rho(system, fn_cube, ref_ugrid, stride, chop):
     '''Load densities from a file, reduce by stride, chop and check ugrid
 
@@ -131,17 +145,14 @@ def load_rho(system, fn_cube, ref_ugrid, stride, chop):
         proatomdb = ProAtomDB.from_refatoms(numbers, max_kation=0, max_anion=0, agspec='fine')
         # Construct the pro-density
         rho = np.zeros(ref_ugrid.shape)
-        for i in xrange(system.natom):
-            spline = proatomdb.get_spline(system.numbers[i])
-            ref_ugrid.eval_spline(spline, system.coordinates[i], rho)
+        splines = [proatomdb.get_spline(number) for number in system.numbers]
+        ref_ugrid.eval_spline_multi(splines, system.coordinates, np.ones(system.natom), rho)
     else:
-        # Load cube
-        sys = System.from_file(fn_cube)
-        rho = sys.extra['cube_data']
-        ugrid = sys.grid
-        # Reduce grid size
+        # Load cube and reduce grid size
         if stride > 1:
-            rho, ugrid = reduce_data(rho, ugrid, stride, chop)
+            sys, rho, ugrid = load_cube_data(fn_cube, stride, chop)
+        else:
+            sys, rho, ugrid = load_cube_data(fn_cube)
         # Compare with ref_ugrid (only shape)
         if (ugrid.shape != ref_ugrid.shape).any():
             raise ValueError('The densities file does not contain the same amount if information as the potential file.')
@@ -21,7 +21,8 @@
 #pylint: skip-file
 
 
-import os, shutil
+import os, shutil, stat
+from glob import glob
 from horton.context import context
 from horton.periodic import periodic
 from horton.part.proatomdb import ProAtomDB
@@ -118,6 +119,37 @@ def test_script_input_orca():
         check_files(dn, fns)
 
 
+def test_script_run_cp2k():
+    with tmpdir('horton.scripts.test.test_atomdb.test_script_run_cp2k') as dn:
+        fn_template = 'template_atomdb_cp2k.in'
+        fn_valence = 'include_atomdb_cp2k_valence.inc'
+        fn_ppot = 'include_atomdb_cp2k_ppot.inc'
+        copy_files(dn, [fn_template, fn_valence, fn_ppot])
+        check_script('horton-atomdb.py input cp2k Ca,F %s' % fn_template, dn)
+        # A fake CP2K binary that just copies the input to the output.
+        fn_bin = os.path.join(dn, 'fake_cp2k')
+        with open(fn_bin, 'w') as f:
+            print >> f, '#!/bin/bash'
+            print >> f, 'cat $1'
+        os.chmod(fn_bin, stat.S_IXUSR | os.stat(fn_bin).st_mode)
+        os.environ['CP2K_BIN'] = fn_bin
+        try:
+            check_script('horton-atomdb.py run --nproc=3', dn)
+        finally:
+            del os.environ['CP2K_BIN']
+        fns = [
+            '020_ca_021_q-01/mult02/atom.cp2k.out', '020_ca_020_q+00/mult01/atom.cp2k.out',
+            '020_ca_019_q+01/mult02/atom.cp2k.out', '020_ca_018_q+02/mult01/atom.cp2k.out',
+            '020_ca_017_q+03/mult02/atom.cp2k.out', '009__f_010_q-01/mult01/atom.cp2k.out',
+            '009__f_009_q+00/mult02/atom.cp2k.out', '009__f_008_q+01/mult03/atom.cp2k.out',
+            '009__f_007_q+02/mult04/atom.cp2k.out',
+            '020_ca_021_q-01/mult02/run.log', '009__f_007_q+02/mult04/run.log',
+        ]
+        check_files(dn, fns)
+        with open(os.path.join(dn, '009__f_007_q+02/mult04/atom.cp2k.out')) as f:
+            assert f.read() == open(os.path.join(dn, '009__f_007_q+02/mult04/atom.in')).read()
+
+
 def copy_atom_output(fn, number, charge, mult, dn, fn_out):
     pop = number - charge
     symbol = periodic[number].symbol.lower().rjust(2, '_')
@@ -192,3 +224,40 @@ def test_script_convert_g03():
         assert padb.get_numbers() == [1, 8]
         assert padb.get_charges(1) == [0, -1]
         assert padb.get_charges(8) == [+1, 0, -1]
+
+
+def test_script_convert_g03_parallel():
+    with tmpdir('horton.scripts.test.test_atomdb.test_script_convert_g03_parallel') as dn:
+        copy_atom_output('atom_001_001_hf_sto3g.fchk', 1,  0, 2, dn, 'atom.fchk')
+        copy_atom_output('atom_001_002_hf_sto3g.fchk', 1, -1, 1, dn, 'atom.fchk')
+        copy_atom_output('atom_008_007_hf_sto3g.fchk', 8, +1, 4, dn, 'atom.fchk')
+        copy_atom_output('atom_008_008_hf_sto3g.fchk', 8,  0, 3, dn, 'atom.fchk')
+        copy_atom_output('atom_008_009_hf_sto3g.fchk', 8, -1, 2, dn, 'atom.fchk')
+        make_fake_run_script('g03', dn)
+        check_script('horton-atomdb.py convert --grid medium --nproc 2', dn)
+        fns = [
+            'atoms.h5', '001__h_001_q+00/record.h5', '001__h_002_q-01/record.h5',
+            '008__o_007_q+01/record.h5', '008__o_008_q+00/record.h5',
+            '008__o_009_q-01/record.h5',
+        ]
+        check_files(dn, fns)
+        padb1 = ProAtomDB.from_file(os.path.join(dn, 'atoms.h5'))
+        assert padb1.get_numbers() == [1, 8]
+        assert padb1.get_charges(1) == [0, -1]
+        assert padb1.get_charges(8) == [+1, 0, -1]
+
+        # With another grid, the cached records can not be used.
+        check_script('horton-atomdb.py convert --grid coarse', dn)
+        padb2 = ProAtomDB.from_file(os.path.join(dn, 'atoms.h5'))
+        assert padb2.get_rgrid(8).size != padb1.get_rgrid(8).size
+
+        # Remove the outputs. The conversion must still work with the cached
+        # records.
+        for fn in glob(os.path.join(dn, '*/mult??/atom.fchk')):
+            os.remove(fn)
+        os.remove(os.path.join(dn, 'atoms.h5'))
+        check_script('horton-atomdb.py convert --grid coarse', dn)
+        padb3 = ProAtomDB.from_file(os.path.join(dn, 'atoms.h5'))
+        assert padb3.get_charges(8) == [+1, 0, -1]
+        for charge in +1, 0, -1:
+            assert (padb2.get_record(8, charge).rho == padb3.get_record(8, charge).rho).all()
@@ -93,6 +93,22 @@ def test_reduce_data1():
     assert (ugrid2.pbc == ugrid.pbc).all()
 
 
+def test_load_cube_data():
+    sys = System.from_file(context.get_fn('test/aelta.cube'))
+    with tmpdir('horton.scripts.test.test_common.test_load_cube_data') as dn:
+        fn_cube = '%s/aelta.cube' % dn
+        fn_h5 = '%s/aelta.cube.h5' % dn
+        sys.to_file(fn_cube)
+        sys.to_file(fn_h5)
+        for stride, chop in (1, 0), (3, 0), (5, 2):
+            sys1, data1, ugrid1 = load_cube_data(fn_cube, stride, chop)
+            sys2, data2, ugrid2 = load_cube_data(fn_h5, stride, chop)
+            assert (sys1.numbers == sys2.numbers).all()
+            assert (data1 == data2).all()
+            assert (ugrid1.shape == ugrid2.shape).all()
+            assert abs(ugrid1.grid_rvecs - ugrid2.grid_rvecs).max() < 1e-10
+
+
 def test_parse_pbc():
     assert (parse_pbc('111') == [1, 1, 1]).all()
     assert (parse_pbc('000') == [0, 0, 0]).all()
@@ -20,6 +20,7 @@
 #--
 #pylint: skip-file
 
+from horton import *
 from horton.test.common import check_script, tmpdir
 from horton.scripts.test.common import copy_files, check_files
 
@@ -28,3 +29,16 @@ def test_scripts():
         fn_fchk = 'water_sto3g_hf_g03.fchk'
         copy_files(dn, [fn_fchk])
         check_script('horton-convert.py %s test.xyz' % fn_fchk, dn)
+
+
+def test_script_cube_h5():
+    with tmpdir('horton.scripts.test.test_convert.test_script_cube_h5') as dn:
+        fn_cube = 'jbw_coarse_aedens.cube'
+        copy_files(dn, [fn_cube])
+        check_script('horton-convert.py %s test.cube.h5 --compression=gzip' % fn_cube, dn)
+        check_files(dn, ['test.cube.h5'])
+        check_script('horton-convert.py test.cube.h5 test.cube', dn)
+        sys1 = System.from_file('%s/%s' % (dn, fn_cube))
+        sys2 = System.from_file('%s/test.cube.h5' % dn)
+        assert (sys1.extra['cube_data'] == sys2.extra['cube_data']).all()
+        assert (sys1.grid.shape == sys2.grid.shape).all()
@@ -51,7 +51,7 @@ def test_script_jbw_coarse_h():
     check_script_jbw_coarse('h')
 
 
-def check_script_lta(fn_sym, suffix):
+def check_script_lta(fn_sym, suffix, extra=''):
     with tmpdir('horton.scripts.test.test_cpart.test_script_lta_coarse_h_%s' % suffix) as dn:
         # prepare files
         if fn_sym is not None:
@@ -67,7 +67,7 @@ def check_script_lta(fn_sym, suffix):
         if fn_sym is None:
             check_script('horton-cpart.py %s %s:cpart/h_r1 h atoms.h5' % (fn_cube, fn_h5), dn)
         else:
-            check_script('horton-cpart.py %s %s:cpart/h_r1 h atoms.h5 --symmetry=%s' % (fn_cube, fn_h5, fn_sym), dn)
+            check_script('horton-cpart.py %s %s:cpart/h_r1 h atoms.h5 --symmetry=%s %s' % (fn_cube, fn_h5, fn_sym, extra), dn)
 
         # check the output
         check_files(dn, [fn_h5])
@@ -89,3 +89,7 @@ def test_script_lta():
 
 def test_script_lta_sym():
     check_script_lta('lta_gulp.cif', 'sym')
+
+
+def test_script_lta_sym_reduce():
+    check_script_lta('lta_gulp.cif', 'sym_reduce', '--symmetry-reduce')
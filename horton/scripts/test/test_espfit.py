@@ -22,6 +22,7 @@
 
 
 import os, h5py as h5
+from nose.tools import assert_raises
 
 from horton import *
 from horton.test.common import check_script, tmpdir
@@ -45,6 +46,15 @@ def test_wfar():
     assert parse_wfar('4.2:0.3') == (4.2*angstrom, 0.3*angstrom)
 
 
+def test_layers():
+    assert parse_layers(None) == (0, None)
+    assert parse_layers('2:5') == (2, 5)
+    with assert_raises(ValueError):
+        parse_layers('2')
+    with assert_raises(ValueError):
+        parse_layers('5:2')
+
+
 def test_scripts():
     # Generate some random system with random esp data
     natom = 5
@@ -68,6 +78,30 @@ def test_scripts():
         check_script('horton-esp-test.py esp.h5 other.h5:charges foo.h5', dn)
         check_script('horton-esp-gen.py other.h5:charges esp.cube gen.h5', dn)
         check_files(dn, ['esp.h5', 'other.h5', 'foo.h5', 'gen.h5'])
+        check_script('horton-esp-cost.py esp.cube esp_fft.h5 --wnear=0:1.0:0.5 --method=fft', dn)
+        with h5.File(os.path.join(dn, 'esp.h5')) as f1, h5.File(os.path.join(dn, 'esp_fft.h5')) as f2:
+            A1 = f1['cost/A'][:]
+            A2 = f2['cost/A'][:]
+            assert abs(A1 - A2).max() < 1e-4*abs(A1).max()
+        # Two partial runs, merged in a third one, must give the same result.
+        check_script('horton-esp-cost.py esp.cube part1.h5 --wnear=0:1.0:0.5 --layers=0:4 --slab-size=3 --checkpoint=chk1.h5', dn)
+        check_script('horton-esp-cost.py esp.cube part2.h5 --wnear=0:1.0:0.5 --layers=4:10 --checkpoint=chk2.h5', dn)
+        check_files(dn, ['chk1.h5', 'chk2.h5'])
+        assert not os.path.isfile(os.path.join(dn, 'part1.h5'))
+        # Resuming from a checkpoint with other settings must fail.
+        with assert_raises(AssertionError):
+            check_script('horton-esp-cost.py esp.cube part1.h5 --wnear=0:1.5:0.5 --layers=0:6 --checkpoint=chk1.h5', dn)
+        with assert_raises(AssertionError):
+            check_script('horton-esp-cost.py esp.cube part1.h5 --wnear=0:1.0:0.5 --layers=0:6 --rcut=15 --checkpoint=chk1.h5', dn)
+        check_script('horton-esp-cost.py esp.cube esp_slab.h5 --wnear=0:1.0:0.5 --merge chk1.h5 chk2.h5', dn)
+        with h5.File(os.path.join(dn, 'esp.h5')) as f1, h5.File(os.path.join(dn, 'esp_slab.h5')) as f2:
+            for key in 'cost/A', 'cost/B', 'cost/C':
+                assert abs(f1[key][()] - f2[key][()]).max() < 1e-10*abs(f1[key][()]).max()
+        check_script('horton-esp-gen.py other.h5:charges esp.cube gen_spme.h5 --method=spme', dn)
+        with h5.File(os.path.join(dn, 'gen.h5')) as f1, h5.File(os.path.join(dn, 'gen_spme.h5')) as f2:
+            esp1 = f1['esp'][:]
+            esp2 = f2['esp'][:]
+            assert abs(esp1 - esp2).max() < 1e-4*abs(esp1).max()
 
     # Write the cube file to the tmpdir and run scripts (run 2)
     with tmpdir('horton.scripts.test.test_espfit.test_scripts2') as dn:
@@ -80,6 +114,15 @@ def test_scripts():
         check_script('horton-esp-gen.py other.h5:charges esp.cube gen.h5', dn)
         check_files(dn, ['esp.h5', 'other.h5', 'foo.h5', 'gen.h5'])
 
+    # Same with binary grid files and a stride (run 3)
+    with tmpdir('horton.scripts.test.test_espfit.test_scripts3') as dn:
+        sys_esp.to_file(os.path.join(dn, 'esp.cube.h5'))
+        sys_rho.to_file(os.path.join(dn, 'rho.cube.h5'))
+        check_script('horton-esp-cost.py esp.cube.h5 esp.h5 --wnear=0:1.0:0.5 --wdens=rho.cube.h5 --stride=2', dn)
+        check_script('horton-esp-fit.py esp.h5 other.h5', dn)
+        check_script('horton-esp-gen.py other.h5:charges esp.cube.h5 gen.h5', dn)
+        check_files(dn, ['esp.h5', 'other.h5', 'gen.h5'])
+
 
 def test_scripts_symmetry():
     # Write the cube file to the tmpdir and run scripts
@@ -37,7 +37,7 @@ def write_atomdb_sto3g(dn, do_deriv=True):
     padb.to_file(os.path.join(dn, 'atoms.h5'))
 
 
-def check_script_water_sto3g(scheme, do_deriv=True):
+def check_script_water_sto3g(scheme, do_deriv=True, extra=''):
     with tmpdir('horton.scripts.test.test_wpart.test_script_water_sto3g_%s' % scheme) as dn:
         fn_fchk = 'water_sto3g_hf_g03.fchk'
         copy_files(dn, [fn_fchk])
@@ -45,7 +45,7 @@ def check_script_water_sto3g(scheme, do_deriv=True):
             check_script('horton-wpart.py %s water_sto3g_hf_g03_wpart.h5:wpart/%s %s --debug' % (fn_fchk, scheme, scheme), dn)
         else:
             write_atomdb_sto3g(dn, do_deriv)
-            check_script('horton-wpart.py %s water_sto3g_hf_g03_wpart.h5:wpart/%s %s atoms.h5' % (fn_fchk, scheme, scheme), dn)
+            check_script('horton-wpart.py %s water_sto3g_hf_g03_wpart.h5:wpart/%s %s atoms.h5 %s' % (fn_fchk, scheme, scheme, extra), dn)
         fn_h5 = 'water_sto3g_hf_g03_wpart.h5'
         check_files(dn, [fn_h5])
         with h5.File(os.path.join(dn, fn_h5)) as f:
@@ -69,6 +69,14 @@ def test_script_water_sto3g_hi():
     check_script_water_sto3g('hi')
 
 
+def test_script_water_sto3g_hi_proatom_tolerance():
+    check_script_water_sto3g('hi', extra='--proatom-tolerance=1e-10')
+
+
+def test_script_water_sto3g_hi_greedy_cache_memory():
+    check_script_water_sto3g('hi', extra='--greedy --cache-memory=0.1 --spill-dir=.')
+
+
 def test_script_water_sto3g_hi_noderiv():
     check_script_water_sto3g('hi', do_deriv=False)
 
@@ -28,6 +28,7 @@
 '''
 
 
+import hashlib
 import numpy as np
 import h5py as h5
 
@@ -42,6 +43,17 @@ from horton.periodic import periodic
 __all__ = ['System']
 
 
+def _get_basis_key(obasis):
+    '''Return a key that identifies a Gaussian basis by its contents'''
+    result = hashlib.sha1()
+    for array in (obasis.centers, obasis.shell_map, obasis.nprims,
+                  obasis.shell_types, obasis.alphas, obasis.con_coeffs):
+        array = np.ascontiguousarray(array)
+        result.update(str(array.shape))
+        result.update(array.tostring())
+    return result.hexdigest()
+
+
 class System(object):
     def __init__(self, coordinates, numbers, obasis=None, grid=None, wfn=None,
                  lf=None, cache=None, extra=None, cell=None,
@@ -497,8 +509,70 @@ class System(object):
             #self.update_chk('cache.er')
         return electron_repulsion
 
+    @timer.with_section('RI integrals')
+    def get_electron_repulsion_ri(self, auxbasis):
+        '''Return the density-fitting factor of the electron repulsion integrals
+
+           **Arguments:**
+
+           auxbasis
+                The auxiliary basis: a string with the name of a basis set
+                family, a GOBasisDesc or a GOBasis instance.
+
+           **Returns:** an array B with shape (naux, nbasis, nbasis) such
+           that (ij|kl) is approximated by sum_P B[P,i,j] B[P,k,l], in
+           chemists' notation. It is obtained from the three-index integrals
+           (ij|P) and the Cholesky decomposition of the Coulomb metric (P|Q).
+        '''
+        from horton.gbasis import GOBasisDesc
+        if isinstance(auxbasis, basestring):
+            key = auxbasis.lower()
+            auxbasis = GOBasisDesc(auxbasis)
+        else:
+            key = None
+        if isinstance(auxbasis, GOBasisDesc):
+            auxbasis = auxbasis.apply_to(self)
+        if key is None:
+            # The contents of the basis are used as key, because the id of an
+            # object may be reused after it is garbage collected.
+            key = _get_basis_key(auxbasis)
+        naux = auxbasis.nbasis
+        nbasis = self.obasis.nbasis
+        factor, new = self.cache.load('er_ri', key, alloc=(naux, nbasis, nbasis), tags='or')
+        if new:
+            self.obasis.compute_electron_repulsion_three_center(auxbasis, factor)
+            metric = np.zeros((naux, naux), float)
+            auxbasis.compute_electron_repulsion_two_center(metric)
+            # Solve L B = (ij|P) with L the Cholesky factor of the metric.
+            lower = np.linalg.cholesky(metric)
+            factor[:] = np.linalg.solve(lower, factor.reshape(naux, -1)).reshape(naux, nbasis, nbasis)
+            if log.do_medium:
+                log('Computed the RI factor with %i auxiliary basis functions.' % naux)
+        return factor
+
+    @timer.with_section('ER Schwarz')
+    def get_electron_repulsion_schwarz(self):
+        '''Return the Schwarz bounds for all pairs of shells
+
+           See ``GOBasis.compute_electron_repulsion_schwarz``.
+        '''
+        schwarz, new = self.cache.load('er_schwarz', alloc=(self.obasis.nshell, self.obasis.nshell), tags='o')
+        if new:
+            schwarz[:] = self.obasis.compute_electron_repulsion_schwarz()
+        return schwarz
+
+    @timer.with_section('ER direct')
+    def compute_electron_repulsion_direct(self, dms, coulombs=None, exchanges=None, threshold=0.0):
+        '''Contract the electron repulsion integrals with density matrices on the fly
+
+           See ``GOBasis.compute_electron_repulsion_direct`` for the meaning of
+           the arguments. The Schwarz bounds are cached.
+        '''
+        schwarz = self.get_electron_repulsion_schwarz()
+        self.obasis.compute_electron_repulsion_direct(dms, coulombs, exchanges, threshold, schwarz)
+
     @timer.with_section('Orbitals grid')
-    def compute_grid_orbitals(self, points, iorbs=None, orbs=None, select='alpha'):
+    def compute_grid_orbitals(self, points, iorbs=None, orbs=None, select='alpha', tolerance=0):
         '''Compute the electron density on a grid using self.wfn as input
 
            **Arguments:**
@@ -519,6 +593,10 @@ class System(object):
            select
                 'alpha', 'beta'
 
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected for the sake of efficiency.
+
            **Returns:**
 
            orbs
@@ -533,11 +611,11 @@ class System(object):
             orbs = np.zeros(shape, float)
         elif orbs.shape != shape:
             raise TypeError('The shape of the output array is wrong')
-        self.obasis.compute_grid_orbitals_exp(exp, points, iorbs, orbs)
+        self.obasis.compute_grid_orbitals_exp(exp, points, iorbs, orbs, tolerance)
         return orbs
 
     @timer.with_section('Density grid')
-    def compute_grid_density(self, points, rhos=None, select='full', epsilon=0):
+    def compute_grid_density(self, points, rhos=None, select='full', epsilon=0, tolerance=0):
         '''Compute the electron density on a grid using self.wfn as input
 
            **Arguments:**
@@ -558,6 +636,10 @@ class System(object):
                 Allow errors on the density of this magnitude for the sake of
                 efficiency.
 
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected for the sake of efficiency.
+
            **Returns:**
 
            rhos
@@ -569,11 +651,11 @@ class System(object):
         elif rhos.shape != (points.shape[0],):
             raise TypeError('The shape of the output array is wrong')
         dm = self.wfn.get_dm(select)
-        self.obasis.compute_grid_density_dm(dm, points, rhos, epsilon)
+        self.obasis.compute_grid_density_dm(dm, points, rhos, epsilon, tolerance)
         return rhos
 
     @timer.with_section('Gradient grid')
-    def compute_grid_gradient(self, points, gradrhos=None, select='full'):
+    def compute_grid_gradient(self, points, gradrhos=None, select='full', tolerance=0):
         '''Compute the electron density on a grid using self.wfn as input
 
            **Arguments:**
@@ -590,6 +672,10 @@ class System(object):
            select
                 'alpha', 'beta', 'full' or 'spin'. ('full' is the default.)
 
+           tolerance
+                Basis functions whose absolute value is below this tolerance
+                are neglected for the sake of efficiency.
+
            **Returns:**
 
            gradrhos
@@ -601,11 +687,11 @@ class System(object):
         elif gradrhos.shape != (points.shape[0],3):
             raise TypeError('The shape of the output array is wrong')
         dm = self.wfn.get_dm(select)
-        self.obasis.compute_grid_gradient_dm(dm, points, gradrhos)
+        self.obasis.compute_grid_gradient_dm(dm, points, gradrhos, tolerance=tolerance)
         return gradrhos
 
     @timer.with_section('Hartree grid')
-    def compute_grid_hartree(self, points, hartree=None, select='full'):
+    def compute_grid_hartree(self, points, hartree=None, select='full', threshold=0):
         '''Compute the hartree potential on a grid using self.wfn as input
 
            **Arguments:**
@@ -622,6 +708,12 @@ class System(object):
            select
                 'alpha', 'beta', 'full' or 'spin'. ('full' is the default.)
 
+           threshold
+                When positive, shell pairs are screened and a multipole
+                expansion is used for distant points. The error on the result
+                is of the order of this threshold. (See
+                ``GOBasis.compute_grid_hartree_dm``.)
+
            **Returns:**
 
            hartree
@@ -633,11 +725,11 @@ class System(object):
         elif hartree.shape != (points.shape[0],):
             raise TypeError('The shape of the output array is wrong')
         dm = self.wfn.get_dm(select)
-        self.obasis.compute_grid_hartree_dm(dm, points, hartree)
+        self.obasis.compute_grid_hartree_dm(dm, points, hartree, threshold)
         return hartree
 
     @timer.with_section('ESP grid')
-    def compute_grid_esp(self, points, esp=None, select='full'):
+    def compute_grid_esp(self, points, esp=None, select='full', threshold=0):
         '''Compute the esp on a grid using self.wfn as input
 
            **Arguments:**
@@ -654,6 +746,12 @@ class System(object):
            select
                 'alpha', 'beta', 'full' or 'spin'. ('full' is the default.)
 
+           threshold
+                When positive, shell pairs are screened and a multipole
+                expansion is used for distant points. The error on the result
+                is of the order of this threshold. (See
+                ``GOBasis.compute_grid_hartree_dm``.)
+
            **Returns:**
 
            esp
@@ -665,20 +763,25 @@ class System(object):
         elif esp.shape != (points.shape[0],):
             raise TypeError('The shape of the output array is wrong')
         dm = self.wfn.get_dm(select)
-        self.obasis.compute_grid_hartree_dm(dm, points, esp)
+        self.obasis.compute_grid_hartree_dm(dm, points, esp, threshold)
         esp *= -1
         compute_grid_nucpot(self.numbers, self.coordinates, points, esp)
         return esp
 
     @timer.with_section('Fock grid dens')
-    def compute_grid_density_fock(self, points, weights, pots, fock):
+    def compute_grid_density_fock(self, points, weights, pots, fock, tolerance=0):
         '''See documentation self.obasis.compute_grid_density_fock'''
-        self.obasis.compute_grid_density_fock(points, weights, pots, fock)
+        self.obasis.compute_grid_density_fock(points, weights, pots, fock, tolerance)
 
     @timer.with_section('Fock grid grad')
-    def compute_grid_gradient_fock(self, points, weights, pots, fock):
+    def compute_grid_gradient_fock(self, points, weights, pots, fock, tolerance=0):
         '''See documentation self.obasis.compute_grid_gradient_fock'''
-        self.obasis.compute_grid_gradient_fock(points, weights, pots, fock)
+        self.obasis.compute_grid_gradient_fock(points, weights, pots, fock, tolerance)
+
+    @timer.with_section('Fused grid')
+    def compute_grid_fused_fock(self, dms, points, weights, callback, focks, gradient=True, tolerance=0):
+        '''See documentation self.obasis.compute_grid_fused_fock'''
+        self.obasis.compute_grid_fused_fock(dms, points, weights, callback, focks, gradient, tolerance)
 
     def compute_nucnuc(self):
         '''Compute interaction energy of the nuclei'''
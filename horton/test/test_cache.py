@@ -21,9 +21,10 @@
 #pylint: skip-file
 
 
-import numpy as np
+import os, numpy as np
 from nose.tools import assert_raises
 from horton import *
+from horton.test.common import tmpdir
 
 
 class Example(JustOnceClass):
@@ -435,3 +436,97 @@ def test_tags():
         c.load('tmp', alloc=5, tags='aw')
     with assert_raises(ValueError):
         c.load('tmp', alloc=5, tags='ab')
+
+
+def test_memory_policy_evict():
+    c = Cache(max_memory=2*80)
+    assert c.max_memory == 160
+    for i in xrange(4):
+        tmp, new = c.load('tmp', i, alloc=10, tags='r')
+        assert new
+        tmp[:] = i
+    del tmp
+    # Only the two most recently used arrays are kept.
+    assert c.nbytes == 160
+    assert sorted(c.iterkeys()) == [('tmp', 2), ('tmp', 3)]
+    # Using an array makes it the most recently used one.
+    c.load('tmp', 2)
+    c.load('tmp', 0, alloc=10, tags='r')
+    assert sorted(c.iterkeys()) == [('tmp', 0), ('tmp', 2)]
+    # Items without the 'r' tag are never evicted.
+    c.dump('foo', np.zeros(10), tags='o')
+    c.load('bar', alloc=10)
+    assert sorted(c.iterkeys()) == ['bar', 'foo']
+    assert c.nbytes == 160
+    # The budget is exceeded when the most recent item does not fit.
+    c.load('tmp', 1, alloc=10, tags='r')
+    assert set(c.iterkeys()) == set([('tmp', 1), 'bar', 'foo'])
+    assert c.nbytes == 240
+    # Removing the budget keeps everything.
+    c.set_memory_policy()
+    assert c.max_memory is None
+    for i in xrange(4):
+        c.load('tmp', i, alloc=10, tags='r')
+    assert len(c) == 6
+    assert c.nbytes == 480
+    c.clear(dealloc=True)
+    assert c.nbytes == 0
+
+
+def test_memory_policy_referenced():
+    c = Cache(max_memory=80)
+    tmp0 = c.load('tmp', 0, alloc=10, tags='r')[0]
+    tmp1 = c.load('tmp', 1, alloc=10, tags='r')[0]
+    view = tmp1[:5]
+    del tmp1
+    # Arrays that are still in use outside the cache are not evicted.
+    assert c.nbytes == 160
+    del view
+    c.load('tmp', 2, alloc=10, tags='r')
+    assert sorted(c.iterkeys()) == [('tmp', 0), ('tmp', 2)]
+    del tmp0
+    c.set_memory_policy(80)
+    assert sorted(c.iterkeys()) == [('tmp', 2)]
+
+
+def test_memory_policy_spill():
+    with tmpdir('horton.test.test_cache.test_memory_policy_spill') as dn:
+        c = Cache()
+        with assert_raises(ValueError):
+            c.set_memory_policy(-1)
+        with assert_raises(ValueError):
+            c.set_memory_policy(None, dn)
+        c.set_memory_policy(2*80, dn)
+        assert len(os.listdir(dn)) == 1
+        mem0 = log.mem.get_current()
+        for i in xrange(4):
+            tmp, new = c.load('tmp', i, alloc=10, tags='rg')
+            tmp[:] = i
+        del tmp
+        assert c.nbytes == 160
+        assert log.mem.get_current() == mem0 + 160
+        # All items are still present, some of them on disk.
+        assert len(c) == 4
+        assert ('tmp', 0) in c
+        assert sorted(c.iterkeys()) == [('tmp', i) for i in xrange(4)]
+        for i in xrange(4):
+            tmp, new = c.load('tmp', i, alloc=10, tags='rg')
+            assert not new
+            assert (tmp == i).all()
+        del tmp
+        assert (c.load('tmp', 0) == 0).all()
+        assert c.nbytes == 160
+        assert log.mem.get_current() == mem0 + 160
+        # Clearing also forgets spilled items.
+        c.clear(tags='g')
+        assert len(c) == 0
+        tmp, new = c.load('tmp', 0, alloc=10, tags='rg')
+        assert new
+        del tmp
+        c.dump('tmp', 1, np.ones(20), tags='r')
+        c.load('tmp', 3, alloc=10, tags='rg')
+        c.clear_item('tmp', 1)
+        assert ('tmp', 1) not in c
+        c.set_memory_policy()
+        assert len(os.listdir(dn)) == 0
+        assert len(c) == 2
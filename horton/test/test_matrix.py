@@ -322,3 +322,138 @@ def test_naturals():
     assert exp_alpha.occupations.min() > -1e-6
     assert exp_alpha.occupations.max() < 1+1e-6
     exp_alpha.check_normalization(sys.get_overlap())
+
+
+def get_random_two_body(nbasis):
+    lf = DenseLinalgFactory()
+    er = lf.create_two_body(nbasis)
+    for i in xrange(nbasis):
+        for j in xrange(nbasis):
+            for k in xrange(nbasis):
+                for l in xrange(nbasis):
+                    if er._array[i,j,k,l] == 0.0:
+                        er.set_element(i, j, k, l, np.random.uniform(-1, 1))
+    er.check_symmetry()
+    return er
+
+
+def get_random_dm(nbasis):
+    dm = DenseOneBody(nbasis)
+    tmp = np.random.uniform(-1, 1, (nbasis, nbasis))
+    dm._array[:] = tmp + tmp.T
+    return dm
+
+
+def test_sparse_two_body_apply():
+    nbasis = 6
+    er1 = get_random_two_body(nbasis)
+    er2 = SparseTwoBody(nbasis)
+    er2.assign(er1)
+    er2.check_symmetry()
+    npair = (nbasis*(nbasis+1))/2
+    assert er2.size == (npair*(npair+1))/2
+    dm = get_random_dm(nbasis)
+    for method in 'apply_direct', 'apply_exchange':
+        op1 = DenseOneBody(nbasis)
+        getattr(er1, method)(dm, op1)
+        op2 = DenseOneBody(nbasis)
+        getattr(er2, method)(dm, op2)
+        op2.check_symmetry()
+        assert abs(op1._array - op2._array).max() < 1e-10
+    # The same with small chunks
+    er2.chunk_size = 7
+    for method in 'apply_direct', 'apply_exchange':
+        op1 = DenseOneBody(nbasis)
+        getattr(er1, method)(dm, op1)
+        op2 = DenseOneBody(nbasis)
+        getattr(er2, method)(dm, op2)
+        assert abs(op1._array - op2._array).max() < 1e-10
+
+
+def test_sparse_two_body_threshold():
+    nbasis = 5
+    er1 = get_random_two_body(nbasis)
+    er2 = SparseTwoBody(nbasis, threshold=0.5)
+    er2.assign(er1)
+    assert (abs(er2._values) >= 0.5).all()
+    for i, j, k, l in np.indices((nbasis,)*4).reshape(4, -1).T:
+        expect = er1.get_element(i, j, k, l)
+        if abs(expect) < 0.5:
+            assert er2.get_element(i, j, k, l) == 0.0
+        else:
+            assert er2.get_element(i, j, k, l) == expect
+
+
+def test_sparse_two_body_set_element():
+    nbasis = 4
+    er1 = get_random_two_body(nbasis)
+    er2 = SparseTwoBody(nbasis)
+    for i, j, k, l in np.indices((nbasis,)*4).reshape(4, -1).T:
+        er2.set_element(i, j, k, l, er1.get_element(i, j, k, l))
+    er2.check_symmetry()
+    for i, j, k, l in np.indices((nbasis,)*4).reshape(4, -1).T:
+        assert er2.get_element(i, j, k, l) == er1.get_element(i, j, k, l)
+    # overwrite an existing element
+    er2.set_element(0, 1, 2, 3, 5.0)
+    assert er2.get_element(2, 3, 0, 1) == 5.0
+    er2.check_symmetry()
+    assert er2.get_element(3, 0, 1, 2) == 5.0
+    # clear
+    er2.clear()
+    assert er2.size == 0
+    assert er2.get_element(0, 1, 2, 3) == 0.0
+
+
+def test_sparse_two_body_basis_permutation_signs():
+    nbasis = 5
+    er1 = get_random_two_body(nbasis)
+    er2 = SparseTwoBody(nbasis)
+    er2.assign(er1)
+    permutation = np.random.permutation(nbasis)
+    er1.apply_basis_permutation(permutation)
+    er2.apply_basis_permutation(permutation)
+    er2.check_symmetry()
+    signs = np.random.randint(0, 2, nbasis)*2 - 1
+    er1._array *= np.einsum('i,j,k,l->ijkl', signs, signs, signs, signs)
+    er2.apply_basis_signs(signs)
+    for i, j, k, l in np.indices((nbasis,)*4).reshape(4, -1).T:
+        assert er2.get_element(i, j, k, l) == er1.get_element(i, j, k, l)
+
+
+def test_sparse_two_body_hdf5():
+    import h5py as h5
+    nbasis = 4
+    er1 = SparseTwoBody(nbasis, 1e-3)
+    er1.assign(get_random_two_body(nbasis))
+    with h5.File('horton.test.test_matrix.test_sparse_two_body_hdf5', driver='core', backing_store=False) as f:
+        er1.to_hdf5(f)
+        er2 = SparseTwoBody.from_hdf5(f, None)
+    assert er2.nbasis == nbasis
+    assert er2.threshold == 1e-3
+    assert (er1._indexes == er2._indexes).all()
+    assert (er1._values == er2._values).all()
+
+
+def test_sparse_linalg_factory():
+    lf = SparseLinalgFactory(5, threshold=1e-8)
+    assert lf.threshold == 1e-8
+    op1 = lf.create_one_body()
+    assert isinstance(op1, DenseOneBody)
+    op2 = lf.create_two_body()
+    assert isinstance(op2, SparseTwoBody)
+    assert op2.nbasis == 5
+    assert op2.threshold == 1e-8
+    assert lf.get_memory_two_body(5) < DenseLinalgFactory().get_memory_two_body(5)
+
+
+def test_electron_electron_water_sto3g_hf_sparse():
+    lf, cache, wfn = get_water_sto3g_hf(SparseLinalgFactory(threshold=1e-10))
+    assert isinstance(cache['er'], SparseTwoBody)
+    hartree = lf.create_one_body(7)
+    exchange = lf.create_one_body(7)
+    dm = wfn.dm_alpha
+    cache['er'].apply_direct(dm, hartree)
+    cache['er'].apply_exchange(dm, exchange)
+    eee = 2*hartree.expectation_value(dm) \
+          - exchange.expectation_value(dm)
+    assert abs(eee - 38.29686853319) < 1e-4
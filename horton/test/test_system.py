@@ -177,6 +177,147 @@ def check_electron_repulsion(fn_fchk, check_zeros=False):
     assert error < 1e-5
 
 
+def check_electron_repulsion_sparse(fn_fchk, threshold):
+    fn_log = fn_fchk[:-5] + '.log'
+    sys1 = System.from_file(fn_fchk, fn_log)
+    er1 = sys1.get_electron_repulsion()
+    sys2 = System.from_file(fn_fchk, lf=SparseLinalgFactory(threshold=threshold))
+    er2 = sys2.get_electron_repulsion()
+    assert isinstance(er2, SparseTwoBody)
+    er2.check_symmetry()
+    # compare with the reference integrals, converted to the sparse format
+    ref = SparseTwoBody(er1.nbasis, threshold)
+    ref.assign(er1)
+    assert ref.size >= er2.size
+    for index in ref._indexes[::max(1, ref.size/1000)]:
+        i, j, k, l = index
+        expect = ref.get_element(i, k, j, l)
+        assert abs(er2.get_element(i, k, j, l) - expect) < 1e-5*abs(expect) + threshold
+    # compare the Hartree and exchange operators
+    dm = sys2.wfn.dm_full
+    for method in 'apply_direct', 'apply_exchange':
+        op1 = sys1.lf.create_one_body()
+        getattr(er1, method)(dm, op1)
+        op2 = sys2.lf.create_one_body()
+        getattr(er2, method)(dm, op2)
+        op2.check_symmetry()
+        assert abs(op1._array - op2._array).max() < 1e-5
+
+
+def test_electron_repulsion_sparse_water_sto3g_hf():
+    check_electron_repulsion_sparse(context.get_fn('test/water_sto3g_hf_g03.fchk'), 1e-10)
+
+
+def test_electron_repulsion_sparse_all_elements():
+    # Without a threshold, all symmetry-unique elements are stored, with
+    # the compact index type.
+    sys = System.from_file(context.get_fn('test/water_sto3g_hf_g03.fchk'))
+    nbasis = sys.obasis.nbasis
+    er = SparseTwoBody(nbasis, 0.0)
+    sys.obasis.compute_electron_repulsion(er)
+    assert er._indexes.dtype == np.uint16
+    assert er._indexes.shape == (er.size, 4)
+    npair = (nbasis*(nbasis+1))/2
+    assert er.size == (npair*(npair+1))/2
+    er.check_symmetry()
+
+
+def test_electron_repulsion_sparse_water_ccpvdz_pure_hf():
+    check_electron_repulsion_sparse(context.get_fn('test/water_ccpvdz_pure_hf_g03.fchk'), 1e-8)
+
+
+def check_electron_repulsion_direct(fn_fchk, threshold, eps):
+    sys = System.from_file(fn_fchk)
+    er = sys.get_electron_repulsion()
+    dms = [sys.wfn.dm_alpha, sys.wfn.dm_full]
+    coulombs = [sys.lf.create_one_body() for dm in dms]
+    exchanges = [sys.lf.create_one_body() for dm in dms]
+    sys.compute_electron_repulsion_direct(dms, coulombs, exchanges, threshold)
+    for dm, coulomb, exchange in zip(dms, coulombs, exchanges):
+        coulomb.check_symmetry()
+        exchange.check_symmetry()
+        ref = sys.lf.create_one_body()
+        er.apply_direct(dm, ref)
+        assert abs(coulomb._array - ref._array).max() < eps
+        er.apply_exchange(dm, ref)
+        assert abs(exchange._array - ref._array).max() < eps
+    # only exchange
+    exchange = sys.lf.create_one_body()
+    sys.compute_electron_repulsion_direct(dms[:1], exchanges=[exchange], threshold=threshold)
+    assert abs(exchange._array - exchanges[0]._array).max() < eps
+
+
+def test_electron_repulsion_direct_water_sto3g_hf():
+    check_electron_repulsion_direct(context.get_fn('test/water_sto3g_hf_g03.fchk'), 0.0, 1e-10)
+
+
+def test_electron_repulsion_direct_water_ccpvdz_cart_hf():
+    check_electron_repulsion_direct(context.get_fn('test/water_ccpvdz_cart_hf_g03.fchk'), 1e-10, 1e-8)
+
+
+def test_electron_repulsion_ri_water_sto3g_hf():
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    factor = sys.get_electron_repulsion_ri('cc-pVDZ')
+    assert factor.shape == (24, sys.obasis.nbasis, sys.obasis.nbasis)
+    assert abs(factor - factor.transpose(0, 2, 1)).max() < 1e-10
+    # the result is cached
+    assert sys.get_electron_repulsion_ri('cc-pvdz') is factor
+    # basis objects with the same contents share the cached result
+    auxbasis1 = GOBasisDesc('cc-pVDZ').apply_to(sys)
+    factor1 = sys.get_electron_repulsion_ri(auxbasis1)
+    assert sys.get_electron_repulsion_ri(GOBasisDesc('cc-pVDZ').apply_to(sys)) is factor1
+    assert abs(factor1 - factor).max() < 1e-10
+    # a new basis object never gets the result of an old one, even when it
+    # reuses the id of an object that has been garbage collected
+    for irep in xrange(10):
+        del auxbasis1
+        auxbasis1 = GOBasisDesc('3-21G').apply_to(sys)
+        factor2 = sys.get_electron_repulsion_ri(auxbasis1)
+        assert factor2.shape == (13, sys.obasis.nbasis, sys.obasis.nbasis)
+    # it is removed from the cache when the orbital basis changes
+    sys.update_obasis('3-21G')
+    assert ('er_ri', 'cc-pvdz') not in sys.cache
+
+
+def test_basis_key():
+    from horton.system import _get_basis_key
+    fn_fchk = context.get_fn('test/water_sto3g_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    auxbasis1 = GOBasisDesc('cc-pVDZ').apply_to(sys)
+    auxbasis2 = GOBasisDesc('cc-pVDZ').apply_to(sys)
+    assert auxbasis1 is not auxbasis2
+    assert _get_basis_key(auxbasis1) == _get_basis_key(auxbasis2)
+    assert _get_basis_key(auxbasis1) != _get_basis_key(GOBasisDesc('3-21G').apply_to(sys))
+    # a change in the exponents or the geometry gives a different key
+    auxbasis3 = GOBasis(auxbasis1.centers, auxbasis1.shell_map, auxbasis1.nprims,
+                        auxbasis1.shell_types, auxbasis1.alphas*1.1,
+                        auxbasis1.con_coeffs)
+    assert _get_basis_key(auxbasis1) != _get_basis_key(auxbasis3)
+    auxbasis4 = GOBasis(auxbasis1.centers + 0.1, auxbasis1.shell_map,
+                        auxbasis1.nprims, auxbasis1.shell_types,
+                        auxbasis1.alphas, auxbasis1.con_coeffs)
+    assert _get_basis_key(auxbasis1) != _get_basis_key(auxbasis4)
+
+
+def test_electron_repulsion_schwarz_water_ccpvdz_pure_hf():
+    fn_fchk = context.get_fn('test/water_ccpvdz_pure_hf_g03.fchk')
+    sys = System.from_file(fn_fchk)
+    schwarz = sys.obasis.compute_electron_repulsion_schwarz()
+    assert schwarz.shape == (sys.obasis.nshell, sys.obasis.nshell)
+    assert (schwarz == schwarz.T).all()
+    # All integrals must be bounded by the product of Schwarz factors
+    er = sys.get_electron_repulsion()._array
+    begins = np.cumsum([0] + [get_shell_nbasis(shell_type) for shell_type in sys.obasis.shell_types])
+    shell_index = np.zeros(sys.obasis.nbasis, int)
+    for ishell in xrange(sys.obasis.nshell):
+        shell_index[begins[ishell]:begins[ishell+1]] = ishell
+    bound = schwarz[shell_index][:,shell_index]
+    # <ij|kl> = (ik|jl)
+    bound4 = bound[:,None,:,None]*bound[None,:,None,:]
+    assert (abs(er) <= bound4*(1 + 1e-10)).all()
+
+
 def test_electron_repulsion_water_sto3g_hf():
     check_electron_repulsion(context.get_fn('test/water_sto3g_hf_g03.fchk'), True)
 
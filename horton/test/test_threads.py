@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Horton is a development platform for electronic structure methods.
+# Copyright (C) 2011-2013 Toon Verstraelen <Toon.Verstraelen@UGent.be>
+#
+# This file is part of Horton.
+#
+# Horton is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# Horton is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+#pylint: skip-file
+
+
+import numpy as np
+from nose.tools import assert_raises
+from horton import *
+
+
+def test_set_num_threads():
+    nthread = get_num_threads()
+    try:
+        set_num_threads(3)
+        assert get_num_threads() == 3
+        with assert_raises(ValueError):
+            set_num_threads(0)
+        assert get_num_threads() == 3
+    finally:
+        set_num_threads(nthread)
+
+
+def test_threads_gbasis_grid():
+    sys = System.from_file(context.get_fn('test/water_hfs_321g.fchk'))
+    obasis = sys.obasis
+    dm = sys.wfn.dm_full
+    npoint = 1000
+    points = np.random.normal(0, 1.5, (npoint, 3))
+    weights = np.random.uniform(0, 1, npoint)
+    pots = np.random.uniform(-1, 1, npoint)
+    nthread = get_num_threads()
+    results = []
+    try:
+        for n in 1, 4:
+            set_num_threads(n)
+            rhos = np.zeros(npoint)
+            obasis.compute_grid_density_dm(dm, points, rhos, epsilon=1e-15)
+            basis = np.zeros((npoint, obasis.nbasis))
+            obasis.compute_grid_basis(points, basis)
+            fock = sys.lf.create_one_body()
+            obasis._compute_grid1_fock(points, weights, pots, GB1DMGridDensityFn(obasis.max_shell_type), fock)
+            hartree = np.zeros(npoint)
+            obasis.compute_grid_hartree_dm(dm, points[:50], hartree[:50])
+            results.append((rhos, basis, fock._array, hartree))
+    finally:
+        set_num_threads(nthread)
+    for a, b in zip(*results):
+        assert abs(a - b).max() < 1e-10*abs(a).max()
+
+
+def test_threads_becke_weights():
+    sys = System.from_file(context.get_fn('test/water.xyz'))
+    nthread = get_num_threads()
+    results = []
+    try:
+        for n in 1, 4:
+            set_num_threads(n)
+            grid = BeckeMolGrid(sys, random_rotate=False)
+            results.append(grid.weights)
+    finally:
+        set_num_threads(nthread)
+    assert abs(results[0] - results[1]).max() < 1e-14
@@ -22,10 +22,11 @@
 
 
 import sys, argparse, numpy as np
-from glob import glob
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 from horton import log, lebedev_laikov_npoints, ProAtomDB, angstrom, periodic, \
-    AtomicGridSpec, ProAtomRecord, __version__
+    AtomicGridSpec, __version__
 from horton.scripts.atomdb import *
 
 
@@ -94,6 +95,45 @@ def main_input(args):
     args.program.write_run_script()
 
 
+def parse_args_run(args):
+    parser = argparse.ArgumentParser(prog='horton-atomdb.py run',
+        description='Run the atomic computations on the local machine with '
+                    'the run_*.sh script, several at the same time.')
+    parser.add_argument('-V', '--version', action='version',
+        version="%%(prog)s (horton version %s)" % __version__)
+
+    parser.add_argument('--nproc', type=int, default=1,
+        help='The maximum number of computations that run concurrently. '
+             '[default=%(default)s]')
+
+    return parser.parse_args(args)
+
+
+def main_run(args):
+    program = get_atom_program()
+    dn_mults = list(iter_mult_dirs())
+    if log.do_medium:
+        log('Running %i computations with at most %i at the same time.' % (len(dn_mults), args.nproc))
+
+    # Each computation runs in a separate process, so threads suffice to
+    # control the number of concurrent computations.
+    pool = ThreadPool(args.nproc)
+    try:
+        retcodes = pool.map(program.run_atom, dn_mults, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    nfail = 0
+    for dn_mult, retcode in zip(dn_mults, retcodes):
+        if retcode != 0:
+            nfail += 1
+            if log.do_warning:
+                log.warn('The run script failed in %s. See %s/run.log.' % (dn_mult, dn_mult))
+    if nfail > 0:
+        raise RuntimeError('The run script failed in %i directories.' % nfail)
+
+
 def parse_args_convert(args):
     parser = argparse.ArgumentParser(prog='horton-atomdb.py convert',
         description='Convert the output of the atomic computations to horton '
@@ -110,6 +150,9 @@ def parse_args_convert(args):
              'allow a more fine-grained control of the atomic integration '
              'grid. Note that the radial part of this grid is also used for '
              'interpolation in horton-wpart.py')
+    parser.add_argument('--nproc', type=int, default=1,
+        help='The number of processes used to convert the atomic states in '
+             'parallel. [default=%(default)s]')
 
     return parser.parse_args(args)
 
@@ -222,60 +265,41 @@ def plot_atoms(proatomdb):
             log('Written', fn_png)
 
 
+def _convert_state_helper(args):
+    # Module-level function such that it can be sent to worker processes.
+    return convert_state(*args)
+
+
 def main_convert(args):
-    # The atomic grid specification
-    agspec = AtomicGridSpec(args.grid)
+    # Check the atomic grid specification
+    AtomicGridSpec(args.grid)
 
     # The program is detected based on the run script that is present
-    run_scripts = glob("run_*.sh")
-    if len(run_scripts) != 1:
-        raise RuntimeError('Found %i run_*.sh scripts while exactly one is needed to know which program was used to run the atomic computations.' % len(run_scripts))
-    program = atom_programs[run_scripts[0][4:-3]]
+    program = get_atom_program()
+
+    # Convert all sensible directories. The records are stored in each state
+    # directory, such that an interrupted conversion can be resumed.
+    dn_states = list(iter_state_dirs())
+    jobs = [(program, dn_state, args.grid) for dn_state in dn_states]
+    if args.nproc > 1:
+        pool = Pool(args.nproc)
+        try:
+            founds = pool.map(_convert_state_helper, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        founds = map(_convert_state_helper, jobs)
 
-    # Loop over all sensible directories
+    # Collect the records
     energy_table = EnergyTable()
     records = []
-    for dn_state in sorted(glob("[01]??_??_[01]??_q[+-]??")):
-        number = int(dn_state[:3])
-        pop = int(dn_state[7:10])
-
-        cases = []
-        for dn_mult in sorted(glob('%s/mult??' % dn_state)):
-            if log.do_medium:
-                log('Loading from', dn_mult)
-            system, energy = program.load_atom(dn_mult)
-            if energy is None:
-                if log.do_medium:
-                    log('No (sensible) results found:  ', dn_mult)
-                continue
-            cases.append((energy, system))
-
-        if len(cases) == 0:
-            if log.do_medium:
-                log('Nothing found in:  ', dn_state)
+    for dn_state, found in zip(dn_states, founds):
+        if not found:
             continue
-
-        # Get the lowest in energy and write to chk file
-        cases.sort()
-        energy, system = cases[0]
-
-        # Add case to energy table
-        energy_table.add(number, pop, energy)
-
-        # Write system to Horton file if possible
-        if system is not None:
-            system.assign_chk('%s/horton.h5' % dn_state)
-
-        # Construct a record for the proatomdb
-        records.append(ProAtomRecord.from_system(system, agspec))
-
-        # Release memory and close h5 files
-        system = None
-        del cases
-
-        # Let user know we are alive.
-        if log.do_medium:
-            log('Succesfull:        ', dn_state)
+        record = load_state_record(dn_state)
+        energy_table.add(record.number, record.population, record.energy)
+        records.append(record)
 
     # Report energies
     if log.do_medium:
@@ -296,17 +320,20 @@ def main():
 
     args = sys.argv[1:]
     if len(args) == 0:
-        print >> sys.stderr, 'Expecting at least one argument: "input" or "convert"'
+        print >> sys.stderr, 'Expecting at least one argument: "input", "run" or "convert"'
         sys.exit(-1)
     command = args.pop(0)
     if command == 'input':
         parsed = parse_args_input(args)
         main_input(parsed)
+    elif command == 'run':
+        parsed = parse_args_run(args)
+        main_run(parsed)
     elif command == 'convert':
         parsed = parse_args_convert(args)
         main_convert(parsed)
     else:
-        print >> sys.stderr, 'The first argument must be "input" or "convert"'
+        print >> sys.stderr, 'The first argument must be "input", "run" or "convert"'
         sys.exit(-1)
 
 
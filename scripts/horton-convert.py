@@ -23,7 +23,7 @@
 
 import sys, argparse, os, numpy as np
 
-from horton import __version__, System
+from horton import __version__, System, dump_cube_h5
 
 
 # All, except underflows, is *not* fine.
@@ -39,6 +39,7 @@ def parse_args():
     parser.add_argument('input',
         help='The input file. Supported file types are: '
              '*.h5 (Horton\'s native format), '
+             '*.cube.h5 (Horton\'s binary format for data on a uniform grid), '
              '*.cif (Crystallographic Information File), '
              '*.cp2k.out (Output from a CP2K atom computation), '
              '*.cube (Gaussian cube file), '
@@ -52,11 +53,15 @@ def parse_args():
     parser.add_argument('output',
         help='The output file. Supported file types are: '
              '*.h5 (Horton\'s native format), '
+             '*.cube.h5 (Horton\'s binary format for data on a uniform grid), '
              '*.cif (Crystallographic Information File), '
              '*.cube (Gaussian cube file), '
              '*.molden.input (Molden wavefunction file), '
              'POSCAR (VASP files), '
              '*.xyz (The XYZ format).')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'lzf'],
+        help='Compress the grid data when writing a *.cube.h5 file. '
+             '[default=no compression]')
 
     return parser.parse_args()
 
@@ -64,7 +69,10 @@ def parse_args():
 def main():
     args = parse_args()
     sys = System.from_file(args.input)
-    sys.to_file(args.output)
+    if args.output.endswith('.cube.h5'):
+        dump_cube_h5(args.output, sys, args.compression)
+    else:
+        sys.to_file(args.output)
 
 
 if __name__ == '__main__':
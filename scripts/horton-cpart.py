@@ -24,8 +24,8 @@
 import sys, argparse, os, numpy as np
 
 from horton import System, cpart_schemes, Cell, ProAtomDB, log, \
-    symmetry_analysis, UniformGrid, __version__
-from horton.scripts.common import reduce_data, store_args, parse_pbc, \
+    symmetry_analysis, __version__
+from horton.scripts.common import load_cube_data, store_args, parse_pbc, \
     iter_elements, write_part_output, parse_h5, check_output
 
 
@@ -78,6 +78,11 @@ def parse_args():
         help='Perform a symmetry analysis on the AIM results. This option '
              'requires one argument: a CIF file with the generators of the '
              'symmetry of this system and a primitive unit cell.')
+    parser.add_argument('--symmetry-reduce', default=False, action='store_true',
+        help='Use the symmetry from the --symmetry option to reduce the '
+             'amount of work: the populations and proatom parameters are only '
+             'computed for the atoms in the primitive unit and copied to all '
+             'equivalent atoms.')
 
     parser.add_argument('--compact', default=None, type=float,
         help='Reduce the cutoff radius of the proatoms such that the tail with '
@@ -101,12 +106,36 @@ def parse_args():
         help='The iterative scheme is converged when the maximum change of '
              'the charges between two iterations drops below this threshold. '
              '[default=%(default)s]')
+    parser.add_argument('--diis', default=0, type=int,
+        help='The number of previous iterations used to extrapolate the '
+             'proatoms with DIIS in the iterative schemes. This usually '
+             'reduces the number of iterations considerably. The default '
+             '(zero) results in plain fixed-point iterations. '
+             '[default=%(default)s]')
     parser.add_argument('--greedy', default=False, action='store_true',
         help='Keep more precomputed results in memory. This speeds up the '
              'partitioning but consumes more memory. It is only applicable to '
              'the Hirshfeld-I (hi) and Hirhfeld-E (he) schemes.')
     parser.add_argument('--lmax', default=3, type=int,
         help='The maximum angular momentum to consider in multipole expansions')
+    parser.add_argument('--tmpdir', default=None, type=str,
+        help='Store the large arrays on the grid in memory-mapped files in '
+             'the given directory instead of in memory. This makes it possible '
+             'to partition cube files that do not fit in memory, at the cost '
+             'of disk I/O.')
+    parser.add_argument('--nproc', default=1, type=int,
+        help='The number of threads used to process the atoms in parallel. '
+             '[default=%(default)s]')
+    parser.add_argument('--cache-memory', default=None, type=float,
+        help='The maximum amount of memory (in MB) used by the recomputable '
+             'arrays in the cache, e.g. the isolated atoms kept with the '
+             '--greedy option. When this budget is exceeded, the least '
+             'recently used arrays are discarded and recomputed when needed. '
+             'By default, the memory usage is not limited.')
+    parser.add_argument('--spill-dir', default=None, type=str,
+        help='Write the arrays discarded due to the --cache-memory option to a '
+             'scratch file in the given directory, instead of recomputing '
+             'them.')
 
     return parser.parse_args()
 
@@ -119,20 +148,12 @@ def main():
     if check_output(fn_h5, grp_name, args.overwrite):
         return
 
-    # Load the system
-    sys = System.from_file(args.cube)
-    ugrid = sys.grid
-    if not isinstance(ugrid, UniformGrid):
-        raise TypeError('The specified file does not contain data on a rectangular grid.')
+    # Load the system and reduce the grid if required
+    sys, moldens, ugrid = load_cube_data(args.cube, args.stride, args.chop)
     ugrid.pbc[:] = parse_pbc(args.pbc)
-    moldens = sys.extra['cube_data']
-
-    # Reduce the grid if required
-    if args.stride > 1 or args.chop > 0:
-        moldens, ugrid = reduce_data(moldens, ugrid, args.stride, args.chop)
 
     # Load the proatomdb and make pro-atoms more compact if that is requested
-    proatomdb = ProAtomDB.from_file(args.atoms)
+    proatomdb = ProAtomDB.from_file(args.atoms, numbers=sys.numbers)
     if args.compact is not None:
         proatomdb.compact(args.compact)
     proatomdb.normalize()
@@ -143,19 +164,32 @@ def main():
     # List of element numbers for which weight corrections are needed:
     wcor_numbers = list(iter_elements(args.wcor))
 
+    # Load the symmetry information if requested.
+    if args.symmetry is not None:
+        sys_sym = System.from_file(args.symmetry)
+        sym = sys_sym.extra.get('symmetry')
+        if sym is None:
+            raise ValueError('No symmetry information found in %s.' % args.symmetry)
+    elif args.symmetry_reduce:
+        raise ValueError('The --symmetry-reduce option requires the --symmetry option.')
+
     # Run the partitioning
     kwargs = dict((key, val) for key, val in vars(args).iteritems() if key in CPartClass.options)
+    if args.symmetry_reduce:
+        kwargs['symmetry'] = sym
+    if args.tmpdir is not None:
+        kwargs['tmpdir'] = args.tmpdir
     cpart = cpart_schemes[args.scheme](
         sys, ugrid, True, moldens, proatomdb, wcor_numbers,
         args.wcor_rcut_max, args.wcor_rcond, **kwargs)
+    if args.cache_memory is not None:
+        cpart.cache.set_memory_policy(int(args.cache_memory*1024**2), args.spill_dir)
+    elif args.spill_dir is not None:
+        raise ValueError('The --spill-dir option requires the --cache-memory option.')
     names = cpart.do_all()
 
     # Do a symmetry analysis if requested.
     if args.symmetry is not None:
-        sys_sym = System.from_file(args.symmetry)
-        sym = sys_sym.extra.get('symmetry')
-        if sym is None:
-            raise ValueError('No symmetry information found in %s.' % args.symmetry)
         sys_results = dict((name, cpart[name]) for name in names)
         sym_results = symmetry_analysis(sys, sym, sys_results)
         cpart.cache.dump('symmetry', sym_results)
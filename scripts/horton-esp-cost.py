@@ -23,12 +23,12 @@
 
 import sys, argparse, os, numpy as np
 
-from horton import System, setup_weights, ESPCost, log, angstrom, __version__
-from horton.scripts.common import reduce_data, parse_ewald_args, parse_pbc, \
+from horton import System, setup_weights, ESPCost, ESPCostAccumulator, log, \
+    angstrom, LockedH5File, __version__
+from horton.scripts.common import load_cube_data, parse_ewald_args, parse_pbc, \
     write_script_output, parse_h5, check_output
 from horton.scripts.espfit import parse_wdens, parse_wnear, parse_wfar, \
-    load_rho, save_weights, max_at_edge
-from horton.grid.cext import UniformGrid
+    parse_layers, load_rho, save_weights, max_at_edge
 
 
 # All, except underflows, is *not* fine.
@@ -76,6 +76,32 @@ def parse_args():
         help='The gcut scale (gcut = gcut_scale*alpha) for the reciprocal '
              'space constribution to the electrostatic interactions. '
              '[default=%(default)s]')
+    parser.add_argument('--method', default='direct', choices=['direct', 'fft'],
+        help='The algorithm used to set up the cost function for 3D periodic '
+             'systems. With \'fft\', the potential of each atom on the whole '
+             'grid is computed at once, using an FFT for the reciprocal space '
+             'part. This is much faster for large systems, but requires more '
+             'memory. [default=%(default)s]')
+    parser.add_argument('--slab-size', default=None, type=int,
+        help='Set up the cost function in slabs with the given number of '
+             'layers (along the first axis of the grid). This is only '
+             'supported by the direct method. By default, the whole grid is '
+             'treated at once.')
+    parser.add_argument('--checkpoint', default=None, type=str,
+        help='An HDF5 file in which the partial cost function is stored after '
+             'each slab. When the file exists, the computation is resumed '
+             'from it.')
+    parser.add_argument('--layers', default=None, type=str,
+        help='Only consider the given range of layers, in the format '
+             '"begin:end". When the cost function is not complete afterwards, '
+             'no output is written and the partial result is only stored in '
+             'the checkpoint file. The checkpoint files of runs with '
+             'different layers can be combined with the --merge option. '
+             'This can be used to distribute the work over several '
+             'processes.')
+    parser.add_argument('--merge', default=None, type=str, nargs='+',
+        help='Checkpoint files of other (partial) runs that are merged before '
+             'the remaining layers are computed.')
 
     parser.add_argument('--wdens', default=None, type=str, nargs='?', const=':-9:0.8',
         help='Define weights based on an electron density. The argument has '
@@ -112,6 +138,51 @@ def parse_args():
     return parser.parse_args()
 
 
+def setup_cost_slabs(args, sys, ugrid, esp, weights, rcut, alpha, gcut):
+    '''Accumulate the cost function slab by slab, with optional checkpoints
+
+       Returns None when the cost function is not complete yet.
+    '''
+    accumulator = ESPCostAccumulator(sys.coordinates, ugrid, rcut, alpha, gcut)
+    if args.checkpoint is not None and os.path.isfile(args.checkpoint):
+        if log.do_medium:
+            log('Resuming from checkpoint %s' % args.checkpoint)
+        with LockedH5File(args.checkpoint, 'r') as f:
+            resumed = ESPCostAccumulator.from_hdf5(f, None)
+        # Make sure the checkpoint belongs to the current computation
+        resumed.check_compatible(accumulator)
+        accumulator = resumed
+    if args.merge is not None:
+        for fn_merge in args.merge:
+            if log.do_medium:
+                log('Merging partial cost function from %s' % fn_merge)
+            with LockedH5File(fn_merge, 'r') as f:
+                accumulator.merge(ESPCostAccumulator.from_hdf5(f, None))
+    # Make sure the resumed and merged layers used the same data
+    accumulator.check_data(esp, weights)
+
+    def write_checkpoint():
+        if args.checkpoint is not None:
+            with LockedH5File(args.checkpoint, 'w') as f:
+                accumulator.to_hdf5(f)
+
+    if args.merge is not None:
+        write_checkpoint()
+    begin, end = parse_layers(args.layers)
+    nlayer = ugrid.shape[0] if args.slab_size is None else args.slab_size
+    for slab_begin, slab_end in accumulator.iter_slabs(nlayer, begin, end):
+        if log.do_medium:
+            log('Adding layers %i:%i' % (slab_begin, slab_end))
+        accumulator.add_slab(slab_begin, esp[slab_begin:slab_end], weights[slab_begin:slab_end])
+        write_checkpoint()
+
+    if not accumulator.complete:
+        if log.do_medium:
+            log('The cost function is not complete. No output is written.')
+        return
+    return accumulator.get_cost()
+
+
 def main():
     args = parse_args()
 
@@ -120,19 +191,14 @@ def main():
     if check_output(fn_h5, grp_name, args.overwrite):
         return
 
-    # Load the system
+    # Load the system and reduce the grid if required
     if log.do_medium:
         log('Loading potential array')
-    sys = System.from_file(args.cube)
-    ugrid = sys.grid
-    if not isinstance(ugrid, UniformGrid):
-        raise TypeError('The specified file does not contain data on a rectangular grid.')
-    ugrid.pbc[:] = parse_pbc(args.pbc) # correct pbc
-    esp = sys.extra['cube_data']
-
-    # Reduce the grid if required
     if args.stride > 1:
-        esp, ugrid = reduce_data(esp, ugrid, args.stride, args.chop)
+        sys, esp, ugrid = load_cube_data(args.cube, args.stride, args.chop)
+    else:
+        sys, esp, ugrid = load_cube_data(args.cube)
+    ugrid.pbc[:] = parse_pbc(args.pbc) # correct pbc
 
     # Fix sign
     if args.sign:
@@ -199,7 +265,15 @@ def main():
     # Construct the cost function
     if log.do_medium:
         log('Setting up cost function (may take a while)   ')
-    cost = ESPCost.from_grid_data(sys, ugrid, esp, weights, rcut, alpha, gcut)
+    if args.method == 'fft':
+        if args.slab_size is not None or args.checkpoint is not None or \
+           args.layers is not None or args.merge is not None:
+            raise ValueError('The options --slab-size, --checkpoint, --layers and --merge are not supported by the fft method.')
+        cost = ESPCost.from_grid_data(sys, ugrid, esp, weights, rcut, alpha, gcut, args.method)
+    else:
+        cost = setup_cost_slabs(args, sys, ugrid, esp, weights, rcut, alpha, gcut)
+        if cost is None:
+            return
 
     # Store cost function info
     results = {}
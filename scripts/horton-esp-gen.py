@@ -68,6 +68,10 @@ def parse_args():
         help='The gcut scale (gcut = gcut_scale*alpha) for the reciprocal '
              'space constribution to the electrostatic interactions. '
              '[default=%(default)s]')
+    parser.add_argument('--method', default='direct', choices=['direct', 'spme'],
+        help='The algorithm used to compute the ESP. With \'spme\', the '
+             'smooth particle-mesh Ewald method is used, which is much faster '
+             'for large grids and many atoms. [default=%(default)s]')
 
     return parser.parse_args()
 
@@ -121,7 +125,7 @@ def main():
 
     # Allocate and compute ESP grid
     esp = np.zeros(ugrid.shape, float)
-    compute_esp_grid_cube(ugrid, esp, coordinates, charges, rcut, alpha, gcut)
+    compute_esp_grid_cube(ugrid, esp, coordinates, charges, rcut, alpha, gcut, args.method)
     results['esp'] = esp
 
     # Store the results in an HDF5 file
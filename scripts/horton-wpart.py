@@ -71,18 +71,43 @@ def parse_args():
     parser.add_argument('-e', '--epsilon', default=1e-8, type=float,
         help='Allow errors on the computed electron density of this magnitude '
              'for the sake of efficiency.')
+    parser.add_argument('--proatom-tolerance', default=0.0, type=float,
+        help='Only evaluate each proatom on the atomic grids within the radius '
+             'where its density drops below this tolerance. This removes the '
+             'quadratic scaling of the promolecular density with the number '
+             'of atoms. The default (zero) disables this screening. '
+             '[default=%(default)s]')
     parser.add_argument('--maxiter', '-i', default=500, type=int,
         help='The maximum allowed number of iterations. [default=%(default)s]')
     parser.add_argument('--threshold', '-t', default=1e-6, type=float,
         help='The iterative scheme is converged when the maximum change of '
              'the charges between two iterations drops below this threshold. '
              '[default=%(default)s]')
+    parser.add_argument('--diis', default=0, type=int,
+        help='The number of previous iterations used to extrapolate the '
+             'proatoms with DIIS in the iterative schemes. This usually '
+             'reduces the number of iterations considerably. The default '
+             '(zero) results in plain fixed-point iterations. '
+             '[default=%(default)s]')
     parser.add_argument('--greedy', default=False, action='store_true',
         help='Keep more precomputed results in memory. This speeds up the '
              'partitioning but consumes more memory. It is only applicable to '
              'the Hirshfeld-I (hi) and Hirhfeld-E (he) schemes.')
     parser.add_argument('--lmax', default=3, type=int,
         help='The maximum angular momentum to consider in multipole expansions')
+    parser.add_argument('--nproc', default=1, type=int,
+        help='The number of threads used to process the atoms in parallel. '
+             '[default=%(default)s]')
+    parser.add_argument('--cache-memory', default=None, type=float,
+        help='The maximum amount of memory (in MB) used by the recomputable '
+             'arrays in the cache, e.g. the isolated atoms kept with the '
+             '--greedy option. When this budget is exceeded, the least '
+             'recently used arrays are discarded and recomputed when needed. '
+             'By default, the memory usage is not limited.')
+    parser.add_argument('--spill-dir', default=None, type=str,
+        help='Write the arrays discarded due to the --cache-memory option to a '
+             'scratch file in the given directory, instead of recomputing '
+             'them.')
     parser.add_argument('--slow', default=False, action='store_true',
         help='Also compute the more expensive AIM properties that require the '
              'AIM overlap matrices.')
@@ -107,7 +132,7 @@ def main():
 
     # Load the proatomdb
     if args.atoms is not None:
-        proatomdb = ProAtomDB.from_file(args.atoms)
+        proatomdb = ProAtomDB.from_file(args.atoms, numbers=sys.numbers)
         proatomdb.normalize()
         kwargs['proatomdb'] = proatomdb
     else:
@@ -118,6 +143,10 @@ def main():
     molgrid = BeckeMolGrid(sys, agspec, mode='only')
     sys.update_grid(molgrid) # for the grid to be written to the output
     wpart = wpart_schemes[args.scheme](sys, molgrid, **kwargs)
+    if args.cache_memory is not None:
+        wpart.cache.set_memory_policy(int(args.cache_memory*1024**2), args.spill_dir)
+    elif args.spill_dir is not None:
+        raise ValueError('The --spill-dir option requires the --cache-memory option.')
     names = wpart.do_all()
 
     write_part_output(fn_h5, grp_name, wpart, names, args)
@@ -134,6 +134,8 @@ setup(
             sources=get_sources('horton'),
             depends=get_depends('horton'),
             include_dirs=[np.get_include()],
+            extra_compile_args=["-fopenmp"],
+            extra_link_args=["-fopenmp"],
             language="c++"),
         Extension("horton.gbasis.cext",
             sources=get_sources('horton/gbasis') + ['horton/moments.cpp'],
@@ -141,6 +143,8 @@ setup(
             extra_objects=libint_extra_objects,
             libraries=libint_libraries,
             include_dirs=[np.get_include(), 'horton'] + libint_include_dirs,
+            extra_compile_args=["-fopenmp"],
+            extra_link_args=["-fopenmp"],
             language="c++"),
         Extension("horton.grid.cext",
             sources=get_sources('horton/grid') + [
@@ -150,8 +154,8 @@ setup(
                 'horton/cell.pxd', 'horton/cell.h',
                 'horton/moments.pxd', 'horton/moments.h'],
             include_dirs=[np.get_include(), 'horton'],
-            #extra_compile_args=["-fopenmp"],
-            #extra_link_args=["-fopenmp"],
+            extra_compile_args=["-fopenmp"],
+            extra_link_args=["-fopenmp"],
             language="c++",),
         Extension("horton.meanfield.cext",
             sources=get_sources('horton/meanfield'),
@@ -168,6 +172,8 @@ setup(
                 'horton/cell.pxd', 'horton/cell.h',
                 'horton/grid/uniform.pxd', 'horton/grid/uniform.h'],
             include_dirs=[np.get_include(), 'horton', 'horton/grid'],
+            extra_compile_args=["-fopenmp"],
+            extra_link_args=["-fopenmp"],
             language="c++"),
     ],
     classifiers=[